@@ -1 +1,21 @@
 """Маршрутизаторы обработчиков бота."""
+
+from importlib import import_module
+
+from aiogram import Router
+
+__all__ = ["admin", "backup", "help", "history", "key_management", "usage"]
+
+# Порядок подключения важен: первый подходящий обработчик перехватывает апдейт.
+ROUTER_MODULES = ("help", "admin", "key_management", "backup", "usage", "history")
+
+
+def load_routers() -> list[Router]:
+    """Импортировать модули обработчиков и вернуть их роутеры в порядке подключения.
+
+    Роутеры нужны диспетчеру до начала опроса, поэтому модули загружаются
+    при его сборке; тяжёлые зависимости (``qrcode``, Pillow) обработчики
+    импортируют сами при первом использовании.
+    """
+
+    return [import_module(f"{__name__}.{name}").router for name in ROUTER_MODULES]
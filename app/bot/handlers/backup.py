@@ -0,0 +1,100 @@
+"""Команды резервного копирования ключей: /export и /import."""
+
+from __future__ import annotations
+
+import tempfile
+from pathlib import Path
+
+from aiogram import Bot, F, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile, Message
+from loguru import logger
+
+from app.bot.services.backup import EXPORT_FORMATS, detect_format, export_keys, import_keys
+from app.bot.services.key_cache import KEY_CACHE
+from app.bot.services.limiter import DEVICE_LIMITS
+from app.bot.services.xray import reload_xray, resolve_clients_path
+from app.config import get_settings
+
+router = Router()
+
+
+def _progress_updater(status: Message, title: str):
+    async def update(count: int) -> None:
+        await status.edit_text(f"{title}: обработано {count} строк")
+
+    return update
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject) -> None:
+    """Выгрузить ключи в gzip-файл и отправить его администратору.
+
+    Аргументы:
+        message (Message): Сообщение с командой ``/export [csv|ndjson]``.
+        command (CommandObject): Разобранная команда с аргументами.
+    """
+
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        await message.answer("Формат экспорта: csv или ndjson")
+        return
+
+    status = await message.answer("⏳ Экспорт ключей…")
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / f"keys.{fmt}.gz"
+        try:
+            count = await export_keys(path, fmt, progress=_progress_updater(status, "⏳ Экспорт"))
+        except Exception as error:  # noqa: BLE001
+            logger.exception("Ошибка экспорта ключей: {}", error)
+            await status.edit_text("Не удалось выгрузить ключи")
+            return
+
+        await status.edit_text(f"✅ Экспортировано ключей: {count}")
+        await message.answer_document(FSInputFile(path, filename=path.name), caption="Резервная копия ключей")
+
+
+@router.message(Command("import"), F.document)
+async def cmd_import(message: Message, bot: Bot) -> None:
+    """Загрузить ключи из присланного файла (подпись ``/import``).
+
+    Аргументы:
+        message (Message): Сообщение с файлом ``*.csv.gz`` или ``*.ndjson.gz``.
+        bot (Bot): Экземпляр бота для скачивания файла.
+    """
+
+    filename = message.document.file_name or ""
+    try:
+        fmt = detect_format(filename)
+    except ValueError:
+        await message.answer("Ожидается файл *.csv.gz или *.ndjson.gz")
+        return
+
+    settings = get_settings()
+    status = await message.answer("⏳ Импорт ключей…")
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / Path(filename).name
+        try:
+            await bot.download(message.document, destination=path)
+            result = await import_keys(
+                path,
+                config_path=resolve_clients_path(settings),
+                fmt=fmt,
+                progress=_progress_updater(status, "⏳ Импорт"),
+            )
+        except Exception as error:  # noqa: BLE001
+            logger.exception("Ошибка импорта ключей: {}", error)
+            await status.edit_text("Не удалось импортировать ключи")
+            return
+
+    if result.clients_added:
+        reload_xray()
+    if result.inserted and (KEY_CACHE.loaded or DEVICE_LIMITS.loaded):
+        await KEY_CACHE.warm()
+    await status.edit_text(
+        "✅ Импорт завершён\n"
+        f"• Прочитано строк: {result.total}\n"
+        f"• Добавлено в БД: {result.inserted}\n"
+        f"• Уже существовали: {result.skipped}\n"
+        f"• Добавлено в конфиг XRay: {result.clients_added}"
+    )
@@ -1,23 +1,24 @@
 """Публичный хендлер команды /help."""
 
+from typing import Any
+
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
 from app.bot.services.xray import compose_vless_link
-from app.config import get_settings
+from app.config import get_settings, per_settings_version
 
 router = Router()
 
-@router.message(Command("help"))
-async def cmd_help(message: Message) -> None:
-    """Показать справочную информацию."""
-
-    settings = get_settings()
+@per_settings_version
+def build_help_text(settings: Any) -> str:
+    """Собрать текст /help; пересчитывается один раз на версию настроек."""
 
     example_link = compose_vless_link(
         "11111111-1111-1111-1111-111111111111",
         "user@example.com",
+        settings,
     )
 
     network = (settings.xray_network or "").lower()
@@ -33,7 +34,7 @@ async def cmd_help(message: Message) -> None:
     if settings.xray_flow:
         details.append(f"• Flow: {settings.xray_flow}")
 
-    text = (
+    return (
         "ℹ️ <b>Справка</b>\n\n"
         "• /start — панель администратора (нужен доступ ADMIN_ID)\n"
         "• /help — показать это сообщение\n\n"
@@ -46,4 +47,9 @@ async def cmd_help(message: Message) -> None:
         + "\n\nСвяжитесь с администратором, чтобы получить ключ или продлить доступ."
     )
 
-    await message.answer(text)
+
+@router.message(Command("help"))
+async def cmd_help(message: Message) -> None:
+    """Показать справочную информацию."""
+
+    await message.answer(build_help_text(get_settings()))
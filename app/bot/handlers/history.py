@@ -0,0 +1,148 @@
+"""История конфигурации XRay: /history, /diff и /rollback."""
+
+from __future__ import annotations
+
+import asyncio
+from html import escape
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+from loguru import logger
+
+from app.bot.services.config_history import ConfigHistory, history_for
+from app.bot.services.xray import _load_config, reload_xray, resolve_clients_path, rollback_config
+from app.config import get_settings
+
+router = Router()
+
+HISTORY_LIMIT = 15
+DIFF_LINES = 30
+
+
+async def _history(message: Message) -> ConfigHistory | None:
+    """Вернуть историю файла клиентов, учтя ручные правки; None — история выключена."""
+
+    path = resolve_clients_path(get_settings())
+    history = history_for(path)
+    if history is None:
+        await message.answer("История конфигурации выключена (CONFIG_HISTORY_DIR).")
+        return None
+    await asyncio.to_thread(lambda: history.observe(_load_config(path)))
+    return history
+
+
+def _parse_versions(args: str | None, count: int) -> list[int] | None:
+    parts = (args or "").split()
+    if not 1 <= len(parts) <= count or not all(part.isdigit() for part in parts):
+        return None
+    return [int(part) for part in parts]
+
+
+@router.message(Command("history"))
+async def cmd_history(message: Message, command: CommandObject) -> None:
+    """Показать последние версии config.json.
+
+    Аргументы:
+        message (Message): Сообщение с командой ``/history [N]``.
+        command (CommandObject): Разобранная команда с аргументами.
+    """
+
+    limit = HISTORY_LIMIT
+    if command.args:
+        parsed = _parse_versions(command.args, 1)
+        if parsed is None or not 0 < parsed[0] <= 100:
+            await message.answer("Использование: /history [число версий до 100]")
+            return
+        limit = parsed[0]
+
+    history = await _history(message)
+    if history is None:
+        return
+    versions = await asyncio.to_thread(history.versions, limit)
+    if not versions:
+        await message.answer("История конфигурации пуста.")
+        return
+
+    lines = ["🕘 <b>Версии конфигурации</b>", ""]
+    for info in versions:
+        changes = f"+{info.added} −{info.removed}"
+        if info.full:
+            changes += ", настройки"
+        lines.append(f"v{info.version} · {info.created_at} · {escape(info.source)} · {changes}")
+    lines.append("")
+    lines.append("/diff &lt;версия&gt; [версия] — сравнить, /rollback &lt;версия&gt; — откатить")
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("diff"))
+async def cmd_diff(message: Message, command: CommandObject) -> None:
+    """Показать разницу между версиями (по умолчанию — с текущей).
+
+    Аргументы:
+        message (Message): Сообщение с командой ``/diff <версия> [версия]``.
+        command (CommandObject): Разобранная команда с аргументами.
+    """
+
+    versions = _parse_versions(command.args, 2)
+    if versions is None:
+        await message.answer("Использование: /diff &lt;версия&gt; [версия]")
+        return
+
+    history = await _history(message)
+    if history is None:
+        return
+    try:
+        diff = await asyncio.to_thread(history.diff, *versions)
+    except KeyError as error:
+        await message.answer(f"❌ {escape(str(error.args[0]))}")
+        return
+
+    target = f"v{versions[1]}" if len(versions) == 2 else "текущей"
+    lines = [f"🔍 <b>v{versions[0]} → {target}</b>", ""]
+    if diff.settings_changed:
+        lines.append("⚙️ Изменены настройки кроме клиентов")
+    changes = [("+", tag, client) for tag, client in diff.added] + [("−", tag, client) for tag, client in diff.removed]
+    for sign, tag, client in changes[:DIFF_LINES]:
+        name = client.get("email") or client.get("id") or "?"
+        lines.append(f"{sign} {escape(str(name))} [{escape(tag)}]")
+    if len(changes) > DIFF_LINES:
+        lines.append(f"… и ещё {len(changes) - DIFF_LINES}")
+    if len(lines) == 2:
+        lines.append("Отличий нет.")
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("rollback"))
+async def cmd_rollback(message: Message, command: CommandObject) -> None:
+    """Откатить config.json к версии из истории и перезагрузить XRay.
+
+    Аргументы:
+        message (Message): Сообщение с командой ``/rollback <версия>``.
+        command (CommandObject): Разобранная команда с аргументами.
+    """
+
+    versions = _parse_versions(command.args, 1)
+    if versions is None:
+        await message.answer("Использование: /rollback &lt;версия&gt;")
+        return
+
+    settings = get_settings()
+    path = resolve_clients_path(settings)
+    if history_for(path) is None:
+        await message.answer("История конфигурации выключена (CONFIG_HISTORY_DIR).")
+        return
+    try:
+        created = await asyncio.to_thread(
+            rollback_config, versions[0], path, compact=settings.xray_config_compact
+        )
+    except KeyError as error:
+        await message.answer(f"❌ {escape(str(error.args[0]))}")
+        return
+
+    reload_xray()
+    logger.info("Конфиг XRay откатан к версии {} (новая версия {})", versions[0], created)
+    await message.answer(
+        f"↩️ Конфиг возвращён к v{versions[0]} (записан как v{created}).\n"
+        "Таблица ключей не изменялась: сверьте список ключей, если откат затронул клиентов."
+    )
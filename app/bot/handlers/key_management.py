@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import asyncio
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Any
@@ -9,12 +10,24 @@ from uuid import uuid4
 
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
-from aiogram.types.input_file import BufferedInputFile
 from loguru import logger
-from sqlalchemy import delete, select
-
-from app.bot.services.xray import create_client, generate_qr_code, remove_client, reload_xray
-from app.config import get_settings
+from sqlalchemy import delete
+
+from app.bot.services.journal import discard_intent, get_journal
+from app.bot.services.key_cache import KEY_CACHE, KeyRecord
+from app.bot.services.qr_delivery import send_qr
+from app.bot.services.xray import (
+    client_links,
+    compose_vless_link,
+    configured_tags,
+    create_client_async,
+    generate_qr_code,
+    provision_client_async,
+    reload_xray,
+    remove_client_async,
+    resolve_clients_path,
+)
+from app.config import get_settings, per_settings_version
 from app.db import get_session
 from app.models.key import Key
 
@@ -54,15 +67,14 @@ async def _delete_key_record(uuid: str) -> None:
             await session.commit()
 
 
-async def _fetch_keys() -> list[Key]:
-    """Получить все ключи из базы данных."""
+async def _fetch_keys() -> list[KeyRecord]:
+    """Получить все ключи из кэша (при первом обращении кэш читается из базы)."""
 
-    async with get_session() as session:
-        result = await session.execute(select(Key))
-        return list(result.scalars().all())
+    await KEY_CACHE.ensure_loaded()
+    return KEY_CACHE.all()
 
 
-def _build_delete_keyboard(keys: list[Key]) -> InlineKeyboardMarkup:
+def _build_delete_keyboard(keys: list[KeyRecord]) -> InlineKeyboardMarkup:
     buttons = [
         [
             InlineKeyboardButton(
@@ -75,6 +87,19 @@ def _build_delete_keyboard(keys: list[Key]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def _build_qr_keyboard(keys: list[KeyRecord]) -> InlineKeyboardMarkup:
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=f"📷 QR {key.email or key.uuid[:8]}",
+                callback_data=f"show_qr:{key.uuid}",
+            )
+        ]
+        for key in keys
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
 def _build_expiration_keyboard() -> InlineKeyboardMarkup:
     buttons = [
         [InlineKeyboardButton(text=label, callback_data=f"create_key:expires:{value}")]
@@ -97,6 +122,13 @@ def _format_expiration(expires_at: datetime | None) -> str:
     return "Действует до: " + expires_at.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
 
 
+def _key_email(base: str, uuid: str) -> str:
+    """Email ключа с его UUID: по email из access.log ограничитель находит ключ."""
+
+    local, _, domain = base.partition("@")
+    return f"{local}_{uuid}@{domain}" if domain else f"{base}_{uuid}"
+
+
 def _format_device_limit(limit: int | None) -> str:
     return f"Лимит устройств: {limit}" if limit else "Лимит устройств: не ограничен"
 
@@ -109,7 +141,10 @@ async def handle_create_key(callback: CallbackQuery) -> None:
     user_id = callback.from_user.id
     PENDING_CREATIONS[user_id] = {
         "email": f"user_{user_id}@vpn.local",
-        "config_path": Path(settings.xray_config_path),
+        "config_path": resolve_clients_path(settings),
+        "compact": settings.xray_config_compact,
+        "tags": configured_tags(settings),
+        "journal_path": settings.journal_path,
     }
 
     await callback.message.answer(
@@ -177,27 +212,63 @@ async def handle_create_key_devices(callback: CallbackQuery) -> None:
 
 async def _finalize_creation(callback: CallbackQuery, data: dict[str, Any]) -> None:
     client_uuid = str(uuid4())
-    email: str = data["email"]
+    email = _key_email(data["email"], client_uuid)
     expires_at: datetime | None = data.get("expires_at")
     device_limit: int | None = data.get("device_limit")
     config_path: Path = Path(data["config_path"])
 
-    vless_link = create_client(client_uuid, email, config_path)
-    await _store_key(client_uuid, email, expires_at=expires_at, device_limit=device_limit)
-    reload_xray()
+    tags: list[str] = data.get("tags") or []
+    compact: bool = data.get("compact", False)
 
-    qr_buffer = generate_qr_code(vless_link)
-    qr_file = BufferedInputFile(qr_buffer.getvalue(), filename=f"{client_uuid}.png")
+    journal = get_journal(data.get("journal_path"))
+    seq = await journal.begin(
+        "add",
+        client_uuid,
+        email=email,
+        expires_at=expires_at.isoformat() if expires_at else None,
+        device_limit=device_limit,
+        config_path=str(config_path),
+        compact=compact,
+        tags=tags,
+    )
+    try:
+        if tags:
+            links = await provision_client_async(client_uuid, email, config_path, tags, compact=compact)
+            link_lines = [f"{tag}: {link}" for tag, link in links.items()]
+            vless_link = next(iter(links.values()))
+        else:
+            vless_link = await create_client_async(client_uuid, email, config_path, compact=compact)
+            link_lines = [vless_link]
+        await _store_key(client_uuid, email, expires_at=expires_at, device_limit=device_limit)
+    except Exception:
+        # Ключ не выдан: убираем его из того хранилища, куда он успел попасть.
+        await discard_intent(journal, seq)
+        raise
+    # Ссылка уходит администратору только после fsync отметки: иначе recover
+    # после сбоя откатил бы уже выданный ключ.
+    await journal.commit(seq)
+    KEY_CACHE.put(KeyRecord(client_uuid, email, expires_at, device_limit))
+    reload_xray()
 
     info_lines = [
         "✅ Ключ создан",
-        vless_link,
+        *link_lines,
         _format_expiration(expires_at),
         _format_device_limit(device_limit),
     ]
 
-    await callback.message.answer("\n".join(info_lines))
-    await callback.message.answer_document(qr_file, caption="QR-код для подключения")
+    await callback.message.answer(
+        "\n".join(info_lines),
+        reply_markup=_build_qr_keyboard([KeyRecord(client_uuid, email, expires_at, device_limit)]),
+    )
+    # Ключ только что создан: сохранённого file_id у него быть не может.
+    await send_qr(
+        callback.message,
+        client_uuid,
+        lambda: generate_qr_code(vless_link).getvalue(),
+        lookup=False,
+        link=vless_link,
+    )
     logger.info(
         "Создан ключ %s (expires=%s, limit=%s)",
         client_uuid,
@@ -206,21 +277,56 @@ async def _finalize_creation(callback: CallbackQuery, data: dict[str, Any]) -> N
     )
 
 
+@router.callback_query(F.data.startswith("show_qr:"))
+async def handle_show_qr(callback: CallbackQuery) -> None:
+    """Повторно отправить QR-код существующего ключа."""
+
+    _, _, uuid = callback.data.partition(":")
+    await KEY_CACHE.ensure_loaded()
+    record = KEY_CACHE.get(uuid)
+    if record is None:
+        await callback.answer("Ключ не найден", show_alert=True)
+        return
+
+    settings = get_settings()
+    tags = configured_tags(settings)
+
+    def current_link() -> str:
+        link = compose_vless_link(uuid, record.email)
+        if tags:
+            links = client_links(uuid, record.email, resolve_clients_path(settings), tags)
+            link = next(iter(links.values()), link)
+        return link
+
+    # Ссылка считается по текущим настройкам: после их перезагрузки QR-код
+    # со старым хостом или транспортом загружается заново.
+    link = await asyncio.to_thread(current_link)
+    await send_qr(callback.message, uuid, lambda: generate_qr_code(link).getvalue(), link=link)
+    await callback.answer()
+
+
 @router.callback_query(F.data.startswith("delete_key:"))
 async def handle_delete_key(callback: CallbackQuery) -> None:
     """Удалить ключ по UUID из конфига и базы данных."""
 
     _, _, uuid = callback.data.partition(":")
     settings = get_settings()
-    config_path = Path(settings.xray_config_path)
+    config_path = resolve_clients_path(settings)
 
     if not uuid:
         await callback.answer("UUID не найден", show_alert=True)
         return
 
-    removed = remove_client(uuid, config_path)
+    journal = get_journal(settings.journal_path)
+    seq = await journal.begin(
+        "remove", uuid, config_path=str(config_path), compact=settings.xray_config_compact
+    )
+    removed = await remove_client_async(uuid, config_path, compact=settings.xray_config_compact)
     if removed:
         await _delete_key_record(uuid)
+    journal.commit(seq)
+    if removed:
+        KEY_CACHE.discard(uuid)
         reload_xray()
         await callback.answer("Ключ удалён", show_alert=True)
         await callback.message.answer(f"🗑 Ключ {uuid} удалён")
@@ -268,18 +374,17 @@ async def handle_list_keys(callback: CallbackQuery) -> None:
             )
         )
 
-    await callback.message.answer("Список ключей:\n" + "\n".join(lines))
+    await callback.message.answer("Список ключей:\n" + "\n".join(lines), reply_markup=_build_qr_keyboard(keys))
     await callback.answer()
 
 
-@router.callback_query(F.data == "settings")
-async def handle_settings(callback: CallbackQuery) -> None:
-    """Отправить краткую справку по настройкам."""
-
-    settings = get_settings()
-    info = (
+@per_settings_version
+def _settings_summary(settings: Any) -> str:
+    return (
         "⚙️ Настройки бота:\n"
         f"• XRAY_CONFIG_PATH: {settings.xray_config_path}\n"
+        f"• XRAY_CLIENTS_PATH: {settings.xray_clients_path or '—'}\n"
+        f"• XRAY_CONFIG_COMPACT: {'да' if settings.xray_config_compact else 'нет'}\n"
         f"• XRAY_HOST: {settings.xray_host}\n"
         f"• XRAY_PORT: {settings.xray_port}\n"
         f"• XRAY_SECURITY: {settings.xray_security or 'none'}\n"
@@ -288,5 +393,11 @@ async def handle_settings(callback: CallbackQuery) -> None:
         f"• XRAY_FLOW: {settings.xray_flow or '—'}\n"
         f"• XRAY_RELOAD_COMMAND: {settings.xray_reload_command or 'не задана'}"
     )
-    await callback.message.answer(info)
+
+
+@router.callback_query(F.data == "settings")
+async def handle_settings(callback: CallbackQuery) -> None:
+    """Отправить краткую справку по настройкам."""
+
+    await callback.message.answer(_settings_summary(get_settings()))
     await callback.answer()
@@ -0,0 +1,97 @@
+"""Отчёты об использовании ключей: /usage и /top."""
+
+from __future__ import annotations
+
+import asyncio
+import html
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+
+from app.bot.services.heavy_hitters import RANK_BY, top_from_logs
+from app.bot.services.key_cache import KEY_CACHE
+from app.bot.services.usage import month_start, top_users
+from app.config import get_settings
+
+router = Router()
+
+TOP_LIMIT = 10
+
+
+def _period_start(args: str | None, now: datetime) -> tuple[datetime, str] | None:
+    """Разобрать аргумент команды: пусто — текущий месяц, число — последние N дней."""
+
+    if not args or not args.strip():
+        start = month_start(now)
+        return datetime(start.year, start.month, 1, tzinfo=timezone.utc), "с начала месяца"
+    days = args.strip()
+    if not days.isdigit() or not 0 < int(days) <= 366:
+        return None
+    return now - timedelta(days=int(days)), f"за {int(days)} дн."
+
+
+@router.message(Command("usage"))
+async def cmd_usage(message: Message, command: CommandObject) -> None:
+    """Показать ключи с наибольшим числом подключений.
+
+    Аргументы:
+        message (Message): Сообщение с командой ``/usage [дней]``.
+        command (CommandObject): Разобранная команда с аргументами.
+    """
+
+    now = datetime.now(timezone.utc)
+    period = _period_start(command.args, now)
+    if period is None:
+        await message.answer("Использование: /usage [дней от 1 до 366]")
+        return
+    since, title = period
+
+    totals = await top_users(since, TOP_LIMIT, now=now)
+    if not totals:
+        await message.answer(f"Нет данных об использовании {title}.")
+        return
+
+    await KEY_CACHE.ensure_loaded()
+    lines = [f"📊 <b>Топ ключей по подключениям {title}</b>", ""]
+    for position, total in enumerate(totals, start=1):
+        record = KEY_CACHE.get(total.key_uuid)
+        name = record.email if record is not None else f"{total.key_uuid} (удалён)"
+        lines.append(
+            f"{position}. {html.escape(name)} — {total.connections} подключений, до {total.peak_devices} устройств"
+        )
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("top"))
+async def cmd_top(message: Message, command: CommandObject) -> None:
+    """Показать самых активных клиентов по текущему access.log.
+
+    Аргументы:
+        message (Message): Сообщение с командой ``/top [devices|connections] [N]``.
+        command (CommandObject): Разобранная команда с аргументами.
+    """
+
+    by, limit = "devices", TOP_LIMIT
+    for arg in (command.args or "").split():
+        if arg in RANK_BY:
+            by = arg
+        elif arg.isdigit() and 0 < int(arg) <= 50:
+            limit = int(arg)
+        else:
+            await message.answer("Использование: /top [devices|connections] [N до 50]")
+            return
+
+    path = get_settings().xray_access_log_path
+    rows = await asyncio.to_thread(top_from_logs, [path], limit, by=by)
+    if not rows:
+        await message.answer("В журнале XRay нет принятых соединений.")
+        return
+
+    title = "уникальным IP" if by == "devices" else "соединениям"
+    lines = [f"🔥 <b>Топ клиентов по {title}</b> (access.log)", ""]
+    for position, row in enumerate(rows, start=1):
+        bound = f" (±{row.error})" if row.error else ""
+        lines.append(f"{position}. {html.escape(row.key)} — устройств {row.devices}, соединений {row.connections}{bound}")
+    await message.answer("\n".join(lines))
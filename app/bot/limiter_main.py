@@ -0,0 +1,123 @@
+"""Точка входа сервиса ограничения подключений."""
+
+import asyncio
+import signal
+
+from loguru import logger
+
+from app.bot.services.device_groups import DeviceGrouper
+from app.bot.services.file_watcher import FileWatcher
+from app.bot.services.geoip import GeoLocator
+from app.bot.services.key_cache import start_key_cache_sync
+from app.bot.services.limiter import DEVICE_LIMITS
+from app.bot.services.limiter_daemon import LimiterDaemon
+from app.bot.services.metrics import install_db_timing, start_metrics_server
+from app.bot.services.nft import NftBanSet
+from app.bot.services.usage import UsageRecorder, maintenance_loop
+from app.bot.services.xray import resolve_clients_path
+from app.config import get_settings
+from app.db import get_engine
+from app.migrations import is_postgres
+
+
+async def main() -> None:
+    """Запустить сервис ограничения и работать до SIGINT/SIGTERM."""
+
+    settings = get_settings()
+    ban_set = None
+    if settings.limiter_enforcement == "nft":
+        ban_set = NftBanSet(port=settings.xray_port, timeout_seconds=settings.limiter_ban_seconds)
+        ban_set.setup()
+
+    # История использования хранится в секционированных таблицах PostgreSQL.
+    usage = None
+    if settings.usage_sample_seconds and is_postgres(settings.database_url):
+        usage = UsageRecorder(settings.usage_sample_seconds)
+
+    # Места ключей (страны или AS) по локальной базе MaxMind.
+    geo = None
+    if settings.limiter_geoip_path or settings.limiter_asn_path:
+        geo = GeoLocator.open(
+            settings.limiter_geoip_path,
+            settings.limiter_asn_path,
+            level=settings.limiter_geo_level,
+            cache_size=settings.limiter_geo_cache_size,
+        )
+
+    daemon = LimiterDaemon(
+        settings.xray_access_log_path,
+        resolve_clients_path(settings),
+        settings.limiter_state_path,
+        limits=DEVICE_LIMITS,
+        window_seconds=settings.limiter_window_seconds,
+        release_ticks=settings.limiter_release_ticks,
+        bandwidth=settings.limiter_bandwidth,
+        ban_set=ban_set,
+        usage=usage,
+        groups=DeviceGrouper(
+            settings.limiter_ipv4_group_prefix,
+            settings.limiter_ipv6_group_prefix,
+            settings.limiter_group_cidrs.split(","),
+        ),
+        geo=geo,
+        geo_window_seconds=settings.limiter_geo_window_seconds,
+        max_locations=settings.limiter_geo_max_locations,
+    )
+
+    # Тик по дописи в access.log вместо сна на весь интервал.
+    file_watcher = None
+    if settings.file_watch_poll_seconds:
+        file_watcher = FileWatcher(settings.file_watch_poll_seconds)
+        daemon.watch(file_watcher)
+        file_watcher.start()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    metrics_runner = None
+    if settings.limiter_metrics_port:
+        install_db_timing()
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.limiter_metrics_port)
+
+    # Лимиты обновляются по уведомлениям из базы; daemon.run дополнительно
+    # перечитывает их целиком на случай потерянных уведомлений.
+    background_tasks = start_key_cache_sync(settings.database_url, 0)
+    if usage is not None:
+        background_tasks.append(
+            asyncio.create_task(
+                maintenance_loop(
+                    get_engine(),
+                    stop_event,
+                    raw_retention_months=settings.usage_raw_retention_months,
+                    hourly_retention_months=settings.usage_hourly_retention_months,
+                ),
+                name="usage-maintenance",
+            )
+        )
+
+    logger.info(
+        "Запуск ограничителя: журнал {}, тик {} с",
+        settings.xray_access_log_path,
+        settings.limiter_tick_seconds,
+    )
+    try:
+        await daemon.run(
+            stop_event,
+            tick_seconds=settings.limiter_tick_seconds,
+            min_tick_seconds=settings.limiter_min_tick_seconds,
+        )
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        if file_watcher is not None:
+            file_watcher.close()
+        if geo is not None:
+            geo.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,36 +1,111 @@
 """Точка входа Telegram-бота."""
 
 import asyncio
+from typing import Any
 
-from aiogram import Bot, Dispatcher
+from aiogram import BaseMiddleware, Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from loguru import logger
 
-from app.bot.handlers.admin import router as admin_router
-from app.bot.handlers.help import router as help_router
-from app.bot.handlers.key_management import router as key_router
+from app.bot.handlers import load_routers
 from app.bot.middlewares.admin import AdminAccessMiddleware
+from app.bot.middlewares.metrics import MetricsMiddleware
+from app.bot.services.config_history import configure_history
+from app.bot.services.file_watcher import FileWatcher
+from app.bot.services.journal import get_journal, recover
+from app.bot.services.key_cache import start_key_cache_sync
+from app.bot.services.metrics import (
+    REGISTRY,
+    collect_key_counts,
+    install_db_timing,
+    start_metrics_server,
+)
+from app.bot.services.settings_watcher import start_settings_watcher
+from app.bot.services.xray import resolve_clients_path, watch_config
 from app.config import get_settings
+from app.db import get_engine
+from app.migrations import is_postgres, run_migrations
+
+
+def build_dispatcher(settings: Any, *, access_middleware: BaseMiddleware | None = None) -> Dispatcher:
+    """Собрать диспетчер с роутерами и middleware.
+
+    Аргументы:
+        settings: Настройки приложения.
+        access_middleware (BaseMiddleware | None): Проверка доступа вместо
+            стандартной :class:`AdminAccessMiddleware` (используется нагрузочным стендом).
+
+    Возвращает:
+        Dispatcher: Готовый к обработке апдейтов диспетчер.
+    """
+
+    dispatcher = Dispatcher()
+
+    for router in load_routers():
+        dispatcher.include_router(router)
+
+    if access_middleware is None:
+        access_middleware = AdminAccessMiddleware(settings.admin_id, allowed_commands={"help"})
+    dispatcher.message.outer_middleware(access_middleware)
+    dispatcher.callback_query.outer_middleware(access_middleware)
+    dispatcher.message.middleware(MetricsMiddleware("message"))
+    dispatcher.callback_query.middleware(MetricsMiddleware("callback_query"))
+    return dispatcher
 
 
 async def main() -> None:
     """Инициализировать бота и запустить долгий поллинг."""
 
     settings = get_settings()
+    if settings.migrate_on_startup and is_postgres(settings.database_url):
+        await run_migrations(get_engine())
+
+    configure_history(
+        settings.config_history_dir,
+        keep=settings.config_history_keep,
+        snapshot_every=settings.config_history_snapshot_every,
+    )
+
+    # До приёма апдейтов: конфиг XRay и база должны совпадать.
+    journal = get_journal(settings.journal_path)
+    await recover(journal)
+
     bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dispatcher = Dispatcher()
+    dispatcher = build_dispatcher(settings)
 
-    dispatcher.include_router(help_router)
-    dispatcher.include_router(admin_router)
-    dispatcher.include_router(key_router)
+    metrics_runner = None
+    if settings.metrics_port:
+        install_db_timing()
+        REGISTRY.add_collector(collect_key_counts)
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port)
 
-    access_middleware = AdminAccessMiddleware(settings.admin_id, allowed_commands={"help"})
-    dispatcher.message.outer_middleware(access_middleware)
-    dispatcher.callback_query.outer_middleware(access_middleware)
+    # Индекс конфига перестраивается только после правок извне, .env перечитывается по событию.
+    file_watcher = None
+    if settings.file_watch_poll_seconds:
+        file_watcher = FileWatcher(settings.file_watch_poll_seconds)
+        watch_config(file_watcher, resolve_clients_path(settings))
+        file_watcher.start()
+
+    background_tasks = start_key_cache_sync(settings.database_url, settings.key_cache_refresh_seconds)
+    background_tasks.append(start_settings_watcher(settings.settings_reload_seconds, watcher=file_watcher))
+    if journal.enabled and settings.journal_checkpoint_seconds:
+        background_tasks.append(
+            asyncio.create_task(journal.checkpoint_loop(settings.journal_checkpoint_seconds), name="journal-checkpoint")
+        )
 
     logger.info("Запуск бота с ADMIN_ID=%s", settings.admin_id)
-    await dispatcher.start_polling(bot)
+    try:
+        await dispatcher.start_polling(bot)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        if file_watcher is not None:
+            file_watcher.close()
+        await journal.flush()
+        journal.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
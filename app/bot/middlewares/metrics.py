@@ -0,0 +1,66 @@
+"""Middleware, измеряющее длительность обработчиков."""
+
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.bot.services.metrics import HANDLER_ERRORS, HANDLER_SECONDS
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Записывает время выполнения каждого обработчика в гистограмму.
+
+    Регистрируется как inner-middleware, поэтому в ``data["handler"]`` уже
+    лежит выбранный обработчик и метка содержит имя его функции.
+    """
+
+    def __init__(self, event_type: str) -> None:
+        """Запомнить тип событий, для которых собираются метрики.
+
+        Аргументы:
+            event_type (str): Значение метки ``event`` (например ``message``).
+        """
+
+        self._event_type = event_type
+        self._series: dict[Any, tuple[Any, Any]] = {}
+
+    def _series_for(self, handler_object: Any) -> tuple[Any, Any]:
+        callback = getattr(handler_object, "callback", None)
+        series = self._series.get(callback)
+        if series is None:
+            name = getattr(callback, "__name__", "unknown")
+            series = (
+                HANDLER_SECONDS.labels(self._event_type, name),
+                HANDLER_ERRORS.labels(self._event_type, name),
+            )
+            self._series[callback] = series
+        return series
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        """Вызвать обработчик и записать его длительность.
+
+        Аргументы:
+            handler (Callable): Следующий обработчик цепочки.
+            event (TelegramObject): Входящее событие Telegram.
+            data (dict[str, Any]): Контекст Aiogram.
+
+        Возвращает:
+            Any: Результат обработчика.
+        """
+
+        seconds, errors = self._series_for(data.get("handler"))
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(perf_counter() - started)
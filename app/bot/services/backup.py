@@ -0,0 +1,379 @@
+"""Потоковый экспорт и импорт ключей для резервного копирования и миграций.
+
+Экспорт читает таблицу ``keys`` серверным курсором и пишет строки в gzip-файл
+формата CSV или NDJSON, не загружая таблицу в память целиком. Импорт читает
+такой же файл пачками, переносит строки в БД (в PostgreSQL — через ``COPY``)
+и добавляет недостающих клиентов в config.json XRay одной записью.
+
+Запуск из командной строки::
+
+    python -m app.bot.services.backup export keys.csv.gz
+    python -m app.bot.services.backup import keys.ndjson.gz --config ./docker/xray/config.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import gzip
+import inspect
+import json
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterator, Sequence, TextIO
+
+from loguru import logger
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.bot.services.xray import add_clients, resolve_clients_path
+from app.config import get_settings
+from app.db import get_session
+from app.models.key import Key
+
+EXPORT_FORMATS = ("csv", "ndjson")
+FIELDS = ("uuid", "email", "created_at", "expires_at", "device_limit")
+BATCH_SIZE = 1000
+PROGRESS_STEP = 10_000
+
+ProgressCallback = Callable[[int], Awaitable[None] | None]
+
+_COPY_STAGING_SQL = (
+    "CREATE TEMP TABLE IF NOT EXISTS keys_import ("
+    "uuid VARCHAR(64), email VARCHAR(255), created_at TIMESTAMPTZ, "
+    "expires_at TIMESTAMPTZ, device_limit INTEGER"
+    ") ON COMMIT DELETE ROWS"
+)
+_COPY_SQL = "COPY keys_import (uuid, email, created_at, expires_at, device_limit) FROM STDIN"
+_COPY_MERGE_SQL = (
+    "INSERT INTO keys (uuid, email, created_at, expires_at, device_limit) "
+    "SELECT uuid, email, COALESCE(created_at, NOW()), expires_at, device_limit FROM keys_import "
+    "ON CONFLICT (uuid) DO NOTHING"
+)
+
+
+@dataclass(slots=True)
+class ImportResult:
+    """Итог импорта ключей.
+
+    Атрибуты:
+        total (int): Количество прочитанных строк.
+        inserted (int): Количество новых записей в БД.
+        skipped (int): Строки, UUID которых уже были в БД.
+        clients_added (int): Клиенты, добавленные в config.json.
+    """
+
+    total: int = 0
+    inserted: int = 0
+    skipped: int = 0
+    clients_added: int = 0
+
+
+def detect_format(path: str | Path) -> str:
+    """Определить формат файла по расширению.
+
+    Аргументы:
+        path (str | Path): Путь к файлу вида ``*.csv.gz`` или ``*.ndjson.gz``.
+
+    Возвращает:
+        str: ``csv`` или ``ndjson``.
+    """
+
+    suffixes = [suffix.lstrip(".").lower() for suffix in Path(path).suffixes]
+    for fmt in EXPORT_FORMATS:
+        if fmt in suffixes:
+            return fmt
+    if "jsonl" in suffixes or "json" in suffixes:
+        return "ndjson"
+    raise ValueError(f"Не удалось определить формат файла: {path}")
+
+
+def _serialize(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _parse_datetime(value: Any) -> datetime | None:
+    if value in (None, ""):
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def _parse_limit(value: Any) -> int | None:
+    if value in (None, ""):
+        return None
+    return int(value)
+
+
+def _normalize_row(raw: dict[str, Any]) -> dict[str, Any]:
+    uuid = (raw.get("uuid") or "").strip()
+    if not uuid:
+        raise ValueError("Строка без UUID")
+    return {
+        "uuid": uuid,
+        "email": raw.get("email") or "",
+        "created_at": _parse_datetime(raw.get("created_at")),
+        "expires_at": _parse_datetime(raw.get("expires_at")),
+        "device_limit": _parse_limit(raw.get("device_limit")),
+    }
+
+
+def _iter_rows(handle: TextIO, fmt: str) -> Iterator[dict[str, Any]]:
+    if fmt == "csv":
+        for raw in csv.DictReader(handle):
+            yield _normalize_row(raw)
+        return
+    for line in handle:
+        line = line.strip()
+        if line:
+            yield _normalize_row(json.loads(line))
+
+
+def _open_export(destination: str | Path, fmt: str) -> tuple[TextIO, Any]:
+    handle = gzip.open(destination, "wt", encoding="utf-8", newline="")
+    writer = csv.writer(handle) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(FIELDS)
+    return handle, writer
+
+
+def _write_rows(handle: TextIO, writer: Any, rows: Sequence[Sequence[Any]]) -> None:
+    for row in rows:
+        values = [_serialize(value) for value in row]
+        if writer is not None:
+            writer.writerow(["" if value is None else value for value in values])
+        else:
+            handle.write(json.dumps(dict(zip(FIELDS, values, strict=True)), ensure_ascii=False))
+            handle.write("\n")
+
+
+def _read_batch(rows: Iterator[dict[str, Any]], size: int) -> list[dict[str, Any]]:
+    return list(islice(rows, size))
+
+
+async def _report(progress: ProgressCallback | None, count: int) -> None:
+    if progress is None:
+        return
+    result = progress(count)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def export_keys(
+    destination: str | Path,
+    fmt: str = "csv",
+    *,
+    progress: ProgressCallback | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Выгрузить все ключи в gzip-файл без загрузки таблицы в память.
+
+    Сериализация и сжатие каждой пачки идут в рабочем потоке, поэтому цикл
+    событий бота не блокируется даже на больших таблицах.
+
+    Аргументы:
+        destination (str | Path): Путь к создаваемому файлу.
+        fmt (str): Формат ``csv`` или ``ndjson``.
+        progress (ProgressCallback | None): Вызывается каждые ``PROGRESS_STEP`` строк
+            и в конце, если итог ещё не сообщался.
+        batch_size (int): Размер пачки, получаемой из серверного курсора.
+
+    Возвращает:
+        int: Количество выгруженных строк.
+    """
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+    columns = [getattr(Key, field) for field in FIELDS]
+    statement = select(*columns).order_by(Key.id).execution_options(yield_per=batch_size)
+    count = 0
+    reported: int | None = None
+
+    async with get_session() as session:
+        result = await session.stream(statement)
+        handle, writer = await asyncio.to_thread(_open_export, destination, fmt)
+        try:
+            async for partition in result.partitions(batch_size):
+                await asyncio.to_thread(_write_rows, handle, writer, partition)
+                count += len(partition)
+                if count - (reported or 0) >= PROGRESS_STEP:
+                    await _report(progress, count)
+                    reported = count
+        finally:
+            await asyncio.to_thread(handle.close)
+
+    if count != reported:
+        # Повтор того же текста Telegram отклоняет ("message is not modified").
+        await _report(progress, count)
+    logger.info("Экспортировано ключей: {} ({})", count, destination)
+    return count
+
+
+async def _copy_batch(session: AsyncSession, rows: list[dict[str, Any]]) -> int:
+    """Загрузить пачку через COPY во временную таблицу и слить её в ``keys``."""
+
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+    async with driver_connection.cursor() as cursor:
+        await cursor.execute(_COPY_STAGING_SQL)
+        async with cursor.copy(_COPY_SQL) as copy:
+            for row in rows:
+                await copy.write_row([row[field] for field in FIELDS])
+        await cursor.execute(_COPY_MERGE_SQL)
+        return max(cursor.rowcount, 0)
+
+
+async def _insert_batch(session: AsyncSession, rows: list[dict[str, Any]]) -> int:
+    """Вставить пачку обычным executemany, пропуская существующие UUID."""
+
+    uuids = [row["uuid"] for row in rows]
+    result = await session.execute(select(Key.uuid).where(Key.uuid.in_(uuids)))
+    existing = set(result.scalars().all())
+    now = datetime.now(timezone.utc)
+    fresh: list[dict[str, Any]] = []
+    for row in rows:
+        if row["uuid"] in existing:
+            continue
+        existing.add(row["uuid"])
+        fresh.append({**row, "created_at": row["created_at"] or now})
+    if fresh:
+        await session.execute(insert(Key), fresh)
+    return len(fresh)
+
+
+async def _flush_batch(session: AsyncSession, rows: list[dict[str, Any]]) -> int:
+    if not rows:
+        return 0
+    connection = await session.connection()
+    if connection.dialect.name == "postgresql":
+        inserted = await _copy_batch(session, rows)
+    else:
+        inserted = await _insert_batch(session, rows)
+    await session.commit()
+    return inserted
+
+
+async def import_keys(
+    source: str | Path,
+    *,
+    config_path: str | Path | None = None,
+    fmt: str | None = None,
+    progress: ProgressCallback | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> ImportResult:
+    """Загрузить ключи из gzip-файла в БД и config.json.
+
+    Строки читаются и записываются в БД пачками по ``batch_size``; от
+    каждой строки в памяти остаются только UUID и email. Распаковка и разбор
+    файла идут в рабочем потоке, а не в цикле событий. После загрузки
+    клиенты, которых нет в конфиге XRay, добавляются в него одной записью
+    под блокировкой конфига (:func:`add_clients`).
+
+    Импорт можно безопасно повторить: строки, уже попавшие в БД,
+    пропускаются, а клиенты сверяются с текущим конфигом. Поэтому после
+    сбоя до записи конфига (ключи есть в БД, но не в XRay) достаточно
+    запустить импорт того же файла ещё раз.
+
+    Аргументы:
+        source (str | Path): Путь к файлу экспорта.
+        config_path (str | Path | None): Файл с клиентами (по умолчанию из настроек).
+        fmt (str | None): Формат файла, если его нельзя определить по расширению.
+        progress (ProgressCallback | None): Вызывается каждые ``PROGRESS_STEP`` строк
+            и в конце, если итог ещё не сообщался.
+        batch_size (int): Размер пачки для записи в БД.
+
+    Возвращает:
+        ImportResult: Статистика импорта.
+    """
+
+    fmt = fmt or detect_format(source)
+    settings = get_settings()
+    path = Path(config_path) if config_path else resolve_clients_path(settings)
+    compact = settings.xray_config_compact
+
+    summary = ImportResult()
+    clients: list[tuple[str, str]] = []
+    reported: int | None = None
+
+    handle = await asyncio.to_thread(gzip.open, source, "rt", encoding="utf-8", newline="")
+    try:
+        rows = _iter_rows(handle, fmt)
+        async with get_session() as session:
+            while batch := await asyncio.to_thread(_read_batch, rows, batch_size):
+                summary.total += len(batch)
+                clients.extend((row["uuid"], row["email"]) for row in batch)
+                summary.inserted += await _flush_batch(session, batch)
+                if summary.total - (reported or 0) >= PROGRESS_STEP:
+                    await _report(progress, summary.total)
+                    reported = summary.total
+    finally:
+        await asyncio.to_thread(handle.close)
+
+    if clients:
+        fresh = ({"id": uuid, "email": email} for uuid, email in clients)
+        summary.clients_added = await asyncio.to_thread(add_clients, fresh, path, compact=compact)
+
+    summary.skipped = summary.total - summary.inserted
+    if summary.total != reported:
+        await _report(progress, summary.total)
+    logger.info(
+        "Импортировано ключей: {} (новых в БД {}, новых в конфиге {})",
+        summary.total,
+        summary.inserted,
+        summary.clients_added,
+    )
+    return summary
+
+
+def _print_progress(count: int) -> None:
+    print(f"\r… обработано строк: {count}", end="", file=sys.stderr, flush=True)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Точка входа CLI для экспорта и импорта ключей."""
+
+    parser = argparse.ArgumentParser(description="Экспорт и импорт ключей VPN")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="выгрузить ключи в gzip-файл")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default=None)
+
+    import_parser = commands.add_parser("import", help="загрузить ключи из gzip-файла")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=EXPORT_FORMATS, default=None)
+    import_parser.add_argument("--config", default=None, help="путь к config.json XRay")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        fmt = args.format or detect_format(args.path)
+        count = asyncio.run(export_keys(args.path, fmt, progress=_print_progress))
+        print(f"\nЭкспортировано: {count}", file=sys.stderr)
+        return 0
+
+    result = asyncio.run(
+        import_keys(args.path, config_path=args.config, fmt=args.format, progress=_print_progress)
+    )
+    print(
+        f"\nИмпортировано: {result.total}, новых в БД: {result.inserted}, "
+        f"новых в конфиге: {result.clients_added}",
+        file=sys.stderr,
+    )
+    return 0
+
+
+__all__ = ["ImportResult", "detect_format", "export_keys", "import_keys"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,482 @@
+"""История версий config.json XRay: дельты списков клиентов и полные снимки.
+
+Каждое сохранение конфига ботом становится новой версией. Ручная правка
+тоже становится версией: её замечают перед следующим изменением или при
+просмотре истории. Версия хранится одним файлом в каталоге истории:
+
+* ``000042.delta.json`` — изменение списков клиентов по тегам inbound-ов:
+  какие клиенты удалены (с позицией в старом списке) и какие добавлены
+  (с позицией в новом). Дельта обратима, поэтому откат на несколько версий
+  назад применяет обратные дельты к текущему конфигу, и его стоимость
+  пропорциональна размеру изменений, а не конфига;
+* ``000050.full.json`` — полный снимок. Пишется каждые ``snapshot_every``
+  версий, а также когда изменилось что-то кроме клиентов (TLS, routing,
+  порядок клиентов). Через такую версию назад не пройти, поэтому
+  состояние до неё восстанавливается вперёд от ближайшего более раннего
+  снимка.
+
+Хранится не меньше ``keep`` последних версий. Удаляются только целые
+отрезки перед снимком, чтобы любая оставшаяся версия восстанавливалась.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from app.bot.services.xray_model import SUPPORTED_PROTOCOLS
+
+# Дельта: тег inbound-а → {"removed": [[позиция, клиент], ...], "added": [...]}.
+Delta = dict[str, dict[str, list[list[Any]]]]
+
+_DELTA_SUFFIX = ".delta.json"
+_FULL_SUFFIX = ".full.json"
+
+
+class VersionInfo(NamedTuple):
+    """Сведения о версии для списка ``/history``.
+
+    Атрибуты:
+        version (int): Номер версии.
+        created_at (str): Время записи (ISO 8601, UTC).
+        source (str): ``bot``, ``external`` (ручная правка) или ``rollback:<версия>``.
+        added (int): Добавлено клиентов.
+        removed (int): Удалено клиентов.
+        full (bool): Изменилось что-то кроме клиентов (версия хранится снимком).
+    """
+
+    version: int
+    created_at: str
+    source: str
+    added: int
+    removed: int
+    full: bool
+
+
+@dataclass
+class ConfigDiff:
+    """Разница между двумя версиями.
+
+    Атрибуты:
+        added (list[tuple[str, dict]]): Клиенты, появившиеся во второй версии (тег, клиент).
+        removed (list[tuple[str, dict]]): Клиенты, исчезнувшие во второй версии.
+        settings_changed (bool): Отличается что-то кроме списков клиентов.
+    """
+
+    added: list[tuple[str, dict[str, Any]]] = field(default_factory=list)
+    removed: list[tuple[str, dict[str, Any]]] = field(default_factory=list)
+    settings_changed: bool = False
+
+
+def _copy(config: dict[str, Any]) -> dict[str, Any]:
+    return json.loads(json.dumps(config))
+
+
+def _client_lists(config: dict[str, Any], *, create: bool = False) -> dict[str, list[dict[str, Any]]] | None:
+    """Списки клиентов по тегам; None, если теги неоднозначны.
+
+    Без ``create`` конфиг не изменяется: отсутствующий список заменяется пустым.
+    """
+
+    lists: dict[str, list[dict[str, Any]]] = {}
+    for position, inbound in enumerate(config.get("inbounds", [])):
+        if inbound.get("protocol") not in SUPPORTED_PROTOCOLS:
+            continue
+        tag = inbound.get("tag") or f"{inbound['protocol']}-{position}"
+        if tag in lists:
+            return None
+        if create:
+            lists[tag] = inbound.setdefault("settings", {}).setdefault("clients", [])
+        else:
+            lists[tag] = inbound.get("settings", {}).get("clients", [])
+    return lists
+
+
+def _skeleton(config: dict[str, Any]) -> dict[str, Any]:
+    """Конфиг без списков клиентов (для сравнения остальных настроек)."""
+
+    inbounds = []
+    for inbound in config.get("inbounds", []):
+        if inbound.get("protocol") in SUPPORTED_PROTOCOLS:
+            settings = {key: value for key, value in inbound.get("settings", {}).items() if key != "clients"}
+            inbound = {**inbound, "settings": settings}
+        inbounds.append(inbound)
+    return {**config, "inbounds": inbounds}
+
+
+def _canonical(client: dict[str, Any]) -> str:
+    return json.dumps(client, sort_keys=True, ensure_ascii=False)
+
+
+def compute_delta(old: dict[str, Any], new: dict[str, Any]) -> Delta | None:
+    """Построить обратимую дельту клиентов между конфигами.
+
+    Возвращает:
+        Delta | None: Дельта или None, если изменилось что-то кроме клиентов
+        либо порядок оставшихся клиентов (тогда версия хранится снимком).
+    """
+
+    if _skeleton(old) != _skeleton(new):
+        return None
+    old_lists, new_lists = _client_lists(old), _client_lists(new)
+    if old_lists is None or new_lists is None:
+        return None
+
+    delta: Delta = {}
+    for tag, new_clients in new_lists.items():
+        old_clients = old_lists.get(tag, [])
+        if old_clients == new_clients:
+            continue
+        old_keys = [_canonical(client) for client in old_clients]
+        new_keys = [_canonical(client) for client in new_clients]
+        if len(set(old_keys)) != len(old_keys) or len(set(new_keys)) != len(new_keys):
+            return None
+        old_set, new_set = set(old_keys), set(new_keys)
+        removed = [[index, old_clients[index]] for index, key in enumerate(old_keys) if key not in new_set]
+        added = [[index, new_clients[index]] for index, key in enumerate(new_keys) if key not in old_set]
+        kept_old = [key for key in old_keys if key in new_set]
+        kept_new = [key for key in new_keys if key in old_set]
+        if kept_old != kept_new:
+            return None
+        delta[tag] = {"removed": removed, "added": added}
+    return delta
+
+
+def apply_delta(config: dict[str, Any], delta: Delta, *, reverse: bool = False) -> None:
+    """Применить дельту к конфигу на месте (``reverse`` — откатить её).
+
+    Стоимость пропорциональна числу изменённых клиентов.
+    """
+
+    lists = _client_lists(config, create=True) or {}
+    for tag, change in delta.items():
+        clients = lists[tag]
+        drop, insert = (change["added"], change["removed"]) if reverse else (change["removed"], change["added"])
+        for index, _ in sorted(drop, key=lambda item: item[0], reverse=True):
+            del clients[index]
+        for index, client in sorted(insert, key=lambda item: item[0]):
+            clients.insert(index, client)
+
+
+# Версия, записанная откатом, хранит цепочку шагов ``[дельта, обратно?]``:
+# обратные дельты пройденных версий. Так она остаётся точной и обратимой.
+Steps = list[list[Any]]
+
+
+def _steps(payload: dict[str, Any]) -> Steps:
+    return payload.get("steps") or [[payload["clients"], False]]
+
+
+def apply_steps(config: dict[str, Any], steps: Steps, *, reverse: bool = False) -> None:
+    """Применить цепочку шагов (``reverse`` — откатить её целиком)."""
+
+    if reverse:
+        for delta, backwards in reversed(steps):
+            apply_delta(config, delta, reverse=not backwards)
+    else:
+        for delta, backwards in steps:
+            apply_delta(config, delta, reverse=backwards)
+
+
+def _counts(steps: Steps | None) -> tuple[int, int]:
+    added = removed = 0
+    for delta, backwards in steps or ():
+        for change in delta.values():
+            plus, minus = len(change["added"]), len(change["removed"])
+            added += minus if backwards else plus
+            removed += plus if backwards else minus
+    return added, removed
+
+
+class ConfigHistory:
+    """Версии одного файла конфигурации."""
+
+    def __init__(self, directory: str | Path, *, keep: int = 200, snapshot_every: int = 50) -> None:
+        """Подготовить каталог истории.
+
+        Аргументы:
+            directory (str | Path): Каталог с файлами версий.
+            keep (int): Сколько последних версий хранить как минимум.
+            snapshot_every (int): Каждая какая версия сохраняется полным снимком.
+        """
+
+        self.directory = Path(directory)
+        self.keep = max(keep, 1)
+        self.snapshot_every = max(snapshot_every, 1)
+        self._lock = threading.RLock()
+        self._head: dict[str, Any] | None = None
+        self._head_version = 0
+        self._loaded = False
+
+    # --- файлы версий -------------------------------------------------
+
+    def _path(self, version: int, suffix: str) -> Path:
+        return self.directory / f"{version:06d}{suffix}"
+
+    def _scan(self) -> tuple[set[int], set[int]]:
+        deltas: set[int] = set()
+        snapshots: set[int] = set()
+        if self.directory.exists():
+            for path in self.directory.iterdir():
+                name = path.name
+                if name.endswith(_DELTA_SUFFIX):
+                    deltas.add(int(name[: -len(_DELTA_SUFFIX)]))
+                elif name.endswith(_FULL_SUFFIX):
+                    snapshots.add(int(name[: -len(_FULL_SUFFIX)]))
+        return deltas, snapshots
+
+    def _read(self, version: int, suffix: str) -> dict[str, Any]:
+        return json.loads(self._path(version, suffix).read_bytes())
+
+    def _write(self, version: int, suffix: str, payload: dict[str, Any]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(version, suffix)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_bytes(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        os.replace(tmp_path, path)
+
+    # --- голова истории ------------------------------------------------
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        deltas, snapshots = self._scan()
+        versions = deltas | snapshots
+        if versions:
+            head = max(versions)
+            self._head = self._forward_state(head, deltas, snapshots)
+            self._head_version = head
+        self._loaded = True
+
+    @property
+    def head_version(self) -> int:
+        """Номер последней версии (0 — истории нет)."""
+
+        with self._lock:
+            self._ensure_loaded()
+            return self._head_version
+
+    def observe(self, config: dict[str, Any]) -> int | None:
+        """Записать конфиг как версию ``external``, если он отличается от последней.
+
+        Вызывается перед изменением, чтобы ручная правка не смешалась с
+        изменением бота.
+
+        Возвращает:
+            int | None: Номер новой версии или None, если отличий нет.
+        """
+
+        with self._lock:
+            self._ensure_loaded()
+            if self._head is not None and self._head == config:
+                return None
+            return self.record(config, "external")
+
+    def record(self, config: dict[str, Any], source: str = "bot", *, steps: Steps | None = None) -> int:
+        """Записать новую версию.
+
+        Аргументы:
+            config (dict[str, Any]): Сохранённый конфиг.
+            source (str): Источник изменения.
+            steps (Steps | None): Уже известный путь от последней версии
+                (при откате), чтобы не сравнивать списки клиентов заново.
+
+        Возвращает:
+            int: Номер записанной версии.
+        """
+
+        with self._lock:
+            self._ensure_loaded()
+            version = self._head_version + 1
+            if steps is None and self._head is not None:
+                delta = compute_delta(self._head, config)
+                steps = None if delta is None else [[delta, False]]
+            meta = {"v": version, "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"), "source": source}
+            snapshot = _copy(config)
+            if self._head is not None and steps is not None:
+                if len(steps) == 1 and not steps[0][1]:
+                    self._write(version, _DELTA_SUFFIX, {**meta, "clients": steps[0][0]})
+                else:
+                    self._write(version, _DELTA_SUFFIX, {**meta, "steps": steps})
+            if self._head is None or steps is None or version % self.snapshot_every == 0:
+                added, removed = _counts(steps)
+                self._write(
+                    version,
+                    _FULL_SUFFIX,
+                    {**meta, "full": steps is None, "added": added, "removed": removed, "config": snapshot},
+                )
+            self._head = snapshot
+            self._head_version = version
+            self._prune()
+            return version
+
+    def _prune(self) -> None:
+        deltas, snapshots = self._scan()
+        boundary = self._head_version - self.keep + 1
+        anchors = [version for version in snapshots if version <= boundary]
+        if not anchors:
+            return
+        oldest = max(anchors)
+        for version in deltas:
+            # Дельта самого снимка-якоря не нужна: назад от него идти некуда.
+            if version <= oldest:
+                self._path(version, _DELTA_SUFFIX).unlink(missing_ok=True)
+        for version in snapshots:
+            if version < oldest:
+                self._path(version, _FULL_SUFFIX).unlink(missing_ok=True)
+
+    # --- восстановление версий -----------------------------------------
+
+    def _forward_state(self, target: int, deltas: set[int], snapshots: set[int]) -> dict[str, Any]:
+        bases = [version for version in snapshots if version <= target]
+        if not bases:
+            raise KeyError(f"Версия {target} не сохранилась в истории")
+        base = max(bases)
+        config = self._read(base, _FULL_SUFFIX)["config"]
+        for version in range(base + 1, target + 1):
+            apply_steps(config, _steps(self._read(version, _DELTA_SUFFIX)))
+        return config
+
+    def _plan(self, target: int) -> tuple[str, int]:
+        """Выбрать путь к версии: назад от головы или вперёд от снимка (и его длину)."""
+
+        deltas, snapshots = self._scan()
+        if target < 1 or target > self._head_version or not (deltas | snapshots) or target < min(deltas | snapshots):
+            raise KeyError(f"Версия {target} не сохранилась в истории")
+        between = range(target + 1, self._head_version + 1)
+        backward = len(between) if all(version in deltas for version in between) else None
+        bases = [version for version in snapshots if version <= target]
+        forward = target - max(bases) if bases else None
+        if backward is not None and (forward is None or backward <= forward):
+            return "backward", backward
+        if forward is None:
+            raise KeyError(f"Версия {target} не сохранилась в истории")
+        return "forward", forward
+
+    def state(self, version: int) -> dict[str, Any]:
+        """Восстановить конфиг версии ``version``."""
+
+        with self._lock:
+            self._ensure_loaded()
+            route, _ = self._plan(version)
+            if route == "backward":
+                assert self._head is not None
+                config = _copy(self._head)
+                for current in range(self._head_version, version, -1):
+                    apply_steps(config, _steps(self._read(current, _DELTA_SUFFIX)), reverse=True)
+                return config
+            deltas, snapshots = self._scan()
+            return self._forward_state(version, deltas, snapshots)
+
+    def rollback(self, version: int, current: dict[str, Any]) -> tuple[dict[str, Any], Steps | None]:
+        """Подготовить откат текущего конфига к версии ``version``.
+
+        Если путь назад состоит из дельт, они применяются к ``current`` на
+        месте: работа пропорциональна размеру изменений. Иначе версия
+        восстанавливается от снимка.
+
+        Аргументы:
+            version (int): Целевая версия.
+            current (dict[str, Any]): Текущий конфиг (совпадает с последней версией).
+
+        Возвращает:
+            tuple[dict[str, Any], Steps | None]: Конфиг целевой версии и шаги
+            от текущего к нему (None — если откат шёл через снимок).
+        """
+
+        with self._lock:
+            self._ensure_loaded()
+            route, _ = self._plan(version)
+            if route == "forward":
+                return self.state(version), None
+            path: Steps = []
+            for step in range(self._head_version, version, -1):
+                undo = [[delta, not backwards] for delta, backwards in reversed(_steps(self._read(step, _DELTA_SUFFIX)))]
+                apply_steps(current, undo)
+                path += undo
+            return current, path
+
+    def versions(self, limit: int = 20) -> list[VersionInfo]:
+        """Последние ``limit`` версий, новые первыми."""
+
+        with self._lock:
+            self._ensure_loaded()
+            deltas, snapshots = self._scan()
+            result = []
+            for version in sorted(deltas | snapshots, reverse=True)[:limit]:
+                if version in deltas:
+                    payload = self._read(version, _DELTA_SUFFIX)
+                    added, removed = _counts(_steps(payload))
+                    full = False
+                else:
+                    payload = self._read(version, _FULL_SUFFIX)
+                    added, removed, full = payload.get("added", 0), payload.get("removed", 0), payload.get("full", True)
+                result.append(VersionInfo(version, payload["ts"], payload["source"], added, removed, full))
+            return result
+
+    def diff(self, first: int, second: int | None = None) -> ConfigDiff:
+        """Сравнить две версии (по умолчанию — с последней)."""
+
+        with self._lock:
+            self._ensure_loaded()
+            old = self.state(first)
+            new = self.state(second or self._head_version)
+        result = ConfigDiff(settings_changed=_skeleton(old) != _skeleton(new))
+        old_lists, new_lists = _client_lists(old) or {}, _client_lists(new) or {}
+        for tag in old_lists.keys() | new_lists.keys():
+            old_clients = {_canonical(client): client for client in old_lists.get(tag, [])}
+            new_clients = {_canonical(client): client for client in new_lists.get(tag, [])}
+            result.added += [(tag, client) for key, client in new_clients.items() if key not in old_clients]
+            result.removed += [(tag, client) for key, client in old_clients.items() if key not in new_clients]
+        return result
+
+
+_HISTORIES: dict[Path, ConfigHistory] = {}
+_OPTIONS: dict[str, Any] | None = None
+
+
+def configure_history(directory: str | Path | None, *, keep: int = 200, snapshot_every: int = 50) -> None:
+    """Включить историю для всех файлов конфигурации, которые пишет бот.
+
+    Аргументы:
+        directory (str | Path | None): Корневой каталог истории; пусто — выключить.
+        keep (int): Сколько версий хранить как минимум.
+        snapshot_every (int): Период полных снимков.
+    """
+
+    global _OPTIONS
+    _HISTORIES.clear()
+    _OPTIONS = {"directory": Path(directory), "keep": keep, "snapshot_every": snapshot_every} if directory else None
+
+
+def history_for(config_path: str | Path) -> ConfigHistory | None:
+    """История файла ``config_path`` или None, если история выключена."""
+
+    if _OPTIONS is None:
+        return None
+    path = Path(config_path).resolve()
+    history = _HISTORIES.get(path)
+    if history is None:
+        history = _HISTORIES[path] = ConfigHistory(
+            _OPTIONS["directory"] / path.stem,
+            keep=_OPTIONS["keep"],
+            snapshot_every=_OPTIONS["snapshot_every"],
+        )
+    return history
+
+
+__all__ = [
+    "ConfigDiff",
+    "ConfigHistory",
+    "VersionInfo",
+    "apply_delta",
+    "apply_steps",
+    "compute_delta",
+    "configure_history",
+    "history_for",
+]
@@ -0,0 +1,229 @@
+"""Группировка IP-адресов в устройства для ограничителя.
+
+Мобильные операторы выпускают абонентов через CGNAT и меняют им адрес в
+пределах одной /24 (IPv4) или /64 (IPv6): без группировки каждое переключение
+выглядит как новое устройство. :class:`DeviceGrouper` сводит адрес к ключу
+группы:
+
+* сеть из списка разрешённых CIDR (самое длинное совпадение) — одно
+  устройство на всю сеть, например диапазон офиса или оператора;
+* иначе — адрес, обрезанный до ``ipv4_prefix`` / ``ipv6_prefix`` бит.
+
+Список CIDR хранится в :class:`PrefixTrie` — двоичном дереве префиксов со
+сжатием путей по 128-битным адресам (IPv4 — как ``::ffff:a.b.c.d``, см.
+:mod:`app.bot.services.ipset`). Поиск проходит не больше узлов, чем бит в
+самом длинном префиксе, и обычно обрывается через несколько узлов.
+
+Группы считаются только для ключей, у которых адресов больше лимита:
+группировка число устройств лишь уменьшает, поэтому остальные ключи
+проверяются одним ``len`` и ингест журнала не меняется.
+"""
+
+from __future__ import annotations
+
+import ipaddress
+from typing import Any, Iterable
+
+from app.bot.services.ipset import IP_BYTES, pack_ip, unpack_ip
+
+ADDRESS_BITS = IP_BYTES * 8
+_V4_BITS = 96  # длина префикса ::ffff:0:0/96 в IPv4-mapped адресе
+
+
+class _Node:
+    __slots__ = ("bits", "length", "value", "children")
+
+    def __init__(self, bits: int, length: int, value: Any = None) -> None:
+        self.bits = bits
+        self.length = length
+        self.value = value
+        self.children: list[_Node | None] = [None, None]
+
+
+def _mask(bits: int, length: int) -> int:
+    return bits >> (ADDRESS_BITS - length) << (ADDRESS_BITS - length) if length else 0
+
+
+class PrefixTrie:
+    """Дерево префиксов 128-битных адресов с поиском самого длинного совпадения.
+
+    Узлы хранят префикс целиком, поэтому цепочки без ветвлений не тратят по
+    узлу на бит (radix-дерево).
+    """
+
+    __slots__ = ("_root", "_size")
+
+    def __init__(self) -> None:
+        self._root = _Node(0, 0)
+        self._size = 0
+
+    def insert(self, packed: bytes, length: int, value: Any) -> None:
+        """Добавить префикс.
+
+        Аргументы:
+            packed (bytes): Сеть, упакованная :func:`pack_ip`.
+            length (int): Длина префикса в битах 128-битного адреса (0–128).
+            value (Any): Значение, возвращаемое :meth:`lookup`; не None.
+        """
+
+        if not 0 <= length <= ADDRESS_BITS:
+            raise ValueError(f"Некорректная длина префикса: {length}")
+        bits = _mask(int.from_bytes(packed, "big"), length)
+        node = self._root
+        while node.length != length:
+            branch = (bits >> (ADDRESS_BITS - 1 - node.length)) & 1
+            child = node.children[branch]
+            if child is None:
+                node.children[branch] = _Node(bits, length, value)
+                self._size += 1
+                return
+            diff = bits ^ child.bits
+            common = min(ADDRESS_BITS - diff.bit_length(), length, child.length)
+            if common == child.length:
+                node = child
+                continue
+            # Префикс расходится внутри ребра: вставляем развилку.
+            fork = node.children[branch] = _Node(_mask(bits, common), common)
+            fork.children[(child.bits >> (ADDRESS_BITS - 1 - common)) & 1] = child
+            if common == length:
+                fork.value = value
+            else:
+                fork.children[(bits >> (ADDRESS_BITS - 1 - common)) & 1] = _Node(bits, length, value)
+            self._size += 1
+            return
+        if node.value is None:
+            self._size += 1
+        node.value = value
+
+    def lookup(self, packed: bytes) -> Any:
+        """Значение самого длинного префикса, содержащего адрес, или None."""
+
+        address = int.from_bytes(packed, "big")
+        node = self._root
+        best = node.value
+        while node.length < ADDRESS_BITS:
+            child = node.children[(address >> (ADDRESS_BITS - 1 - node.length)) & 1]
+            if child is None:
+                break
+            shift = ADDRESS_BITS - child.length
+            if address >> shift != child.bits >> shift:
+                break
+            node = child
+            if node.value is not None:
+                best = node.value
+        return best
+
+    def __len__(self) -> int:
+        return self._size
+
+
+def _truncate(length: int) -> tuple[int, int]:
+    """Число байт ключа и маска последнего байта для префикса ``length`` бит."""
+
+    size, rest = divmod(length, 8)
+    if rest:
+        return size + 1, (0xFF << (8 - rest)) & 0xFF
+    return size, 0xFF
+
+
+class DeviceGrouper:
+    """Сводит IP-адреса ключа к устройствам.
+
+    Атрибуты:
+        ipv4_prefix (int): Длина префикса группы для IPv4 (32 — каждый адрес отдельно).
+        ipv6_prefix (int): Длина префикса группы для IPv6 (128 — каждый адрес отдельно).
+        networks (PrefixTrie): Разрешённые CIDR, каждая из которых — одно устройство.
+        enabled (bool): Группировка что-то меняет; иначе адрес равен устройству.
+    """
+
+    def __init__(self, ipv4_prefix: int = 32, ipv6_prefix: int = 128, allow: Iterable[str] = ()) -> None:
+        """Подготовить группировку.
+
+        Аргументы:
+            ipv4_prefix (int): Префикс группы IPv4, 0–32.
+            ipv6_prefix (int): Префикс группы IPv6, 0–128.
+            allow (Iterable[str]): CIDR, считающиеся одним устройством; пустые строки пропускаются.
+
+        Исключения:
+            ValueError: Префикс вне диапазона или некорректный CIDR.
+        """
+
+        if not 0 <= ipv4_prefix <= 32:
+            raise ValueError(f"Префикс IPv4 должен быть от 0 до 32: {ipv4_prefix}")
+        if not 0 <= ipv6_prefix <= ADDRESS_BITS:
+            raise ValueError(f"Префикс IPv6 должен быть от 0 до 128: {ipv6_prefix}")
+        self.ipv4_prefix = ipv4_prefix
+        self.ipv6_prefix = ipv6_prefix
+        self._v4 = _truncate(_V4_BITS + ipv4_prefix)
+        self._v6 = _truncate(ipv6_prefix)
+
+        self.networks = PrefixTrie()
+        for cidr in allow:
+            cidr = cidr.strip()
+            if not cidr:
+                continue
+            network = ipaddress.ip_network(cidr, strict=False)
+            length = network.prefixlen + (_V4_BITS if network.version == 4 else 0)
+            packed = pack_ip(str(network.network_address))
+            # Ключ сети длиннее 16 байт и не совпадает с ключом обрезанного адреса.
+            self.networks.insert(packed, length, packed + bytes((length,)))
+        self.enabled = ipv4_prefix < 32 or ipv6_prefix < ADDRESS_BITS or len(self.networks) > 0
+
+    def key(self, packed: bytes) -> bytes:
+        """Ключ устройства для упакованного адреса."""
+
+        if self.networks:
+            network = self.networks.lookup(packed)
+            if network is not None:
+                return network
+        size, mask = self._v4 if packed.startswith(b"\0" * 10 + b"\xff\xff") else self._v6
+        if mask == 0xFF:
+            return packed[:size]
+        return packed[: size - 1] + bytes((packed[size - 1] & mask,))
+
+    def _packed(self, ips: Iterable[str]) -> Iterable[bytes]:
+        packed = getattr(ips, "packed", None)
+        if packed is not None:
+            return packed()
+        result = []
+        for ip in ips:
+            try:
+                result.append(pack_ip(ip))
+            except ValueError:
+                continue
+        return result
+
+    def count(self, ips: Iterable[str]) -> int:
+        """Число устройств среди адресов (``IpSet``, ``IpWindow`` или строк)."""
+
+        if not self.enabled:
+            return len(ips) if hasattr(ips, "__len__") else sum(1 for _ in ips)  # type: ignore[arg-type]
+        key = self.key
+        return len({key(packed) for packed in self._packed(ips)})
+
+    def excess(self, ips: Iterable[str], limit: int) -> list[str]:
+        """Адреса устройств сверх первых ``limit`` в порядке появления.
+
+        Аргументы:
+            ips (Iterable[str]): Адреса ключа, упорядоченные по первому появлению.
+            limit (int): Разрешённое число устройств.
+
+        Возвращает:
+            list[str]: Адреса, относящиеся к лишним устройствам.
+        """
+
+        key = self.key
+        allowed: set[bytes] = set()
+        extra: list[str] = []
+        for packed in self._packed(ips):
+            group = key(packed)
+            if group in allowed:
+                continue
+            if len(allowed) < limit:
+                allowed.add(group)
+            else:
+                extra.append(unpack_ip(packed))
+        return extra
+
+
+__all__ = ["DeviceGrouper", "PrefixTrie"]
@@ -0,0 +1,245 @@
+"""Уведомления об изменении файлов: inotify на Linux, опрос ``mtime`` в остальных случаях.
+
+Подписчик передаёт путь к файлу и функцию обратного вызова; она выполняется
+в цикле событий, поэтому должна быть быстрой (выставить флаг, ``Event.set``)
+и не делать ввод-вывод сама.
+
+inotify следит не за самим файлом, а за его каталогом: так замечаются запись
+через временный файл и ``os.replace``, ротация журнала и появление файла,
+которого ещё не было. Если inotify недоступен (не Linux, исчерпан
+``max_user_watches``, каталога ещё нет), файл опрашивается по
+``(inode, размер, mtime)`` раз в ``poll_interval`` секунд.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Callable
+
+from loguru import logger
+
+from app.bot.services.metrics import REGISTRY, Counter
+
+FILE_WATCH_EVENTS = REGISTRY.register(
+    Counter("vpn_file_watch_events_total", "Изменения файлов, доставленные подписчикам", ("backend",))
+)
+
+Callback = Callable[[Path], None]
+Signature = tuple[int, int, int]
+
+# Константы из <sys/inotify.h>.
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+def _load_libc() -> ctypes.CDLL | None:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):  # pragma: no cover - libc без inotify
+        return None
+    return libc
+
+
+def file_signature(path: Path) -> Signature | None:
+    """Вернуть ``(inode, размер, mtime_ns)`` файла или None, если его нет."""
+
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class FileWatcher:
+    """Доставляет подписчикам события изменения файлов.
+
+    Атрибуты:
+        poll_interval (float): Период опроса файлов, за которыми не следит inotify.
+        backend (str): ``inotify`` или ``poll`` — основной механизм после :meth:`start`.
+    """
+
+    def __init__(self, poll_interval: float = 1.0, *, use_inotify: bool = True) -> None:
+        """Подготовить наблюдатель; файлы отслеживаются после :meth:`start`.
+
+        Аргументы:
+            poll_interval (float): Период опроса ``mtime`` для файлов без inotify.
+            use_inotify (bool): Пытаться использовать inotify (False — только опрос).
+        """
+
+        self.poll_interval = poll_interval
+        self.backend = "poll"
+        self._use_inotify = use_inotify
+        self._libc: ctypes.CDLL | None = None
+        self._fd: int | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._subscribers: dict[Path, list[Callback]] = {}
+        self._dirs: dict[Path, int] = {}
+        self._wds: dict[int, Path] = {}
+        self._polled: dict[Path, Signature | None] = {}
+        self._poll_task: asyncio.Task | None = None
+
+    # --- подписки ------------------------------------------------------
+
+    def subscribe(self, path: str | Path, callback: Callback) -> Callable[[], None]:
+        """Подписаться на изменения файла.
+
+        Аргументы:
+            path (str | Path): Отслеживаемый файл (может ещё не существовать).
+            callback (Callable[[Path], None]): Вызывается в цикле событий с путём файла.
+
+        Возвращает:
+            Callable[[], None]: Функция отписки.
+        """
+
+        target = Path(path).absolute()
+        callbacks = self._subscribers.setdefault(target, [])
+        callbacks.append(callback)
+        if self._loop is not None and len(callbacks) == 1:
+            self._watch(target)
+
+        def unsubscribe() -> None:
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks and self._subscribers.get(target) is callbacks:
+                del self._subscribers[target]
+                self._polled.pop(target, None)
+
+        return unsubscribe
+
+    def _watch(self, path: Path) -> None:
+        if self._fd is not None and self._add_dir_watch(path.parent):
+            return
+        self._polled[path] = file_signature(path)
+        if self._poll_task is None and self._loop is not None:
+            self._poll_task = self._loop.create_task(self._poll(), name="file-watcher-poll")
+
+    def _add_dir_watch(self, directory: Path) -> bool:
+        if directory in self._dirs:
+            return True
+        assert self._libc is not None and self._fd is not None
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            logger.warning("inotify для {} недоступен ({}), опрашиваем mtime", directory, os.strerror(error))
+            return False
+        self._dirs[directory] = wd
+        self._wds[wd] = directory
+        return True
+
+    # --- жизненный цикл ------------------------------------------------
+
+    def start(self) -> None:
+        """Начать наблюдение; вызывается из работающего цикла событий."""
+
+        self._loop = asyncio.get_running_loop()
+        if self._use_inotify:
+            self._libc = _load_libc()
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                self.backend = "inotify"
+                self._loop.add_reader(fd, self._on_readable)
+            else:  # pragma: no cover - исчерпан лимит инстансов inotify
+                logger.warning("inotify_init1: {}, опрашиваем mtime", os.strerror(ctypes.get_errno()))
+        for path in list(self._subscribers):
+            self._watch(path)
+        logger.info("Наблюдение за файлами: {}, файлов {}", self.backend, len(self._subscribers))
+
+    def close(self) -> None:
+        """Остановить наблюдение и освободить дескриптор inotify."""
+
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._fd is not None:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._dirs.clear()
+        self._wds.clear()
+        self._polled.clear()
+        self._loop = None
+
+    # --- доставка ------------------------------------------------------
+
+    def _notify(self, paths: set[Path], backend: str) -> None:
+        for path in paths:
+            for callback in list(self._subscribers.get(path, ())):
+                FILE_WATCH_EVENTS.labels(backend).inc()
+                try:
+                    callback(path)
+                except Exception as error:  # noqa: BLE001 - сбой подписчика не останавливает наблюдение
+                    logger.exception("Подписчик изменений {} завершился с ошибкой: {}", path, error)
+
+    def _on_readable(self) -> None:
+        assert self._fd is not None
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return
+        changed: set[Path] = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Очередь ядра переполнилась: события потеряны, уведомляем всех.
+                changed.update(self._subscribers)
+                continue
+            directory = self._wds.get(wd)
+            if directory is not None and name:
+                path = directory / os.fsdecode(name)
+                if path in self._subscribers:
+                    changed.add(path)
+        self._notify(changed, "inotify")
+
+    def check(self) -> set[Path]:
+        """Опросить файлы без inotify и уведомить подписчиков изменившихся.
+
+        Возвращает:
+            set[Path]: Файлы, у которых изменилась сигнатура.
+        """
+
+        changed: set[Path] = set()
+        for path, signature in list(self._polled.items()):
+            current = file_signature(path)
+            if current != signature:
+                self._polled[path] = current
+                changed.add(path)
+        self._notify(changed, "poll")
+        return changed
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self.check()
+
+
+__all__ = ["FILE_WATCH_EVENTS", "FileWatcher", "file_signature"]
@@ -0,0 +1,288 @@
+"""Отчёт о самых активных ключах за один проход по журналу.
+
+Карта «клиент → множество IP» растёт вместе с числом пользователей, а для
+отчёта «топ-N» она не нужна. Здесь используется алгоритм SpaceSaving:
+отслеживается не более ``capacity`` клиентов. Когда места нет, новый клиент
+вытесняет клиента с наименьшим счётчиком и наследует его счётчик как
+погрешность. Любой клиент, на которого приходится больше ``1 / capacity``
+всех соединений, гарантированно остаётся в таблице. Уникальные IP для
+каждого отслеживаемого клиента считаются точно до ``EXACT_LIMIT`` адресов,
+дальше — HyperLogLog (около 3 % погрешности на 1 КиБ). Итоговый топ-N
+выбирается кучей ограниченного размера. Память зависит только от
+``capacity``, а не от числа пользователей в журнале.
+
+Байтов трафика в access.log нет, поэтому отчёт строится по числу
+соединений или по уникальным IP (устройствам).
+
+Запуск из консоли::
+
+    python -m app.bot.services.heavy_hitters /var/log/xray/access.log --by devices -n 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import math
+import sys
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+from app.bot.services.log_parser import iter_records
+
+RANK_BY = ("devices", "connections")
+DEFAULT_CAPACITY = 1024
+EXACT_LIMIT = 64
+HLL_PRECISION = 10
+
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+
+def _hash64(value: str) -> int:
+    # Встроенный hash строк (SipHash) в разы быстрее hashlib и достаточно
+    # равномерен. Он зависит от PYTHONHASHSEED, поэтому скетчи разных
+    # процессов объединять нельзя; здесь этого и не требуется.
+    return hash(value) & _HASH_MASK
+
+
+class HyperLogLog:
+    """Оценка числа уникальных строк в ``2 ** precision`` байтах."""
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = HLL_PRECISION) -> None:
+        """Подготовить пустой скетч.
+
+        Аргументы:
+            precision (int): Число бит индекса регистра (4–16); стандартная
+                погрешность ``1.04 / sqrt(2 ** precision)``.
+        """
+
+        if not 4 <= precision <= 16:
+            raise ValueError("precision должна быть от 4 до 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: str) -> None:
+        """Учесть строку."""
+
+        hashed = _hash64(value)
+        rest_bits = _HASH_BITS - self.precision
+        index = hashed >> rest_bits
+        rest = hashed & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: HyperLogLog) -> None:
+        """Объединить со скетчем той же точности."""
+
+        if other.precision != self.precision:
+            raise ValueError("Скетчи разной точности нельзя объединить")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        """Вернуть оценку числа уникальных значений."""
+
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / sum(2.0**-register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            return round(size * math.log(size / zeros))
+        return round(raw)
+
+
+class DistinctCounter:
+    """Точное множество до ``exact_limit`` значений, затем :class:`HyperLogLog`."""
+
+    __slots__ = ("_exact", "_sketch", "exact_limit")
+
+    def __init__(self, exact_limit: int = EXACT_LIMIT) -> None:
+        self.exact_limit = exact_limit
+        self._exact: set[str] | None = set()
+        self._sketch: HyperLogLog | None = None
+
+    def add(self, value: str) -> None:
+        """Учесть значение."""
+
+        if self._exact is not None:
+            self._exact.add(value)
+            if len(self._exact) > self.exact_limit:
+                self._sketch = HyperLogLog()
+                for item in self._exact:
+                    self._sketch.add(item)
+                self._exact = None
+            return
+        assert self._sketch is not None
+        self._sketch.add(value)
+
+    @property
+    def exact(self) -> bool:
+        """True, пока значение счётчика точное."""
+
+        return self._exact is not None
+
+    def estimate(self) -> int:
+        """Вернуть число уникальных значений (точное или оценку)."""
+
+        if self._exact is not None:
+            return len(self._exact)
+        assert self._sketch is not None
+        return self._sketch.estimate()
+
+
+class HeavyHitter(NamedTuple):
+    """Строка отчёта.
+
+    Атрибуты:
+        key (str): Email (или UUID) клиента.
+        connections (int): Соединения; может быть завышено не более чем на ``error``.
+        devices (int): Уникальные IP с момента, когда клиент попал в таблицу.
+        error (int): Верхняя граница завышения ``connections``.
+    """
+
+    key: str
+    connections: int
+    devices: int
+    error: int
+
+
+class SpaceSaving:
+    """Частые элементы потока в таблице фиксированного размера."""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        """Подготовить пустую таблицу.
+
+        Аргументы:
+            capacity (int): Сколько клиентов отслеживать одновременно.
+        """
+
+        if capacity < 1:
+            raise ValueError("capacity должна быть положительной")
+        self.capacity = capacity
+        self.total = 0
+        # key → [счётчик, погрешность, уникальные IP]
+        self._slots: dict[str, list] = {}
+        # Ровно одна запись (счётчик на момент добавления, key) на клиента.
+        # Счётчики только растут, поэтому устаревшая запись занижена и
+        # исправляется лениво, когда оказывается на вершине кучи.
+        self._heap: list[tuple[int, str]] = []
+
+    def add(self, key: str, item: str | None = None) -> None:
+        """Учесть появление ``key`` и, если задан, его ``item`` (IP).
+
+        Аргументы:
+            key (str): Клиент.
+            item (str | None): Значение для подсчёта уникальных.
+        """
+
+        self.total += 1
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._admit(key)
+        slot[0] += 1
+        if item is not None:
+            slot[2].add(item)
+
+    def _admit(self, key: str) -> list:
+        heap = self._heap
+        if len(self._slots) < self.capacity:
+            slot = self._slots[key] = [0, 0, DistinctCounter()]
+            heapq.heappush(heap, (1, key))
+            return slot
+        while True:
+            count, victim = heap[0]
+            current = self._slots[victim][0]
+            if current == count:
+                break
+            heapq.heapreplace(heap, (current, victim))
+        del self._slots[victim]
+        slot = self._slots[key] = [count, count, DistinctCounter()]
+        heapq.heapreplace(heap, (count + 1, key))
+        return slot
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def top(self, n: int, by: str = "devices") -> list[HeavyHitter]:
+        """Вернуть ``n`` клиентов с наибольшим значением ``by``.
+
+        Аргументы:
+            n (int): Размер отчёта.
+            by (str): ``devices`` — уникальные IP, ``connections`` — соединения.
+
+        Возвращает:
+            list[HeavyHitter]: Строки отчёта по убыванию.
+        """
+
+        if by not in RANK_BY:
+            raise ValueError(f"Неизвестный критерий {by!r}, ожидается один из {RANK_BY}")
+        rows = (
+            HeavyHitter(key, count, distinct.estimate(), error) for key, (count, error, distinct) in self._slots.items()
+        )
+        if by == "devices":
+            return heapq.nlargest(n, rows, key=lambda row: (row.devices, row.connections))
+        return heapq.nlargest(n, rows, key=lambda row: row.connections)
+
+
+def top_keys(
+    records: Iterable[tuple[str, str]],
+    n: int = 10,
+    *,
+    by: str = "devices",
+    capacity: int = DEFAULT_CAPACITY,
+) -> list[HeavyHitter]:
+    """Построить топ-N клиентов по потоку ``(клиент, ip)`` за один проход.
+
+    Аргументы:
+        records (Iterable[tuple[str, str]]): Поток записей, например :func:`iter_records`.
+        n (int): Размер отчёта.
+        by (str): ``devices`` или ``connections``.
+        capacity (int): Размер таблицы SpaceSaving (не меньше ``n``).
+
+    Возвращает:
+        list[HeavyHitter]: Строки отчёта по убыванию.
+    """
+
+    summary = SpaceSaving(max(capacity, n))
+    add = summary.add
+    for key, ip in records:
+        add(key, ip)
+    return summary.top(n, by)
+
+
+def top_from_logs(
+    paths: Iterable[str | Path],
+    n: int = 10,
+    *,
+    by: str = "devices",
+    capacity: int = DEFAULT_CAPACITY,
+) -> list[HeavyHitter]:
+    """Построить топ-N клиентов по журналам access.log (в том числе ``*.gz``)."""
+
+    return top_keys(iter_records(paths), n, by=by, capacity=capacity)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Точка входа CLI отчёта."""
+
+    parser = argparse.ArgumentParser(description="Самые активные ключи по access.log XRay")
+    parser.add_argument("paths", nargs="+", help="журналы, в том числе ротированные *.gz")
+    parser.add_argument("-n", type=int, default=10, help="размер отчёта")
+    parser.add_argument("--by", choices=RANK_BY, default="devices")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="размер таблицы SpaceSaving")
+    args = parser.parse_args(argv)
+
+    for position, row in enumerate(top_from_logs(args.paths, args.n, by=args.by, capacity=args.capacity), start=1):
+        bound = f" (±{row.error})" if row.error else ""
+        print(f"{position:>3}. {row.key}  устройств {row.devices}, соединений {row.connections}{bound}")
+    return 0
+
+
+__all__ = ["DistinctCounter", "HeavyHitter", "HyperLogLog", "SpaceSaving", "top_from_logs", "top_keys"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
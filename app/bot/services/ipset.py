@@ -0,0 +1,369 @@
+"""Компактное хранение IP-адресов и UUID для ограничителя.
+
+Строка IP в ``set[str]`` стоит 50–70 байт плюс слот множества, а окно
+``dict[str, float]`` — ещё и объект float на каждый адрес. Здесь адрес
+упаковывается в 16 байт (IPv4 — как IPv4-mapped ``::ffff:a.b.c.d``), а
+контейнеры ключа — это один ``bytearray`` с записями фиксированной длины:
+
+* :class:`IpSet` — множество адресов, 16 байт на адрес;
+* :class:`IpWindow` — окно ограничителя, 16 байт адреса и 4 байта времени
+  последнего появления (секунды UNIX), порядок — по первому появлению.
+
+Поиск адреса в небольшом контейнере — ``bytearray.find`` с проверкой
+выравнивания, то есть сравнение на C без создания объектов. Начиная с
+``INDEX_THRESHOLD`` записей контейнер заводит словарь ``адрес → смещение``,
+и поиск перестаёт зависеть от числа адресов: без него вставка тысяч адресов
+одного ключа стоила бы O(n²). У обычного ключа адресов единицы, и словаря
+у него нет. UUID переводятся в маленькие целые
+:class:`UuidTable`, а окна лежат в списке по этим номерам
+(:class:`WindowTable`), без словаря строк.
+"""
+
+from __future__ import annotations
+
+import base64
+import socket
+import struct
+from collections.abc import Set as AbstractSet
+from typing import Iterable, Iterator, MutableMapping
+
+IP_BYTES = 16
+WINDOW_RECORD = IP_BYTES + 4
+INDEX_THRESHOLD = 32
+
+_V4_PREFIX = b"\0" * 10 + b"\xff\xff"
+_SEEN = struct.Struct("=I")
+
+
+def pack_ip(ip: str) -> bytes:
+    """Упаковать адрес в 16 байт.
+
+    Аргументы:
+        ip (str): IPv4 или IPv6 в текстовом виде.
+
+    Возвращает:
+        bytes: Адрес IPv6 или IPv4-mapped IPv6.
+
+    Исключения:
+        ValueError: Строка не является IP-адресом.
+    """
+
+    try:
+        if ":" in ip:
+            return socket.inet_pton(socket.AF_INET6, ip)
+        return _V4_PREFIX + socket.inet_pton(socket.AF_INET, ip)
+    except OSError as error:
+        raise ValueError(f"Некорректный IP-адрес: {ip!r}") from error
+
+
+def unpack_ip(packed: bytes | memoryview) -> str:
+    """Вернуть текстовую форму адреса, упакованного :func:`pack_ip`."""
+
+    packed = bytes(packed)
+    if packed.startswith(_V4_PREFIX):
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+def _find(data: bytearray, packed: bytes, record: int) -> int:
+    # Совпадение может начаться внутри записи (хвост одного адреса + начало
+    # другого), поэтому учитываются только позиции на границе записи.
+    position = data.find(packed)
+    while position != -1 and position % record:
+        position = data.find(packed, position + 1)
+    return position
+
+
+class _Records(bytearray):
+    """Записи фиксированной длины ``RECORD`` с адресом в первых 16 байтах."""
+
+    __slots__ = ("_offsets",)
+    __hash__ = None  # type: ignore[assignment]
+
+    RECORD = IP_BYTES
+
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)  # type: ignore[arg-type]
+        self._offsets: dict[bytes, int] | None = None
+
+    def _position(self, packed: bytes) -> int:
+        offsets = self._offsets
+        if offsets is None:
+            size = bytearray.__len__(self)
+            if size < INDEX_THRESHOLD * self.RECORD:
+                return _find(self, packed, self.RECORD)
+            view = bytes(self)
+            offsets = self._offsets = {
+                view[offset : offset + IP_BYTES]: offset for offset in range(0, size, self.RECORD)
+            }
+        return offsets.get(packed, -1)
+
+    def _append(self, record: bytes) -> None:
+        if self._offsets is not None:
+            self._offsets[record[:IP_BYTES]] = bytearray.__len__(self)
+        self += record
+
+    def assign(self, data: bytes | bytearray) -> None:
+        """Заменить все записи сырыми байтами ``data``."""
+
+        self[:] = data
+        self._offsets = None
+
+    def packed(self) -> Iterator[bytes]:
+        """Адреса в упакованном виде (16 байт) в порядке добавления."""
+
+        view = bytes(self)
+        return (view[offset : offset + IP_BYTES] for offset in range(0, len(view), self.RECORD))
+
+    def __contains__(self, ip: object) -> bool:
+        if not isinstance(ip, str):
+            return False
+        try:
+            return self._position(pack_ip(ip)) != -1
+        except ValueError:
+            return False
+
+    def __len__(self) -> int:
+        return bytearray.__len__(self) // self.RECORD
+
+
+class IpSet(_Records, AbstractSet):
+    """Множество IP-адресов по 16 байт на адрес.
+
+    Реализует ``collections.abc.Set`` над текстовыми адресами: ``in``,
+    итерация, ``len``, сравнения и операции ``&``, ``|``, ``-`` работают
+    так же, как у ``set[str]``.
+    """
+
+    __slots__ = ()
+
+    # Сравнения bytearray сравнивают байты: берём семантику множеств.
+    __le__ = AbstractSet.__le__
+    __lt__ = AbstractSet.__lt__
+    __ge__ = AbstractSet.__ge__
+    __gt__ = AbstractSet.__gt__
+    __eq__ = AbstractSet.__eq__
+
+    @classmethod
+    def _from_iterable(cls, ips: Iterable[str]) -> IpSet:
+        result = cls()
+        for ip in ips:
+            result.add(ip)
+        return result
+
+    def add(self, ip: str) -> None:
+        """Добавить адрес (повторное добавление ничего не меняет)."""
+
+        self.add_packed(pack_ip(ip))
+
+    def add_packed(self, packed: bytes) -> None:
+        """Добавить уже упакованный адрес."""
+
+        if self._position(packed) == -1:
+            self._append(packed)
+
+    def __iter__(self) -> Iterator[str]:  # type: ignore[override]
+        return (unpack_ip(packed) for packed in self.packed())
+
+    def __ne__(self, other: object) -> bool:
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self) -> str:
+        return f"IpSet({sorted(self)!r})"
+
+
+class IpWindow(_Records):
+    """Окно ограничителя: адрес → время последнего появления.
+
+    Записи по 20 байт идут в порядке первого появления адреса, обновление
+    времени не меняет позицию. Итерация возвращает адреса строками.
+    """
+
+    __slots__ = ()
+
+    RECORD = WINDOW_RECORD
+
+    def touch(self, packed: bytes, seen: int) -> None:
+        """Отметить появление адреса.
+
+        Аргументы:
+            packed (bytes): Адрес, упакованный :func:`pack_ip`.
+            seen (int): Время появления (секунды UNIX).
+        """
+
+        position = self._position(packed)
+        if position == -1:
+            self._append(packed + _SEEN.pack(seen))
+        else:
+            _SEEN.pack_into(self, position + IP_BYTES, seen)
+
+    def expire(self, horizon: int) -> None:
+        """Удалить адреса, не появлявшиеся с момента ``horizon``."""
+
+        with memoryview(self) as raw, raw.cast("I") as words:
+            # Время — каждое пятое 32-битное слово; min считается на C.
+            if min(words[4 :: WINDOW_RECORD // 4], default=horizon) >= horizon:
+                return
+        kept = bytearray()
+        for offset in range(0, bytearray.__len__(self), WINDOW_RECORD):
+            if _SEEN.unpack_from(self, offset + IP_BYTES)[0] >= horizon:
+                kept += self[offset : offset + WINDOW_RECORD]
+        self.assign(kept)
+
+    def items(self) -> list[tuple[str, int]]:
+        """Пары ``(адрес, время последнего появления)`` в порядке первого появления."""
+
+        view = bytes(self)
+        return [
+            (unpack_ip(view[offset : offset + IP_BYTES]), _SEEN.unpack_from(view, offset + IP_BYTES)[0])
+            for offset in range(0, len(view), WINDOW_RECORD)
+        ]
+
+    def __iter__(self) -> Iterator[str]:  # type: ignore[override]
+        return (ip for ip, _ in self.items())
+
+    def __repr__(self) -> str:
+        return f"IpWindow({self.items()!r})"
+
+
+class UuidTable:
+    """Перевод UUID в маленькие целые номера и обратно.
+
+    Номера выдаются подряд и не переиспользуются, поэтому их можно хранить
+    в окнах и состоянии вместо строк.
+    """
+
+    __slots__ = ("_ids", "_uuids")
+
+    def __init__(self) -> None:
+        self._ids: dict[str, int] = {}
+        self._uuids: list[str] = []
+
+    def intern(self, uuid: str) -> int:
+        """Вернуть номер UUID, выдав новый при первом обращении."""
+
+        index = self._ids.get(uuid)
+        if index is None:
+            index = self._ids[uuid] = len(self._uuids)
+            self._uuids.append(uuid)
+        return index
+
+    def get(self, uuid: str) -> int | None:
+        """Номер UUID или None, если он ещё не встречался."""
+
+        return self._ids.get(uuid)
+
+    def __getitem__(self, index: int) -> str:
+        return self._uuids[index]
+
+    def __len__(self) -> int:
+        return len(self._uuids)
+
+
+class WindowTable(MutableMapping[str, IpWindow]):
+    """Окна ограничителя по номерам UUID с интерфейсом словаря ``uuid → окно``.
+
+    Атрибуты:
+        uuids (UuidTable): Таблица номеров UUID.
+    """
+
+    __slots__ = ("uuids", "_slots", "_count")
+
+    def __init__(self) -> None:
+        self.uuids = UuidTable()
+        self._slots: list[IpWindow | None] = []
+        self._count = 0
+
+    def window(self, index: int) -> IpWindow:
+        """Вернуть окно ключа с номером ``index``, создав его при необходимости."""
+
+        slots = self._slots
+        if index >= len(slots):
+            slots.extend([None] * (index + 1 - len(slots)))
+        window = slots[index]
+        if window is None:
+            window = slots[index] = IpWindow()
+            self._count += 1
+        return window
+
+    def by_index(self) -> Iterator[tuple[int, IpWindow]]:
+        """Непустые окна вместе с номерами UUID."""
+
+        for index, window in enumerate(self._slots):
+            if window is not None:
+                yield index, window
+
+    def expire(self, horizon: int) -> None:
+        """Удалить устаревшие адреса и опустевшие окна."""
+
+        slots = self._slots
+        for index, window in enumerate(slots):
+            if window is None:
+                continue
+            window.expire(horizon)
+            if not window:
+                slots[index] = None
+                self._count -= 1
+
+    def _index(self, uuid: str) -> int:
+        index = self.uuids.get(uuid)
+        if index is None or index >= len(self._slots) or self._slots[index] is None:
+            raise KeyError(uuid)
+        return index
+
+    def __getitem__(self, uuid: str) -> IpWindow:
+        return self._slots[self._index(uuid)]  # type: ignore[return-value]
+
+    def __setitem__(self, uuid: str, window: Iterable[tuple[str, float]] | IpWindow) -> None:
+        index = self.uuids.intern(uuid)
+        if index < len(self._slots) and self._slots[index] is not None:
+            del self[uuid]
+        target = self.window(index)
+        if isinstance(window, IpWindow):
+            target.assign(window)
+            return
+        for ip, seen in window:
+            target.touch(pack_ip(ip), int(seen))
+
+    def __delitem__(self, uuid: str) -> None:
+        self._slots[self._index(uuid)] = None
+        self._count -= 1
+
+    def __iter__(self) -> Iterator[str]:
+        uuids = self.uuids
+        return (uuids[index] for index, _ in self.by_index())
+
+    def __len__(self) -> int:
+        return self._count
+
+    def dump(self) -> dict[str, str]:
+        """Окна для сохранения в JSON: ``uuid → base64`` записей окна."""
+
+        uuids = self.uuids
+        return {uuids[index]: base64.b64encode(window).decode("ascii") for index, window in self.by_index()}
+
+    def load(self, packed: dict[str, str]) -> None:
+        """Восстановить окна, сохранённые :meth:`dump`."""
+
+        for uuid, data in packed.items():
+            raw = base64.b64decode(data)
+            if raw and len(raw) % WINDOW_RECORD == 0:
+                self.window(self.uuids.intern(uuid)).assign(raw)
+
+    def __repr__(self) -> str:
+        return f"WindowTable({dict(self.items())!r})"
+
+
+__all__ = [
+    "INDEX_THRESHOLD",
+    "IP_BYTES",
+    "IpSet",
+    "IpWindow",
+    "UuidTable",
+    "WINDOW_RECORD",
+    "WindowTable",
+    "pack_ip",
+    "unpack_ip",
+]
+
@@ -0,0 +1,367 @@
+"""Журнал намерений для изменений клиентов (write-ahead log).
+
+Ключ живёт в двух хранилищах: в config.json XRay и в таблице ``keys``.
+Процесс может упасть между записью одного и другого. Поэтому перед
+изменением в журнал дописывается намерение (``add``/``remove`` с UUID и
+параметрами), а после обновления обоих хранилищ — отметка ``done``.
+
+Записи копятся в пакет, и один ``fsync`` подтверждает все намерения,
+пришедшие за время предыдущего сброса (group commit). Отметку ``done`` для
+``remove`` можно не ждать: если она потеряется, удаление просто повторится.
+Отметку ``add`` обработчик дожидается (в том же пакетном ``fsync``) до
+того, как выдать ссылку, иначе после сбоя ключ был бы откачен уже выданным.
+
+При старте :func:`recover` читает журнал (после последней контрольной
+точки там только «хвост» операций) и приводит незавершённые намерения к
+одному исходу: ключа не должно быть ни в конфиге, ни в базе. Для ``add``
+это откат (ссылка выдаётся только после записи отметки), для ``remove`` —
+завершение удаления. Затем :meth:`MutationJournal.checkpoint` атомарно
+перезаписывает журнал, оставляя только незавершённые операции. Время
+восстановления зависит от длины хвоста, а не от числа ключей.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from loguru import logger
+from sqlalchemy import delete
+
+from app.bot.services.key_cache import KEY_CACHE
+from app.bot.services.metrics import REGISTRY, Counter
+from app.bot.services.xray import reload_xray, remove_clients
+from app.db import get_session
+from app.models.key import Key
+
+OPS = ("add", "remove")
+DONE = "done"
+
+JOURNAL_RECORDS = REGISTRY.register(
+    Counter("vpn_journal_records_total", "Записи журнала изменений клиентов", ["op"])
+)
+JOURNAL_FSYNCS = REGISTRY.register(Counter("vpn_journal_fsyncs_total", "Сбросы журнала на диск"))
+
+
+def _encode(record: dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def read_journal(path: str | Path) -> tuple[dict[int, dict[str, Any]], int]:
+    """Прочитать журнал и вернуть незавершённые намерения.
+
+    Оборванная последняя строка (сбой посреди записи) пропускается.
+
+    Аргументы:
+        path (str | Path): Файл журнала.
+
+    Возвращает:
+        tuple[dict[int, dict[str, Any]], int]: Намерения без отметки ``done``
+        по номеру и наибольший встреченный номер.
+    """
+
+    pending: dict[int, dict[str, Any]] = {}
+    last_seq = 0
+    try:
+        handle = open(path, "rb")
+    except FileNotFoundError:
+        return pending, last_seq
+    with handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+                seq = int(record["seq"])
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Пропущена повреждённая запись журнала: {!r}", line[:80])
+                continue
+            last_seq = max(last_seq, seq)
+            if record.get("op") == DONE:
+                pending.pop(seq, None)
+            elif record.get("op") in OPS:
+                pending[seq] = record
+    return pending, last_seq
+
+
+class MutationJournal:
+    """Журнал намерений с пакетным ``fsync``."""
+
+    def __init__(self, path: str | Path | None) -> None:
+        """Открыть журнал.
+
+        Аргументы:
+            path (str | Path | None): Файл журнала; None — журнал выключен,
+                методы ничего не пишут.
+        """
+
+        self.path = Path(path) if path else None
+        self._open: dict[int, dict[str, Any]] = {}
+        self._seq = 0
+        self._loaded = False
+        self._handle: BinaryIO | None = None
+        self._pending: list[bytes] = []
+        self._batch: asyncio.Future | None = None
+        self._lock: asyncio.Lock | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        """True, если журнал пишется на диск."""
+
+        return self.path is not None
+
+    def load(self) -> list[dict[str, Any]]:
+        """Прочитать файл журнала и вернуть незавершённые намерения по порядку."""
+
+        if self.path is None:
+            return []
+        pending, last_seq = read_journal(self.path)
+        self._open.update(pending)
+        self._seq = max(self._seq, last_seq)
+        self._loaded = True
+        return [self._open[seq] for seq in sorted(self._open)]
+
+    def open_intents(self) -> list[dict[str, Any]]:
+        """Незавершённые намерения текущего процесса и прочитанные при старте."""
+
+        return [self._open[seq] for seq in sorted(self._open)]
+
+    async def begin(self, op: str, uuid: str, **params: Any) -> int:
+        """Записать намерение и дождаться его попадания на диск.
+
+        Аргументы:
+            op (str): ``add`` или ``remove``.
+            uuid (str): UUID ключа.
+            **params: Параметры операции (email, срок, путь к конфигу...).
+
+        Возвращает:
+            int: Номер записи для :meth:`commit`; 0, если журнал выключен.
+        """
+
+        if op not in OPS:
+            raise ValueError(f"Неизвестная операция журнала {op!r}")
+        if self.path is None:
+            return 0
+        if not self._loaded:
+            self.load()
+        self._seq += 1
+        record = {"seq": self._seq, "op": op, "uuid": uuid, **params}
+        self._open[self._seq] = record
+        JOURNAL_RECORDS.labels(op).inc()
+        await self._enqueue(record)
+        return record["seq"]
+
+    def commit(self, seq: int) -> asyncio.Future:
+        """Отметить намерение выполненным.
+
+        Аргументы:
+            seq (int): Номер записи, полученный от :meth:`begin`.
+
+        Возвращает:
+            asyncio.Future: Завершается, когда отметка записана на диск (уже
+            завершён, если записывать нечего). Для ``add`` его нужно дождаться
+            до выдачи ссылки; ошибку записи он передаёт ожидающему.
+        """
+
+        if self.path is None or self._open.pop(seq, None) is None:
+            done = asyncio.get_running_loop().create_future()
+            done.set_result(None)
+            return done
+        JOURNAL_RECORDS.labels(DONE).inc()
+        return self._enqueue({"seq": seq, "op": DONE})
+
+    def forget(self, seqs: list[int]) -> None:
+        """Снять намерения без записи отметок (перед :meth:`checkpoint`)."""
+
+        for seq in seqs:
+            self._open.pop(seq, None)
+
+    def intent(self, seq: int) -> dict[str, Any] | None:
+        """Вернуть незавершённое намерение по номеру."""
+
+        return self._open.get(seq)
+
+    def _enqueue(self, record: dict[str, Any]) -> asyncio.Future:
+        self._pending.append(_encode(record))
+        batch = self._batch
+        if batch is None:
+            loop = asyncio.get_running_loop()
+            batch = self._batch = loop.create_future()
+            task = loop.create_task(self._flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        return batch
+
+    async def _flush(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Пока шёл предыдущий fsync, записи копились в этом пакете.
+            lines, batch = self._pending, self._batch
+            self._pending, self._batch = [], None
+            if batch is None:
+                return
+            try:
+                await asyncio.to_thread(self._append, b"".join(lines))
+            except Exception as error:  # noqa: BLE001 - ошибка отдаётся ожидающим begin
+                logger.error("Не удалось записать журнал {}: {}", self.path, error)
+                batch.set_exception(error)
+                # Отметки done для remove никто не ждёт; не засоряем журнал asyncio.
+                batch.add_done_callback(lambda future: future.exception())
+            else:
+                batch.set_result(None)
+
+    def _append(self, data: bytes) -> None:
+        assert self.path is not None
+        if self._handle is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._handle = open(self.path, "ab")
+        self._handle.write(data)
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        JOURNAL_FSYNCS.inc()
+
+    async def checkpoint(self) -> int:
+        """Атомарно перезаписать журнал, оставив только незавершённые намерения.
+
+        Возвращает:
+            int: Число оставшихся записей.
+        """
+
+        if self.path is None:
+            return 0
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            records = self.open_intents()
+            await asyncio.to_thread(self._rewrite, b"".join(_encode(record) for record in records))
+        return len(records)
+
+    def _rewrite(self, data: bytes) -> None:
+        assert self.path is not None
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, self.path)
+        directory = os.open(self.path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    async def checkpoint_loop(self, interval_seconds: float) -> None:
+        """Периодически создавать контрольную точку до отмены задачи."""
+
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.checkpoint()
+            except Exception as error:  # noqa: BLE001
+                logger.exception("Не удалось создать контрольную точку журнала: {}", error)
+
+    async def flush(self) -> None:
+        """Дождаться записи всех поставленных в очередь записей (в том числе ``done``)."""
+
+        while self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def close(self) -> None:
+        """Закрыть файл журнала."""
+
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+async def _purge(records: list[dict[str, Any]]) -> list[str]:
+    by_config: dict[tuple[str, bool], list[str]] = {}
+    for record in records:
+        if record.get("config_path"):
+            key = (record["config_path"], bool(record.get("compact", False)))
+            by_config.setdefault(key, []).append(record["uuid"])
+
+    removed: list[str] = []
+    for (config_path, compact), uuids in by_config.items():
+        removed += await asyncio.to_thread(remove_clients, uuids, config_path, compact=compact)
+
+    uuids = [record["uuid"] for record in records]
+    async with get_session() as session:
+        await session.execute(delete(Key).where(Key.uuid.in_(uuids)))
+        await session.commit()
+    for uuid in uuids:
+        KEY_CACHE.discard(uuid)
+    if removed:
+        reload_xray()
+    return removed
+
+
+async def discard_intent(journal: MutationJournal, seq: int) -> None:
+    """Убрать следы прерванной операции из обоих хранилищ и закрыть намерение.
+
+    Вызывается обработчиком, если изменение упало с исключением. Если
+    очистка тоже не удалась, намерение остаётся в журнале до :func:`recover`.
+    """
+
+    record = journal.intent(seq)
+    if record is None:
+        return
+    try:
+        await _purge([record])
+    except Exception as error:  # noqa: BLE001
+        logger.error("Ключ {} будет очищен при следующем запуске: {}", record["uuid"], error)
+        return
+    journal.commit(seq)
+
+
+async def recover(journal: MutationJournal) -> list[str]:
+    """Довести незавершённые намерения журнала и создать контрольную точку.
+
+    Аргументы:
+        journal (MutationJournal): Журнал изменений.
+
+    Возвращает:
+        list[str]: UUID ключей, по которым было незавершённое намерение.
+    """
+
+    records = journal.load()
+    if not records:
+        if journal.enabled:
+            await journal.checkpoint()
+        return []
+
+    uuids = [record["uuid"] for record in records]
+    logger.warning("Восстановление после сбоя: незавершённые операции с ключами {}", uuids)
+    await _purge(records)
+    journal.forget([record["seq"] for record in records])
+    await journal.checkpoint()
+    return uuids
+
+
+_JOURNALS: dict[str, MutationJournal] = {}
+
+
+def get_journal(path: str | Path | None) -> MutationJournal:
+    """Вернуть журнал процесса для ``JOURNAL_PATH`` (пустой путь — выключен)."""
+
+    key = str(path or "")
+    journal = _JOURNALS.get(key)
+    if journal is None:
+        journal = _JOURNALS[key] = MutationJournal(path or None)
+    return journal
+
+
+__all__ = [
+    "MutationJournal",
+    "discard_intent",
+    "get_journal",
+    "read_journal",
+    "recover",
+]
@@ -0,0 +1,239 @@
+"""Кэш метаданных ключей в памяти процесса.
+
+Список ключей и экран удаления читают данные из памяти, а не из базы.
+Кэш прогревается одним запросом, затем обновляется точечно: локально из
+хендлеров и, при работе с PostgreSQL, по уведомлениям ``LISTEN keys_changed``.
+Уведомления шлёт триггер на таблице ``keys`` (``migrations/002_keys_notify.sql``),
+поэтому несколько реплик бота видят изменения друг друга. После
+переподключения слушателя (уведомления могли потеряться) и раз в
+``KEY_CACHE_REFRESH_SECONDS`` кэш полностью перечитывается.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from datetime import datetime
+from typing import Iterator, NamedTuple
+
+from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+
+from app.bot.services.limiter import DEVICE_LIMITS, DeviceLimitCache
+from app.bot.services.metrics import REGISTRY, Counter, Gauge
+from app.db import get_session
+from app.models.key import Key
+
+CHANNEL = "keys_changed"
+
+KEY_CACHE_SIZE = REGISTRY.register(Gauge("vpn_key_cache_size", "Ключей в кэше метаданных"))
+KEY_CACHE_RELOADS = REGISTRY.register(
+    Counter("vpn_key_cache_reloads_total", "Полные перечитывания кэша ключей")
+)
+KEY_CACHE_NOTIFICATIONS = REGISTRY.register(
+    Counter("vpn_key_cache_notifications_total", "Применённые уведомления об изменении ключей")
+)
+
+
+class KeyRecord(NamedTuple):
+    """Компактная запись о ключе.
+
+    Атрибуты:
+        uuid (str): Идентификатор клиента XRay.
+        email (str): Контакт пользователя или комментарий.
+        expires_at (datetime | None): Срок действия ключа.
+        device_limit (int | None): Максимальное количество устройств.
+    """
+
+    uuid: str
+    email: str
+    expires_at: datetime | None
+    device_limit: int | None
+
+
+class KeyCache:
+    """UUID → :class:`KeyRecord` с синхронизацией кэша лимитов устройств."""
+
+    def __init__(self, limits: DeviceLimitCache = DEVICE_LIMITS) -> None:
+        """Подготовить пустой кэш.
+
+        Аргументы:
+            limits (DeviceLimitCache): Кэш лимитов ограничителя, который
+                обновляется вместе с записями.
+        """
+
+        self._records: dict[str, KeyRecord] = {}
+        self._limits = limits
+        self.loaded = False
+
+    async def warm(self) -> int:
+        """Полностью перечитать ключи из базы данных.
+
+        Возвращает:
+            int: Количество ключей в кэше.
+        """
+
+        async with get_session() as session:
+            result = await session.execute(
+                select(Key.uuid, Key.email, Key.expires_at, Key.device_limit).order_by(Key.id)
+            )
+            records = {row.uuid: KeyRecord(*row) for row in result}
+        self._records = records
+        self._limits.replace(
+            {record.uuid: record.device_limit for record in records.values() if record.device_limit is not None}
+        )
+        self.loaded = True
+        KEY_CACHE_RELOADS.inc()
+        KEY_CACHE_SIZE.set(len(records))
+        logger.info("Кэш ключей загружен: {} записей", len(records))
+        return len(records)
+
+    async def ensure_loaded(self) -> None:
+        """Прогреть кэш при первом обращении."""
+
+        if not self.loaded:
+            await self.warm()
+
+    def get(self, uuid: str) -> KeyRecord | None:
+        """Вернуть запись ключа или None."""
+
+        return self._records.get(uuid)
+
+    def all(self) -> list[KeyRecord]:
+        """Вернуть все записи в порядке создания."""
+
+        return list(self._records.values())
+
+    def put(self, record: KeyRecord) -> None:
+        """Добавить или заменить запись."""
+
+        self._records[record.uuid] = record
+        self._limits.set(record.uuid, record.device_limit)
+        KEY_CACHE_SIZE.set(len(self._records))
+
+    def discard(self, uuid: str) -> None:
+        """Удалить запись, если она есть."""
+
+        self._records.pop(uuid, None)
+        self._limits.discard(uuid)
+        KEY_CACHE_SIZE.set(len(self._records))
+
+    def apply_notification(self, payload: str) -> None:
+        """Применить уведомление триггера ``keys_notify``.
+
+        Аргументы:
+            payload (str): JSON вида ``{"op": "INSERT"|"UPDATE"|"DELETE", "uuid": ..., ...}``.
+        """
+
+        data = json.loads(payload)
+        KEY_CACHE_NOTIFICATIONS.inc()
+        old_uuid = data.get("old_uuid")
+        if old_uuid and old_uuid != data["uuid"]:
+            self.discard(old_uuid)
+        if data["op"] == "DELETE":
+            self.discard(data["uuid"])
+            return
+        expires_at = data.get("expires_at")
+        self.put(
+            KeyRecord(
+                uuid=data["uuid"],
+                email=data.get("email") or "",
+                expires_at=datetime.fromisoformat(expires_at) if expires_at else None,
+                device_limit=data.get("device_limit"),
+            )
+        )
+
+    async def listen(self, conninfo: str, *, retry_seconds: float = 5.0) -> None:
+        """Слушать ``LISTEN keys_changed`` и применять уведомления до отмены задачи.
+
+        После каждого (пере)подключения кэш перечитывается целиком: пока
+        соединения не было, уведомления могли потеряться.
+
+        Аргументы:
+            conninfo (str): Строка подключения libpq.
+            retry_seconds (float): Пауза перед повторным подключением.
+        """
+
+        import psycopg
+
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as connection:
+                    await connection.execute(f"LISTEN {CHANNEL}")
+                    await self.warm()
+                    async for notify in connection.notifies():
+                        try:
+                            self.apply_notification(notify.payload)
+                        except (ValueError, KeyError) as error:
+                            logger.warning("Некорректное уведомление {}: {}", notify.payload, error)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:  # noqa: BLE001
+                logger.warning("Слушатель {} отключился: {}", CHANNEL, error)
+            await asyncio.sleep(retry_seconds)
+
+    async def refresh_loop(self, interval_seconds: float) -> None:
+        """Периодически перечитывать кэш целиком, страхуя от пропущенных уведомлений."""
+
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.warm()
+            except Exception as error:  # noqa: BLE001
+                logger.warning("Не удалось перечитать кэш ключей: {}", error)
+
+    def __iter__(self) -> Iterator[KeyRecord]:
+        return iter(self._records.values())
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+KEY_CACHE = KeyCache()
+
+
+def listen_conninfo(database_url: str) -> str | None:
+    """Преобразовать URL SQLAlchemy в строку подключения psycopg.
+
+    Аргументы:
+        database_url (str): ``DATABASE_URL`` приложения.
+
+    Возвращает:
+        str | None: Строка подключения или None, если база не PostgreSQL.
+    """
+
+    url = make_url(database_url)
+    if url.get_backend_name() != "postgresql":
+        return None
+    return url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def start_key_cache_sync(database_url: str, refresh_seconds: float) -> list[asyncio.Task]:
+    """Запустить слушатель уведомлений и периодическое перечитывание кэша.
+
+    Аргументы:
+        database_url (str): ``DATABASE_URL`` приложения.
+        refresh_seconds (float): Интервал полного перечитывания; 0 — не перечитывать.
+
+    Возвращает:
+        list[asyncio.Task]: Запущенные задачи (отменяются при остановке).
+    """
+
+    tasks = []
+    conninfo = listen_conninfo(database_url)
+    if conninfo is not None:
+        tasks.append(asyncio.create_task(KEY_CACHE.listen(conninfo), name="key-cache-listen"))
+    if refresh_seconds:
+        tasks.append(asyncio.create_task(KEY_CACHE.refresh_loop(refresh_seconds), name="key-cache-refresh"))
+    return tasks
+
+
+__all__ = [
+    "CHANNEL",
+    "KEY_CACHE",
+    "KeyCache",
+    "KeyRecord",
+    "listen_conninfo",
+    "start_key_cache_sync",
+]
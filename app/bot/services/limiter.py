@@ -5,49 +5,175 @@ from __future__ import annotations
 import re
 import subprocess
 from pathlib import Path
-from typing import Dict, Iterable, Set
+from typing import AbstractSet, Dict, Iterator, Mapping
+
+from loguru import logger
+from sqlalchemy import select
+
+from app.bot.services.device_groups import DeviceGrouper
+from app.bot.services.ipset import IpSet, pack_ip
+from app.bot.services.metrics import LIMITER_PARSE_SECONDS, LIMITER_PASS_SECONDS, timed
+from app.db import get_session
+from app.models.key import Key
 
 LOG_PATTERN = re.compile(r"uuid=(?P<uuid>[0-9a-fA-F-]+).*?ip=(?P<ip>[0-9.]+)")
 
 
-def parse_active_ips(log_path: str | Path) -> dict[str, set[str]]:
+@timed(LIMITER_PARSE_SECONDS)
+def parse_active_ips(log_path: str | Path) -> dict[str, IpSet]:
     """Собрать карту UUID → множество IP из access.log.
 
+    IP хранятся упакованными (:class:`IpSet`, 16 байт на адрес), строки с
+    некорректным адресом пропускаются.
+
     Аргументы:
         log_path (str | Path): Путь к файлу журналов XRay.
 
     Возвращает:
-        dict[str, set[str]]: Словарь uuid → уникальные IP-адреса.
+        dict[str, IpSet]: Словарь uuid → уникальные IP-адреса.
     """
 
     path = Path(log_path)
     if not path.exists():
         return {}
 
-    mapping: Dict[str, Set[str]] = {}
+    mapping: Dict[str, IpSet] = {}
     for line in path.read_text(encoding="utf-8").splitlines():
         match = LOG_PATTERN.search(line)
         if not match:
             continue
+        try:
+            packed = pack_ip(match.group("ip"))
+        except ValueError:
+            continue
         uuid = match.group("uuid")
-        ip = match.group("ip")
-        mapping.setdefault(uuid, set()).add(ip)
+        ips = mapping.get(uuid)
+        if ips is None:
+            ips = mapping[uuid] = IpSet()
+        ips.add_packed(packed)
     return mapping
 
 
-def detect_overuse(log_path: str | Path, limit: int = 3) -> dict[str, set[str]]:
+class DeviceLimitCache(Mapping[str, int]):
+    """Кэш UUID → лимит устройств, загружаемый из таблицы ``keys`` один раз.
+
+    Ключи без лимита (``device_limit IS NULL``) в кэш не попадают, поэтому
+    ограничитель их пропускает. После создания или удаления ключа кэш
+    обновляется точечно через :meth:`set` и :meth:`discard`.
+    """
+
+    def __init__(self) -> None:
+        self._limits: dict[str, int] = {}
+        self.loaded = False
+
+    async def load(self) -> int:
+        """Полностью перечитать лимиты из базы данных.
+
+        Возвращает:
+            int: Количество ключей с ограничением.
+        """
+
+        async with get_session() as session:
+            result = await session.execute(
+                select(Key.uuid, Key.device_limit).where(Key.device_limit.is_not(None))
+            )
+            self._limits = dict(result.all())
+        self.loaded = True
+        logger.info("Загружены лимиты устройств: {} ключей", len(self._limits))
+        return len(self._limits)
+
+    def replace(self, limits: Mapping[str, int]) -> None:
+        """Заменить содержимое кэша уже загруженными лимитами."""
+
+        self._limits = dict(limits)
+        self.loaded = True
+
+    def set(self, uuid: str, limit: int | None) -> None:
+        """Обновить лимит ключа; ``None`` снимает ограничение."""
+
+        if limit is None:
+            self._limits.pop(uuid, None)
+        else:
+            self._limits[uuid] = limit
+
+    def discard(self, uuid: str) -> None:
+        """Удалить ключ из кэша."""
+
+        self._limits.pop(uuid, None)
+
+    def __getitem__(self, uuid: str) -> int:
+        return self._limits[uuid]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._limits)
+
+    def __len__(self) -> int:
+        return len(self._limits)
+
+
+DEVICE_LIMITS = DeviceLimitCache()
+
+
+def _resolve_limits(limits: Mapping[str, int] | None) -> Mapping[str, int]:
+    if limits is not None:
+        return limits
+    if not DEVICE_LIMITS.loaded:
+        # Пустой незагруженный кэш молча отключил бы все ограничения.
+        raise RuntimeError("Лимиты устройств не загружены: вызовите await DEVICE_LIMITS.load() или передайте limits")
+    return DEVICE_LIMITS
+
+
+def find_offenders(
+    active: Mapping[str, AbstractSet[str]], limits: Mapping[str, int], groups: DeviceGrouper | None = None
+) -> dict[str, AbstractSet[str]]:
+    """Отобрать ключи, у которых устройств больше их собственного лимита.
+
+    Аргументы:
+        active (Mapping[str, AbstractSet[str]]): Карта UUID → активные IP
+            (``IpSet`` из :func:`parse_active_ips` или ``set[str]``).
+        limits (Mapping[str, int]): Карта UUID → лимит; ключи без лимита пропускаются.
+        groups (DeviceGrouper | None): Группировка адресов в устройства (по
+            умолчанию каждый IP — отдельное устройство).
+
+    Возвращает:
+        dict[str, AbstractSet[str]]: Нарушители и их IP (те же объекты, что в ``active``).
+    """
+
+    if groups is not None and not groups.enabled:
+        groups = None
+    offenders: dict[str, AbstractSet[str]] = {}
+    get_limit = limits.get
+    for uuid, ips in active.items():
+        limit = get_limit(uuid)
+        # Группировка только уменьшает число устройств: группы считаются лишь
+        # для ключей, у которых адресов уже больше лимита.
+        if limit is not None and len(ips) > limit and (groups is None or groups.count(ips) > limit):
+            offenders[uuid] = ips
+    return offenders
+
+
+def detect_overuse(
+    log_path: str | Path,
+    limits: Mapping[str, int] | None = None,
+    groups: DeviceGrouper | None = None,
+) -> dict[str, AbstractSet[str]]:
     """Найти клиентов, превысивших лимит подключений.
 
     Аргументы:
         log_path (str | Path): Путь к access.log.
-        limit (int): Допустимое количество уникальных IP.
+        limits (Mapping[str, int] | None): Лимиты по UUID (по умолчанию ``DEVICE_LIMITS``).
+        groups (DeviceGrouper | None): Группировка адресов в устройства (подсети, разрешённые CIDR).
 
     Возвращает:
-        dict[str, set[str]]: Нарушители и их IP.
+        dict[str, AbstractSet[str]]: Нарушители и их IP (:class:`IpSet`).
+
+    Исключения:
+        RuntimeError: ``limits`` не передан, а ``DEVICE_LIMITS`` ещё не загружен.
     """
 
+    limits = _resolve_limits(limits)
     active = parse_active_ips(log_path)
-    return {uuid: ips for uuid, ips in active.items() if len(ips) > limit}
+    return find_offenders(active, limits, groups)
 
 
 def apply_tc_limit(uuid: str, bandwidth: str = "1mbit") -> None:
@@ -76,19 +202,41 @@ def apply_tc_limit(uuid: str, bandwidth: str = "1mbit") -> None:
     subprocess.run(command, check=True)
 
 
-def handle_overuse(log_path: str | Path, limit: int = 3, bandwidth: str = "1mbit") -> list[str]:
+def remove_tc_limit(uuid: str) -> None:
+    """Снять ограничение скорости, установленное :func:`apply_tc_limit`.
+
+    Аргументы:
+        uuid (str): Идентификатор клиента.
+    """
+
+    class_id = uuid.replace("-", "")[:4]
+    command = ["tc", "class", "del", "dev", "eth0", "parent", "1:", "classid", f"1:{class_id}"]
+    subprocess.run(command, check=False)
+
+
+@timed(LIMITER_PASS_SECONDS)
+def handle_overuse(
+    log_path: str | Path,
+    limits: Mapping[str, int] | None = None,
+    bandwidth: str = "1mbit",
+    groups: DeviceGrouper | None = None,
+) -> list[str]:
     """Наложить ограничение на клиентов, превысивших лимит.
 
     Аргументы:
         log_path (str | Path): Файл логов с UUID и IP.
-        limit (int): Максимум разрешённых устройств.
+        limits (Mapping[str, int] | None): Лимиты по UUID (по умолчанию ``DEVICE_LIMITS``).
         bandwidth (str): Ограничение скорости для tc.
+        groups (DeviceGrouper | None): Группировка адресов в устройства.
 
     Возвращает:
         list[str]: UUID, для которых применено ограничение.
+
+    Исключения:
+        RuntimeError: ``limits`` не передан, а ``DEVICE_LIMITS`` ещё не загружен.
     """
 
-    offenders = detect_overuse(log_path, limit)
+    offenders = detect_overuse(log_path, limits, groups)
     for uuid in offenders:
         apply_tc_limit(uuid, bandwidth)
     return list(offenders.keys())
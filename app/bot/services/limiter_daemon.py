@@ -0,0 +1,522 @@
+"""Долгоживущий сервис ограничения подключений.
+
+Каждый тик сервис дочитывает новые строки access.log, обновляет скользящие
+окна IP по ключам, сравнивает число устройств с ``device_limit`` ключа и
+включает или снимает ограничение. Ограничение снимается только после
+нескольких подряд «чистых» тиков (гистерезис), а состояние окон
+сохраняется на диск, чтобы перезапуск не обнулял накопленные данные.
+
+С :class:`FileWatcher` тик запускается дописью в журнал (не чаще
+``min_tick_seconds``), а не только по таймеру, и карта email → UUID
+перечитывается лишь после изменения конфига.
+
+С :class:`GeoLocator` каждый адрес из журнала переводится в место (страну
+или AS), и ключи, активные одновременно из большего числа мест, чем
+``max_locations``, отмечаются в отчёте тика, журнале и метрике — без
+ограничения скорости.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import subprocess
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Mapping
+
+from loguru import logger
+
+from app.bot.services import limiter
+from app.bot.services.device_groups import DeviceGrouper
+from app.bot.services.file_watcher import FileWatcher
+from app.bot.services.geoip import GeoLocator
+from app.bot.services.ipset import IpWindow, WindowTable, pack_ip
+from app.bot.services.log_parser import load_email_map, parse_line
+from app.bot.services.metrics import REGISTRY, Gauge, Histogram
+from app.bot.services.nft import NftBanSet
+from app.bot.services.usage import UsageRecorder
+from app.bot.services.xray import _load_config
+
+LIMITER_TICK_SECONDS = REGISTRY.register(
+    Histogram("vpn_limiter_tick_seconds", "Длительность тика сервиса ограничения")
+)
+LIMITER_BACKLOG_BYTES = REGISTRY.register(
+    Gauge("vpn_limiter_backlog_bytes", "Непрочитанный хвост access.log на начало тика")
+)
+LIMITER_LIMITED_KEYS = REGISTRY.register(
+    Gauge("vpn_limiter_limited_keys", "Ключи под ограничением")
+)
+LIMITER_SHARED_KEYS = REGISTRY.register(
+    Gauge("vpn_limiter_shared_keys", "Ключи, активные одновременно из большего числа мест, чем разрешено")
+)
+
+MAX_READ_BYTES = 64 * 1024 * 1024
+
+
+class LogTailer:
+    """Читает только дописанные строки журнала и переживает ротацию.
+
+    Смена inode или уменьшение файла считаются ротацией: чтение начинается
+    с начала нового файла.
+    """
+
+    def __init__(self, path: str | Path, offset: int = 0, inode: int | None = None) -> None:
+        self.path = Path(path)
+        self.offset = offset
+        self.inode = inode
+
+    def backlog(self) -> int:
+        """Вернуть количество ещё не прочитанных байтов."""
+
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return 0
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            return stat.st_size
+        return stat.st_size - self.offset
+
+    def read_lines(self, max_bytes: int = MAX_READ_BYTES) -> list[str]:
+        """Прочитать новые полные строки, не более ``max_bytes`` за вызов."""
+
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return []
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            if self.inode is not None:
+                logger.info("Журнал {} ротирован, чтение с начала", self.path)
+            self.inode = stat.st_ino
+            self.offset = 0
+
+        with self.path.open("rb") as handle:
+            handle.seek(self.offset)
+            data = handle.read(max_bytes)
+        cut = data.rfind(b"\n") + 1
+        self.offset += cut
+        return data[:cut].decode("utf-8", errors="replace").splitlines()
+
+
+@dataclass(slots=True)
+class TickReport:
+    """Итоги одного тика.
+
+    Атрибуты:
+        duration (float): Длительность тика в секундах.
+        backlog_bytes (int): Непрочитанные байты журнала на начало тика.
+        lines (int): Прочитано строк.
+        active_keys (int): Ключи с активными IP в окне.
+        limited (list[str]): Ключи, ограниченные в этом тике.
+        released (list[str]): Ключи, с которых снято ограничение.
+        banned (int): IP, добавленные в nftables в этом тике.
+        connections (dict[str, int]): Принятые соединения за тик по UUID.
+        shared (list[str]): Ключи, впервые замеченные в слишком многих местах (странах или AS).
+    """
+
+    duration: float = 0.0
+    backlog_bytes: int = 0
+    lines: int = 0
+    active_keys: int = 0
+    limited: list[str] = field(default_factory=list)
+    released: list[str] = field(default_factory=list)
+    banned: int = 0
+    connections: dict[str, int] = field(default_factory=dict)
+    shared: list[str] = field(default_factory=list)
+
+
+class LimiterDaemon:
+    """Сервис ограничения: ингест журнала, окна по ключам и применение лимитов."""
+
+    def __init__(
+        self,
+        log_path: str | Path,
+        config_path: str | Path,
+        state_path: str | Path,
+        *,
+        limits: Mapping[str, int] = limiter.DEVICE_LIMITS,
+        window_seconds: float = 300.0,
+        release_ticks: int = 3,
+        bandwidth: str = "1mbit",
+        apply_limit: Callable[[str, str], None] = limiter.apply_tc_limit,
+        release_limit: Callable[[str], None] = limiter.remove_tc_limit,
+        ban_set: NftBanSet | None = None,
+        usage: UsageRecorder | None = None,
+        groups: DeviceGrouper | None = None,
+        geo: GeoLocator | None = None,
+        geo_window_seconds: float = 600.0,
+        max_locations: int = 2,
+    ) -> None:
+        """Подготовить сервис.
+
+        Аргументы:
+            log_path (str | Path): access.log XRay.
+            config_path (str | Path): Файл с клиентами XRay для перевода email → UUID.
+            state_path (str | Path): JSON-файл с сохранённым состоянием.
+            limits (Mapping[str, int]): Лимиты устройств по UUID.
+            window_seconds (float): Сколько секунд IP считается активным.
+            release_ticks (int): Сколько «чистых» тиков нужно для снятия ограничения.
+            bandwidth (str): Скорость для ограниченных ключей.
+            apply_limit (Callable): Включение ограничения ``(uuid, bandwidth)``.
+            release_limit (Callable): Снятие ограничения ``(uuid)``.
+            ban_set (NftBanSet | None): Режим nftables: лишним IP запрещаются новые
+                соединения вместо ``tc``-ограничения скорости.
+            usage (UsageRecorder | None): Запись истории использования ключей.
+            groups (DeviceGrouper | None): Группировка IP в устройства (подсети CGNAT,
+                разрешённые CIDR); по умолчанию каждый IP — отдельное устройство.
+            geo (GeoLocator | None): Определение страны или AS адреса; без него места не считаются.
+            geo_window_seconds (float): Сколько секунд место считается активным.
+            max_locations (int): Сколько мест одновременно допустимо для ключа.
+        """
+
+        self.tailer = LogTailer(log_path)
+        self.config_path = Path(config_path)
+        self.state_path = Path(state_path)
+        self.limits = limits
+        self.window_seconds = window_seconds
+        self.release_ticks = release_ticks
+        self.bandwidth = bandwidth
+        self._apply_limit = apply_limit
+        self._release_limit = release_limit
+        self.ban_set = ban_set
+        self.usage = usage
+        self.groups = groups if groups is not None and groups.enabled else None
+        self.geo = geo
+        self.geo_window_seconds = geo_window_seconds
+        self.max_locations = max_locations
+
+        # Окна «IP → время» по номерам UUID: 20 байт на адрес вместо строки и float.
+        self.windows = WindowTable()
+        self.limited: dict[str, int] = {}
+        # Места (страна или AS) по номерам UUID: место → время последнего появления.
+        self.locations: dict[int, dict[str, int]] = {}
+        self.shared: set[str] = set()
+        self._email_ids: dict[str, int] = {}
+        self._config_mtime: float | None = None
+        # Заполняются в watch(): без наблюдателя конфиг проверяется по mtime
+        # каждый тик, а пауза между тиками фиксирована.
+        self._log_appended: asyncio.Event | None = None
+        self._config_dirty = True
+        self._config_watched = False
+
+    def watch(self, watcher: FileWatcher) -> None:
+        """Подписаться на изменения журнала и конфига.
+
+        Аргументы:
+            watcher (FileWatcher): Наблюдатель за файлами (запущенный или нет).
+        """
+
+        appended = self._log_appended = asyncio.Event()
+        watcher.subscribe(self.tailer.path, lambda _path: appended.set())
+        watcher.subscribe(self.config_path, self._mark_config_dirty)
+        self._config_watched = True
+
+    def _mark_config_dirty(self, _path: Path) -> None:
+        self._config_dirty = True
+
+    # --- состояние -----------------------------------------------------
+
+    def load_state(self) -> None:
+        """Восстановить окна, ограничения и позицию в журнале."""
+
+        if not self.state_path.exists():
+            return
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as error:
+            logger.warning("Не удалось прочитать состояние ограничителя: {}", error)
+            return
+        self.tailer.offset = int(state.get("offset", 0))
+        self.tailer.inode = state.get("inode")
+        self.windows = WindowTable()
+        if "packed_windows" in state:
+            self.windows.load(state["packed_windows"])
+        else:  # состояние в прежнем формате ``uuid → {ip: время}``
+            for uuid, ips in state.get("windows", {}).items():
+                self.windows[uuid] = ips.items()
+        self.limited = {uuid: int(streak) for uuid, streak in state.get("limited", {}).items()}
+        intern = self.windows.uuids.intern
+        self.locations = {
+            intern(uuid): {place: int(seen) for place, seen in places.items()}
+            for uuid, places in state.get("locations", {}).items()
+        }
+        logger.info(
+            "Состояние ограничителя восстановлено: {} ключей в окне, {} ограничено",
+            len(self.windows),
+            len(self.limited),
+        )
+
+    def save_state(self) -> None:
+        """Атомарно сохранить состояние на диск."""
+
+        state: dict[str, Any] = {
+            "offset": self.tailer.offset,
+            "inode": self.tailer.inode,
+            "packed_windows": self.windows.dump(),
+            "limited": self.limited,
+        }
+        if self.locations:
+            uuids = self.windows.uuids
+            state["locations"] = {uuids[index]: places for index, places in self.locations.items()}
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(state, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_path, self.state_path)
+
+    # --- тик -----------------------------------------------------------
+
+    def _refresh_email_map(self) -> None:
+        if self._config_watched:
+            if not self._config_dirty:
+                return
+            self._config_dirty = False
+        try:
+            mtime = self.config_path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self._config_mtime:
+            intern = self.windows.uuids.intern
+            email_map = load_email_map(_load_config(self.config_path))
+            self._email_ids = {email: intern(uuid) for email, uuid in email_map.items()}
+            self._config_mtime = mtime
+
+    def _ingest(self, lines: list[str], now: float) -> dict[str, int]:
+        email_ids = self._email_ids
+        intern = self.windows.uuids.intern
+        limits = self.limits
+        window_for = self.windows.window
+        seen = int(now)
+        counts: dict[int, int] = {}
+        # Пары (ключ, адрес) для гео-данных: в пачке строки повторяются, место
+        # ищется один раз на пару после цикла.
+        pairs: set[tuple[int, bytes]] | None = set() if self.geo is not None else None
+        for line in lines:
+            parsed = parse_line(line)
+            if parsed is None:
+                continue
+            email, ip = parsed
+            try:
+                packed = pack_ip(ip)
+            except ValueError:
+                continue
+            index = email_ids.get(email)
+            if index is None:
+                # Номера не освобождаются: неизвестный email получает номер, только
+                # если сам является UUID с лимитом, иначе таблица росла бы без границ.
+                if email not in limits:
+                    continue
+                index = intern(email)
+            window_for(index).touch(packed, seen)
+            counts[index] = counts.get(index, 0) + 1
+            if pairs is not None:
+                pairs.add((index, packed))
+        if pairs:
+            self._locate(pairs, seen)
+        uuids = self.windows.uuids
+        return {uuids[index]: count for index, count in counts.items()}
+
+    def _locate(self, pairs: set[tuple[int, bytes]], seen: int) -> None:
+        assert self.geo is not None
+        location = self.geo.location
+        locations = self.locations
+        for index, packed in pairs:
+            place = location(packed)
+            if place is not None:
+                places = locations.get(index)
+                if places is None:
+                    places = locations[index] = {}
+                places[place] = seen
+
+    def _expire(self, now: float) -> None:
+        self.windows.expire(int(now - self.window_seconds))
+
+    def _flag_shared(self, report: TickReport, now: float) -> None:
+        """Отметить ключи, активные одновременно из слишком многих мест."""
+
+        horizon = int(now - self.geo_window_seconds)
+        uuids = self.windows.uuids
+        shared: set[str] = set()
+        for index in list(self.locations):
+            places = self.locations[index]
+            for place in [place for place, seen in places.items() if seen < horizon]:
+                del places[place]
+            if not places:
+                del self.locations[index]
+            elif len(places) > self.max_locations:
+                uuid = uuids[index]
+                shared.add(uuid)
+                if uuid not in self.shared:
+                    report.shared.append(uuid)
+                    logger.warning("Ключ {} активен из {} мест: {}", uuid, len(places), ", ".join(sorted(places)))
+        self.shared = shared
+
+    def _over_limit(self, window: IpWindow, limit: int) -> bool:
+        if len(window) <= limit:
+            return False
+        return self.groups is None or self.groups.count(window) > limit
+
+    def _enforce_bans(self, report: TickReport, now: float) -> None:
+        """Забанить IP устройств сверх лимита; окно упорядочено по первому появлению IP."""
+
+        assert self.ban_set is not None
+        get_limit = self.limits.get
+        uuids = self.windows.uuids
+        for index, window in self.windows.by_index():
+            uuid = uuids[index]
+            limit = get_limit(uuid)
+            if limit is not None and self._over_limit(window, limit):
+                extra = list(window)[limit:] if self.groups is None else self.groups.excess(window, limit)
+                if self.ban_set.ban(extra, now):
+                    report.limited.append(uuid)
+        try:
+            report.banned = self.ban_set.commit(now)
+        except (OSError, subprocess.CalledProcessError) as error:
+            # Очередь банов сохраняется в NftBanSet и уходит следующим commit.
+            logger.error("Не удалось применить баны nftables: {}", error)
+
+    def _enforce(self, report: TickReport) -> None:
+        get_limit = self.limits.get
+        uuids = self.windows.uuids
+        for index, window in self.windows.by_index():
+            uuid = uuids[index]
+            limit = get_limit(uuid)
+            if limit is not None and self._over_limit(window, limit):
+                if uuid not in self.limited:
+                    try:
+                        self._apply_limit(uuid, self.bandwidth)
+                    except (OSError, subprocess.CalledProcessError) as error:
+                        # Ключ не отмечается ограниченным: попытка повторится на следующем тике.
+                        logger.error("Не удалось ограничить ключ {}: {}", uuid, error)
+                        continue
+                    report.limited.append(uuid)
+                self.limited[uuid] = 0
+
+        for uuid in list(self.limited):
+            limit = get_limit(uuid)
+            window = self.windows.get(uuid)
+            if limit is not None and window is not None and self._over_limit(window, limit):
+                continue
+            self.limited[uuid] += 1
+            if limit is None or self.limited[uuid] >= self.release_ticks:
+                try:
+                    self._release_limit(uuid)
+                except (OSError, subprocess.CalledProcessError) as error:
+                    logger.error("Не удалось снять ограничение с ключа {}: {}", uuid, error)
+                    continue
+                del self.limited[uuid]
+                report.released.append(uuid)
+
+    def tick(self, now: float | None = None) -> TickReport:
+        """Выполнить один проход: ингест, окна, применение лимитов.
+
+        Аргументы:
+            now (float | None): Текущее время (UNIX), передавайте для тестов.
+
+        Возвращает:
+            TickReport: Итоги тика.
+        """
+
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        report = TickReport(backlog_bytes=self.tailer.backlog())
+
+        self._refresh_email_map()
+        lines = self.tailer.read_lines()
+        report.lines = len(lines)
+        report.connections = self._ingest(lines, now)
+        self._expire(now)
+        if self.geo is not None:
+            self._flag_shared(report, now)
+        if self.ban_set is not None:
+            self._enforce_bans(report, now)
+        else:
+            self._enforce(report)
+        self.save_state()
+
+        report.active_keys = len(self.windows)
+        report.duration = time.perf_counter() - started
+        LIMITER_TICK_SECONDS.observe(report.duration)
+        LIMITER_BACKLOG_BYTES.set(report.backlog_bytes)
+        LIMITER_LIMITED_KEYS.set(len(self.limited))
+        LIMITER_SHARED_KEYS.set(len(self.shared))
+        return report
+
+    async def _wait_next_tick(
+        self, stop_event: asyncio.Event, tick_seconds: float, min_tick_seconds: float, started: float
+    ) -> None:
+        if self._log_appended is None:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), timeout=tick_seconds)
+            return
+
+        waiters = [asyncio.ensure_future(stop_event.wait()), asyncio.ensure_future(self._log_appended.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=tick_seconds, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        # Поток дописей обрабатывается пачками: следующий тик не раньше min_tick_seconds от начала прошлого.
+        delay = started + min_tick_seconds - time.monotonic()
+        if delay > 0 and not stop_event.is_set():
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), timeout=delay)
+        self._log_appended.clear()
+
+    async def run(
+        self,
+        stop_event: asyncio.Event,
+        tick_seconds: float = 10.0,
+        limits_refresh_seconds: float = 300.0,
+        *,
+        min_tick_seconds: float = 1.0,
+    ) -> None:
+        """Запускать тики до установки ``stop_event``.
+
+        Аргументы:
+            stop_event (asyncio.Event): Событие завершения.
+            tick_seconds (float): Интервал между тиками (без наблюдателя) или
+                наибольшая пауза, если журнал не дописывается.
+            limits_refresh_seconds (float): Как часто полностью перечитывать лимиты из БД.
+            min_tick_seconds (float): Наименьший интервал между тиками, запущенными дописью в журнал.
+        """
+
+        self.load_state()
+        refreshed_at = float("-inf")
+        while not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                refresh = getattr(self.limits, "load", None)
+                if refresh is not None and time.monotonic() - refreshed_at >= limits_refresh_seconds:
+                    await refresh()
+                    refreshed_at = time.monotonic()
+                report = await asyncio.to_thread(self.tick)
+                if self.usage is not None:
+                    self.usage.add(report.connections, self.windows)
+                    await self.usage.maybe_flush()
+                logger.info(
+                    "Тик ограничителя: {:.1f} мс, хвост {} байт, строк {}, ключей {}, "
+                    "ограничено +{} / снято {}, забанено IP {}, в нескольких местах +{}",
+                    report.duration * 1000,
+                    report.backlog_bytes,
+                    report.lines,
+                    report.active_keys,
+                    len(report.limited),
+                    len(report.released),
+                    report.banned,
+                    len(report.shared),
+                )
+            except Exception as error:  # noqa: BLE001
+                logger.exception("Ошибка тика ограничителя: {}", error)
+            await self._wait_next_tick(stop_event, tick_seconds, min_tick_seconds, started)
+
+        if self.usage is not None and len(self.usage):
+            try:
+                await self.usage.flush()
+            except Exception as error:  # noqa: BLE001
+                logger.warning("Выборки использования при остановке не записаны: {}", error)
+
+
+__all__ = ["LimiterDaemon", "LogTailer", "TickReport"]
@@ -0,0 +1,395 @@
+"""Метрики бота и фоновых задач в текстовом формате Prometheus.
+
+Модуль не зависит от prometheus_client: счётчики, gauge и гистограммы
+реализованы поверх списков фиксированного размера, чтобы наблюдение стоило
+единицы микросекунд. Значения публикуются локальным HTTP-эндпоинтом
+``/metrics`` (см. :func:`start_metrics_server`).
+"""
+
+from __future__ import annotations
+
+import inspect
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Awaitable, Callable, Iterable, Sequence, TypeVar
+
+from aiohttp import web
+from loguru import logger
+
+F = TypeVar("F", bound=Callable[..., Any])
+M = TypeVar("M", bound="_Metric")
+
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Collector = Callable[[], Awaitable[None] | None]
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание, дочерние серии по меткам."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> Any:
+        """Вернуть серию для заданных значений меток (создаётся один раз)."""
+
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self) -> Any:
+        return self._children[()]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key: tuple[str, ...], child: Any) -> list[str]:
+        labels = _format_labels(self.labelnames, key)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """Произвольное текущее значение, например число ключей."""
+
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    @property
+    def value(self) -> float:
+        return self._default().value
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds: tuple[float, ...]) -> None:
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Гистограмма длительностей с фиксированными границами корзин."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _render_child(self, key: tuple[str, ...], child: _HistogramValue) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.upper_bounds, float("inf")), child.counts, strict=True):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик и асинхронных сборщиков, обновляющих gauge перед выдачей."""
+
+    def __init__(self) -> None:
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Collector] = []
+
+    def register(self, metric: M) -> M:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    async def collect(self) -> None:
+        for collector in self._collectors:
+            try:
+                result = collector()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as error:  # noqa: BLE001
+                logger.warning("Сборщик метрик завершился с ошибкой: {}", error)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(
+    Histogram("vpn_bot_handler_seconds", "Длительность обработки апдейта", ("event", "handler"))
+)
+HANDLER_ERRORS = REGISTRY.register(
+    Counter("vpn_bot_handler_errors_total", "Исключения в обработчиках", ("event", "handler"))
+)
+DB_QUERY_SECONDS = REGISTRY.register(
+    Histogram("vpn_db_query_seconds", "Длительность SQL-запросов")
+)
+CONFIG_WRITE_SECONDS = REGISTRY.register(
+    Histogram("vpn_xray_config_write_seconds", "Изменение config.json XRay", ("operation",))
+)
+CONFIG_LOCK_WAIT_SECONDS = REGISTRY.register(
+    Histogram("vpn_xray_config_lock_wait_seconds", "Ожидание блокировки config.json XRay")
+)
+CONFIG_STALE_WRITES = REGISTRY.register(
+    Counter("vpn_xray_config_stale_writes_total", "Отклонённые записи config.json по устаревшему поколению")
+)
+XRAY_RELOAD_SECONDS = REGISTRY.register(
+    Histogram("vpn_xray_reload_seconds", "Длительность перезагрузки XRay")
+)
+LIMITER_PARSE_SECONDS = REGISTRY.register(
+    Histogram("vpn_limiter_parse_seconds", "Разбор access.log ограничителем")
+)
+LIMITER_PASS_SECONDS = REGISTRY.register(
+    Histogram("vpn_limiter_pass_seconds", "Полный проход ограничителя подключений")
+)
+KEYS_TOTAL = REGISTRY.register(
+    Gauge("vpn_keys", "Количество ключей в базе", ("state",))
+)
+
+
+def timed(series: Any) -> Callable[[F], F]:
+    """Декоратор, записывающий длительность вызова в гистограмму.
+
+    Аргументы:
+        series: Гистограмма без меток или серия, полученная через ``labels``.
+
+    Возвращает:
+        Callable: Декоратор для синхронных и асинхронных функций.
+    """
+
+    def decorator(func: F) -> F:
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    series.observe(time.perf_counter() - started)
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                series.observe(time.perf_counter() - started)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+_db_timing_installed = False
+
+
+def install_db_timing() -> None:
+    """Подписаться на события SQLAlchemy и измерять время каждого запроса.
+
+    Слушатели вешаются на класс ``Engine``, поэтому движок, созданный позже
+    через :func:`app.db.get_engine`, тоже попадает в метрики.
+    """
+
+    global _db_timing_installed
+
+    if _db_timing_installed:
+        return
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany) -> None:  # noqa: ARG001
+        conn.info.setdefault("_query_started", []).append(time.perf_counter())
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany) -> None:  # noqa: ARG001
+        started = conn.info["_query_started"].pop()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started)
+
+    def on_error(exception_context) -> None:
+        # after_cursor_execute не вызывается для упавшего запроса: снимаем его
+        # отметку здесь, иначе стек растёт и следующие замеры берут чужое время.
+        conn = exception_context.connection
+        if conn is None or exception_context.statement is None:
+            return
+        started = conn.info.get("_query_started")
+        if started:
+            started.pop()
+
+    event.listen(Engine, "before_cursor_execute", before_execute)
+    event.listen(Engine, "after_cursor_execute", after_execute)
+    event.listen(Engine, "handle_error", on_error)
+    _db_timing_installed = True
+
+
+async def collect_key_counts() -> None:
+    """Обновить gauge ``vpn_keys`` по данным таблицы ``keys``."""
+
+    from datetime import datetime, timezone
+
+    from sqlalchemy import func, select
+
+    from app.db import get_session
+    from app.models.key import Key
+
+    now = datetime.now(timezone.utc)
+    async with get_session() as session:
+        total = await session.scalar(select(func.count()).select_from(Key))
+        expired = await session.scalar(
+            select(func.count()).select_from(Key).where(Key.expires_at.is_not(None), Key.expires_at <= now)
+        )
+    KEYS_TOTAL.labels("total").set(total or 0)
+    KEYS_TOTAL.labels("expired").set(expired or 0)
+    KEYS_TOTAL.labels("active").set((total or 0) - (expired or 0))
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    registry: Registry = request.app["registry"]
+    await registry.collect()
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(
+    host: str, port: int, registry: Registry = REGISTRY
+) -> web.AppRunner:
+    """Запустить HTTP-сервер с эндпоинтом ``/metrics``.
+
+    Аргументы:
+        host (str): Адрес для прослушивания (обычно 127.0.0.1).
+        port (int): TCP-порт.
+        registry (Registry): Набор публикуемых метрик.
+
+    Возвращает:
+        web.AppRunner: Запущенный раннер; для остановки вызовите ``cleanup()``.
+    """
+
+    app = web.Application()
+    app["registry"] = registry
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://{}:{}/metrics", host, port)
+    return runner
+
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "REGISTRY",
+    "Registry",
+    "collect_key_counts",
+    "install_db_timing",
+    "start_metrics_server",
+    "timed",
+]
@@ -0,0 +1,144 @@
+"""Отказ в новых соединениях для лишних устройств через nftables.
+
+Заблокированные IP хранятся в именованных множествах nftables с флагом
+``timeout``: ядро само удаляет элементы по истечении срока, поэтому бан
+снимается автоматически. Все изменения за тик собираются в один скрипт и
+применяются одной транзакцией ``nft -f -``. Уже установленные соединения
+не рвутся — правило срабатывает только на ``ct state new``.
+"""
+
+from __future__ import annotations
+
+import subprocess
+import time
+from typing import Iterable
+
+from loguru import logger
+
+SET_SIZE = 262_144
+ELEMENTS_PER_STATEMENT = 1000
+
+
+class NftBanSet:
+    """Пара множеств nftables (IPv4/IPv6) с временными банами."""
+
+    def __init__(
+        self,
+        *,
+        table: str = "vpn_limiter",
+        port: int = 443,
+        timeout_seconds: int = 300,
+        nft_binary: str = "nft",
+    ) -> None:
+        """Запомнить параметры таблицы.
+
+        Аргументы:
+            table (str): Имя таблицы семейства ``inet``.
+            port (int): TCP/UDP-порт XRay, на котором отбрасываются новые соединения.
+            timeout_seconds (int): Срок бана.
+            nft_binary (str): Путь к исполняемому файлу ``nft``.
+        """
+
+        self.table = table
+        self.port = port
+        self.timeout_seconds = timeout_seconds
+        self.nft_binary = nft_binary
+        self._pending: dict[str, float] = {}
+        self._banned: dict[str, float] = {}
+
+    def _run(self, script: str) -> None:
+        subprocess.run([self.nft_binary, "-f", "-"], input=script, text=True, check=True)
+
+    def setup_script(self) -> str:
+        """Вернуть скрипт создания таблицы, множеств и правил."""
+
+        table = f"inet {self.table}"
+        return "\n".join(
+            [
+                f"add table {table}",
+                f"add set {table} banned_v4 {{ type ipv4_addr; flags timeout; size {SET_SIZE}; }}",
+                f"add set {table} banned_v6 {{ type ipv6_addr; flags timeout; size {SET_SIZE}; }}",
+                f"add chain {table} input {{ type filter hook input priority -10; policy accept; }}",
+                f"flush chain {table} input",
+                f"add rule {table} input ct state new meta l4proto {{ tcp, udp }} th dport {self.port} "
+                "ip saddr @banned_v4 reject",
+                f"add rule {table} input ct state new meta l4proto {{ tcp, udp }} th dport {self.port} "
+                "ip6 saddr @banned_v6 reject",
+                "",
+            ]
+        )
+
+    def setup(self) -> None:
+        """Создать таблицу и правила (идемпотентно)."""
+
+        self._run(self.setup_script())
+        logger.info("nftables: таблица inet {} готова", self.table)
+
+    def ban(self, ips: Iterable[str], now: float | None = None) -> int:
+        """Поставить IP в очередь на бан до следующего :meth:`commit`.
+
+        IP, чей бан ещё действует, повторно не добавляются: ``add element``
+        не продлевает таймаут, а лишние элементы только раздувают транзакцию.
+
+        Аргументы:
+            ips (Iterable[str]): Адреса IPv4/IPv6.
+            now (float | None): Текущее время (UNIX), передавайте для тестов.
+
+        Возвращает:
+            int: Количество новых адресов в очереди.
+        """
+
+        now = time.time() if now is None else now
+        added = 0
+        for ip in ips:
+            expires_at = self._banned.get(ip)
+            if expires_at is not None and expires_at > now:
+                continue
+            if ip not in self._pending:
+                self._pending[ip] = now + self.timeout_seconds
+                added += 1
+        return added
+
+    def commit_script(self) -> str:
+        """Сформировать скрипт добавления всех ожидающих адресов."""
+
+        v4 = [ip for ip in self._pending if ":" not in ip]
+        v6 = [ip for ip in self._pending if ":" in ip]
+        lines: list[str] = []
+        for set_name, ips in (("banned_v4", v4), ("banned_v6", v6)):
+            for start in range(0, len(ips), ELEMENTS_PER_STATEMENT):
+                chunk = ips[start : start + ELEMENTS_PER_STATEMENT]
+                elements = ", ".join(f"{ip} timeout {self.timeout_seconds}s" for ip in chunk)
+                lines.append(f"add element inet {self.table} {set_name} {{ {elements} }}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def commit(self, now: float | None = None) -> int:
+        """Применить накопленные баны одной транзакцией ``nft -f``.
+
+        Аргументы:
+            now (float | None): Текущее время (UNIX), передавайте для тестов.
+
+        Возвращает:
+            int: Количество забаненных адресов.
+        """
+
+        now = time.time() if now is None else now
+        self._banned = {ip: expires for ip, expires in self._banned.items() if expires > now}
+        script = self.commit_script()
+        if not script:
+            return 0
+        self._run(script)
+        count = len(self._pending)
+        self._banned.update(self._pending)
+        self._pending.clear()
+        return count
+
+    @property
+    def active(self) -> int:
+        """Количество банов, которые по локальному учёту ещё действуют."""
+
+        now = time.time()
+        return sum(1 for expires in self._banned.values() if expires > now)
+
+
+__all__ = ["NftBanSet"]
@@ -0,0 +1,115 @@
+"""Отправка QR-кодов ключей с повторным использованием ``file_id`` Telegram.
+
+PNG с QR-кодом рисуется и загружается в Telegram только один раз. Telegram
+возвращает ``file_id`` загруженного документа, и он сохраняется в
+``keys.qr_file_id``. Повторная отправка того же ключа идёт по ``file_id``:
+без рендера и без передачи файла. ``file_id`` привязан к боту, поэтому
+после смены токена Telegram его отвергнет. Тогда QR-код загружается заново,
+а сохранённый идентификатор перезаписывается.
+
+Рядом с ``file_id`` хранится SHA-256 закодированной ссылки
+(``keys.qr_link_hash``). Ссылка зависит от настроек (``XRAY_HOST``,
+транспорт, теги inbound-ов), которые перечитываются без перезапуска; если
+отпечаток не совпадает, старый документ не отправляется, а QR-код
+рисуется и загружается заново.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from typing import Callable
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+from aiogram.types.input_file import BufferedInputFile
+from loguru import logger
+from sqlalchemy import select, update
+
+from app.bot.services.metrics import REGISTRY, Counter
+from app.db import get_session
+from app.models.key import Key
+
+QR_CAPTION = "QR-код для подключения"
+
+QR_DELIVERIES = REGISTRY.register(
+    Counter("vpn_qr_deliveries_total", "Отправленные QR-коды", ["source"])
+)
+
+
+def link_hash(link: str) -> str:
+    """Отпечаток ссылки, закодированной в QR-коде."""
+
+    return hashlib.sha256(link.encode("utf-8")).hexdigest()
+
+
+async def get_file_id(uuid: str, link: str | None = None) -> str | None:
+    """Вернуть сохранённый ``file_id`` QR-кода ключа.
+
+    Аргументы:
+        uuid (str): UUID ключа.
+        link (str | None): Текущая ссылка ключа; если задана, ``file_id``
+            возвращается, только когда QR-код кодирует именно её.
+
+    Возвращает:
+        str | None: ``file_id`` или None, если его нет или он устарел.
+    """
+
+    async with get_session() as session:
+        query = select(Key.qr_file_id, Key.qr_link_hash).where(Key.uuid == uuid)
+        result = await session.execute(query)
+        row = result.one_or_none()
+    if row is None or (link is not None and row.qr_link_hash != link_hash(link)):
+        return None
+    return row.qr_file_id
+
+
+async def store_file_id(uuid: str, file_id: str | None, link: str | None = None) -> None:
+    """Сохранить (или очистить) ``file_id`` QR-кода ключа и отпечаток его ссылки."""
+
+    values = {"qr_file_id": file_id, "qr_link_hash": link_hash(link) if link is not None else None}
+    async with get_session() as session:
+        await session.execute(update(Key).where(Key.uuid == uuid).values(**values))
+        await session.commit()
+
+
+async def send_qr(
+    message: Message,
+    uuid: str,
+    render: Callable[[], bytes],
+    *,
+    caption: str = QR_CAPTION,
+    lookup: bool = True,
+    link: str | None = None,
+) -> None:
+    """Отправить QR-код ключа в чат сообщения.
+
+    Аргументы:
+        message (Message): Сообщение, в чат которого отправляется QR-код.
+        uuid (str): UUID ключа.
+        render (Callable[[], bytes]): Рендер PNG; вызывается в отдельном потоке
+            и только если сохранённого ``file_id`` нет.
+        caption (str): Подпись к документу.
+        lookup (bool): Искать сохранённый ``file_id`` (False для только что созданного ключа).
+        link (str | None): Ссылка, которую кодирует ``render``; сохранённый
+            ``file_id`` другой ссылки не используется.
+    """
+
+    file_id = await get_file_id(uuid, link) if lookup else None
+    if file_id is not None:
+        try:
+            await message.answer_document(file_id, caption=caption)
+            QR_DELIVERIES.labels("file_id").inc()
+            return
+        except TelegramBadRequest as error:
+            logger.warning("file_id QR-кода ключа {} отклонён Telegram, загружаю заново: {}", uuid, error)
+
+    png = await asyncio.to_thread(render)
+    sent = await message.answer_document(BufferedInputFile(png, filename=f"{uuid}.png"), caption=caption)
+    QR_DELIVERIES.labels("upload").inc()
+    document = getattr(sent, "document", None)
+    if document is not None:
+        await store_file_id(uuid, document.file_id, link)
+
+
+__all__ = ["QR_CAPTION", "get_file_id", "link_hash", "send_qr", "store_file_id"]
@@ -9,6 +9,7 @@ from typing import Iterable
 from loguru import logger
 from sqlalchemy import delete, select
 
+from app.bot.services.key_cache import KEY_CACHE
 from app.db import get_session
 from app.models.key import Key
 
@@ -34,6 +35,8 @@ async def remove_expired_keys(now: datetime | None = None) -> list[str]:
         if uuids:
             await session.execute(delete(Key).where(Key.uuid.in_(uuids)))
             await session.commit()
+            for uuid in uuids:
+                KEY_CACHE.discard(uuid)
             logger.info("Удалены просроченные ключи: %s", uuids)
         return uuids
 
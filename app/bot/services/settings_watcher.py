@@ -0,0 +1,132 @@
+"""Перечитывание настроек без перезапуска бота.
+
+Наблюдатель раз в ``interval`` секунд (или по событию :class:`FileWatcher`)
+сверяет ``mtime``/размер файла .env и при изменении вызывает
+:func:`app.config.reload_settings`. Сигнал
+``SIGHUP`` запускает проверку немедленно и перечитывает настройки, даже если
+файл не менялся (например, после правки переменных окружения в systemd).
+Ошибочный .env не применяется: действующие настройки остаются прежними.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import signal
+from pathlib import Path
+
+from loguru import logger
+
+from app.bot.services.file_watcher import FileWatcher
+from app.bot.services.metrics import REGISTRY, Gauge
+from app.config import ENV_FILE, RESTART_REQUIRED, reload_settings, settings_version
+
+SETTINGS_VERSION = REGISTRY.register(Gauge("vpn_settings_version", "Версия загруженных настроек"))
+
+
+class SettingsWatcher:
+    """Следит за .env и перечитывает настройки при его изменении."""
+
+    def __init__(self, path: str | Path = ENV_FILE, interval: float = 5.0) -> None:
+        """Запомнить исходное состояние файла.
+
+        Аргументы:
+            path (str | Path): Файл .env.
+            interval (float): Интервал проверки, 0 — только по ``SIGHUP``.
+        """
+
+        self.path = Path(path)
+        self.interval = interval
+        self._stamp = self._read_stamp()
+        self._wakeup = asyncio.Event()
+        self._forced = False
+        self._watched = False
+
+    def watch(self, watcher: FileWatcher) -> None:
+        """Проверять файл по событиям наблюдателя вместо опроса по таймеру.
+
+        Аргументы:
+            watcher (FileWatcher): Наблюдатель за файлами.
+        """
+
+        watcher.subscribe(self.path, lambda _path: self._wakeup.set())
+        self._watched = True
+
+    def _read_stamp(self) -> tuple[int, int] | None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def trigger(self) -> None:
+        """Запросить перечитывание настроек (обработчик ``SIGHUP``)."""
+
+        self._forced = True
+        self._wakeup.set()
+
+    def check(self) -> list[str]:
+        """Перечитать настройки, если файл изменился или был запрошен reload.
+
+        Возвращает:
+            list[str]: Имена изменившихся полей.
+        """
+
+        stamp = self._read_stamp()
+        if stamp == self._stamp and not self._forced:
+            return []
+        self._stamp = stamp
+        self._forced = False
+        try:
+            changed = reload_settings()
+        except Exception as error:  # noqa: BLE001 - ошибка в .env не должна останавливать бота
+            logger.error("Настройки не перечитаны, остаются прежние: {}", error)
+            return []
+
+        SETTINGS_VERSION.set(settings_version())
+        if changed:
+            logger.info("Настройки перечитаны (версия {}): {}", settings_version(), ", ".join(changed))
+            restart = sorted(set(changed) & set(RESTART_REQUIRED))
+            if restart:
+                logger.warning("Изменения {} вступят в силу после перезапуска", ", ".join(restart))
+        return changed
+
+    async def run(self) -> None:
+        """Проверять файл до отмены задачи."""
+
+        SETTINGS_VERSION.set(settings_version())
+        while True:
+            try:
+                timeout = None if self._watched else self.interval or None
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self.check()
+
+
+def start_settings_watcher(
+    interval: float, path: str | Path = ENV_FILE, watcher: FileWatcher | None = None
+) -> asyncio.Task:
+    """Запустить наблюдатель и подписать его на ``SIGHUP``.
+
+    Аргументы:
+        interval (float): Интервал проверки .env, 0 — только по ``SIGHUP``.
+        path (str | Path): Файл .env.
+        watcher (FileWatcher | None): Наблюдатель за файлами; с ним .env проверяется
+            по событию изменения, а не раз в ``interval`` секунд.
+
+    Возвращает:
+        asyncio.Task: Задача наблюдателя (отменяется при остановке).
+    """
+
+    settings_watcher = SettingsWatcher(path, interval)
+    if watcher is not None and interval:
+        settings_watcher.watch(watcher)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, settings_watcher.trigger)
+    except (NotImplementedError, AttributeError, RuntimeError):  # pragma: no cover - Windows
+        logger.debug("SIGHUP недоступен, настройки перечитываются только по изменению файла")
+    return asyncio.create_task(settings_watcher.run(), name="settings-watcher")
+
+
+__all__ = ["SETTINGS_VERSION", "SettingsWatcher", "start_settings_watcher"]
@@ -0,0 +1,385 @@
+"""История использования ключей: выборки, агрегаты и хранение.
+
+Ограничитель каждый тик передаёт сюда число принятых соединений и активных
+IP по ключам. :class:`UsageRecorder` копит их в памяти и раз в
+``USAGE_SAMPLE_SECONDS`` пишет по одной строке на ключ в ``usage_samples``.
+:func:`run_maintenance` (PostgreSQL) поддерживает таблицы:
+
+* создаёт месячные секции ``usage_samples`` и ``usage_hourly`` на текущий и
+  следующий месяц;
+* сворачивает полные часы выборок в ``usage_hourly``, полные сутки — в
+  ``usage_daily``; докуда данные уже свёрнуты, хранится в ``usage_rollups``;
+* удаляет секции старше срока хранения целиком (``DROP TABLE``), без
+  ``DELETE`` и последующего VACUUM. Секция удаляется, только если её данные
+  уже попали в следующий уровень агрегатов.
+
+Отчёты (:func:`top_users`) читают только агрегаты.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from datetime import date, datetime, time, timezone
+from typing import Mapping, NamedTuple, Sized
+
+from loguru import logger
+from sqlalchemy import func, insert, select, union_all
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.bot.services.metrics import REGISTRY, Counter
+from app.db import get_session
+from app.models.usage import UsageDaily, UsageHourly, UsageSample
+
+MAINTENANCE_SECONDS = 300.0
+PARTITIONED_TABLES = ("usage_samples", "usage_hourly")
+
+USAGE_SAMPLES = REGISTRY.register(Counter("vpn_usage_samples_total", "Записанные выборки использования ключей"))
+
+_HOURLY_ROLLUP = """
+INSERT INTO usage_hourly (hour, key_uuid, connections, peak_devices, samples)
+SELECT date_trunc('hour', sampled_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+       key_uuid, SUM(connections), MAX(devices), COUNT(*)
+FROM usage_samples
+WHERE sampled_at >= %(start)s AND sampled_at < %(end)s
+GROUP BY 1, 2
+ON CONFLICT (hour, key_uuid) DO UPDATE SET
+    connections = EXCLUDED.connections,
+    peak_devices = EXCLUDED.peak_devices,
+    samples = EXCLUDED.samples
+"""
+
+_DAILY_ROLLUP = """
+INSERT INTO usage_daily (day, key_uuid, connections, peak_devices)
+SELECT (hour AT TIME ZONE 'UTC')::date, key_uuid, SUM(connections), MAX(peak_devices)
+FROM usage_hourly
+WHERE hour >= %(start)s AND hour < %(end)s
+GROUP BY 1, 2
+ON CONFLICT (day, key_uuid) DO UPDATE SET
+    connections = EXCLUDED.connections,
+    peak_devices = EXCLUDED.peak_devices
+"""
+
+_PARTITIONS = """
+SELECT child.relname
+FROM pg_inherits
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE parent.relname = %(table)s
+"""
+
+
+class UsageTotal(NamedTuple):
+    """Итог по ключу за период.
+
+    Атрибуты:
+        key_uuid (str): UUID ключа.
+        connections (int): Соединения за период.
+        peak_devices (int): Наибольшее число устройств за период.
+    """
+
+    key_uuid: str
+    connections: int
+    peak_devices: int
+
+
+def month_start(moment: datetime | date) -> date:
+    """Вернуть первое число месяца для даты или момента (UTC)."""
+
+    if isinstance(moment, datetime):
+        moment = moment.astimezone(timezone.utc).date()
+    return moment.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    """Сдвинуть первое число месяца на ``months`` месяцев."""
+
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _utc(day: date) -> datetime:
+    return datetime.combine(day, time(), tzinfo=timezone.utc)
+
+
+def partition_name(table: str, month: date) -> str:
+    """Имя месячной секции: ``usage_samples_2024_03``."""
+
+    return f"{table}_{month:%Y_%m}"
+
+
+def partition_ddl(table: str, month: date) -> str:
+    """SQL создания секции ``table`` на месяц ``month`` (идемпотентный)."""
+
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{_utc(month).isoformat()}') TO ('{_utc(add_months(month, 1)).isoformat()}')"
+    )
+
+
+def expired_partitions(table: str, names: list[str], cutoff: datetime) -> list[str]:
+    """Выбрать секции, все данные которых старше ``cutoff``.
+
+    Аргументы:
+        table (str): Родительская таблица.
+        names (list[str]): Имена существующих секций.
+        cutoff (datetime): Граница хранения; секция удаляется, если её месяц
+            целиком лежит до неё.
+
+    Возвращает:
+        list[str]: Имена секций для удаления, от старых к новым.
+    """
+
+    pattern = re.compile(rf"^{re.escape(table)}_(\d{{4}})_(\d{{2}})$")
+    expired = []
+    for name in sorted(names):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        if _utc(add_months(month, 1)) <= cutoff:
+            expired.append(name)
+    return expired
+
+
+class UsageRecorder:
+    """Буфер выборок ограничителя с периодической записью в ``usage_samples``."""
+
+    def __init__(self, interval_seconds: float = 60.0) -> None:
+        """Подготовить пустой буфер.
+
+        Аргументы:
+            interval_seconds (float): Как часто записывать накопленное в базу.
+        """
+
+        self.interval_seconds = interval_seconds
+        self._buffer: dict[str, list[int]] = {}
+        self._flushed_at: datetime | None = None
+
+    def add(self, connections: Mapping[str, int], windows: Mapping[str, Sized]) -> None:
+        """Учесть итоги тика.
+
+        Аргументы:
+            connections (Mapping[str, int]): Новые соединения за тик по UUID.
+            windows (Mapping[str, Sized]): Активные IP по UUID (окна ограничителя).
+        """
+
+        buffer = self._buffer
+        for uuid, count in connections.items():
+            entry = buffer.get(uuid)
+            if entry is None:
+                entry = buffer[uuid] = [0, 0]
+            entry[0] += count
+        for uuid, window in windows.items():
+            entry = buffer.get(uuid)
+            if entry is None:
+                entry = buffer[uuid] = [0, 0]
+            if len(window) > entry[1]:
+                entry[1] = len(window)
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self, now: datetime | None = None) -> int:
+        """Записать буфер одной пачкой.
+
+        При ошибке записи буфер сохраняется и будет записан в следующий раз.
+
+        Аргументы:
+            now (datetime | None): Время выборки, передавайте для тестов.
+
+        Возвращает:
+            int: Количество записанных строк.
+        """
+
+        now = now or datetime.now(timezone.utc)
+        self._flushed_at = now
+        if not self._buffer:
+            return 0
+        rows = [
+            {"sampled_at": now, "key_uuid": uuid, "connections": connections, "devices": devices}
+            for uuid, (connections, devices) in self._buffer.items()
+        ]
+        async with get_session() as session:
+            await session.execute(insert(UsageSample), rows)
+            await session.commit()
+        self._buffer.clear()
+        USAGE_SAMPLES.inc(len(rows))
+        return len(rows)
+
+    async def maybe_flush(self, now: datetime | None = None) -> int:
+        """Записать буфер, если с прошлой записи прошло ``interval_seconds``."""
+
+        now = now or datetime.now(timezone.utc)
+        if self._flushed_at is None:
+            self._flushed_at = now
+        if (now - self._flushed_at).total_seconds() < self.interval_seconds:
+            return 0
+        try:
+            return await self.flush(now)
+        except Exception as error:  # noqa: BLE001
+            logger.warning("Не удалось записать выборки использования: {}", error)
+            return 0
+
+
+async def _partitions(connection: AsyncConnection, table: str) -> list[str]:
+    result = await connection.exec_driver_sql(_PARTITIONS, {"table": table})
+    return [row[0] for row in result]
+
+
+async def _watermark(connection: AsyncConnection, name: str) -> datetime | None:
+    result = await connection.exec_driver_sql(
+        "SELECT rolled_until FROM usage_rollups WHERE name = %(name)s", {"name": name}
+    )
+    return result.scalar()
+
+
+async def _rollup(
+    connection: AsyncConnection, name: str, source: str, column: str, sql: str, end: datetime
+) -> datetime | None:
+    """Свернуть ``[водяной знак, end)`` и сдвинуть водяной знак; вернуть его."""
+
+    start = await _watermark(connection, name)
+    if start is None:
+        result = await connection.exec_driver_sql(f"SELECT MIN({column}) FROM {source}")
+        first = result.scalar()
+        if first is None:
+            return None
+        start = first.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if name == "daily":
+            start = start.replace(hour=0)
+    if start >= end:
+        return start
+    result = await connection.exec_driver_sql(sql, {"start": start, "end": end})
+    await connection.exec_driver_sql(
+        "INSERT INTO usage_rollups (name, rolled_until) VALUES (%(name)s, %(end)s) "
+        "ON CONFLICT (name) DO UPDATE SET rolled_until = EXCLUDED.rolled_until",
+        {"name": name, "end": end},
+    )
+    logger.info("Свёртка {}: {} строк за {} — {}", name, result.rowcount, start, end)
+    return end
+
+
+async def run_maintenance(
+    engine: AsyncEngine,
+    *,
+    raw_retention_months: int = 2,
+    hourly_retention_months: int = 13,
+    now: datetime | None = None,
+) -> list[str]:
+    """Создать секции, свернуть выборки и удалить устаревшие секции.
+
+    Аргументы:
+        engine (AsyncEngine): Движок PostgreSQL.
+        raw_retention_months (int): Сколько полных месяцев хранить сырые выборки.
+        hourly_retention_months (int): Сколько полных месяцев хранить почасовые агрегаты.
+        now (datetime | None): Текущее время, передавайте для тестов.
+
+    Возвращает:
+        list[str]: Имена удалённых секций.
+    """
+
+    now = now or datetime.now(timezone.utc)
+    current = month_start(now)
+    hour_end = now.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    day_end = hour_end.replace(hour=0)
+
+    async with engine.begin() as connection:
+        for table in PARTITIONED_TABLES:
+            for month in (current, add_months(current, 1)):
+                await connection.exec_driver_sql(partition_ddl(table, month))
+
+    async with engine.begin() as connection:
+        hourly_until = await _rollup(connection, "hourly", "usage_samples", "sampled_at", _HOURLY_ROLLUP, hour_end)
+        daily_until = await _rollup(connection, "daily", "usage_hourly", "hour", _DAILY_ROLLUP, day_end)
+
+    dropped: list[str] = []
+    retention = (
+        ("usage_samples", raw_retention_months, hourly_until),
+        ("usage_hourly", hourly_retention_months, daily_until),
+    )
+    for table, months, rolled_until in retention:
+        cutoff = _utc(add_months(current, -months))
+        if rolled_until is not None:
+            cutoff = min(cutoff, rolled_until)
+        async with engine.begin() as connection:
+            for name in expired_partitions(table, await _partitions(connection, table), cutoff):
+                await connection.exec_driver_sql(f"DROP TABLE IF EXISTS {name}")
+                dropped.append(name)
+    if dropped:
+        logger.info("Удалены секции истории: {}", ", ".join(dropped))
+    return dropped
+
+
+async def maintenance_loop(
+    engine: AsyncEngine,
+    stop_event: asyncio.Event,
+    *,
+    raw_retention_months: int = 2,
+    hourly_retention_months: int = 13,
+    interval_seconds: float = MAINTENANCE_SECONDS,
+) -> None:
+    """Запускать :func:`run_maintenance` до установки ``stop_event``."""
+
+    while not stop_event.is_set():
+        try:
+            await run_maintenance(
+                engine,
+                raw_retention_months=raw_retention_months,
+                hourly_retention_months=hourly_retention_months,
+            )
+        except Exception as error:  # noqa: BLE001
+            logger.exception("Ошибка обслуживания истории использования: {}", error)
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval_seconds)
+        except asyncio.TimeoutError:
+            continue
+
+
+async def top_users(since: datetime, limit: int = 10, now: datetime | None = None) -> list[UsageTotal]:
+    """Ключи с наибольшим числом соединений начиная с ``since``.
+
+    Полные сутки берутся из ``usage_daily``, текущие сутки — из
+    ``usage_hourly``; сырые выборки не читаются, поэтому ещё не свёрнутый
+    текущий час в отчёт не попадает.
+
+    Аргументы:
+        since (datetime): Начало периода (UTC).
+        limit (int): Сколько ключей вернуть.
+        now (datetime | None): Текущее время, передавайте для тестов.
+
+    Возвращает:
+        list[UsageTotal]: Ключи по убыванию числа соединений.
+    """
+
+    now = now or datetime.now(timezone.utc)
+    today = now.astimezone(timezone.utc).date()
+    daily = select(UsageDaily.key_uuid, UsageDaily.connections, UsageDaily.peak_devices).where(
+        UsageDaily.day >= since.astimezone(timezone.utc).date(), UsageDaily.day < today
+    )
+    hourly = select(UsageHourly.key_uuid, UsageHourly.connections, UsageHourly.peak_devices).where(
+        UsageHourly.hour >= max(since, _utc(today))
+    )
+    combined = union_all(daily, hourly).subquery()
+    connections = func.sum(combined.c.connections).label("total_connections")
+    query = (
+        select(combined.c.key_uuid, connections, func.max(combined.c.peak_devices))
+        .group_by(combined.c.key_uuid)
+        .order_by(connections.desc(), combined.c.key_uuid)
+        .limit(limit)
+    )
+    async with get_session() as session:
+        result = await session.execute(query)
+        return [UsageTotal(uuid, int(total), int(peak)) for uuid, total, peak in result]
+
+
+__all__ = [
+    "UsageRecorder",
+    "UsageTotal",
+    "expired_partitions",
+    "maintenance_loop",
+    "month_start",
+    "partition_ddl",
+    "run_maintenance",
+    "top_users",
+]
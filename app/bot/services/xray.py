@@ -1,42 +1,415 @@
-"""Сервисы работы с конфигурацией XRay."""
+"""Сервисы работы с конфигурацией XRay.
+
+Запуск из командной строки (вынос клиентов в фрагмент для ``-confdir``)::
+
+    python -m app.bot.services.xray shard --config /etc/xray/conf.d/00_base.json \
+        --clients /etc/xray/conf.d/10_clients.json
+"""
 
 from __future__ import annotations
 
+import argparse
+import asyncio
 import json
+import os
 import shlex
 import shutil
 import subprocess
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Sequence
+from typing import Any, Callable, Iterable, Iterator, Sequence
 
-import qrcode
 from loguru import logger
 
-from app.config import get_settings
+from app.bot.services.config_history import history_for
+from app.bot.services.file_watcher import FileWatcher, Signature, file_signature
+from app.bot.services.metrics import (
+    CONFIG_LOCK_WAIT_SECONDS,
+    CONFIG_STALE_WRITES,
+    CONFIG_WRITE_SECONDS,
+    XRAY_RELOAD_SECONDS,
+    timed,
+)
+from app.bot.services.xray_model import XrayConfig, parse_tags
+from app.config import get_settings, per_settings_version
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson опционален
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - на Windows остаётся только блокировка потоков
+    fcntl = None
+
+# Чтение-изменение-запись конфига выполняется в пуле потоков, поэтому
+# параллельные мутации сериализуются, чтобы не потерять чужие изменения.
+# Между процессами (бот, админские скрипты) порядок задаёт flock на файле
+# ``<config>.lock`` рядом с конфигом.
+_CONFIG_LOCK = threading.Lock()
+
+
+# Разобранный конфиг для операций только чтения (ссылки, QR): сигнатура файла
+# и модель. Собственные записи кладут сюда результат сразу, поэтому файл
+# разбирается заново только после правки извне.
+_READ_CACHE: dict[Path, tuple[Signature | None, XrayConfig]] = {}
+# Файлы под наблюдением FileWatcher: кэш сбрасывается по событию, чтение обходится без stat.
+_WATCHED: set[Path] = set()
+
+
+class StaleConfigError(RuntimeError):
+    """Конфиг изменили после чтения: запись по устаревшей копии отклонена."""
+
+
+def lock_path(config_path: str | Path) -> Path:
+    """Вернуть файл межпроцессной блокировки для конфига."""
+
+    path = Path(config_path)
+    return path.with_name(path.name + ".lock")
+
+
+def generation_path(config_path: str | Path) -> Path:
+    """Вернуть файл со счётчиком поколений конфига."""
+
+    path = Path(config_path)
+    return path.with_name(path.name + ".gen")
+
+
+@contextmanager
+def _config_lock(*paths: Path) -> Iterator[None]:
+    """Захватить блокировку конфига, записав время ожидания в метрику.
+
+    Сначала берётся блокировка потоков процесса, затем ``flock`` на файлах
+    ``.lock`` всех переданных конфигов в стабильном порядке, чтобы два
+    процесса не захватили их навстречу друг другу.
+    """
+
+    started = time.perf_counter()
+    with _CONFIG_LOCK, ExitStack() as stack:
+        if fcntl is not None:
+            for path in sorted({Path(path) for path in paths}):
+                if not path.parent.is_dir():
+                    continue  # конфига нет — _load_config сообщит об этом сам
+                handle = stack.enter_context(open(lock_path(path), "a+b"))
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        CONFIG_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started)
+        yield
+
+
+def _loads(data: bytes) -> dict[str, Any]:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(config: dict[str, Any], compact: bool = False) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(config) if compact else orjson.dumps(config, option=orjson.OPT_INDENT_2)
+    if compact:
+        return json.dumps(config, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return json.dumps(config, indent=2, ensure_ascii=False).encode("utf-8")
 
 
 def _load_config(config_path: Path) -> dict[str, Any]:
     if not config_path.exists():
         raise FileNotFoundError(f"Конфиг не найден: {config_path}")
-    return json.loads(config_path.read_text(encoding="utf-8"))
+    return _loads(config_path.read_bytes())
 
 
-def _save_config(config: dict[str, Any], config_path: Path) -> None:
-    config_path.write_text(json.dumps(config, indent=2, ensure_ascii=False), encoding="utf-8")
+def _load_for_update(config_path: Path) -> dict[str, Any]:
+    # Ручная правка, сделанная после последней версии, сохраняется в истории
+    # отдельной версией до изменения ботом.
+    config = _load_config(config_path)
+    history = history_for(config_path)
+    if history is not None:
+        history.observe(config)
+    return config
 
 
-def _get_vless_clients(config: dict[str, Any]) -> list[dict[str, Any]]:
-    for inbound in config.get("inbounds", []):
-        if inbound.get("protocol") != "vless":
+def read_generation(config_path: str | Path) -> int:
+    """Прочитать поколение конфига: число записей, сделанных под блокировкой.
+
+    Аргументы:
+        config_path (str | Path): Путь к файлу конфигурации.
+
+    Возвращает:
+        int: Текущее поколение; 0, если файл поколений ещё не создан.
+    """
+
+    try:
+        return int(generation_path(config_path).read_text(encoding="utf-8").strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_generation(config_path: Path, generation: int) -> None:
+    path = generation_path(config_path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(str(generation), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _save_config(
+    config: dict[str, Any],
+    config_path: Path,
+    *,
+    compact: bool = False,
+    source: str = "bot",
+    steps: list | None = None,
+    generation: int | None = None,
+) -> None:
+    # Вызывается под _config_lock: проверка поколения и запись атомарны
+    # относительно других процессов, соблюдающих блокировку.
+    current = read_generation(config_path)
+    if generation is not None and generation != current:
+        CONFIG_STALE_WRITES.inc()
+        raise StaleConfigError(
+            f"Конфиг {config_path} изменён другим процессом (поколение {generation} → {current})"
+        )
+    # Запись через временный файл: читатели без блокировки (ограничитель, XRay)
+    # видят либо старую, либо новую версию, но не обрезанный файл.
+    tmp_path = config_path.with_name(f"{config_path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(_dumps(config, compact))
+    if config_path.exists():
+        shutil.copymode(config_path, tmp_path)
+    os.replace(tmp_path, config_path)
+    _write_generation(config_path, current + 1)
+    _READ_CACHE[config_path.absolute()] = (file_signature(config_path), XrayConfig(config))
+    history = history_for(config_path)
+    if history is not None:
+        history.record(config, source, steps=steps)
+
+
+def read_model(config_path: str | Path) -> XrayConfig:
+    """Вернуть индекс конфига для чтения, разбирая файл только после его изменения.
+
+    Модель общая для всех вызывающих: её нельзя изменять. Для изменений
+    конфиг всегда перечитывается под блокировкой.
+
+    Аргументы:
+        config_path (str | Path): Путь к файлу конфигурации.
+
+    Возвращает:
+        XrayConfig: Индекс inbound-ов текущего содержимого файла.
+    """
+
+    path = Path(config_path).absolute()
+    cached = _READ_CACHE.get(path)
+    if cached is not None and path in _WATCHED:
+        return cached[1]
+    signature = file_signature(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    model = XrayConfig(_load_config(path))
+    _READ_CACHE[path] = (signature, model)
+    return model
+
+
+def _on_config_changed(path: Path) -> None:
+    cached = _READ_CACHE.get(path)
+    # Событие от собственной записи приходит, когда кэш уже совпадает с файлом.
+    if cached is not None and cached[0] != file_signature(path):
+        del _READ_CACHE[path]
+        logger.info("Конфиг {} изменён извне, индекс будет перестроен", path)
+
+
+def watch_config(watcher: FileWatcher, config_path: str | Path) -> Callable[[], None]:
+    """Сбрасывать индекс :func:`read_model` только при внешних правках файла.
+
+    Аргументы:
+        watcher (FileWatcher): Наблюдатель за файлами.
+        config_path (str | Path): Путь к файлу конфигурации.
+
+    Возвращает:
+        Callable[[], None]: Функция отписки.
+    """
+
+    path = Path(config_path).absolute()
+    unsubscribe = watcher.subscribe(path, _on_config_changed)
+    _WATCHED.add(path)
+
+    def stop() -> None:
+        _WATCHED.discard(path)
+        unsubscribe()
+
+    return stop
+
+
+def load_config(config_path: str | Path) -> tuple[dict[str, Any], int]:
+    """Прочитать конфиг вместе с его поколением.
+
+    Подходит для долгих изменений, которые нельзя держать под блокировкой:
+    прочитать, подготовить новую версию и записать её через :func:`commit_config`.
+
+    Аргументы:
+        config_path (str | Path): Путь к файлу конфигурации.
+
+    Возвращает:
+        tuple[dict[str, Any], int]: Конфиг и поколение, с которого он прочитан.
+    """
+
+    path = Path(config_path)
+    with _config_lock(path):
+        return _load_for_update(path), read_generation(path)
+
+
+def commit_config(
+    config: dict[str, Any], config_path: str | Path, generation: int, *, compact: bool = False
+) -> int:
+    """Записать конфиг, если с момента чтения его никто не изменил.
+
+    Аргументы:
+        config (dict[str, Any]): Новое содержимое конфига.
+        config_path (str | Path): Путь к файлу конфигурации.
+        generation (int): Поколение, полученное от :func:`load_config`.
+        compact (bool): Сохранить файл без отступов.
+
+    Возвращает:
+        int: Новое поколение конфига.
+
+    Исключения:
+        StaleConfigError: Конфиг успел изменить другой процесс или поток.
+    """
+
+    path = Path(config_path)
+    with _config_lock(path):
+        _save_config(config, path, compact=compact, generation=generation)
+    return generation + 1
+
+
+def resolve_clients_path(settings: Any) -> Path:
+    """Вернуть файл, в котором хранится список клиентов.
+
+    Если задан ``XRAY_CLIENTS_PATH``, клиенты живут в отдельном фрагменте,
+    который XRay подключает через ``-confdir``; иначе — в основном config.json.
+
+    Аргументы:
+        settings: Настройки приложения.
+
+    Возвращает:
+        Path: Путь к файлу для операций с клиентами.
+    """
+
+    return Path(settings.xray_clients_path or settings.xray_config_path)
+
+
+def _pending_shard_path(clients_path: Path) -> Path:
+    # Без суффикса .json: ``xray run -confdir`` не подхватит недописанный фрагмент.
+    return clients_path.with_name(clients_path.name + ".pending")
+
+
+def _merge_inbounds(fragment: dict[str, Any], inbounds: list[dict[str, Any]]) -> None:
+    current = fragment.setdefault("inbounds", [])
+    tags = {inbound.get("tag") for inbound in current if inbound.get("tag")}
+    for inbound in inbounds:
+        tag = inbound.get("tag")
+        if (tag and tag in tags) or (not tag and inbound in current):
             continue
-        settings = inbound.setdefault("settings", {})
-        return settings.setdefault("clients", [])
-    raise ValueError("В конфиге отсутствует inbound с протоколом vless")
+        current.append(inbound)
 
 
-def compose_vless_link(uuid: str, email: str) -> str:
-    settings = get_settings()
+def shard_config(config_path: str | Path, clients_path: str | Path, *, compact: bool = False) -> int:
+    """Вынести vless-inbound с клиентами из config.json в отдельный фрагмент.
+
+    XRay при запуске с ``-confdir`` объединяет файлы каталога, поэтому
+    inbound из фрагмента дополняет основной конфиг. После разделения
+    изменение клиента перезаписывает только фрагмент, а TLS, outbounds,
+    routing и прочие inbound-ы остаются нетронутыми.
+
+    Перенос идёт в три шага: фрагмент целиком пишется в ``<clients>.pending``
+    (XRay его не читает), затем основной конфиг без vless, затем сам
+    фрагмент. Сбой на любом шаге не оставляет inbound-ы в обоих файлах, а
+    повторный вызов доводит прерванный перенос до конца; если переносить
+    нечего и незавершённого переноса нет, вызов ничего не делает.
+
+    Аргументы:
+        config_path (str | Path): Основной config.json.
+        clients_path (str | Path): Файл фрагмента с клиентами.
+        compact (bool): Записывать фрагмент без отступов.
+
+    Возвращает:
+        int: Количество перенесённых клиентов (при завершении прерванного
+        переноса — клиенты, попавшие во фрагмент на этом вызове).
+
+    Исключения:
+        ValueError: Во фрагменте уже есть inbound с тем же ``tag``.
+    """
+
+    main_path = Path(config_path)
+    fragment_path = Path(clients_path)
+    pending_path = _pending_shard_path(fragment_path)
+    with _config_lock(main_path, fragment_path):
+        config = _load_for_update(main_path)
+        inbounds = config.get("inbounds", [])
+        moved = [inbound for inbound in inbounds if inbound.get("protocol") == "vless"]
+        if not moved and not pending_path.exists():
+            return 0
+
+        fragment: dict[str, Any] = {"inbounds": []}
+        if fragment_path.exists():
+            fragment = _load_for_update(fragment_path)
+        if moved:
+            existing = {inbound.get("tag") for inbound in fragment.get("inbounds", []) if inbound.get("tag")}
+            clashes = sorted(existing & {inbound.get("tag") for inbound in moved})
+            if clashes:
+                raise ValueError(f"Во фрагменте {fragment_path} уже есть inbound-ы: {', '.join(clashes)}")
+            staged = json.loads(json.dumps(fragment))
+            _merge_inbounds(staged, moved)
+            tmp_path = pending_path.with_name(f"{pending_path.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(_dumps(staged, compact))
+            os.replace(tmp_path, pending_path)
+            config["inbounds"] = [inbound for inbound in inbounds if inbound.get("protocol") != "vless"]
+            _save_config(config, main_path)
+        else:
+            # Основной конфиг уже записан без vless: inbound-ы есть только в .pending.
+            moved = [
+                inbound
+                for inbound in _loads(pending_path.read_bytes()).get("inbounds", [])
+                if inbound.get("protocol") == "vless"
+            ]
+            logger.warning("Завершение прерванного переноса клиентов в {}", fragment_path)
+
+        before = len(fragment.get("inbounds", []))
+        _merge_inbounds(fragment, moved)
+        added = fragment["inbounds"][before:]
+        _save_config(fragment, fragment_path, compact=compact)
+        pending_path.unlink()
+
+    clients = sum(len(inbound.get("settings", {}).get("clients", [])) for inbound in added)
+    logger.info("Клиенты ({}) перенесены в {}", clients, fragment_path)
+    return clients
+
+
+def _get_vless_clients(config: dict[str, Any]) -> list[dict[str, Any]]:
+    return XrayConfig(config).default().clients
+
+
+@per_settings_version
+def _inbound_tags(settings: Any) -> tuple[str, ...]:
+    return tuple(parse_tags(getattr(settings, "xray_inbound_tags", "")))
+
+
+def configured_tags(settings: Any | None = None) -> list[str]:
+    """Вернуть теги inbound-ов из ``XRAY_INBOUND_TAGS`` (пустой список — первый vless)."""
+
+    return list(_inbound_tags(settings or get_settings()))
+
+
+@per_settings_version
+def vless_link_template(settings: Any) -> tuple[str, str]:
+    """Вернуть неизменные части vless-ссылки для текущей версии настроек.
+
+    Аргументы:
+        settings: Настройки приложения.
+
+    Возвращает:
+        tuple[str, str]: ``@host:port`` и строка параметров (с ``?`` или пустая).
+    """
 
     params: list[tuple[str, str]] = []
     if settings.xray_flow:
@@ -49,61 +422,254 @@ def compose_vless_link(uuid: str, email: str) -> str:
         params.append(("serviceName", settings.xray_service_name))
 
     query = "&".join(f"{key}={value}" for key, value in params if value)
+    return f"@{settings.xray_host}:{settings.xray_port}", f"?{query}" if query else ""
+
 
-    base = f"vless://{uuid}@{settings.xray_host}:{settings.xray_port}"
-    if query:
-        base = f"{base}?{query}"
-    return f"{base}#{email}"
+def compose_vless_link(uuid: str, email: str, settings: Any | None = None) -> str:
+    """Сформировать vless-ссылку по шаблону текущей версии настроек."""
 
+    address, query = vless_link_template(settings or get_settings())
+    return f"vless://{uuid}{address}{query}#{email}"
 
-def create_client(uuid: str, email: str, config_path: str | Path) -> str:
+
+@timed(CONFIG_WRITE_SECONDS.labels("create"))
+def create_client(uuid: str, email: str, config_path: str | Path, *, compact: bool = False) -> str:
     """Добавить клиента в конфигурацию XRay.
 
     Аргументы:
         uuid (str): Уникальный идентификатор клиента.
         email (str): Комментарий/почта пользователя, который будет записан в конфиге.
         config_path (str | Path): Путь к файлу config.json.
+        compact (bool): Сохранить файл без отступов.
 
     Возвращает:
         str: Сформированная vless-ссылка для подключения.
     """
 
     path = Path(config_path)
-    config = _load_config(path)
-    clients = _get_vless_clients(config)
-
-    if any(client.get("id") == uuid for client in clients):
-        raise ValueError("Клиент с таким UUID уже существует")
+    with _config_lock(path):
+        config = _load_for_update(path)
+        inbound = XrayConfig(config).default()
+        if inbound.has(uuid):
+            raise ValueError("Клиент с таким UUID уже существует")
 
-    clients.append({"id": uuid, "email": email})
-    _save_config(config, path)
+        inbound.add(uuid, email)
+        _save_config(config, path, compact=compact)
 
     return compose_vless_link(uuid, email)
 
 
-def remove_client(uuid: str, config_path: str | Path) -> bool:
-    """Удалить клиента по UUID из файла конфигурации.
+async def create_client_async(
+    uuid: str, email: str, config_path: str | Path, *, compact: bool = False
+) -> str:
+    """Асинхронная версия :func:`create_client`.
+
+    Разбор и сериализация config.json выполняются в рабочем потоке, поэтому
+    обработчики не блокируют цикл событий даже на больших конфигах.
+
+    Аргументы:
+        uuid (str): Уникальный идентификатор клиента.
+        email (str): Комментарий/почта пользователя.
+        config_path (str | Path): Путь к файлу config.json.
+        compact (bool): Сохранить файл без отступов.
+
+    Возвращает:
+        str: Сформированная vless-ссылка для подключения.
+    """
+
+    return await asyncio.to_thread(create_client, uuid, email, config_path, compact=compact)
+
+
+@timed(CONFIG_WRITE_SECONDS.labels("create"))
+def provision_client(
+    uuid: str,
+    email: str,
+    config_path: str | Path,
+    tags: Sequence[str] | None = None,
+    *,
+    compact: bool = False,
+) -> dict[str, str]:
+    """Добавить клиента сразу в несколько inbound-ов за одно чтение и одну запись.
+
+    Аргументы:
+        uuid (str): UUID ключа; для Trojan/Shadowsocks из него выводится пароль.
+        email (str): Почта пользователя.
+        config_path (str | Path): Путь к файлу с inbound-ами.
+        tags (Sequence[str] | None): Теги inbound-ов; по умолчанию ``XRAY_INBOUND_TAGS``,
+            а если и он пуст — первый vless-inbound.
+        compact (bool): Сохранить файл без отступов.
+
+    Возвращает:
+        dict[str, str]: Ссылки подключения ``тег → ссылка`` в порядке тегов.
+    """
+
+    settings = get_settings()
+    if tags is None:
+        tags = configured_tags(settings)
+    path = Path(config_path)
+    with _config_lock(path):
+        config = _load_for_update(path)
+        model = XrayConfig(config)
+        inbounds = model.add_client(uuid, email, tags, flow=settings.xray_flow)
+        _save_config(config, path, compact=compact)
+
+    return {inbound.tag: inbound.link(uuid, email, settings.xray_host) for inbound in inbounds}
+
+
+async def provision_client_async(
+    uuid: str,
+    email: str,
+    config_path: str | Path,
+    tags: Sequence[str] | None = None,
+    *,
+    compact: bool = False,
+) -> dict[str, str]:
+    """Асинхронная версия :func:`provision_client`, выполняемая в рабочем потоке."""
+
+    return await asyncio.to_thread(provision_client, uuid, email, config_path, tags, compact=compact)
+
+
+def client_links(
+    uuid: str, email: str, config_path: str | Path, tags: Sequence[str] | None = None
+) -> dict[str, str]:
+    """Построить ссылки ключа по текущему конфигу без его изменения.
+
+    Аргументы:
+        uuid (str): UUID ключа.
+        email (str): Подпись ссылок.
+        config_path (str | Path): Путь к файлу с inbound-ами.
+        tags (Sequence[str] | None): Теги inbound-ов; без тегов — все inbound-ы с этим ключом.
+
+    Возвращает:
+        dict[str, str]: Ссылки ``тег → ссылка``.
+    """
+
+    return read_model(config_path).links(uuid, email, get_settings().xray_host, tags)
+
+
+@timed(CONFIG_WRITE_SECONDS.labels("create"))
+def add_clients(
+    clients: Iterable[dict[str, Any]], config_path: str | Path, *, compact: bool = False
+) -> int:
+    """Добавить в vless-inbound клиентов, которых в нём ещё нет, за одну запись.
+
+    Чтение и запись идут под одной блокировкой, поэтому клиенты, добавленные
+    другими процессами, не теряются и повторять запись не нужно.
+
+    Аргументы:
+        clients (Iterable[dict[str, Any]]): Клиенты вида ``{"id": uuid, "email": email}``.
+        config_path (str | Path): Путь к файлу config.json.
+        compact (bool): Сохранить файл без отступов.
+
+    Возвращает:
+        int: Сколько клиентов добавлено; файл не перезаписывается, если ни одного.
+    """
+
+    path = Path(config_path)
+    with _config_lock(path):
+        config = _load_for_update(path)
+        existing = _get_vless_clients(config)
+        known_ids = {client.get("id") for client in existing}
+        fresh = []
+        for client in clients:
+            if client["id"] not in known_ids:
+                known_ids.add(client["id"])
+                fresh.append(client)
+        if fresh:
+            existing.extend(fresh)
+            _save_config(config, path, compact=compact)
+    return len(fresh)
+
+
+@timed(CONFIG_WRITE_SECONDS.labels("remove"))
+def remove_client(uuid: str, config_path: str | Path, *, compact: bool = False) -> bool:
+    """Удалить клиента по UUID из всех inbound-ов файла конфигурации.
 
     Аргументы:
         uuid (str): Уникальный идентификатор, который нужно удалить.
         config_path (str | Path): Путь к файлу config.json.
+        compact (bool): Сохранить файл без отступов.
 
     Возвращает:
         bool: True если запись была удалена, иначе False.
     """
 
     path = Path(config_path)
-    config = _load_config(path)
-    clients = _get_vless_clients(config)
+    with _config_lock(path):
+        config = _load_for_update(path)
+        if not XrayConfig(config).remove_client(uuid):
+            return False
 
-    initial_len = len(clients)
-    clients[:] = [client for client in clients if client.get("id") != uuid]
+        _save_config(config, path, compact=compact)
+    return True
 
-    if len(clients) == initial_len:
-        return False
 
-    _save_config(config, path)
-    return True
+@timed(CONFIG_WRITE_SECONDS.labels("remove"))
+def remove_clients(uuids: Sequence[str], config_path: str | Path, *, compact: bool = False) -> list[str]:
+    """Удалить несколько клиентов за одно чтение и одну запись конфига.
+
+    Аргументы:
+        uuids (Sequence[str]): UUID удаляемых ключей.
+        config_path (str | Path): Путь к файлу config.json.
+        compact (bool): Сохранить файл без отступов.
+
+    Возвращает:
+        list[str]: UUID, которые были в конфиге и удалены; файл не перезаписывается, если таких нет.
+    """
+
+    path = Path(config_path)
+    with _config_lock(path):
+        config = _load_for_update(path)
+        model = XrayConfig(config)
+        removed = [uuid for uuid in uuids if model.remove_client(uuid)]
+        if removed:
+            _save_config(config, path, compact=compact)
+    return removed
+
+
+async def remove_client_async(uuid: str, config_path: str | Path, *, compact: bool = False) -> bool:
+    """Асинхронная версия :func:`remove_client`, выполняемая в рабочем потоке.
+
+    Аргументы:
+        uuid (str): Уникальный идентификатор, который нужно удалить.
+        config_path (str | Path): Путь к файлу config.json.
+        compact (bool): Сохранить файл без отступов.
+
+    Возвращает:
+        bool: True если запись была удалена, иначе False.
+    """
+
+    return await asyncio.to_thread(remove_client, uuid, config_path, compact=compact)
+
+
+def rollback_config(version: int, config_path: str | Path, *, compact: bool = False) -> int:
+    """Вернуть файл конфигурации к версии из истории.
+
+    Откат записывается новой версией с источником ``rollback:<версия>``, поэтому
+    его самого можно откатить.
+
+    Аргументы:
+        version (int): Номер версии из ``/history``.
+        config_path (str | Path): Файл, история которого используется.
+        compact (bool): Сохранить файл без отступов.
+
+    Возвращает:
+        int: Номер версии, созданной откатом.
+
+    Исключения:
+        RuntimeError: История конфигурации выключена.
+        KeyError: Версия не сохранилась.
+    """
+
+    path = Path(config_path)
+    history = history_for(path)
+    if history is None:
+        raise RuntimeError("История конфигурации выключена (CONFIG_HISTORY_DIR)")
+    with _config_lock(path):
+        current = _load_for_update(path)
+        target, steps = history.rollback(version, current)
+        _save_config(target, path, compact=compact, source=f"rollback:{version}", steps=steps)
+        return history.head_version
 
 
 def _resolve_reload_command(command: Sequence[str] | None = None) -> list[str]:
@@ -117,6 +683,7 @@ def _resolve_reload_command(command: Sequence[str] | None = None) -> list[str]:
     return ["systemctl", "reload", "xray"]
 
 
+@timed(XRAY_RELOAD_SECONDS)
 def reload_xray(command: Sequence[str] | None = None) -> None:
     """Перезагрузить службу XRay.
 
@@ -150,6 +717,9 @@ def generate_qr_code(link: str) -> BytesIO:
         BytesIO: Буфер PNG с изображением QR-кода.
     """
 
+    # qrcode и Pillow нужны только при выдаче ключа, поэтому не грузятся при старте.
+    import qrcode
+
     image = qrcode.make(link)
     buffer = BytesIO()
     image.save(buffer, format="PNG")
@@ -157,10 +727,54 @@ def generate_qr_code(link: str) -> BytesIO:
     return buffer
 
 
+def main(argv: list[str] | None = None) -> int:
+    """Точка входа CLI для обслуживания конфига XRay."""
+
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Обслуживание конфигурации XRay")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    shard_parser = commands.add_parser("shard", help="вынести vless-inbound-ы с клиентами во фрагмент")
+    shard_parser.add_argument("--config", default=settings.xray_config_path, help="основной config.json")
+    shard_parser.add_argument(
+        "--clients", default=settings.xray_clients_path or None, help="фрагмент с клиентами (XRAY_CLIENTS_PATH)"
+    )
+    shard_parser.add_argument("--compact", action="store_true", default=settings.xray_config_compact)
+
+    args = parser.parse_args(argv)
+    if not args.clients:
+        parser.error("укажите --clients или XRAY_CLIENTS_PATH")
+    moved = shard_config(args.config, args.clients, compact=args.compact)
+    print(f"Перенесено клиентов: {moved}", file=sys.stderr)
+    return 0
+
+
 __all__ = [
+    "StaleConfigError",
+    "add_clients",
+    "client_links",
+    "commit_config",
+    "configured_tags",
     "create_client",
+    "create_client_async",
+    "provision_client",
+    "provision_client_async",
+    "read_generation",
+    "read_model",
+    "load_config",
     "remove_client",
+    "remove_client_async",
+    "remove_clients",
+    "resolve_clients_path",
+    "rollback_config",
+    "shard_config",
     "reload_xray",
     "generate_qr_code",
     "compose_vless_link",
+    "vless_link_template",
+    "watch_config",
 ]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""Модель config.json XRay: inbound-ы по тегу и протоколу, клиенты по UUID.
+
+Конфиг разбирается один раз: :class:`XrayConfig` строит словарь
+``тег → Inbound`` и список inbound-ов каждого протокола, а каждый
+:class:`Inbound` — словарь ``идентификатор клиента → позиция`` (строится
+при первом обращении). Поиск inbound-а по тегу и проверка наличия клиента
+выполняются за O(1), без повторного прохода по ``inbounds``. Модель
+изменяет исходный словарь конфига на месте, поэтому после мутаций его
+достаточно один раз сериализовать.
+
+Поддерживаются VLESS, VMess, Trojan и Shadowsocks (многопользовательский
+режим). Ссылка для клиента строится по настройкам конкретного inbound-а:
+порт, ``streamSettings`` (сеть, TLS/REALITY, gRPC, WebSocket), ``flow``.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+from typing import Any, Iterable
+from urllib.parse import quote, urlencode
+from uuid import UUID
+
+SUPPORTED_PROTOCOLS = ("vless", "vmess", "trojan", "shadowsocks")
+
+# Протоколы, где клиент идентифицируется паролем, а не полем ``id``.
+_PASSWORD_PROTOCOLS = ("trojan", "shadowsocks")
+
+
+def client_key(protocol: str, client: dict[str, Any]) -> str | None:
+    """Вернуть идентификатор клиента: ``id`` (VLESS/VMess) или ``password``."""
+
+    if protocol in _PASSWORD_PROTOCOLS:
+        return client.get("password")
+    return client.get("id")
+
+
+def shadowsocks_password(method: str, uuid: str) -> str:
+    """Вывести пароль клиента Shadowsocks из UUID ключа.
+
+    Методам ``2022-blake3-*`` нужен base64-ключ длины шифра (16 или 32
+    байта), классическим — произвольная строка.
+    """
+
+    if not method.startswith("2022-"):
+        return uuid
+    try:
+        raw = UUID(uuid).bytes
+    except ValueError:
+        # Не UUID (например, ключ, заведённый вручную): 16 байт его хеша.
+        raw = hashlib.sha256(uuid.encode("utf-8")).digest()[:16]
+    if "128" not in method:
+        raw = hashlib.sha256(raw).digest()
+    return base64.b64encode(raw).decode("ascii")
+
+
+class Inbound:
+    """Inbound конфига с индексом клиентов."""
+
+    __slots__ = ("tag", "protocol", "raw", "_positions")
+
+    def __init__(self, tag: str, raw: dict[str, Any]) -> None:
+        """Обернуть словарь inbound-а из конфига.
+
+        Аргументы:
+            tag (str): Тег inbound-а (для inbound-ов без тега — ``протокол-номер``).
+            raw (dict[str, Any]): Словарь inbound-а; изменяется на месте.
+        """
+
+        self.tag = tag
+        self.protocol: str = raw.get("protocol", "")
+        self.raw = raw
+        self._positions: dict[str, int] | None = None
+
+    @property
+    def clients(self) -> list[dict[str, Any]]:
+        """Список клиентов inbound-а (создаётся при отсутствии)."""
+
+        return self.raw.setdefault("settings", {}).setdefault("clients", [])
+
+    def _index(self) -> dict[str, int]:
+        if self._positions is None:
+            protocol = self.protocol
+            self._positions = {
+                key: position
+                for position, client in enumerate(self.clients)
+                if (key := client_key(protocol, client)) is not None
+            }
+        return self._positions
+
+    def secret_for(self, uuid: str) -> str:
+        """Значение ``id``/``password`` клиента с данным UUID ключа."""
+
+        if self.protocol == "shadowsocks":
+            return shadowsocks_password(self._method(), uuid)
+        return uuid
+
+    def _method(self, client: dict[str, Any] | None = None) -> str:
+        settings = self.raw.get("settings", {})
+        return (client or {}).get("method") or settings.get("method", "")
+
+    def has(self, uuid: str) -> bool:
+        """Проверить, есть ли клиент ключа ``uuid`` (O(1))."""
+
+        return self.secret_for(uuid) in self._index()
+
+    def get(self, uuid: str) -> dict[str, Any] | None:
+        """Вернуть словарь клиента ключа ``uuid`` или None."""
+
+        position = self._index().get(self.secret_for(uuid))
+        return None if position is None else self.clients[position]
+
+    def add(self, uuid: str, email: str, *, flow: str = "") -> dict[str, Any]:
+        """Добавить клиента ключа ``uuid``.
+
+        Аргументы:
+            uuid (str): UUID ключа.
+            email (str): Email клиента (XRay требует уникальности в пределах inbound-а).
+            flow (str): ``flow`` для VLESS (например ``xtls-rprx-vision``).
+
+        Возвращает:
+            dict[str, Any]: Добавленный словарь клиента.
+        """
+
+        secret = self.secret_for(uuid)
+        if secret in self._index():
+            raise ValueError(f"Клиент с таким UUID уже существует в inbound {self.tag}")
+        if self.protocol in _PASSWORD_PROTOCOLS:
+            client: dict[str, Any] = {"password": secret, "email": email}
+        else:
+            client = {"id": uuid, "email": email}
+            if self.protocol == "vless" and flow:
+                client["flow"] = flow
+        clients = self.clients
+        self._index()[secret] = len(clients)
+        clients.append(client)
+        return client
+
+    def remove(self, uuid: str) -> bool:
+        """Удалить клиента ключа ``uuid``; вернуть True, если он был."""
+
+        position = self._index().pop(self.secret_for(uuid), None)
+        if position is None:
+            return False
+        del self.clients[position]
+        # Позиции после удалённого сдвинулись; индекс перестроится при следующем обращении.
+        self._positions = None
+        return True
+
+    def link(self, uuid: str, email: str, host: str) -> str:
+        """Сформировать ссылку подключения для клиента этого inbound-а.
+
+        Аргументы:
+            uuid (str): UUID ключа.
+            email (str): Подпись ссылки.
+            host (str): Публичный адрес сервера.
+
+        Возвращает:
+            str: Ссылка ``vless://``, ``vmess://``, ``trojan://`` или ``ss://``.
+        """
+
+        client = self.get(uuid) or {}
+        port = self.raw.get("port", 443)
+        stream = self.raw.get("streamSettings", {})
+        network = stream.get("network", "tcp")
+        security = stream.get("security", "none")
+        label = quote(email)
+
+        if self.protocol == "vmess":
+            payload = {
+                "v": "2",
+                "ps": email,
+                "add": host,
+                "port": str(port),
+                "id": uuid,
+                "aid": "0",
+                "net": network,
+                "type": "none",
+                "tls": "tls" if security == "tls" else "",
+                **_transport_fields(stream),
+            }
+            encoded = base64.b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode("ascii")
+            return f"vmess://{encoded}"
+
+        if self.protocol == "shadowsocks":
+            settings = self.raw.get("settings", {})
+            method = self._method(client)
+            password = client.get("password", self.secret_for(uuid))
+            if method.startswith("2022-") and settings.get("password"):
+                password = f"{settings['password']}:{password}"
+            userinfo = base64.urlsafe_b64encode(f"{method}:{password}".encode()).decode("ascii").rstrip("=")
+            return f"ss://{userinfo}@{host}:{port}#{label}"
+
+        params: dict[str, str] = {}
+        if self.protocol == "vless":
+            params["encryption"] = "none"
+            if client.get("flow"):
+                params["flow"] = client["flow"]
+        params["security"] = security
+        params["type"] = network
+        params.update(_security_params(stream))
+        params.update({key: value for key, value in _transport_fields(stream).items() if key != "host" or value})
+        query = urlencode({key: value for key, value in params.items() if value}, safe="/")
+        secret = client.get("password", uuid) if self.protocol == "trojan" else uuid
+        return f"{self.protocol}://{quote(secret, safe='')}@{host}:{port}?{query}#{label}"
+
+
+def _security_params(stream: dict[str, Any]) -> dict[str, str]:
+    security = stream.get("security")
+    if security == "tls":
+        tls = stream.get("tlsSettings", {})
+        return {"sni": tls.get("serverName", ""), "fp": tls.get("fingerprint", "")}
+    if security == "reality":
+        reality = stream.get("realitySettings", {})
+        # Публичный ключ нельзя получить из privateKey без x25519, поэтому
+        # он берётся из конфига (поле publicKey или settings.publicKey).
+        public_key = reality.get("publicKey") or reality.get("settings", {}).get("publicKey", "")
+        server_names = reality.get("serverNames") or [""]
+        short_ids = reality.get("shortIds") or [""]
+        return {
+            "sni": server_names[0],
+            "pbk": public_key,
+            "sid": short_ids[0],
+            "fp": reality.get("fingerprint") or reality.get("settings", {}).get("fingerprint", "chrome"),
+        }
+    return {}
+
+
+def _transport_fields(stream: dict[str, Any]) -> dict[str, str]:
+    network = stream.get("network", "tcp")
+    if network == "grpc":
+        return {"serviceName": stream.get("grpcSettings", {}).get("serviceName", "")}
+    if network == "ws":
+        ws = stream.get("wsSettings", {})
+        return {"path": ws.get("path", "/"), "host": ws.get("headers", {}).get("Host", "")}
+    return {}
+
+
+class XrayConfig:
+    """Разобранный config.json с индексом inbound-ов по тегу и протоколу."""
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        """Проиндексировать inbound-ы конфига.
+
+        Аргументы:
+            data (dict[str, Any]): Словарь конфига; изменяется на месте.
+        """
+
+        self.data = data
+        self.inbounds: dict[str, Inbound] = {}
+        self.by_protocol: dict[str, list[Inbound]] = {}
+        for position, raw in enumerate(data.get("inbounds", [])):
+            protocol = raw.get("protocol")
+            if protocol not in SUPPORTED_PROTOCOLS:
+                continue
+            inbound = Inbound(raw.get("tag") or f"{protocol}-{position}", raw)
+            self.inbounds[inbound.tag] = inbound
+            self.by_protocol.setdefault(protocol, []).append(inbound)
+
+    def get(self, tag: str) -> Inbound:
+        """Вернуть inbound по тегу (O(1)).
+
+        Исключения:
+            KeyError: Inbound-а с таким тегом нет или его протокол не поддерживается.
+        """
+
+        try:
+            return self.inbounds[tag]
+        except KeyError:
+            raise KeyError(f"В конфиге нет inbound с тегом {tag!r}") from None
+
+    def default(self) -> Inbound:
+        """Первый VLESS-inbound — цель по умолчанию, как в прежней модели."""
+
+        vless = self.by_protocol.get("vless")
+        if not vless:
+            raise ValueError("В конфиге отсутствует inbound с протоколом vless")
+        return vless[0]
+
+    def select(self, tags: Iterable[str] | None = None) -> list[Inbound]:
+        """Inbound-ы по списку тегов; без тегов — :meth:`default`."""
+
+        tags = list(tags or ())
+        if not tags:
+            return [self.default()]
+        return [self.get(tag) for tag in tags]
+
+    def add_client(
+        self, uuid: str, email: str, tags: Iterable[str] | None = None, *, flow: str = ""
+    ) -> list[Inbound]:
+        """Добавить клиента ключа во все выбранные inbound-ы.
+
+        Проверка дубликатов выполняется до изменений, поэтому при ошибке
+        конфиг остаётся нетронутым.
+
+        Возвращает:
+            list[Inbound]: Inbound-ы, в которые добавлен клиент.
+        """
+
+        inbounds = self.select(tags)
+        for inbound in inbounds:
+            if inbound.has(uuid):
+                raise ValueError(f"Клиент с таким UUID уже существует в inbound {inbound.tag}")
+        for inbound in inbounds:
+            inbound.add(uuid, email, flow=flow)
+        return inbounds
+
+    def remove_client(self, uuid: str) -> list[str]:
+        """Удалить клиента ключа из всех inbound-ов; вернуть их теги."""
+
+        return [inbound.tag for inbound in self.inbounds.values() if inbound.remove(uuid)]
+
+    def find(self, uuid: str) -> list[Inbound]:
+        """Inbound-ы, в которых есть клиент ключа ``uuid``."""
+
+        return [inbound for inbound in self.inbounds.values() if inbound.has(uuid)]
+
+    def links(self, uuid: str, email: str, host: str, tags: Iterable[str] | None = None) -> dict[str, str]:
+        """Ссылки ключа ``тег → ссылка`` для выбранных inbound-ов или всех, где он есть."""
+
+        inbounds = self.select(tags) if tags else self.find(uuid)
+        return {inbound.tag: inbound.link(uuid, email, host) for inbound in inbounds}
+
+
+def parse_tags(value: str) -> list[str]:
+    """Разобрать список тегов из настройки ``XRAY_INBOUND_TAGS`` (через запятую)."""
+
+    return [tag.strip() for tag in value.split(",") if tag.strip()]
+
+
+__all__ = ["Inbound", "SUPPORTED_PROTOCOLS", "XrayConfig", "client_key", "parse_tags", "shadowsocks_password"]
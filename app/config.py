@@ -1,13 +1,43 @@
-"""Конфигурация приложения и загрузка переменных окружения."""
+"""Конфигурация приложения и загрузка переменных окружения.
 
-from functools import lru_cache
+Настройки перечитываются без перезапуска (:func:`reload_settings`): новый
+экземпляр :class:`Settings` подменяет старый одной операцией присваивания,
+а номер версии увеличивается. Значения, вычисляемые из настроек (шаблон
+ссылки, текст /help и т.п.), кэшируются декоратором
+:func:`per_settings_version` и пересчитываются один раз на версию.
+"""
+
+import os
+import threading
+from functools import wraps
 from pathlib import Path
+from typing import Any, Callable, TypeVar
 
-from dotenv import load_dotenv
+from dotenv import dotenv_values
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 _PROJECT_ROOT = Path(__file__).resolve().parent.parent
-load_dotenv(_PROJECT_ROOT / ".env")
+ENV_FILE = _PROJECT_ROOT / ".env"
+
+T = TypeVar("T")
+
+# Ключи, которые попали в окружение из .env (а не из настоящего окружения
+# процесса). При перечитывании обновляются и удаляются только они.
+_DOTENV_KEYS: set[str] = set()
+
+
+def _apply_env_file(path: Path | None = None) -> None:
+    values = {key: value for key, value in dotenv_values(path or ENV_FILE).items() if value is not None}
+    for key in _DOTENV_KEYS - values.keys():
+        os.environ.pop(key, None)
+        _DOTENV_KEYS.discard(key)
+    for key, value in values.items():
+        if key in _DOTENV_KEYS or key not in os.environ:
+            os.environ[key] = value
+            _DOTENV_KEYS.add(key)
+
+
+_apply_env_file()
 
 
 class Settings(BaseSettings):
@@ -20,6 +50,42 @@ class Settings(BaseSettings):
         xray_config_path (str): Путь к конфигурации XRay.
         xray_host (str): Домен для генерации vless-ссылки.
         xray_port (int): Порт сервиса XRay.
+        xray_clients_path (str): Отдельный файл-фрагмент с клиентами (режим ``-confdir``).
+        xray_config_compact (bool): Сохранять конфиг без отступов.
+        xray_access_log_path (str): Путь к access.log XRay для ограничителя.
+        xray_inbound_tags (str): Теги inbound-ов (через запятую), в которые добавляется ключ; пусто — первый vless.
+        limiter_tick_seconds (float): Интервал тика сервиса ограничения (наибольший, если журнал не дописывается).
+        limiter_min_tick_seconds (float): Наименьший интервал между тиками, запущенными дописью в журнал.
+        limiter_window_seconds (float): Окно, в течение которого IP считается активным.
+        limiter_release_ticks (int): Число «чистых» тиков до снятия ограничения.
+        limiter_state_path (str): Файл состояния ограничителя.
+        limiter_bandwidth (str): Скорость для ключей, превысивших лимит.
+        limiter_enforcement (str): ``tc`` — ограничение скорости, ``nft`` — отказ в новых соединениях.
+        limiter_ban_seconds (int): Срок бана IP в режиме ``nft``.
+        limiter_metrics_port (int): Порт ``/metrics`` сервиса ограничения, 0 — не запускать.
+        limiter_ipv4_group_prefix (int): Адреса IPv4 из одной подсети этой длины считаются одним устройством (32 — каждый отдельно).
+        limiter_ipv6_group_prefix (int): То же для IPv6 (128 — каждый адрес отдельно).
+        limiter_group_cidrs (str): CIDR через запятую, каждая из которых считается одним устройством.
+        limiter_geoip_path (str): База стран MaxMind (``.mmdb``, Country или City); пусто — без гео-данных.
+        limiter_asn_path (str): База автономных систем MaxMind (``.mmdb``); пусто — не использовать.
+        limiter_geo_level (str): Что считать местом ключа: ``country`` или ``asn``.
+        limiter_geo_window_seconds (float): Сколько секунд место считается активным.
+        limiter_geo_max_locations (int): Сколько мест одновременно допустимо, больше — ключ отмечается.
+        limiter_geo_cache_size (int): Размер LRU-кэша адресов при поиске в базе.
+        metrics_host (str): Адрес HTTP-эндпоинта ``/metrics``.
+        metrics_port (int): Порт эндпоинта метрик, 0 — не запускать.
+        key_cache_refresh_seconds (float): Интервал полного перечитывания кэша ключей, 0 — только по уведомлениям.
+        migrate_on_startup (bool): Применять SQL-миграции при запуске бота (только PostgreSQL).
+        usage_sample_seconds (float): Интервал записи выборок использования ключей, 0 — не собирать.
+        usage_raw_retention_months (int): Сколько месяцев хранить сырые выборки.
+        usage_hourly_retention_months (int): Сколько месяцев хранить почасовые агрегаты.
+        settings_reload_seconds (float): Интервал проверки .env для перечитывания настроек, 0 — только по SIGHUP.
+        file_watch_poll_seconds (float): Период опроса файлов, если inotify недоступен; 0 — не следить за файлами.
+        journal_path (str): Журнал изменений клиентов для восстановления после сбоя, пусто — не вести.
+        journal_checkpoint_seconds (float): Интервал контрольных точек журнала.
+        config_history_dir (str): Каталог истории версий config.json, пусто — не вести.
+        config_history_keep (int): Сколько последних версий конфига хранить как минимум.
+        config_history_snapshot_every (int): Период полных снимков в истории конфига.
     """
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
@@ -35,20 +101,165 @@ class Settings(BaseSettings):
     xray_service_name: str = ""
     xray_flow: str = ""
     xray_reload_command: str = ""
+    xray_clients_path: str = ""
+    xray_config_compact: bool = False
+    xray_access_log_path: str = "/var/log/xray/access.log"
+    xray_inbound_tags: str = ""
+    limiter_tick_seconds: float = 10.0
+    limiter_min_tick_seconds: float = 1.0
+    limiter_window_seconds: float = 300.0
+    limiter_release_ticks: int = 3
+    limiter_state_path: str = "./data/limiter_state.json"
+    limiter_bandwidth: str = "1mbit"
+    limiter_enforcement: str = "tc"
+    limiter_ban_seconds: int = 300
+    limiter_metrics_port: int = 9109
+    limiter_ipv4_group_prefix: int = 32
+    limiter_ipv6_group_prefix: int = 128
+    limiter_group_cidrs: str = ""
+    limiter_geoip_path: str = ""
+    limiter_asn_path: str = ""
+    limiter_geo_level: str = "country"
+    limiter_geo_window_seconds: float = 600.0
+    limiter_geo_max_locations: int = 2
+    limiter_geo_cache_size: int = 65536
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    key_cache_refresh_seconds: float = 300.0
+    migrate_on_startup: bool = True
+    usage_sample_seconds: float = 60.0
+    usage_raw_retention_months: int = 2
+    usage_hourly_retention_months: int = 13
+    settings_reload_seconds: float = 5.0
+    file_watch_poll_seconds: float = 1.0
+    journal_path: str = "./data/journal.log"
+    journal_checkpoint_seconds: float = 60.0
+    config_history_dir: str = "./data/config_history"
+    config_history_keep: int = 200
+    config_history_snapshot_every: int = 50
+
+
+# Параметры, которые используются только при старте процесса: их изменение
+# в .env подхватывается, но вступает в силу после перезапуска.
+RESTART_REQUIRED = (
+    "database_url",
+    "bot_token",
+    "admin_id",
+    "metrics_host",
+    "metrics_port",
+    "migrate_on_startup",
+    "key_cache_refresh_seconds",
+    "settings_reload_seconds",
+    "file_watch_poll_seconds",
+    "journal_path",
+    "journal_checkpoint_seconds",
+    "config_history_dir",
+    "config_history_keep",
+    "config_history_snapshot_every",
+)
+
+_SETTINGS: Settings | None = None
+_VERSION = 0
+_RELOAD_LOCK = threading.Lock()
 
 
-@lru_cache
 def get_settings() -> Settings:
-    """Получить singleton с настройками приложения.
+    """Получить текущий экземпляр настроек приложения.
 
     Возвращает:
         Settings: Экземпляр с загруженными переменными окружения.
     """
 
-    return Settings()
+    settings = _SETTINGS
+    if settings is None:
+        with _RELOAD_LOCK:
+            if _SETTINGS is None:
+                _install(Settings())
+            settings = _SETTINGS
+    return settings
+
+
+def settings_version() -> int:
+    """Номер версии настроек; увеличивается при каждой подмене экземпляра."""
+
+    return _VERSION
+
+
+def _install(settings: Settings) -> None:
+    global _SETTINGS, _VERSION
+    _SETTINGS = settings
+    _VERSION += 1
+
+
+def reload_settings() -> list[str]:
+    """Перечитать .env и окружение и атомарно подменить настройки.
+
+    Если значения не изменились, экземпляр и версия остаются прежними, и
+    производные кэши не сбрасываются. Ошибка разбора (например, нечисловой
+    порт) пробрасывается, а действующие настройки не меняются.
+
+    Возвращает:
+        list[str]: Имена изменившихся полей (пустой список — изменений нет).
+    """
+
+    with _RELOAD_LOCK:
+        saved_keys = set(_DOTENV_KEYS)
+        saved_env = {key: os.environ[key] for key in saved_keys if key in os.environ}
+        try:
+            _apply_env_file()
+            fresh = Settings()
+        except Exception:
+            for key in _DOTENV_KEYS - saved_keys:
+                os.environ.pop(key, None)
+            os.environ.update(saved_env)
+            _DOTENV_KEYS.clear()
+            _DOTENV_KEYS.update(saved_keys)
+            raise
+        current = _SETTINGS
+        if current is None:
+            _install(fresh)
+            return []
+        old, new = current.model_dump(), fresh.model_dump()
+        changed = [name for name in new if new[name] != old.get(name)]
+        if changed:
+            _install(fresh)
+        return changed
 
 
 def reset_settings_cache() -> None:
     """Очистить кэш настроек для повторной загрузки переменных окружения."""
 
-    get_settings.cache_clear()
+    global _SETTINGS
+    with _RELOAD_LOCK:
+        _SETTINGS = None
+
+
+def per_settings_version(func: Callable[[Any], T]) -> Callable[[Any], T]:
+    """Кэшировать значение, вычисляемое из настроек, до их следующей версии.
+
+    Каждая версия настроек — отдельный экземпляр, поэтому кэш сверяется с
+    переданным объектом по идентичности: после :func:`reload_settings`
+    значение пересчитывается при первом обращении, а между перезагрузками
+    берётся готовым. Объект настроек удерживается кэшем, поэтому его ``id``
+    не может достаться другому экземпляру.
+
+    Аргументы:
+        func (Callable[[Any], T]): Функция от настроек.
+
+    Возвращает:
+        Callable[[Any], T]: Функция с тем же интерфейсом и кэшем на одну версию.
+    """
+
+    cached: tuple[Any, T] | None = None
+
+    @wraps(func)
+    def wrapper(settings: Any) -> T:
+        nonlocal cached
+        entry = cached
+        if entry is not None and entry[0] is settings:
+            return entry[1]
+        value = func(settings)
+        cached = (settings, value)
+        return value
+
+    return wrapper
@@ -0,0 +1,270 @@
+"""Применение SQL-миграций из каталога ``migrations/``.
+
+Файлы называются ``NNN_описание.sql`` и применяются по возрастанию номера.
+Применённые версии записываются в таблицу ``schema_migrations``. Пока идёт
+прогон, держится advisory-блокировка уровня сессии, поэтому реплики бота,
+запущенные одновременно, выполняют миграции по очереди, а не наперегонки.
+Блокировка берётся опросом ``pg_try_advisory_lock`` с паузой между
+попытками, а не ждущим ``pg_advisory_lock``: ожидающая реплика не держит
+открытого оператора со снимком, и ``CREATE INDEX CONCURRENTLY`` у владельца
+блокировки не ждёт её, пока она ждёт его.
+
+Обычная миграция выполняется одной транзакцией. Файл, первая строка которого
+``-- migrate: no-transaction``, выполняется по одному оператору вне
+транзакции: так работает ``CREATE INDEX CONCURRENTLY``, который строит индекс
+без блокировки записи в таблицу. Если прошлая попытка такого оператора
+оборвалась, PostgreSQL оставляет невалидный индекс. Перед повтором он
+удаляется (``DROP INDEX CONCURRENTLY``), иначе ``IF NOT EXISTS`` принял бы
+его за готовый.
+
+Запуск вручную::
+
+    python -m app.migrations          # применить
+    python -m app.migrations status   # показать применённые и ожидающие
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+from loguru import logger
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+# Произвольная, но постоянная константа: ключ advisory-блокировки миграций.
+ADVISORY_LOCK_KEY = 7_231_004_901
+LOCK_TIMEOUT = "5s"
+# Пауза между попытками взять блокировку миграций, секунды.
+LOCK_POLL_INTERVAL = 0.5
+
+_FILENAME = re.compile(r"^(?P<version>\d+)_(?P<name>[\w-]+)\.sql$")
+_STATEMENT_END = re.compile(r";\s*$", re.MULTILINE)
+_CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(?P<name>\w+)", re.IGNORECASE
+)
+
+
+@dataclass(frozen=True, slots=True)
+class Migration:
+    """Файл миграции.
+
+    Атрибуты:
+        version (str): Номер из имени файла (``"003"``).
+        name (str): Описание из имени файла.
+        sql (str): Текст миграции.
+        transactional (bool): Выполнять одной транзакцией.
+    """
+
+    version: str
+    name: str
+    sql: str
+    transactional: bool
+
+    def statements(self) -> list[str]:
+        """Разбить текст на операторы (только для миграций вне транзакции).
+
+        Разбиение идёт по ``;`` в конце строки, поэтому такие файлы не должны
+        содержать тел функций в ``$$ … $$``.
+        """
+
+        parts = _STATEMENT_END.split(self.sql)
+        statements = []
+        for part in parts:
+            lines = [line for line in part.splitlines() if not line.strip().startswith("--")]
+            statement = "\n".join(lines).strip()
+            if statement:
+                statements.append(statement)
+        return statements
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> list[Migration]:
+    """Прочитать файлы миграций из каталога в порядке версий.
+
+    Аргументы:
+        directory (Path): Каталог с файлами ``NNN_описание.sql``.
+
+    Возвращает:
+        list[Migration]: Миграции по возрастанию номера.
+    """
+
+    migrations = []
+    for path in directory.glob("*.sql"):
+        match = _FILENAME.match(path.name)
+        if match is None:
+            logger.warning("Пропущен файл миграции с неверным именем: {}", path.name)
+            continue
+        sql = path.read_text(encoding="utf-8")
+        first_line = sql.lstrip().splitlines()[0].strip().lower() if sql.strip() else ""
+        migrations.append(
+            Migration(
+                version=match.group("version"),
+                name=match.group("name"),
+                sql=sql,
+                transactional=first_line != NO_TRANSACTION_MARKER,
+            )
+        )
+    migrations.sort(key=lambda migration: int(migration.version))
+    versions = [int(migration.version) for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Повторяющиеся номера миграций: {versions}")
+    return migrations
+
+
+def is_postgres(database_url: str) -> bool:
+    """Проверить, что ``DATABASE_URL`` указывает на PostgreSQL."""
+
+    return make_url(database_url).get_backend_name() == "postgresql"
+
+
+def pending_migrations(migrations: list[Migration], applied: set[str]) -> list[Migration]:
+    """Вернуть миграции, которых нет среди применённых версий."""
+
+    return [migration for migration in migrations if migration.version not in applied]
+
+
+async def _applied_versions(connection: AsyncConnection) -> set[str]:
+    await connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version TEXT PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW())"
+    )
+    result = await connection.exec_driver_sql("SELECT version FROM schema_migrations")
+    return {row[0] for row in result}
+
+
+async def _drop_invalid_index(connection: AsyncConnection, statement: str) -> None:
+    match = _CONCURRENT_INDEX.search(statement)
+    if match is None:
+        return
+    name = match.group("name")
+    result = await connection.exec_driver_sql(
+        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%(name)s)", {"name": name}
+    )
+    if result.scalar():
+        logger.warning("Индекс {} остался невалидным после прерванной сборки, пересоздаю", name)
+        await connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+async def _acquire_lock(connection: AsyncConnection) -> None:
+    waiting = False
+    while True:
+        result = await connection.exec_driver_sql(
+            "SELECT pg_try_advisory_lock(%(key)s)", {"key": ADVISORY_LOCK_KEY}
+        )
+        if result.scalar():
+            return
+        if not waiting:
+            logger.info("Миграции выполняет другая реплика, жду блокировку")
+            waiting = True
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+
+async def _record(connection: AsyncConnection, migration: Migration) -> None:
+    await connection.exec_driver_sql(
+        "INSERT INTO schema_migrations (version, name) VALUES (%(version)s, %(name)s)",
+        {"version": migration.version, "name": migration.name},
+    )
+
+
+async def _apply(engine: AsyncEngine, lock_connection: AsyncConnection, migration: Migration) -> None:
+    if migration.transactional:
+        async with engine.begin() as connection:
+            await connection.exec_driver_sql(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+            await connection.exec_driver_sql(migration.sql)
+            await _record(connection, migration)
+        return
+
+    for statement in migration.statements():
+        await _drop_invalid_index(lock_connection, statement)
+        await lock_connection.exec_driver_sql(statement)
+    await _record(lock_connection, migration)
+
+
+async def run_migrations(engine: AsyncEngine, directory: Path = MIGRATIONS_DIR) -> list[str]:
+    """Применить ожидающие миграции под advisory-блокировкой.
+
+    Блокировка и операторы вне транзакции выполняются на отдельном
+    соединении в режиме autocommit; транзакционные миграции — на
+    соединениях из пула движка с ``lock_timeout``, чтобы ``ALTER TABLE``,
+    ждущий блокировку, не выстраивал за собой очередь из запросов бота.
+    Операторы ``CONCURRENTLY`` выполняются без ``lock_timeout``: они не
+    блокируют запись, но ждут завершения уже идущих транзакций.
+
+    Аргументы:
+        engine (AsyncEngine): Движок PostgreSQL.
+        directory (Path): Каталог с миграциями.
+
+    Возвращает:
+        list[str]: Версии, применённые в этом запуске.
+    """
+
+    migrations = load_migrations(directory)
+    applied_now: list[str] = []
+    async with engine.connect() as raw_connection:
+        connection = await raw_connection.execution_options(isolation_level="AUTOCOMMIT")
+        await _acquire_lock(connection)
+        try:
+            # Список применённых версий читается уже под блокировкой: реплика,
+            # ждавшая её, увидит миграции, выполненные предыдущей.
+            applied = await _applied_versions(connection)
+            for migration in pending_migrations(migrations, applied):
+                logger.info("Применяю миграцию {}_{}", migration.version, migration.name)
+                await _apply(engine, connection, migration)
+                applied_now.append(migration.version)
+        finally:
+            await connection.exec_driver_sql("SELECT pg_advisory_unlock(%(key)s)", {"key": ADVISORY_LOCK_KEY})
+    if applied_now:
+        logger.info("Применены миграции: {}", ", ".join(applied_now))
+    return applied_now
+
+
+async def migration_status(engine: AsyncEngine, directory: Path = MIGRATIONS_DIR) -> list[tuple[str, str, bool]]:
+    """Вернуть ``(версия, описание, применена)`` для каждой миграции."""
+
+    async with engine.connect() as raw_connection:
+        connection = await raw_connection.execution_options(isolation_level="AUTOCOMMIT")
+        applied = await _applied_versions(connection)
+    return [
+        (migration.version, migration.name, migration.version in applied)
+        for migration in load_migrations(directory)
+    ]
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Точка входа CLI миграций."""
+
+    from app.db import get_engine
+
+    parser = argparse.ArgumentParser(description="SQL-миграции базы VPN-бота")
+    parser.add_argument("command", nargs="?", choices=("apply", "status"), default="apply")
+    parser.add_argument("--dir", type=Path, default=MIGRATIONS_DIR, help="каталог с миграциями")
+    args = parser.parse_args(argv)
+
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        print("Миграции поддерживаются только для PostgreSQL", file=sys.stderr)
+        return 1
+
+    async def run() -> int:
+        try:
+            if args.command == "status":
+                for version, name, applied in await migration_status(engine, args.dir):
+                    print(f"{'✓' if applied else ' '} {version}_{name}")
+            else:
+                applied = await run_migrations(engine, args.dir)
+                print(f"Применено миграций: {len(applied)}", file=sys.stderr)
+        finally:
+            await engine.dispose()
+        return 0
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -18,6 +18,8 @@ class Key(Base):
         created_at (datetime): Время создания ключа.
         expires_at (datetime | None): Срок действия ключа.
         device_limit (int | None): Максимальное количество устройств.
+        qr_file_id (str | None): ``file_id`` загруженного в Telegram QR-кода.
+        qr_link_hash (str | None): SHA-256 ссылки, закодированной в этом QR-коде.
     """
 
     __tablename__ = "keys"
@@ -28,3 +30,5 @@ class Key(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     expires_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     device_limit: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    qr_file_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    qr_link_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
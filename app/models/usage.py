@@ -0,0 +1,67 @@
+"""Модели истории использования ключей."""
+
+from datetime import date, datetime
+
+from sqlalchemy import BigInteger, Date, DateTime, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db import Base
+
+
+class UsageSample(Base):
+    """Сырая выборка ограничителя за интервал записи.
+
+    В PostgreSQL таблица секционирована по месяцам ``sampled_at``
+    (``migrations/004_usage_history.sql``).
+
+    Атрибуты:
+        sampled_at (datetime): Конец интервала выборки.
+        key_uuid (str): UUID ключа.
+        connections (int): Принятые соединения за интервал.
+        devices (int): Наибольшее число активных IP за интервал.
+    """
+
+    __tablename__ = "usage_samples"
+
+    sampled_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    key_uuid: Mapped[str] = mapped_column(String(64), primary_key=True)
+    connections: Mapped[int] = mapped_column(Integer)
+    devices: Mapped[int] = mapped_column(Integer)
+
+
+class UsageHourly(Base):
+    """Почасовой агрегат выборок (секционирован по месяцам ``hour``).
+
+    Атрибуты:
+        hour (datetime): Начало часа.
+        key_uuid (str): UUID ключа.
+        connections (int): Соединения за час.
+        peak_devices (int): Наибольшее число устройств за час.
+        samples (int): Количество выборок в агрегате.
+    """
+
+    __tablename__ = "usage_hourly"
+
+    hour: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    key_uuid: Mapped[str] = mapped_column(String(64), primary_key=True)
+    connections: Mapped[int] = mapped_column(BigInteger)
+    peak_devices: Mapped[int] = mapped_column(Integer)
+    samples: Mapped[int] = mapped_column(Integer)
+
+
+class UsageDaily(Base):
+    """Суточный агрегат (сутки по UTC), хранится без ограничения срока.
+
+    Атрибуты:
+        day (date): Дата.
+        key_uuid (str): UUID ключа.
+        connections (int): Соединения за сутки.
+        peak_devices (int): Наибольшее число устройств за сутки.
+    """
+
+    __tablename__ = "usage_daily"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    key_uuid: Mapped[str] = mapped_column(String(64), primary_key=True)
+    connections: Mapped[int] = mapped_column(BigInteger)
+    peak_devices: Mapped[int] = mapped_column(Integer)
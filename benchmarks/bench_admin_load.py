@@ -0,0 +1,421 @@
+"""Нагрузочный стенд админских сценариев бота.
+
+Стенд поднимает локальный фейковый Bot API на aiohttp, временную базу
+(SQLite по умолчанию или любой ``--database-url``) и временный config.json,
+после чего прогоняет через настоящий ``Dispatcher`` из ``app.bot.main``
+тысячи параллельных сценариев:
+
+    create — ``create_key`` → ``create_key:expires:30d`` → ``create_key:devices:3``;
+    list   — ``list_keys``;
+    delete — ``delete_key:<uuid>`` по заранее заведённым ключам.
+
+Каждый сценарий идёт от своего «виртуального администратора», чтобы мастера
+создания не перемешивались в ``PENDING_CREATIONS``. В отчёте — p50/p99
+латентности по шагам и сценариям, пропускная способность, время записи
+config.json и ожидание его блокировки. Результат сохраняется в
+``benchmarks/results/admin_load-<commit>-<время>.json``; ``--compare``
+печатает разницу с предыдущим прогоном.
+
+Запуск::
+
+    python benchmarks/bench_admin_load.py --create 1000 --list 200 --delete 1000 --concurrency 100
+    python benchmarks/bench_admin_load.py --compare benchmarks/results/admin_load-abc1234-....json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from aiohttp import web  # noqa: E402
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+VIRTUAL_ADMIN_BASE = 10_000_000
+
+
+class FakeBotApi:
+    """Минимальный Bot API: отвечает на методы, которые вызывают обработчики."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.alerts: Counter[str] = Counter()
+        self._message_ids = itertools.count(1)
+
+    def _message(self, chat_id: int, **extra: Any) -> dict[str, Any]:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **extra,
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = int(form.get("chat_id") or 0)
+        if method == "answerCallbackQuery":
+            if form.get("show_alert") in ("true", "True", "1"):
+                self.alerts[str(form.get("text", ""))] += 1
+            result: Any = True
+        elif method == "sendDocument":
+            result = self._message(
+                chat_id, document={"file_id": f"file-{uuid4().hex}", "file_unique_id": uuid4().hex[:16]}
+            )
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=str(form.get("text", "")))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self) -> tuple[web.AppRunner, str]:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # noqa: SLF001
+        return runner, f"http://127.0.0.1:{port}"
+
+
+def build_config(clients: list[str]) -> dict[str, Any]:
+    return {
+        "log": {"loglevel": "warning"},
+        "inbounds": [
+            {
+                "tag": "vless-in",
+                "port": 443,
+                "protocol": "vless",
+                "settings": {
+                    "decryption": "none",
+                    "clients": [{"id": uuid, "email": f"seed_{index}@vpn.local"} for index, uuid in enumerate(clients)],
+                },
+                "streamSettings": {"network": "tcp", "security": "none"},
+            }
+        ],
+        "outbounds": [{"protocol": "freedom", "tag": "direct"}],
+    }
+
+
+def configure_environment(args: argparse.Namespace, workdir: Path) -> None:
+    """Выставить переменные окружения до первого обращения к настройкам."""
+
+    os.environ.update(
+        {
+            "BOT_TOKEN": "123456:LOADTEST",
+            "ADMIN_ID": "1",
+            "DATABASE_URL": args.database_url or f"sqlite+aiosqlite:///{workdir / 'bench.db'}?timeout=30",
+            "XRAY_CONFIG_PATH": str(workdir / "config.json"),
+            "XRAY_CLIENTS_PATH": "",
+            "XRAY_CONFIG_COMPACT": "true" if args.compact else "false",
+            "XRAY_RELOAD_COMMAND": args.reload_command,
+            "METRICS_PORT": "0",
+        }
+    )
+
+
+async def seed(keys: list[str]) -> None:
+    from sqlalchemy import delete, insert
+
+    from app.db import Base, get_engine
+    from app.models.key import Key
+
+    engine = get_engine()
+    if engine.dialect.name == "sqlite":
+        # WAL позволяет читать во время записи; писатели всё равно идут по одному.
+        async with engine.connect() as connection:
+            await connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(delete(Key))
+        for start in range(0, len(keys), 1000):
+            rows = [
+                {"uuid": uuid, "email": f"seed_{start + index}@vpn.local", "device_limit": 3}
+                for index, uuid in enumerate(keys[start : start + 1000])
+            ]
+            if rows:
+                await connection.execute(insert(Key), rows)
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(_percentile(ordered, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round((ordered[-1] if ordered else 0.0) * 1000, 3),
+    }
+
+
+def _histogram_totals(series: Any) -> dict[str, float]:
+    return {
+        "count": series.count,
+        "total_ms": round(series.sum * 1000, 3),
+        "mean_ms": round(series.sum / series.count * 1000, 3) if series.count else 0.0,
+    }
+
+
+def _git_commit() -> tuple[str, bool]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                cwd=ROOT,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    from aiogram import BaseMiddleware, Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Update
+
+    from app.bot.main import build_dispatcher
+    from app.bot.middlewares.admin import AdminAccessMiddleware
+    from app.bot.services.metrics import (
+        CONFIG_LOCK_WAIT_SECONDS,
+        CONFIG_WRITE_SECONDS,
+        HANDLER_ERRORS,
+    )
+    from app.config import get_settings
+
+    class VirtualAdmins(AdminAccessMiddleware):
+        """Пропускает диапазон «виртуальных администраторов» стенда."""
+
+        def __init__(self, admin_ids: range) -> None:
+            super().__init__(admin_ids.start)
+            self._admin_ids = admin_ids
+
+        async def __call__(self, handler, event, data):  # noqa: ANN001, ANN204
+            if event.from_user.id not in self._admin_ids:
+                await self._reject(event)
+                return None
+            return await handler(event, data)
+
+    flows = ["create"] * args.create + ["list"] * args.list + ["delete"] * args.delete
+    random.Random(args.seed).shuffle(flows)
+    admin_ids = range(VIRTUAL_ADMIN_BASE, VIRTUAL_ADMIN_BASE + len(flows))
+
+    seeded = [str(uuid4()) for _ in range(max(args.keys, args.delete))]
+    settings = get_settings()
+    Path(settings.xray_config_path).write_text(json.dumps(build_config(seeded), indent=2), encoding="utf-8")
+    await seed(seeded)
+    to_delete = iter(seeded)
+
+    api = FakeBotApi(latency=args.api_latency_ms / 1000)
+    runner, base_url = await api.start()
+    bot = Bot(token=settings.bot_token, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    access: BaseMiddleware = VirtualAdmins(admin_ids)
+    dispatcher = build_dispatcher(settings, access_middleware=access)
+
+    update_ids = itertools.count(1)
+    step_samples: dict[str, list[float]] = {}
+    flow_samples: dict[str, list[float]] = {}
+    failures: Counter[str] = Counter()
+
+    async def feed(user_id: int, data: str, step: str) -> None:
+        payload = {
+            "update_id": next(update_ids),
+            "callback_query": {
+                "id": uuid4().hex,
+                "from": {"id": user_id, "is_bot": False, "first_name": "Admin"},
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "menu",
+                },
+            },
+        }
+        update = Update.model_validate(payload, context={"bot": bot})
+        started = time.perf_counter()
+        try:
+            await dispatcher.feed_update(bot, update)
+        except Exception as error:  # noqa: BLE001
+            failures[f"{step}: {type(error).__name__}"] += 1
+        step_samples.setdefault(step, []).append(time.perf_counter() - started)
+
+    async def run_flow(kind: str, user_id: int) -> None:
+        started = time.perf_counter()
+        if kind == "create":
+            await feed(user_id, "create_key", "create_key")
+            await feed(user_id, "create_key:expires:30d", "create_key:expires")
+            await feed(user_id, "create_key:devices:3", "create_key:devices")
+        elif kind == "list":
+            await feed(user_id, "list_keys", "list_keys")
+        else:
+            await feed(user_id, f"delete_key:{next(to_delete)}", "delete_key")
+        flow_samples.setdefault(kind, []).append(time.perf_counter() - started)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(kind: str, user_id: int) -> None:
+        async with semaphore:
+            await run_flow(kind, user_id)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(kind, user_id) for kind, user_id in zip(flows, admin_ids, strict=True)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    commit, dirty = _git_commit()
+    updates = sum(len(samples) for samples in step_samples.values())
+    write_create = CONFIG_WRITE_SECONDS.labels("create")
+    write_remove = CONFIG_WRITE_SECONDS.labels("remove")
+    lock_wait = CONFIG_LOCK_WAIT_SECONDS.labels()
+    write_total = write_create.sum + write_remove.sum
+    handler_errors = sum(child.value for child in HANDLER_ERRORS._children.values())  # noqa: SLF001
+
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": {
+            "create": args.create,
+            "list": args.list,
+            "delete": args.delete,
+            "keys": len(seeded),
+            "concurrency": args.concurrency,
+            "api_latency_ms": args.api_latency_ms,
+            "compact": args.compact,
+            "database": "sqlite" if not args.database_url else args.database_url.split(":", 1)[0],
+        },
+        "elapsed_s": round(elapsed, 3),
+        "throughput": {
+            "updates_per_s": round(updates / elapsed, 1) if elapsed else 0.0,
+            "flows_per_s": round(len(flows) / elapsed, 1) if elapsed else 0.0,
+        },
+        "steps": {step: summarize(samples) for step, samples in sorted(step_samples.items())},
+        "flows": {kind: summarize(samples) for kind, samples in sorted(flow_samples.items())},
+        "config_writes": {
+            "create": _histogram_totals(write_create),
+            "remove": _histogram_totals(write_remove),
+            "lock_wait": _histogram_totals(lock_wait),
+            "lock_wait_share": round(lock_wait.sum / write_total, 3) if write_total else 0.0,
+        },
+        "errors": {
+            "handler_exceptions": int(handler_errors),
+            "failed_updates": dict(failures),
+            "alerts": dict(api.alerts),
+        },
+        "api_calls": dict(api.calls),
+    }
+
+
+def print_report(result: dict[str, Any]) -> None:
+    print(f"commit {result['commit']}{' (dirty)' if result['dirty'] else ''}, {result['params']}")
+    print(
+        f"{result['elapsed_s']:.2f} с, {result['throughput']['updates_per_s']} апдейтов/с, "
+        f"{result['throughput']['flows_per_s']} сценариев/с"
+    )
+    print(f"{'шаг':<24}{'n':>8}{'p50, мс':>12}{'p99, мс':>12}{'max, мс':>12}")
+    for section in ("steps", "flows"):
+        for name, stats in result[section].items():
+            print(f"{name:<24}{stats['count']:>8}{stats['p50_ms']:>12.2f}{stats['p99_ms']:>12.2f}{stats['max_ms']:>12.2f}")
+    writes = result["config_writes"]
+    print(
+        f"config.json: create {writes['create']['mean_ms']} мс, remove {writes['remove']['mean_ms']} мс в среднем; "
+        f"ожидание блокировки {writes['lock_wait']['total_ms']} мс ({writes['lock_wait_share']:.0%} времени записи)"
+    )
+    print(f"ошибки: {result['errors']}")
+
+
+def print_comparison(result: dict[str, Any], baseline: dict[str, Any]) -> None:
+    def delta(new: float, old: float) -> str:
+        if not old:
+            return "—"
+        return f"{(new - old) / old:+.1%}"
+
+    print(f"\nСравнение с {baseline['commit']} ({baseline['timestamp']}):")
+    old_rate = baseline["throughput"]["updates_per_s"]
+    new_rate = result["throughput"]["updates_per_s"]
+    print(f"апдейтов/с: {old_rate} → {new_rate} ({delta(new_rate, old_rate)})")
+    for section in ("steps", "flows"):
+        for name, stats in result[section].items():
+            old = baseline.get(section, {}).get(name)
+            if old is None:
+                continue
+            print(
+                f"{name:<24}p50 {old['p50_ms']:.2f} → {stats['p50_ms']:.2f} ({delta(stats['p50_ms'], old['p50_ms'])}), "
+                f"p99 {old['p99_ms']:.2f} → {stats['p99_ms']:.2f} ({delta(stats['p99_ms'], old['p99_ms'])})"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--create", type=int, default=1000, help="сценариев создания ключа")
+    parser.add_argument("--list", type=int, default=200, help="сценариев просмотра списка")
+    parser.add_argument("--delete", type=int, default=1000, help="сценариев удаления")
+    parser.add_argument("--keys", type=int, default=2000, help="ключей в базе и конфиге до начала")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременных сценариев")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="задержка ответа фейкового Bot API")
+    parser.add_argument("--database-url", default="", help="одноразовая БД (по умолчанию временный SQLite)")
+    parser.add_argument("--reload-command", default="true", help="команда вместо перезагрузки XRay")
+    parser.add_argument("--compact", action="store_true", help="XRAY_CONFIG_COMPACT=true")
+    parser.add_argument("--seed", type=int, default=0, help="seed для порядка сценариев")
+    parser.add_argument("--output", type=Path, default=None, help="куда сохранить JSON с результатом")
+    parser.add_argument("--compare", type=Path, default=None, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(args, Path(directory))
+        result = asyncio.run(run(args))
+
+    print_report(result)
+    output = args.output or RESULTS_DIR / f"admin_load-{result['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nРезультат сохранён в {output}")
+
+    if args.compare is not None:
+        print_comparison(result, json.loads(args.compare.read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
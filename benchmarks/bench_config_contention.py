@@ -0,0 +1,176 @@
+"""Конкуренция нескольких процессов за config.json.
+
+Каждый из ``--processes`` процессов делает ``--ops`` циклов над общим
+временным конфигом:
+
+    create — ``create_client`` нового ключа;
+    remove — ``remove_client`` каждого второго созданного ключа;
+    script — каждые ``--script-every`` циклов «админский скрипт» добавляет
+             ключ через ``load_config``/``commit_config`` и повторяет запись,
+             если поколение устарело.
+
+В конце стенд сверяет итоговый список клиентов с ожидаемым: потерянные
+и «воскресшие» ключи означают перезапись чужих изменений. ``--no-lock``
+отключает ``flock`` (остаётся только блокировка потоков внутри процесса)
+и показывает, что без неё записи теряются.
+
+Запуск::
+
+    python benchmarks/bench_config_contention.py --processes 8 --ops 200 --clients 5000
+    python benchmarks/bench_config_contention.py --processes 8 --ops 200 --no-lock
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.bot.services import xray  # noqa: E402
+from app.bot.services.metrics import CONFIG_LOCK_WAIT_SECONDS, CONFIG_STALE_WRITES  # noqa: E402
+
+SCRIPT_ATTEMPTS = 50
+
+
+def _uuid(worker: int, index: int, kind: int = 0) -> str:
+    return f"{kind:08x}-{worker:04x}-4000-8000-{index:012d}"
+
+
+def _worker(config_path: str, worker: int, ops: int, script_every: int, lock: bool, queue: Any) -> None:
+    try:
+        queue.put(_run_worker(Path(config_path), worker, ops, script_every, lock))
+    except Exception as error:  # noqa: BLE001 - сбой процесса попадает в отчёт
+        queue.put({"error": f"{type(error).__name__}: {error}"})
+
+
+def _run_worker(path: Path, worker: int, ops: int, script_every: int, lock: bool) -> dict[str, Any]:
+    xray.get_settings = lambda: SimpleNamespace(  # type: ignore[assignment]
+        xray_host="vpn.example.com",
+        xray_port=443,
+        xray_security="none",
+        xray_network="tcp",
+        xray_service_name="",
+        xray_flow="",
+    )
+    if not lock:
+        xray.fcntl = None
+    latencies: list[float] = []
+    expected: list[str] = []
+    script_retries = 0
+
+    for index in range(ops):
+        uuid = _uuid(worker, index)
+        started = time.perf_counter()
+        xray.create_client(uuid, f"{uuid}@bench", path)
+        latencies.append(time.perf_counter() - started)
+        if index % 2:
+            started = time.perf_counter()
+            xray.remove_client(uuid, path)
+            latencies.append(time.perf_counter() - started)
+        else:
+            expected.append(uuid)
+
+        if script_every and index % script_every == 0:
+            uuid = _uuid(worker, index, kind=1)
+            started = time.perf_counter()
+            for _ in range(SCRIPT_ATTEMPTS):
+                config, generation = xray.load_config(path)
+                xray._get_vless_clients(config).append({"id": uuid, "email": f"{uuid}@script"})
+                try:
+                    xray.commit_config(config, path, generation)
+                    break
+                except xray.StaleConfigError:
+                    script_retries += 1
+            latencies.append(time.perf_counter() - started)
+            expected.append(uuid)
+
+    lock_wait = CONFIG_LOCK_WAIT_SECONDS.labels()
+    return {
+        "latencies": latencies,
+        "expected": expected,
+        "lock_wait_sum": lock_wait.sum,
+        "lock_wait_count": lock_wait.count,
+        "stale_rejected": CONFIG_STALE_WRITES.labels().value,
+        "script_retries": script_retries,
+    }
+
+
+def _percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200, help="циклов create/remove на процесс")
+    parser.add_argument("--clients", type=int, default=1000, help="клиентов в конфиге до старта")
+    parser.add_argument("--script-every", type=int, default=10, help="0 — без load/commit-записей")
+    parser.add_argument("--no-lock", action="store_true", help="отключить межпроцессную блокировку")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "config.json"
+        seed = [{"id": _uuid(0xFFFF, index, kind=2), "email": "seed@bench"} for index in range(args.clients)]
+        path.write_text(json.dumps({"inbounds": [{"protocol": "vless", "settings": {"clients": seed}}]}))
+
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        workers = [
+            context.Process(
+                target=_worker,
+                args=(str(path), worker, args.ops, args.script_every, not args.no_lock, queue),
+            )
+            for worker in range(args.processes)
+        ]
+        started = time.perf_counter()
+        for process in workers:
+            process.start()
+        results = [queue.get() for _ in workers]
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        final = {client["id"] for client in xray._get_vless_clients(json.loads(path.read_text()))}
+        generation = xray.read_generation(path)
+
+    errors = [result["error"] for result in results if "error" in result]
+    results = [result for result in results if "error" not in result]
+    expected = {client["id"] for client in seed}
+    for result in results:
+        expected.update(result["expected"])
+    latencies = [value for result in results for value in result["latencies"]] or [0.0]
+    waits = sum(result["lock_wait_sum"] for result in results)
+    wait_count = sum(result["lock_wait_count"] for result in results)
+
+    mode = "fcntl" if not args.no_lock and xray.fcntl is not None else "thread-only"
+    print(f"processes={args.processes} ops={args.ops} clients={args.clients} lock={mode}")
+    print(f"writes: {len(latencies)} за {elapsed:.2f} с ({len(latencies) / elapsed:.0f}/с), поколение {generation}")
+    print(
+        f"latency, ms: p50 {statistics.median(latencies) * 1000:.2f}"
+        f"  p99 {_percentile(latencies, 0.99) * 1000:.2f}"
+    )
+    print(f"lock wait, ms: avg {waits / max(wait_count, 1) * 1000:.2f}  total {waits * 1000:.0f}")
+    print(
+        f"stale writes rejected: {sum(result['stale_rejected'] for result in results):.0f}"
+        f"  script retries: {sum(result['script_retries'] for result in results)}"
+    )
+    lost, resurrected = expected - final, final - expected
+    print(f"lost updates: {len(lost)}  resurrected: {len(resurrected)}")
+    for error in errors:
+        print(f"worker failed: {error}")
+    if lost or resurrected or errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
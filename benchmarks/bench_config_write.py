@@ -0,0 +1,129 @@
+"""Сравнение форматов записи config.json: время изменения клиента и объём файла.
+
+Режимы:
+    pretty        — текущий формат (``indent=2``), клиенты в основном конфиге;
+    compact       — ``XRAY_CONFIG_COMPACT=true``;
+    shard         — клиенты во фрагменте ``XRAY_CLIENTS_PATH``, с отступами;
+    shard+compact — фрагмент без отступов.
+
+Запуск::
+
+    python benchmarks/bench_config_write.py --clients 50000 --repeat 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.bot.services import xray  # noqa: E402
+
+
+def build_config(clients: int) -> dict:
+    """Сформировать конфиг, похожий на боевой: клиенты, TLS, routing, outbounds."""
+
+    return {
+        "log": {"loglevel": "warning", "access": "/var/log/xray/access.log"},
+        "inbounds": [
+            {
+                "tag": "vless-in",
+                "listen": "0.0.0.0",
+                "port": 443,
+                "protocol": "vless",
+                "settings": {
+                    "clients": [
+                        {"id": f"00000000-0000-4000-8000-{index:012d}", "email": f"user{index}@vpn.local"}
+                        for index in range(clients)
+                    ],
+                    "decryption": "none",
+                },
+                "streamSettings": {
+                    "network": "grpc",
+                    "security": "tls",
+                    "tlsSettings": {
+                        "certificates": [
+                            {
+                                "certificateFile": "/etc/ssl/certs/fullchain.pem",
+                                "keyFile": "/etc/ssl/private/privkey.pem",
+                            }
+                        ]
+                    },
+                    "grpcSettings": {"serviceName": "grpc", "multiMode": True},
+                },
+            },
+            {"tag": "api", "listen": "127.0.0.1", "port": 10085, "protocol": "dokodemo-door"},
+        ],
+        "outbounds": [
+            {"protocol": "freedom", "tag": "direct"},
+            {"protocol": "blackhole", "tag": "block"},
+        ],
+        "routing": {
+            "rules": [
+                {"type": "field", "outboundTag": "block", "domain": [f"ads{index}.example" for index in range(2000)]},
+                {"type": "field", "outboundTag": "block", "ip": ["geoip:private"]},
+            ]
+        },
+    }
+
+
+def _measure(target: Path, compact: bool, repeat: int) -> tuple[float, int]:
+    timings = []
+    for index in range(repeat):
+        uuid = f"ffffffff-0000-4000-8000-{index:012d}"
+        started = time.perf_counter()
+        xray.create_client(uuid, "bench@vpn.local", target, compact=compact)
+        timings.append(time.perf_counter() - started)
+        xray.remove_client(uuid, target, compact=compact)
+    return statistics.median(timings), target.stat().st_size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    xray.get_settings = lambda: SimpleNamespace(  # type: ignore[assignment]
+        xray_host="vpn.example.com",
+        xray_port=443,
+        xray_security="tls",
+        xray_network="grpc",
+        xray_service_name="grpc",
+        xray_flow="",
+    )
+    backend = "orjson" if xray.orjson is not None else "json"
+    print(f"clients={args.clients} repeat={args.repeat} backend={backend}")
+    print(f"{'mode':<15}{'write, ms':>12}{'bytes written':>16}{'vs pretty':>12}")
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for mode, compact, shard in (
+            ("pretty", False, False),
+            ("compact", True, False),
+            ("shard", False, True),
+            ("shard+compact", True, True),
+        ):
+            base = Path(directory) / f"{mode}.json"
+            base.write_text(json.dumps(build_config(args.clients), indent=2), encoding="utf-8")
+            target = base
+            if shard:
+                target = Path(directory) / f"{mode}.clients.json"
+                xray.shard_config(base, target, compact=compact)
+            elif compact:
+                xray._save_config(xray._load_config(base), base, compact=True)
+
+            seconds, size = _measure(target, compact, args.repeat)
+            baseline = baseline or size
+            print(f"{mode:<15}{seconds * 1000:>12.1f}{size:>16,}{size / baseline:>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Стоимость гео-данных при ингесте журнала ограничителем.
+
+Сравниваются на одном и том же наборе строк access.log:
+
+    ingest          — ``LimiterDaemon._ingest`` без гео-данных;
+    ingest + geo    — то же с ``GeoLocator`` (LRU-кэш адресов);
+    lookup cached   — ``GeoLocator.location`` на повторяющихся адресах;
+    lookup uncached — поиск в базе на каждый адрес, без кэша.
+
+Нужна база MaxMind (GeoLite2-Country.mmdb или GeoLite2-City.mmdb) и пакет
+``maxminddb`` (``poetry install --extras geoip``).
+
+Запуск::
+
+    python benchmarks/bench_geoip.py --db ./data/GeoLite2-Country.mmdb --lines 1000000 --users 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.bot.services.geoip import GeoLocator  # noqa: E402
+from app.bot.services.ipset import pack_ip  # noqa: E402
+from app.bot.services.limiter_daemon import LimiterDaemon  # noqa: E402
+from app.bot.services.log_parser import parse_line  # noqa: E402
+
+
+def build_lines(lines: int, users: int, ips: int, seed: int) -> list[str]:
+    """Строки журнала: у каждого пользователя ``ips`` постоянных адресов по всему миру."""
+
+    rng = random.Random(seed)
+    addresses = [
+        [f"{rng.randint(1, 223)}.{rng.getrandbits(8)}.{rng.getrandbits(8)}.{rng.randint(1, 254)}" for _ in range(ips)]
+        for _ in range(users)
+    ]
+    result = []
+    for index in range(lines):
+        user = rng.randrange(users)
+        ip = rng.choice(addresses[user])
+        result.append(
+            f"2024/03/05 12:34:56.{index % 999999:06d} from {ip}:{40000 + index % 20000} accepted "
+            f"tcp:example.com:443 [vless-in -> direct] email: user{user}@vpn.local"
+        )
+    return result
+
+
+def _ingest_seconds(lines: list[str], users: int, geo: GeoLocator | None) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        root = Path(directory)
+        clients = [{"id": f"uuid-{user}", "email": f"user{user}@vpn.local"} for user in range(users)]
+        config = {"inbounds": [{"protocol": "vless", "settings": {"clients": clients}}]}
+        (root / "config.json").write_text(json.dumps(config), encoding="utf-8")
+        daemon = LimiterDaemon(root / "access.log", root / "config.json", root / "state.json", limits={}, geo=geo)
+        daemon._refresh_email_map()
+        started = time.perf_counter()
+        daemon._ingest(lines, 1_700_000_000)
+        return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="база стран MaxMind (.mmdb)")
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--ips", type=int, default=3, help="адресов на пользователя")
+    parser.add_argument("--cache-size", type=int, default=65536)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    lines = build_lines(args.lines, args.users, args.ips, args.seed)
+    packed = [pack_ip(parse_line(line)[1]) for line in lines]  # type: ignore[index]
+    geo = GeoLocator.open(args.db, cache_size=args.cache_size)
+    print(f"lines={args.lines} users={args.users} addresses={args.users * args.ips} cache={args.cache_size}")
+
+    plain = _ingest_seconds(lines, args.users, None)
+    enriched = _ingest_seconds(lines, args.users, geo)
+    print(f"{'ingest':<18}{plain / args.lines * 1e6:>8.2f} мкс/строка")
+    print(f"{'ingest + geo':<18}{enriched / args.lines * 1e6:>8.2f} мкс/строка (+{(enriched / plain - 1) * 100:.0f}%)")
+
+    geo.location.cache_clear()  # type: ignore[attr-defined]
+    started = time.perf_counter()
+    for address in packed:
+        geo.location(address)
+    cached = time.perf_counter() - started
+    info = geo.location.cache_info()  # type: ignore[attr-defined]
+    print(f"{'lookup cached':<18}{cached / len(packed) * 1e6:>8.2f} мкс (попаданий {info.hits / len(packed):.1%})")
+
+    sample = packed[: min(len(packed), 200_000)]
+    started = time.perf_counter()
+    for address in sample:
+        geo._location(address)
+    print(f"{'lookup uncached':<18}{(time.perf_counter() - started) / len(sample) * 1e6:>8.2f} мкс")
+    geo.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Отчёт «топ-N» по access.log: полная карта против потоковой агрегации.
+
+Сравниваются:
+    full map     — ``log_parser.parse_logs`` (карта «клиент → множество IP»)
+                   и сортировка всех клиентов;
+    stream       — ``heavy_hitters.top_from_logs``: SpaceSaving + HyperLogLog.
+
+Для каждого варианта печатаются время, пик памяти (tracemalloc) и
+совпадение топа с точным ответом. Число пользователей растёт, а пик памяти
+потокового варианта должен оставаться постоянным.
+
+Запуск::
+
+    python benchmarks/bench_heavy_hitters.py --lines 1000000 --users 10000 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.bot.services import heavy_hitters, log_parser  # noqa: E402
+
+
+def write_log(path: Path, lines: int, users: int, heavy: int) -> None:
+    """Сгенерировать журнал: ``heavy`` клиентов с множеством IP и «хвост» обычных."""
+
+    rng = random.Random(42)
+    with path.open("w", encoding="utf-8") as handle:
+        for index in range(lines):
+            if index % 4 == 0:
+                # Неравные «тяжёлые» клиенты: у первых заметно больше IP.
+                user = int(heavy * rng.random() ** 2)
+                ip = f"10.{user}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+            else:
+                user = heavy + rng.randrange(users)
+                ip = f"172.16.{user % 256}.{user % 250 + 1}"
+            handle.write(
+                f"2024/03/05 12:34:56 from {ip}:{40000 + index % 20000} accepted "
+                f"tcp:example.com:443 [vless-in -> direct] email: user{user}@vpn.local\n"
+            )
+
+
+def measure(func) -> tuple[object, float, float]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--heavy", type=int, default=20, help="клиентов с большим числом IP")
+    parser.add_argument("-n", type=int, default=10, help="размер отчёта")
+    parser.add_argument("--capacity", type=int, default=heavy_hitters.DEFAULT_CAPACITY)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for users in args.users:
+            path = Path(directory) / f"access-{users}.log"
+            write_log(path, args.lines, users, args.heavy)
+
+            def full_map(path: Path = path) -> list[str]:
+                mapping = log_parser.parse_logs([path], workers=1)
+                return sorted(mapping, key=lambda key: len(mapping[key]), reverse=True)[: args.n]
+
+            exact, full_seconds, full_peak = measure(full_map)
+            rows, stream_seconds, stream_peak = measure(
+                lambda path=path: heavy_hitters.top_from_logs([path], args.n, capacity=args.capacity)
+            )
+            overlap = len(set(exact) & {row.key for row in rows})
+            print(f"{users} пользователей, {args.lines} строк:")
+            print(f"  full map  {full_seconds:7.2f} с  пик {full_peak:8.1f} МиБ")
+            print(
+                f"  stream    {stream_seconds:7.2f} с  пик {stream_peak:8.1f} МиБ  "
+                f"совпадение топ-{args.n}: {overlap}/{args.n}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Вставка тысяч IP в один ключ: индекс смещений против линейного поиска.
+
+У «расшаренного» ключа или у ключа за прокси адресов может быть тысячи.
+Для каждого размера замеряется заполнение одного ключа:
+
+    set[str]        — обычное множество строк, точка отсчёта;
+    IpSet           — упакованное множество с индексом смещений;
+    IpWindow        — окно ограничителя (два прохода: вставка и обновление времени);
+    linear find     — поиск ``bytearray.find`` без индекса, как до индекса (O(n²)).
+
+Запуск::
+
+    python benchmarks/bench_ipset_insert.py --sizes 100 1000 5000 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.bot.services.ipset import IP_BYTES, IpSet, IpWindow, _find, pack_ip  # noqa: E402
+
+
+def build_addresses(count: int, seed: int) -> list[str]:
+    """Сгенерировать ``count`` различных IPv4-адресов."""
+
+    rng = random.Random(seed)
+    result: set[str] = set()
+    while len(result) < count:
+        result.add(f"{rng.randint(1, 223)}.{rng.getrandbits(8)}.{rng.getrandbits(8)}.{rng.getrandbits(8)}")
+    return list(result)
+
+
+def _linear(packed: list[bytes]) -> bytearray:
+    data = bytearray()
+    for address in packed:
+        if _find(data, address, IP_BYTES) == -1:
+            data += address
+    return data
+
+
+def _window(packed: list[bytes]) -> IpWindow:
+    window = IpWindow()
+    for seen in (1, 2):
+        for address in packed:
+            window.touch(address, seen)
+    return window
+
+
+def _ip_set(packed: list[bytes]) -> IpSet:
+    ips = IpSet()
+    for address in packed:
+        ips.add_packed(address)
+    return ips
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--linear-limit", type=int, default=20000, help="не замерять линейный поиск выше")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'addresses':>10}{'set[str], ms':>14}{'IpSet, ms':>12}{'IpWindow, ms':>15}{'linear, ms':>13}")
+    for size in args.sizes:
+        addresses = build_addresses(size, args.seed)
+        packed = [pack_ip(ip) for ip in addresses]
+        timings = []
+        for build, data in ((set, addresses), (_ip_set, packed), (_window, packed), (_linear, packed)):
+            if build is _linear and size > args.linear_limit:
+                timings.append(float("nan"))
+                continue
+            started = time.perf_counter()
+            build(data)
+            timings.append((time.perf_counter() - started) * 1e3)
+        columns = zip(timings, (14, 12, 15, 13), strict=True)
+        print(f"{size:>10}" + "".join(f"{value:>{width}.2f}" for value, width in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Память состояния ограничителя: строки IP против упакованных окон.
+
+Сравниваются представления на синтетическом наборе пользователей:
+
+    legacy windows — ``dict[uuid, dict[ip, float]]``, как в прежнем LimiterDaemon;
+    packed windows — ``WindowTable`` (номера UUID, 20 байт на адрес);
+    legacy sets    — ``dict[uuid, set[ip]]``, как в прежнем ``parse_active_ips``;
+    packed sets    — ``dict[uuid, IpSet]`` (16 байт на адрес).
+
+Строки UUID создаются до замера: в сервисе они уже лежат в карте
+email → UUID, и оба представления ссылаются на них. Память считается
+``tracemalloc``; время — построение и один проход истечения окон.
+
+Запуск::
+
+    python benchmarks/bench_limiter_memory.py --users 500000 --ips 2 --ipv6-share 0.2
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.bot.services.ipset import IpSet, WindowTable, pack_ip  # noqa: E402
+
+NOW = 1_700_000_000
+
+
+def build_dataset(users: int, ips: int, ipv6_share: float, seed: int) -> tuple[list[str], list[list[str]]]:
+    """Сгенерировать UUID и по 1…2·ips адресов на пользователя."""
+
+    rng = random.Random(seed)
+    uuids = [f"{rng.getrandbits(32):08x}-0000-4000-8000-{index:012x}" for index in range(users)]
+    addresses = []
+    for _ in range(users):
+        count = rng.randint(1, 2 * ips - 1)
+        row = []
+        for _ in range(count):
+            if rng.random() < ipv6_share:
+                row.append(f"2a02:6b8:{rng.getrandbits(16):x}:{rng.getrandbits(16):x}::{rng.getrandbits(16):x}")
+            else:
+                row.append(f"{rng.randint(1, 223)}.{rng.getrandbits(8)}.{rng.getrandbits(8)}.{rng.getrandbits(8)}")
+        addresses.append(row)
+    return uuids, addresses
+
+
+def _legacy_windows(uuids: list[str], addresses: list[list[str]]) -> dict[str, dict[str, float]]:
+    windows: dict[str, dict[str, float]] = {}
+    for uuid, row in zip(uuids, addresses, strict=True):
+        window = windows[uuid] = {}
+        for ip in row:
+            window["".join(ip)] = NOW + 0.5  # новая строка, как после разбора журнала
+    return windows
+
+
+def _packed_windows(uuids: list[str], addresses: list[list[str]]) -> WindowTable:
+    table = WindowTable()
+    intern = table.uuids.intern
+    for uuid, row in zip(uuids, addresses, strict=True):
+        window = table.window(intern(uuid))
+        for ip in row:
+            window.touch(pack_ip(ip), NOW)
+    return table
+
+
+def _legacy_sets(uuids: list[str], addresses: list[list[str]]) -> dict[str, set[str]]:
+    return {uuid: {"".join(ip) for ip in row} for uuid, row in zip(uuids, addresses, strict=True)}
+
+
+def _packed_sets(uuids: list[str], addresses: list[list[str]]) -> dict[str, IpSet]:
+    mapping: dict[str, IpSet] = {}
+    for uuid, row in zip(uuids, addresses, strict=True):
+        ips = mapping[uuid] = IpSet()
+        for ip in row:
+            ips.add_packed(pack_ip(ip))
+    return mapping
+
+
+def _expire_legacy(windows: dict[str, dict[str, float]], horizon: float) -> None:
+    for uuid in list(windows):
+        window = windows[uuid]
+        for ip in [ip for ip, seen in window.items() if seen < horizon]:
+            del window[ip]
+        if not window:
+            del windows[uuid]
+
+
+def measure(build: Callable[[], Any]) -> tuple[Any, int, float]:
+    """Построить структуру и вернуть её, прирост памяти и время."""
+
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500_000)
+    parser.add_argument("--ips", type=int, default=2, help="среднее число адресов на пользователя")
+    parser.add_argument("--ipv6-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    uuids, addresses = build_dataset(args.users, args.ips, args.ipv6_share, args.seed)
+    total = sum(len(row) for row in addresses)
+    print(f"users={args.users} addresses={total} ipv6-share={args.ipv6_share}")
+    print(f"{'structure':<16}{'memory, MiB':>13}{'bytes/address':>15}{'build, s':>10}{'expire, s':>11}")
+
+    rows = []
+    for name, build, expire in (
+        ("legacy windows", _legacy_windows, lambda data: _expire_legacy(data, NOW)),
+        ("packed windows", _packed_windows, lambda data: data.expire(NOW)),
+        ("legacy sets", _legacy_sets, None),
+        ("packed sets", _packed_sets, None),
+    ):
+        data, size, elapsed = measure(lambda build=build: build(uuids, addresses))
+        expire_seconds = float("nan")
+        if expire is not None:
+            started = time.perf_counter()
+            expire(data)
+            expire_seconds = time.perf_counter() - started
+        rows.append((name, size))
+        print(f"{name:<16}{size / 2**20:>13.1f}{size / total:>15.1f}{elapsed:>10.2f}{expire_seconds:>11.3f}")
+        del data
+
+    sizes = dict(rows)
+    print(
+        f"windows: x{sizes['legacy windows'] / sizes['packed windows']:.1f} меньше, "
+        f"sets: x{sizes['legacy sets'] / sizes['packed sets']:.1f} меньше"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Пропускная способность разбора access.log: строки в секунду.
+
+Сравниваются:
+    legacy       — ``limiter.parse_active_ips`` на строках ``uuid=… ip=…``;
+    parser x1    — ``log_parser.parse_logs`` в одном процессе на реальном формате XRay;
+    parser xN    — то же в пуле из N процессов (по диапазонам байтов).
+
+Запуск::
+
+    python benchmarks/bench_log_parser.py --lines 2000000 --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.bot.services import limiter, log_parser  # noqa: E402
+
+
+def write_logs(directory: Path, lines: int, users: int) -> tuple[Path, Path]:
+    """Сгенерировать одинаковые по содержанию журналы в старом и реальном формате."""
+
+    rng = random.Random(42)
+    legacy = directory / "legacy.log"
+    real = directory / "access.log"
+    with legacy.open("w", encoding="utf-8") as legacy_file, real.open("w", encoding="utf-8") as real_file:
+        for index in range(lines):
+            user = rng.randrange(users)
+            uuid = f"00000000-0000-4000-8000-{user:012d}"
+            if index % 10 == 0:
+                ip = f"[2001:db8::{rng.randrange(65536):x}]"
+            else:
+                ip = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+            legacy_file.write(f"2024/03/05 12:34:56 uuid={uuid} ip={ip.strip('[]')}\n")
+            if index % 20 == 0:
+                real_file.write(f"2024/03/05 12:34:56 [Info] [{index}] proxy/vless/inbound: connection ends\n")
+            real_file.write(
+                f"2024/03/05 12:34:56.{index % 999999:06d} from {ip}:{40000 + index % 20000} accepted "
+                f"tcp:example{index % 50}.com:443 [vless-in -> direct] email: user{user}@vpn.local\n"
+            )
+    return legacy, real
+
+
+def _rate(lines: int, func) -> tuple[float, float]:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    return elapsed, lines / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy, real = write_logs(Path(directory), args.lines, args.users)
+        chunk = max(real.stat().st_size // args.workers + 1, 1 << 20)
+        cases = [
+            ("legacy", lambda: limiter.parse_active_ips(legacy)),
+            ("parser x1", lambda: log_parser.parse_logs([real], workers=1)),
+            (
+                f"parser x{args.workers}",
+                lambda: log_parser.parse_logs([real], workers=args.workers, chunk_bytes=chunk),
+            ),
+        ]
+        print(f"lines={args.lines} users={args.users}")
+        print(f"{'case':<14}{'seconds':>10}{'lines/s':>14}")
+        for name, func in cases:
+            elapsed, rate = _rate(args.lines, func)
+            print(f"{name:<14}{elapsed:>10.2f}{rate:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Время запуска бота до первого опроса Telegram и профиль импортов.
+
+Скрипт несколько раз запускает ``app.bot.main.main()`` в отдельном процессе.
+``Dispatcher.start_polling`` подменяется заглушкой, поэтому процесс
+завершается ровно в момент, когда бот начал бы опрашивать Telegram.
+Из медианы вычитается время голого ``from aiogram import Bot, Dispatcher``:
+импорт aiogram (сотни моделей pydantic) бот ускорить не может, а разница —
+это собственные накладные расходы приложения, к которым и относится цель
+``--target-ms``. Печатаются медиана и максимум, затем ещё один
+запуск с ``python -X importtime`` показывает самые тяжёлые импорты
+(``-X importtime`` сам замедляет импорт, поэтому в замер времени он не
+входит) и какие из откладываемых модулей (qrcode, PIL, драйверы БД) всё же
+загрузились при старте.
+
+Запуск::
+
+    python benchmarks/bench_startup.py --runs 5 --target-ms 400
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+FLOOR = "from aiogram import Bot, Dispatcher"
+DEFERRED = ("qrcode", "PIL", "psycopg", "aiosqlite")
+
+CHILD = """
+import asyncio
+import sys
+
+from aiogram import Dispatcher
+
+
+async def _first_poll(self, *bots, **kwargs):
+    loaded = [name for name in {deferred!r} if name in sys.modules]
+    print("loaded:" + ",".join(loaded), flush=True)
+
+
+Dispatcher.start_polling = _first_poll
+
+from app.bot.main import main
+
+asyncio.run(main())
+"""
+
+
+def run_once(code: str | None = None, importtime: bool = False) -> tuple[float, str, list[str]]:
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "123456:STARTUP",
+        "ADMIN_ID": "1",
+        "METRICS_PORT": "0",
+        "MIGRATE_ON_STARTUP": "false",
+        "PYTHONPATH": str(ROOT),
+    }
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [
+            sys.executable,
+            *(("-X", "importtime") if importtime else ()),
+            "-c",
+            code or CHILD.format(deferred=DEFERRED),
+        ],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = time.perf_counter() - started
+    loaded: list[str] = []
+    for line in completed.stdout.splitlines():
+        if line.startswith("loaded:"):
+            loaded = [name for name in line[len("loaded:") :].split(",") if name]
+    return elapsed, completed.stderr, loaded
+
+
+def heaviest_imports(importtime: str, limit: int) -> list[tuple[int, str]]:
+    """Вернуть импорты верхнего уровня и модули ``app.*`` по накопленному времени (мкс)."""
+
+    result: list[tuple[int, str]] = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        module = name.strip()
+        if name.startswith("  ") and not module.startswith("app."):
+            continue
+        result.append((int(cumulative), module))
+    return sorted(result, reverse=True)[:limit]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="количество запусков")
+    parser.add_argument("--top", type=int, default=12, help="сколько импортов показать")
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        default=0.0,
+        help="цель для накладных расходов приложения сверх импорта aiogram; 0 — без проверки",
+    )
+    args = parser.parse_args()
+
+    run_once()  # прогрев кэша байткода и файловой системы
+    timings = [run_once()[0] for _ in range(args.runs)]
+    floor = statistics.median(run_once(FLOOR)[0] for _ in range(args.runs)) * 1000
+    _, importtime, loaded = run_once(importtime=True)
+
+    median = statistics.median(timings) * 1000
+    overhead = median - floor
+    print(f"до первого опроса: медиана {median:.0f} мс, максимум {max(timings) * 1000:.0f} мс ({args.runs} запусков)")
+    print(f"из них импорт aiogram: {floor:.0f} мс, накладные расходы приложения: {overhead:.0f} мс")
+    print("\nтяжёлые импорты (-X importtime, накопленное время):")
+    for cumulative, name in heaviest_imports(importtime, args.top):
+        print(f"  {cumulative / 1000:8.1f} мс  {name}")
+    print(f"\nзагружены при старте из откладываемых: {', '.join(loaded) or 'нет'}")
+
+    if args.target_ms and overhead > args.target_ms:
+        print(f"\nЦель {args.target_ms:.0f} мс не достигнута")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Общие фикстуры и контроль памяти для бенчмарков слоя конфигурации XRay.
+
+Время измеряет pytest-benchmark (сравнение с прошлыми прогонами —
+``--benchmark-compare`` и ``--benchmark-compare-fail``). Пиковая память
+операций снимается через ``tracemalloc`` и сравнивается с
+``benchmarks/memory_baseline.json``: превышение больше чем на
+``--mem-threshold`` роняет тест.
+"""
+
+from __future__ import annotations
+
+import json
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable
+from uuid import UUID
+
+import pytest
+
+from app.bot.services import xray
+
+SIZES = (1_000, 10_000, 100_000)
+MEMORY_BASELINE = Path(__file__).with_name("memory_baseline.json")
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("config-bench")
+    group.addoption(
+        "--mem-threshold",
+        type=float,
+        default=0.2,
+        help="допустимый рост пиковой памяти относительно базовой линии (доля, по умолчанию 0.2)",
+    )
+    group.addoption(
+        "--mem-update-baseline",
+        action="store_true",
+        help="перезаписать benchmarks/memory_baseline.json текущими значениями",
+    )
+
+
+def client_uuid(index: int) -> str:
+    """Детерминированный UUID клиента с номером ``index``."""
+
+    return str(UUID(int=index + 1))
+
+
+def build_config(clients: int) -> dict[str, Any]:
+    return {
+        "log": {"loglevel": "warning"},
+        "inbounds": [
+            {
+                "tag": "vless-in",
+                "port": 443,
+                "protocol": "vless",
+                "settings": {
+                    "decryption": "none",
+                    "clients": [
+                        {"id": client_uuid(index), "email": f"user_{index}@vpn.local"}
+                        for index in range(clients)
+                    ],
+                },
+                "streamSettings": {"network": "tcp", "security": "none"},
+            }
+        ],
+        "outbounds": [{"protocol": "freedom", "tag": "direct"}],
+    }
+
+
+_CONFIG_CACHE: dict[int, bytes] = {}
+
+
+def config_bytes(clients: int) -> bytes:
+    """Сериализованный конфиг на ``clients`` клиентов (строится один раз за сессию)."""
+
+    data = _CONFIG_CACHE.get(clients)
+    if data is None:
+        data = _CONFIG_CACHE[clients] = xray._dumps(build_config(clients))
+    return data
+
+
+@pytest.fixture(params=SIZES, ids=lambda size: f"{size // 1000}k")
+def clients(request: pytest.FixtureRequest) -> int:
+    return request.param
+
+
+@pytest.fixture
+def config_path(tmp_path: Path, clients: int) -> Path:
+    path = tmp_path / "config.json"
+    path.write_bytes(config_bytes(clients))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def link_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        xray,
+        "get_settings",
+        lambda: SimpleNamespace(
+            xray_host="vpn.example.com",
+            xray_port=443,
+            xray_security="reality",
+            xray_network="grpc",
+            xray_service_name="vless-grpc",
+            xray_flow="xtls-rprx-vision",
+        ),
+    )
+
+
+class MemoryTracker:
+    """Снимает пик памяти операции и сверяет его с базовой линией."""
+
+    def __init__(self, threshold: float, update: bool) -> None:
+        self.threshold = threshold
+        self.update = update
+        self.baseline: dict[str, int] = {}
+        if MEMORY_BASELINE.exists():
+            self.baseline = json.loads(MEMORY_BASELINE.read_text(encoding="utf-8"))
+        self.measured: dict[str, int] = {}
+
+    @staticmethod
+    def backend() -> str:
+        return "orjson" if xray.orjson is not None else "json"
+
+    def check(self, name: str, func: Callable[[], Any]) -> int:
+        key = f"{name}[{self.backend()}]"
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.measured[key] = peak
+
+        expected = self.baseline.get(key)
+        if not self.update and expected:
+            limit = expected * (1 + self.threshold)
+            assert peak <= limit, (
+                f"{key}: пик памяти {peak / 1024:.0f} КиБ превышает базовую линию "
+                f"{expected / 1024:.0f} КиБ более чем на {self.threshold:.0%}"
+            )
+        return peak
+
+    def save(self) -> None:
+        merged = {**self.baseline, **self.measured}
+        MEMORY_BASELINE.write_text(
+            json.dumps(dict(sorted(merged.items())), indent=2) + "\n", encoding="utf-8"
+        )
+
+
+@pytest.fixture(scope="session")
+def memory(request: pytest.FixtureRequest):
+    tracker = MemoryTracker(
+        request.config.getoption("--mem-threshold"),
+        request.config.getoption("--mem-update-baseline"),
+    )
+    yield tracker
+    if tracker.update:
+        tracker.save()
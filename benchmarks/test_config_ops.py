@@ -0,0 +1,85 @@
+"""Бенчмарки операций с config.json XRay на 1k, 10k и 100k клиентов.
+
+Запуск::
+
+    make bench
+    pytest benchmarks --benchmark-only --benchmark-autosave
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:15%
+    pytest benchmarks --benchmark-disable --mem-update-baseline   # обновить базовую линию памяти
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from uuid import uuid4
+
+from app.bot.services import xray
+from conftest import client_uuid, config_bytes
+
+
+def _last_uuid(clients: int) -> str:
+    return client_uuid(clients - 1)
+
+
+def test_add_client(benchmark, memory, config_path: Path, clients: int) -> None:
+    original = config_bytes(clients)
+
+    def setup():
+        config_path.write_bytes(original)
+        uuid = str(uuid4())
+        return (uuid, f"{uuid}@vpn.local", config_path), {}
+
+    benchmark.pedantic(xray.create_client, setup=setup, rounds=5 if clients >= 100_000 else 20)
+
+    config_path.write_bytes(original)
+    memory.check(f"add-{clients}", lambda: xray.create_client(str(uuid4()), "mem@vpn.local", config_path))
+
+
+def test_remove_client(benchmark, memory, config_path: Path, clients: int) -> None:
+    original = config_bytes(clients)
+    target = client_uuid(clients // 2)
+
+    def setup():
+        config_path.write_bytes(original)
+        return (target, config_path), {}
+
+    removed = benchmark.pedantic(xray.remove_client, setup=setup, rounds=5 if clients >= 100_000 else 20)
+    assert removed is True
+
+    config_path.write_bytes(original)
+    memory.check(f"remove-{clients}", lambda: xray.remove_client(target, config_path))
+
+
+def test_lookup_client(benchmark, config_path: Path, clients: int) -> None:
+    config = xray._load_config(config_path)
+    target = _last_uuid(clients)
+
+    def lookup() -> bool:
+        return any(client.get("id") == target for client in xray._get_vless_clients(config))
+
+    assert benchmark(lookup) is True
+
+
+def test_load_config(benchmark, memory, config_path: Path, clients: int) -> None:
+    config = benchmark(xray._load_config, config_path)
+    assert len(xray._get_vless_clients(config)) == clients
+
+    memory.check(f"load-{clients}", lambda: xray._load_config(config_path))
+
+
+def test_serialize_pretty(benchmark, memory, config_path: Path, clients: int) -> None:
+    config = xray._load_config(config_path)
+    benchmark(xray._dumps, config)
+
+    memory.check(f"serialize-{clients}", lambda: xray._dumps(config))
+
+
+def test_serialize_compact(benchmark, config_path: Path, clients: int) -> None:
+    config = xray._load_config(config_path)
+    benchmark(xray._dumps, config, True)
+
+
+def test_compose_link(benchmark) -> None:
+    uuid = client_uuid(0)
+    link = benchmark(xray.compose_vless_link, uuid, "user_0@vpn.local")
+    assert link.startswith(f"vless://{uuid}@vpn.example.com:443?")
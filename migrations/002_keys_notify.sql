@@ -0,0 +1,26 @@
+-- Уведомления об изменении ключей для кэша бота (канал keys_changed).
+CREATE OR REPLACE FUNCTION keys_notify() RETURNS trigger AS $$
+DECLARE
+    payload json;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        payload := json_build_object('op', TG_OP, 'uuid', OLD.uuid);
+    ELSE
+        payload := json_build_object(
+            'op', TG_OP,
+            'uuid', NEW.uuid,
+            'old_uuid', CASE WHEN TG_OP = 'UPDATE' THEN OLD.uuid END,
+            'email', NEW.email,
+            'expires_at', NEW.expires_at,
+            'device_limit', NEW.device_limit
+        );
+    END IF;
+    PERFORM pg_notify('keys_changed', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS keys_notify ON keys;
+CREATE TRIGGER keys_notify
+    AFTER INSERT OR UPDATE OR DELETE ON keys
+    FOR EACH ROW EXECUTE FUNCTION keys_notify();
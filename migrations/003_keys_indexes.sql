@@ -0,0 +1,10 @@
+-- migrate: no-transaction
+-- Очистка просроченных ключей: expires_at <= now() среди ключей со сроком.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS keys_expires_at_idx
+    ON keys (expires_at)
+    WHERE expires_at IS NOT NULL;
+
+-- Загрузка лимитов устройств: uuid, device_limit WHERE device_limit IS NOT NULL (index-only scan).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS keys_device_limit_idx
+    ON keys (uuid, device_limit)
+    WHERE device_limit IS NOT NULL;
@@ -0,0 +1,32 @@
+-- История использования ключей: сырые выборки ограничителя и агрегаты.
+-- Месячные секции создаёт и удаляет app.bot.services.usage.run_maintenance.
+CREATE TABLE IF NOT EXISTS usage_samples (
+    sampled_at TIMESTAMPTZ NOT NULL,
+    key_uuid VARCHAR(64) NOT NULL,
+    connections INTEGER NOT NULL,
+    devices INTEGER NOT NULL,
+    PRIMARY KEY (sampled_at, key_uuid)
+) PARTITION BY RANGE (sampled_at);
+
+CREATE TABLE IF NOT EXISTS usage_hourly (
+    hour TIMESTAMPTZ NOT NULL,
+    key_uuid VARCHAR(64) NOT NULL,
+    connections BIGINT NOT NULL,
+    peak_devices INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (hour, key_uuid)
+) PARTITION BY RANGE (hour);
+
+CREATE TABLE IF NOT EXISTS usage_daily (
+    day DATE NOT NULL,
+    key_uuid VARCHAR(64) NOT NULL,
+    connections BIGINT NOT NULL,
+    peak_devices INTEGER NOT NULL,
+    PRIMARY KEY (day, key_uuid)
+);
+
+-- До какого момента выборки уже свёрнуты в агрегаты.
+CREATE TABLE IF NOT EXISTS usage_rollups (
+    name TEXT PRIMARY KEY,
+    rolled_until TIMESTAMPTZ NOT NULL
+);
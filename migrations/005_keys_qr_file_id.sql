@@ -0,0 +1,9 @@
+-- file_id загруженного в Telegram QR-кода (app.bot.services.qr_delivery).
+ALTER TABLE keys ADD COLUMN IF NOT EXISTS qr_file_id VARCHAR(255);
+
+-- Запись file_id не меняет данных кэша ключей: уведомление keys_changed
+-- отправляется только при изменении полей, которые читает кэш.
+DROP TRIGGER IF EXISTS keys_notify ON keys;
+CREATE TRIGGER keys_notify
+    AFTER INSERT OR DELETE OR UPDATE OF uuid, email, expires_at, device_limit ON keys
+    FOR EACH ROW EXECUTE FUNCTION keys_notify();
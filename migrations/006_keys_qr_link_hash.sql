@@ -0,0 +1,4 @@
+-- Отпечаток ссылки, закодированной в QR-коде из qr_file_id
+-- (app.bot.services.qr_delivery). После смены XRAY_HOST или параметров
+-- транспорта ссылка меняется, и QR-код загружается заново.
+ALTER TABLE keys ADD COLUMN IF NOT EXISTS qr_link_hash VARCHAR(64);
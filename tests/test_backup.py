@@ -0,0 +1,205 @@
+import asyncio
+import gzip
+import json
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.bot.services import backup
+from app.db import Base
+from app.models.key import Key
+
+
+def _write_config(path, clients: list[dict[str, str]]) -> None:
+    config = {"inbounds": [{"protocol": "vless", "settings": {"clients": clients}}]}
+    path.write_text(json.dumps(config), encoding="utf-8")
+
+
+async def _session_factory(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def override_session():
+        session = factory()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    monkeypatch.setattr(backup, "get_session", override_session)
+    return factory
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_export_import_roundtrip(tmp_path, monkeypatch, fmt) -> None:
+    archive = tmp_path / f"keys.{fmt}.gz"
+    expires = datetime.now(timezone.utc) + timedelta(days=1)
+
+    async def run() -> tuple[int, backup.ImportResult, list[str]]:
+        factory = await _session_factory(monkeypatch)
+        async with factory() as session:
+            for index in range(7):
+                session.add(
+                    Key(
+                        uuid=f"uuid-{index}",
+                        email=f"user{index}@example.com",
+                        expires_at=expires if index % 2 else None,
+                        device_limit=index or None,
+                    )
+                )
+            await session.commit()
+
+        reports: list[int] = []
+        exported = await backup.export_keys(archive, fmt, progress=reports.append, batch_size=2)
+        assert reports[-1] == exported
+
+        async with factory() as session:
+            await session.execute(Key.__table__.delete().where(Key.uuid.in_(["uuid-1", "uuid-5"])))
+            await session.commit()
+
+        config_path = tmp_path / "config.json"
+        _write_config(config_path, [{"id": "uuid-0", "email": "user0@example.com"}])
+        result = await backup.import_keys(archive, config_path=config_path, batch_size=3)
+
+        async with factory() as session:
+            rows = await session.execute(select(Key.uuid).order_by(Key.uuid))
+            return exported, result, [row[0] for row in rows]
+
+    exported, result, uuids = asyncio.run(run())
+
+    assert exported == 7
+    assert result.total == 7
+    assert result.inserted == 2
+    assert result.skipped == 5
+    assert result.clients_added == 6
+    assert uuids == [f"uuid-{index}" for index in range(7)]
+
+    saved = json.loads((tmp_path / "config.json").read_text(encoding="utf-8"))
+    ids = [client["id"] for client in saved["inbounds"][0]["settings"]["clients"]]
+    assert sorted(ids) == uuids
+
+
+def test_import_writes_config_once_and_can_be_rerun(tmp_path, monkeypatch) -> None:
+    archive = tmp_path / "keys.ndjson.gz"
+    with gzip.open(archive, "wt", encoding="utf-8") as handle:
+        for index in range(7):
+            handle.write(json.dumps({"uuid": f"uuid-{index}", "email": f"user{index}@example.com"}) + "\n")
+    config_path = tmp_path / "config.json"
+    _write_config(config_path, [{"id": "uuid-0", "email": "user0@example.com"}])
+    add_clients = backup.add_clients
+    calls: list[int] = []
+
+    def crashing_add_clients(clients, path, *, compact=False):
+        calls.append(len(list(clients)))
+        raise OSError("диск заполнен")
+
+    def config_ids() -> list[str]:
+        saved = json.loads(config_path.read_text(encoding="utf-8"))
+        return sorted(client["id"] for client in saved["inbounds"][0]["settings"]["clients"])
+
+    async def run() -> backup.ImportResult:
+        factory = await _session_factory(monkeypatch)
+        monkeypatch.setattr(backup, "add_clients", crashing_add_clients)
+        with pytest.raises(OSError):
+            await backup.import_keys(archive, config_path=config_path, batch_size=3)
+        # Три пачки в БД и одна запись конфига, которая не удалась.
+        assert calls == [7]
+        assert config_ids() == ["uuid-0"]
+
+        monkeypatch.setattr(backup, "add_clients", add_clients)
+        result = await backup.import_keys(archive, config_path=config_path, batch_size=3)
+        async with factory() as session:
+            rows = await session.execute(select(Key.uuid).order_by(Key.uuid))
+            assert [row[0] for row in rows] == config_ids()
+        return result
+
+    result = asyncio.run(run())
+
+    assert result.inserted == 0 and result.clients_added == 6
+    assert config_ids() == [f"uuid-{index}" for index in range(7)]
+
+
+def test_progress_is_not_repeated_on_exact_step(tmp_path, monkeypatch) -> None:
+    archive = tmp_path / "keys.csv.gz"
+    config_path = tmp_path / "config.json"
+    _write_config(config_path, [])
+    monkeypatch.setattr(backup, "PROGRESS_STEP", 4)
+
+    async def run() -> tuple[list[int], list[int]]:
+        factory = await _session_factory(monkeypatch)
+        async with factory() as session:
+            session.add_all(Key(uuid=f"uuid-{index}", email=f"u{index}@vpn") for index in range(4))
+            await session.commit()
+        exported: list[int] = []
+        await backup.export_keys(archive, "csv", progress=exported.append, batch_size=3)
+        imported: list[int] = []
+        await backup.import_keys(archive, config_path=config_path, progress=imported.append)
+        return exported, imported
+
+    exported, imported = asyncio.run(run())
+
+    assert exported == [4]
+    assert imported == [4]
+
+
+def test_file_work_runs_off_the_event_loop(tmp_path, monkeypatch) -> None:
+    archive = tmp_path / "keys.ndjson.gz"
+    config_path = tmp_path / "config.json"
+    _write_config(config_path, [])
+    threads: set[str] = set()
+    for name in ("_write_rows", "_read_batch"):
+        original = getattr(backup, name)
+
+        def traced(*args, original=original):
+            threads.add(threading.current_thread().name)
+            return original(*args)
+
+        monkeypatch.setattr(backup, name, traced)
+
+    async def run() -> None:
+        factory = await _session_factory(monkeypatch)
+        async with factory() as session:
+            session.add(Key(uuid="only", email="solo@example.com"))
+            await session.commit()
+        await backup.export_keys(archive, "ndjson")
+        await backup.import_keys(archive, config_path=config_path)
+
+    asyncio.run(run())
+
+    assert threads and threading.main_thread().name not in threads
+
+
+def test_ndjson_export_contents(tmp_path, monkeypatch) -> None:
+    archive = tmp_path / "keys.ndjson.gz"
+
+    async def run() -> None:
+        factory = await _session_factory(monkeypatch)
+        async with factory() as session:
+            session.add(Key(uuid="only", email="solo@example.com", device_limit=None))
+            await session.commit()
+        await backup.export_keys(archive, "ndjson")
+
+    asyncio.run(run())
+
+    with gzip.open(archive, "rt", encoding="utf-8") as handle:
+        records = [json.loads(line) for line in handle]
+
+    assert len(records) == 1
+    assert records[0]["uuid"] == "only"
+    assert records[0]["device_limit"] is None
+    assert set(records[0]) == set(backup.FIELDS)
+
+
+def test_detect_format() -> None:
+    assert backup.detect_format("dump.csv.gz") == "csv"
+    assert backup.detect_format("dump.ndjson.gz") == "ndjson"
+    with pytest.raises(ValueError):
+        backup.detect_format("dump.tar.gz")
@@ -0,0 +1,137 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.bot.handlers import history as history_handler
+from app.bot.services import config_history, xray
+from app.bot.services.config_history import ConfigHistory, apply_delta, compute_delta
+
+
+def _config(*uuids: str, level: str = "warning") -> dict:
+    clients = [{"id": uuid, "email": f"{uuid}@vpn"} for uuid in uuids]
+    return {
+        "log": {"loglevel": level},
+        "inbounds": [{"tag": "vless-in", "protocol": "vless", "settings": {"clients": clients}}],
+    }
+
+
+def _ids(config: dict) -> list[str]:
+    return [client["id"] for client in config["inbounds"][0]["settings"]["clients"]]
+
+
+@pytest.fixture
+def settings_stub(monkeypatch):
+    monkeypatch.setattr(
+        xray,
+        "get_settings",
+        lambda: SimpleNamespace(
+            xray_host="vpn.example.com",
+            xray_port=443,
+            xray_security="none",
+            xray_network="tcp",
+            xray_service_name="",
+            xray_flow="",
+        ),
+    )
+
+
+def test_delta_is_reversible_and_rejects_reordering() -> None:
+    old, new = _config("a", "b", "c", "d"), _config("a", "x", "c", "y")
+
+    delta = compute_delta(old, new)
+    assert delta == {
+        "vless-in": {
+            "removed": [[1, {"id": "b", "email": "b@vpn"}], [3, {"id": "d", "email": "d@vpn"}]],
+            "added": [[1, {"id": "x", "email": "x@vpn"}], [3, {"id": "y", "email": "y@vpn"}]],
+        }
+    }
+    forward = json.loads(json.dumps(old))
+    apply_delta(forward, delta)
+    assert forward == new
+    apply_delta(forward, delta, reverse=True)
+    assert forward == old
+
+    assert compute_delta(_config("a", "b"), _config("b", "a")) is None
+    assert compute_delta(_config("a"), _config("a", level="debug")) is None
+
+
+def test_versions_diff_and_rollback(tmp_path, monkeypatch, settings_stub) -> None:
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(_config()))
+    config_history.configure_history(tmp_path / "history", keep=100, snapshot_every=100)
+    try:
+        xray.create_client("a", "a@vpn", config_path)  # v1 — исходный файл, v2 — +a
+        xray.create_client("b", "b@vpn", config_path)  # v3
+        manual = json.loads(config_path.read_text())
+        manual["log"]["loglevel"] = "debug"
+        config_path.write_text(json.dumps(manual))  # ручная правка → v4 (снимок)
+        xray.remove_client("a", config_path)  # v5
+
+        history = xray.history_for(config_path)
+        versions = history.versions()
+        assert [info.version for info in versions] == [5, 4, 3, 2, 1]
+        assert [info.source for info in versions] == ["bot", "external", "bot", "bot", "external"]
+        assert versions[1].full and (versions[0].added, versions[0].removed) == (0, 1)
+
+        diff = history.diff(2)
+        assert diff.settings_changed
+        assert [client["id"] for _, client in diff.added] == ["b"]
+        assert [client["id"] for _, client in diff.removed] == ["a"]
+
+        # Откат через дельты: v5 → v4 (назад одной дельтой).
+        assert xray.rollback_config(4, config_path) == 6
+        assert _ids(json.loads(config_path.read_text())) == ["a", "b"]
+        # Откат через снимок: до v3 не пройти назад через ручную правку v4.
+        assert xray.rollback_config(3, config_path) == 7
+        restored = json.loads(config_path.read_text())
+        assert restored == history.state(3) and restored["log"]["loglevel"] == "warning"
+        # Откат отката тоже точен.
+        assert xray.rollback_config(6, config_path) == 8
+        assert json.loads(config_path.read_text()) == history.state(4)
+
+        with pytest.raises(KeyError):
+            xray.rollback_config(42, config_path)
+    finally:
+        config_history.configure_history(None)
+
+
+def test_retention_keeps_restorable_tail(tmp_path) -> None:
+    history = ConfigHistory(tmp_path, keep=3, snapshot_every=2)
+    uuids: list[str] = []
+    for index in range(9):
+        uuids.append(f"u{index}")
+        history.record(_config(*uuids))
+
+    deltas, snapshots = history._scan()
+    assert min(deltas | snapshots) >= 9 - 3  # хвост не короче keep
+    assert len(deltas | snapshots) <= 3 + 2
+    for version in range(7, 10):
+        assert _ids(history.state(version)) == uuids[:version]
+    with pytest.raises(KeyError):
+        history.state(1)
+
+    reopened = ConfigHistory(tmp_path, keep=3, snapshot_every=2)
+    assert reopened.head_version == 9
+    assert reopened.observe(_config(*uuids)) is None
+
+
+def test_history_command_reports_disabled(monkeypatch) -> None:
+    config_history.configure_history(None)
+    monkeypatch.setattr(
+        history_handler,
+        "get_settings",
+        lambda: SimpleNamespace(xray_config_path="config.json", xray_clients_path="", xray_config_compact=False),
+    )
+    answers: list[str] = []
+
+    async def answer(text: str) -> None:
+        answers.append(text)
+
+    message = SimpleNamespace(answer=answer)
+    asyncio.run(history_handler.cmd_history(message, SimpleNamespace(args=None)))
+    asyncio.run(history_handler.cmd_rollback(message, SimpleNamespace(args="abc")))
+
+    assert "выключена" in answers[0]
+    assert answers[1].startswith("Использование")
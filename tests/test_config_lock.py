@@ -0,0 +1,89 @@
+import json
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+from app.bot.services import xray
+from app.bot.services.xray import StaleConfigError, commit_config, load_config, read_generation
+
+
+def _settings() -> SimpleNamespace:
+    return SimpleNamespace(
+        xray_host="vpn.example.com",
+        xray_port=443,
+        xray_security="none",
+        xray_network="tcp",
+        xray_service_name="",
+        xray_flow="",
+    )
+
+
+def _write_config(path, *uuids: str) -> None:
+    clients = [{"id": uuid, "email": f"{uuid}@vpn"} for uuid in uuids]
+    path.write_text(json.dumps({"inbounds": [{"protocol": "vless", "settings": {"clients": clients}}]}))
+
+
+def _ids(path) -> list[str]:
+    return [client["id"] for client in json.loads(path.read_text())["inbounds"][0]["settings"]["clients"]]
+
+
+def test_stale_commit_is_rejected(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(xray, "get_settings", _settings)
+    path = tmp_path / "config.json"
+    _write_config(path, "a")
+
+    config, generation = load_config(path)
+    assert generation == 0
+    xray.create_client("b", "b@vpn", path)
+    assert read_generation(path) == 1
+
+    xray._get_vless_clients(config).append({"id": "c", "email": "c@vpn"})
+    with pytest.raises(StaleConfigError):
+        commit_config(config, path, generation)
+    assert _ids(path) == ["a", "b"]
+
+    config, generation = load_config(path)
+    xray._get_vless_clients(config).append({"id": "c", "email": "c@vpn"})
+    assert commit_config(config, path, generation) == 2
+    assert _ids(path) == ["a", "b", "c"]
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_add_clients_merges_into_current_config(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(xray, "get_settings", _settings)
+    path = tmp_path / "config.json"
+    _write_config(path, "a")
+
+    xray.create_client("b", "b@vpn", path)
+    added = [{"id": "b", "email": "b@vpn"}, {"id": "c", "email": "c@vpn"}, {"id": "c", "email": "c@vpn"}]
+
+    assert xray.add_clients(added, path) == 1
+    assert _ids(path) == ["a", "b", "c"]
+    assert xray.add_clients(added, path) == 0
+    assert read_generation(path) == 2, "Без новых клиентов файл не перезаписывается"
+
+
+def _hammer(path: str, worker: int, ops: int) -> None:
+    xray.get_settings = _settings
+    for index in range(ops):
+        uuid = f"{worker}-{index}"
+        xray.create_client(uuid, f"{uuid}@vpn", path)
+        if index % 2:
+            xray.remove_client(uuid, path)
+
+
+@pytest.mark.skipif(xray.fcntl is None, reason="нужен fcntl")
+def test_processes_do_not_lose_updates(tmp_path) -> None:
+    path = tmp_path / "config.json"
+    _write_config(path)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_hammer, args=(str(path), worker, 20)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(timeout=60)
+
+    assert [process.exitcode for process in workers] == [0, 0, 0, 0]
+    assert sorted(_ids(path)) == sorted(f"{worker}-{index}" for worker in range(4) for index in range(0, 20, 2))
+    assert read_generation(path) == 4 * 30
@@ -70,3 +70,79 @@ def test_create_client_duplicate(tmp_path, monkeypatch) -> None:
 
     with pytest.raises(ValueError):
         xray.create_client(uuid, email, config_path)
+
+
+def test_compact_mode_writes_without_whitespace(tmp_path, monkeypatch) -> None:
+    config_path = tmp_path / "config.json"
+    _write_config(config_path)
+    monkeypatch.setattr(
+        xray,
+        "get_settings",
+        lambda: SimpleNamespace(
+            xray_host="vpn.example.com",
+            xray_port=443,
+            xray_security="none",
+            xray_network="tcp",
+            xray_service_name="",
+            xray_flow="",
+        ),
+    )
+
+    xray.create_client("uuid-1", "user@example.com", config_path, compact=True)
+
+    raw = config_path.read_text(encoding="utf-8")
+    assert "\n" not in raw and ": " not in raw
+    assert json.loads(raw)["inbounds"][0]["settings"]["clients"][0]["id"] == "uuid-1"
+
+
+def test_shard_config_moves_clients_to_fragment(tmp_path) -> None:
+    config_path = tmp_path / "00_base.json"
+    clients_path = tmp_path / "10_clients.json"
+    config = {
+        "log": {"loglevel": "warning"},
+        "inbounds": [
+            {"tag": "vless-in", "protocol": "vless", "settings": {"clients": [{"id": "a", "email": "a"}]}},
+            {"tag": "api", "protocol": "dokodemo-door"},
+        ],
+        "outbounds": [{"protocol": "freedom", "tag": "direct"}],
+    }
+    config_path.write_text(json.dumps(config), encoding="utf-8")
+
+    assert xray.shard_config(config_path, clients_path) == 1
+    assert xray.shard_config(config_path, clients_path) == 0
+
+    base = json.loads(config_path.read_text(encoding="utf-8"))
+    fragment = json.loads(clients_path.read_text(encoding="utf-8"))
+    assert [inbound["tag"] for inbound in base["inbounds"]] == ["api"]
+    assert base["outbounds"] == config["outbounds"]
+    assert fragment["inbounds"][0]["tag"] == "vless-in"
+
+    assert xray.remove_client("a", clients_path) is True
+    assert json.loads(config_path.read_text(encoding="utf-8")) == base
+
+
+def test_shard_config_resumes_after_crash_between_writes(tmp_path, monkeypatch) -> None:
+    config_path = tmp_path / "00_base.json"
+    clients_path = tmp_path / "10_clients.json"
+    vless = {"tag": "vless-in", "protocol": "vless", "settings": {"clients": [{"id": "a", "email": "a"}]}}
+    config_path.write_text(json.dumps({"inbounds": [vless, {"tag": "api", "protocol": "dokodemo-door"}]}))
+
+    original_save = xray._save_config
+
+    def crash_on_fragment(config, path, **kwargs):
+        if path == clients_path:
+            raise OSError("диск заполнен")
+        original_save(config, path, **kwargs)
+
+    monkeypatch.setattr(xray, "_save_config", crash_on_fragment)
+    with pytest.raises(OSError):
+        xray.shard_config(config_path, clients_path)
+    # Основной конфиг уже без vless, фрагмента нет: inbound-ы ни в одном файле не задвоены.
+    assert [inbound["tag"] for inbound in json.loads(config_path.read_text())["inbounds"]] == ["api"]
+    assert not clients_path.exists()
+
+    monkeypatch.setattr(xray, "_save_config", original_save)
+    assert xray.main(["shard", "--config", str(config_path), "--clients", str(clients_path)]) == 0
+    assert json.loads(clients_path.read_text())["inbounds"] == [vless]
+    assert not list(tmp_path.glob("*.pending"))
+    assert xray.shard_config(config_path, clients_path) == 0
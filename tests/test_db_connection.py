@@ -9,7 +9,7 @@ def test_ping_database(monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setenv("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
 
     config_module: ModuleType = importlib.reload(importlib.import_module("app.config"))
-    config_module.get_settings.cache_clear()
+    config_module.reset_settings_cache()
 
     db_module: ModuleType = importlib.reload(importlib.import_module("app.db"))
     db_module.reset_engine_cache()
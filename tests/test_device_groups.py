@@ -0,0 +1,75 @@
+import ipaddress
+import random
+
+import pytest
+
+from app.bot.services import limiter
+from app.bot.services.device_groups import DeviceGrouper, PrefixTrie
+from app.bot.services.ipset import IpSet, IpWindow, pack_ip
+
+UUID = "123e4567-e89b-12d3-a456-426614174000"
+
+
+def test_trie_matches_longest_prefix_like_linear_scan() -> None:
+    rng = random.Random(7)
+    # IPv4 хранится как IPv4-mapped: 10.0.0.0/8 — это ::ffff:10.0.0.0/104.
+    networks = [ipaddress.ip_network(cidr) for cidr in ("::/0", "::ffff:10.0.0.0/104", "::ffff:10.1.0.0/112")]
+    for _ in range(200):
+        address = ipaddress.IPv6Address(rng.getrandbits(128) & ~((1 << 100) - 1) | (rng.getrandbits(4) << 96))
+        networks.append(ipaddress.ip_network(f"{address}/{rng.randint(1, 128)}", strict=False))
+    trie = PrefixTrie()
+    for network in networks:
+        trie.insert(network.network_address.packed, network.prefixlen, network)
+    assert len(trie) == len(set(networks))
+
+    probes = [ipaddress.IPv6Address(rng.getrandbits(128)) for _ in range(300)]
+    probes += [network.network_address for network in networks]
+    probes.append(ipaddress.IPv6Address(pack_ip("10.1.2.3")))
+    for probe in probes:
+        expected = max((network for network in networks if probe in network), key=lambda network: network.prefixlen)
+        assert trie.lookup(probe.packed) == expected
+
+
+def test_grouper_uses_subnets_and_allowlist() -> None:
+    groups = DeviceGrouper(24, 64, ["203.0.113.0/25", " ", "2001:db8::/32"])
+    assert groups.enabled
+    assert groups.key(pack_ip("198.51.100.7")) == groups.key(pack_ip("198.51.100.200"))
+    assert groups.key(pack_ip("198.51.100.7")) != groups.key(pack_ip("198.51.101.7"))
+    assert groups.key(pack_ip("2a02:6b8:1:2::1")) == groups.key(pack_ip("2a02:6b8:1:2:ffff::9"))
+    assert groups.key(pack_ip("2a02:6b8:1:3::1")) != groups.key(pack_ip("2a02:6b8:1:2::1"))
+    # Вся разрешённая сеть — одно устройство, даже поверх разных /64.
+    assert groups.count(["2001:db8:1::1", "2001:db8:2::1", "203.0.113.1", "203.0.113.100"]) == 2
+    assert groups.count(["203.0.113.1", "203.0.113.200"]) == 2, "/25 не покрывает .200"
+
+    odd = DeviceGrouper(20, 128)
+    assert odd.count(["10.0.0.1", "10.0.15.255", "10.0.16.1"]) == 2
+
+    assert not DeviceGrouper().enabled
+    with pytest.raises(ValueError):
+        DeviceGrouper(33)
+    with pytest.raises(ValueError):
+        DeviceGrouper(allow=["10.0.0.0/40"])
+
+
+def test_excess_keeps_first_devices_and_reads_packed_containers() -> None:
+    groups = DeviceGrouper(24, 64)
+    window = IpWindow()
+    for seen, ip in enumerate(["1.1.1.1", "2.2.2.2", "1.1.1.9", "3.3.3.3", "2.2.2.7"]):
+        window.touch(pack_ip(ip), seen)
+
+    assert groups.count(window) == 3
+    assert groups.excess(window, 2) == ["3.3.3.3"]
+    ips = IpSet()
+    for ip in window:
+        ips.add(ip)
+    assert groups.count(ips) == 3
+
+
+def test_detect_overuse_groups_carrier_nat(tmp_path) -> None:
+    log_path = tmp_path / "access.log"
+    rotating = [f"100.64.7.{host}" for host in range(1, 6)]
+    log_path.write_text("\n".join(f"time uuid={UUID} ip={ip}" for ip in rotating), encoding="utf-8")
+
+    assert UUID in limiter.detect_overuse(log_path, {UUID: 2})
+    assert not limiter.detect_overuse(log_path, {UUID: 2}, DeviceGrouper(24))
+    assert UUID in limiter.detect_overuse(log_path, {UUID: 2}, DeviceGrouper(31))
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from app.bot.services import xray
+from app.bot.services.file_watcher import FileWatcher
+
+
+async def _until(predicate, timeout: float = 2.0) -> None:
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_watcher_reports_append_replace_and_creation(tmp_path, use_inotify) -> None:
+    log_path = tmp_path / "access.log"
+    log_path.write_text("first\n")
+    missing = tmp_path / "later.json"
+    other = tmp_path / "other.txt"
+    events: list[str] = []
+
+    async def run() -> tuple[str, set[str]]:
+        watcher = FileWatcher(poll_interval=0.01, use_inotify=use_inotify)
+        watcher.subscribe(log_path, lambda path: events.append(path.name))
+        unsubscribe = watcher.subscribe(missing, lambda path: events.append(path.name))
+        watcher.start()
+
+        with log_path.open("a") as handle:
+            handle.write("second\n")
+        await _until(lambda: "access.log" in events)
+
+        other.write_text("ignored")
+        tmp = tmp_path / "later.tmp"
+        tmp.write_text("{}")
+        os.replace(tmp, missing)
+        await _until(lambda: "later.json" in events)
+
+        unsubscribe()
+        seen = set(events)
+        events.clear()
+        missing.write_text('{"a": 1}')
+        await asyncio.sleep(0.05)
+        watcher.close()
+        return watcher.backend, seen
+
+    backend, seen = asyncio.run(run())
+
+    assert seen == {"access.log", "later.json"}
+    if not use_inotify:
+        assert backend == "poll"
+    assert events == []
+
+
+def test_read_model_reparses_only_after_external_edit(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(
+        xray,
+        "get_settings",
+        lambda: SimpleNamespace(
+            xray_host="vpn.example.com",
+            xray_port=443,
+            xray_security="none",
+            xray_network="tcp",
+            xray_service_name="",
+            xray_flow="",
+        ),
+    )
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"inbounds": [{"protocol": "vless", "settings": {"clients": []}}]}))
+    parses: list[int] = []
+    original_load = xray._load_config
+    monkeypatch.setattr(xray, "_load_config", lambda path: (parses.append(1), original_load(path))[1])
+
+    async def run() -> None:
+        watcher = FileWatcher(poll_interval=0.01)
+        stop = xray.watch_config(watcher, config_path)
+        watcher.start()
+        try:
+            assert xray.read_model(config_path).default().clients == []
+            assert len(parses) == 1
+
+            # Своя запись кладёт модель в кэш: ни событие, ни чтение не разбирают файл.
+            await asyncio.to_thread(xray.create_client, "a", "a@vpn", config_path)
+            await asyncio.sleep(0.05)
+            before = len(parses)
+            assert [client["id"] for client in xray.read_model(config_path).default().clients] == ["a"]
+            assert len(parses) == before
+
+            config = json.loads(config_path.read_text())
+            config["inbounds"][0]["settings"]["clients"].append({"id": "b", "email": "b@vpn"})
+            config_path.write_text(json.dumps(config))
+            await _until(lambda: config_path.absolute() not in xray._READ_CACHE)
+            assert [client["id"] for client in xray.read_model(config_path).default().clients] == ["a", "b"]
+            assert len(parses) == before + 1
+        finally:
+            stop()
+            watcher.close()
+
+    asyncio.run(run())
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from app.bot.services.geoip import GeoInfo, GeoLocator
+from app.bot.services.ipset import pack_ip
+from app.bot.services.limiter_daemon import LimiterDaemon
+
+UUID = "123e4567-e89b-12d3-a456-426614174000"
+
+
+class _Reader:
+    """Читатель с интерфейсом ``maxminddb.Reader.get`` по словарю адресов."""
+
+    def __init__(self, records: dict[str, dict]) -> None:
+        self.records = records
+        self.calls: list[str] = []
+
+    def get(self, ip: str) -> dict | None:
+        self.calls.append(ip)
+        return self.records.get(ip)
+
+
+COUNTRIES = _Reader(
+    {
+        "1.1.1.1": {"country": {"iso_code": "DE"}},
+        "2.2.2.2": {"registered_country": {"iso_code": "FR"}},
+        "3.3.3.3": {"country": {"iso_code": "NL"}},
+        "2a02:6b8::1": {"country": {"iso_code": "RU"}},
+    }
+)
+ASNS = _Reader({"1.1.1.1": {"autonomous_system_number": 3320, "autonomous_system_organization": "DTAG"}})
+
+
+def test_locator_caches_lookups_and_levels() -> None:
+    countries = _Reader(COUNTRIES.records)
+    geo = GeoLocator(countries, ASNS, cache_size=16)
+
+    for _ in range(3):
+        assert geo.location(pack_ip("1.1.1.1")) == "DE"
+    assert geo.location(pack_ip("2.2.2.2")) == "FR"
+    assert geo.location(pack_ip("2a02:6b8::1")) == "RU"
+    assert geo.location(pack_ip("9.9.9.9")) is None
+    assert countries.calls == ["1.1.1.1", "2.2.2.2", "2a02:6b8::1", "9.9.9.9"]
+    assert geo.info(pack_ip("1.1.1.1")) == GeoInfo("DE", 3320, "DTAG")
+
+    by_asn = GeoLocator(asn_reader=ASNS, level="asn")
+    assert by_asn.location(pack_ip("1.1.1.1")) == "AS3320"
+    assert by_asn.location(pack_ip("2.2.2.2")) is None
+
+    with pytest.raises(ValueError):
+        GeoLocator(countries, level="asn")
+    with pytest.raises(ValueError):
+        GeoLocator(countries, level="city")
+
+
+def test_daemon_flags_key_seen_from_too_many_countries(tmp_path) -> None:
+    config_path = tmp_path / "config.json"
+    config = {"inbounds": [{"protocol": "vless", "settings": {"clients": [{"id": UUID, "email": "user@vpn"}]}}]}
+    config_path.write_text(json.dumps(config), encoding="utf-8")
+    log_path = tmp_path / "access.log"
+
+    def daemon() -> LimiterDaemon:
+        return LimiterDaemon(
+            log_path,
+            config_path,
+            tmp_path / "state.json",
+            limits={},
+            geo=GeoLocator(COUNTRIES),
+            geo_window_seconds=600,
+            max_locations=2,
+        )
+
+    def append(*ips: str) -> None:
+        with log_path.open("a", encoding="utf-8") as handle:
+            for ip in ips:
+                handle.write(f"2024/03/05 12:34:56 from {ip}:5000 accepted tcp:example.com:443 email: user@vpn\n")
+
+    first = daemon()
+    append("1.1.1.1", "2.2.2.2", "9.9.9.9")
+    assert first.tick(now=1000).shared == []
+
+    append("3.3.3.3")
+    assert first.tick(now=1100).shared == [UUID]
+    assert first.tick(now=1200).shared == [], "Отмечается один раз, пока ключ остаётся в нескольких местах"
+    assert first.shared == {UUID}
+
+    # Места переживают перезапуск и истекают через geo_window_seconds.
+    restarted = daemon()
+    restarted.load_state()
+    append("[2a02:6b8::1]")
+    restarted.tick(now=1550)
+    assert restarted.shared == {UUID}
+    restarted.tick(now=1750)
+    assert restarted.shared == set()
@@ -0,0 +1,96 @@
+import asyncio
+import gzip
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from app.bot.handlers import usage as usage_handler
+from app.bot.services import heavy_hitters
+from app.bot.services.log_parser import iter_records
+
+
+def _line(ip: str, email: str) -> str:
+    return f"2024/03/05 12:34:56 from {ip}:5000 accepted tcp:example.com:443 [vless-in -> direct] email: {email}\n"
+
+
+def test_hyperloglog_estimate_is_close() -> None:
+    sketch = heavy_hitters.HyperLogLog()
+    for index in range(50_000):
+        sketch.add(f"10.{index >> 16}.{(index >> 8) & 255}.{index & 255}")
+
+    assert abs(sketch.estimate() - 50_000) / 50_000 < 0.1
+
+    small = heavy_hitters.HyperLogLog()
+    for ip in ("1.1.1.1", "2.2.2.2", "1.1.1.1"):
+        small.add(ip)
+    assert small.estimate() == 2
+
+
+def test_distinct_counter_switches_to_sketch() -> None:
+    counter = heavy_hitters.DistinctCounter(exact_limit=4)
+    for index in range(4):
+        counter.add(f"ip{index}")
+    assert counter.exact and counter.estimate() == 4
+
+    for index in range(1000):
+        counter.add(f"ip{index}")
+    assert not counter.exact
+    assert 900 < counter.estimate() < 1100
+
+
+def test_space_saving_keeps_heavy_hitters_in_bounded_table() -> None:
+    rng = random.Random(7)
+    stream = [("heavy", f"h{index % 200}") for index in range(5_000)]
+    stream += [("medium", f"m{index % 3}") for index in range(2_000)]
+    stream += [(f"user{index}", "1.1.1.1") for index in range(20_000)]
+    rng.shuffle(stream)
+
+    summary = heavy_hitters.SpaceSaving(capacity=50)
+    for key, ip in stream:
+        summary.add(key, ip)
+
+    assert len(summary) == 50
+    by_connections = summary.top(2, "connections")
+    assert [row.key for row in by_connections] == ["heavy", "medium"]
+    heavy = by_connections[0]
+    assert heavy.connections - heavy.error <= 5_000 <= heavy.connections
+    assert summary.top(1, "devices")[0].key == "heavy"
+
+
+def test_top_keys_rejects_unknown_metric() -> None:
+    with pytest.raises(ValueError):
+        heavy_hitters.top_keys([("a", "1.1.1.1")], by="bytes")
+
+
+def test_top_from_plain_and_gzip_logs(tmp_path) -> None:
+    plain = tmp_path / "access.log"
+    plain.write_text(
+        _line("1.1.1.1", "a@vpn") + _line("2.2.2.2", "a@vpn") + "garbage line\n" + _line("3.3.3.3", "b@vpn"),
+        encoding="utf-8",
+    )
+    rotated = tmp_path / "access.log.1.gz"
+    with gzip.open(rotated, "wt", encoding="utf-8") as handle:
+        handle.write(_line("[2001:DB8::1]", "b@vpn") + _line("4.4.4.4", "b@vpn"))
+
+    assert list(iter_records([plain, rotated, tmp_path / "missing.log"]))[-2] == ("b@vpn", "2001:db8::1")
+
+    rows = heavy_hitters.top_from_logs([plain, rotated], 5)
+    assert [(row.key, row.devices, row.connections) for row in rows] == [("b@vpn", 3, 3), ("a@vpn", 2, 2)]
+
+
+def test_top_command_reads_access_log(monkeypatch, tmp_path) -> None:
+    log_path = tmp_path / "access.log"
+    log_path.write_text(_line("1.1.1.1", "a@vpn") + _line("1.1.1.1", "a@vpn"), encoding="utf-8")
+    monkeypatch.setattr(usage_handler, "get_settings", lambda: SimpleNamespace(xray_access_log_path=str(log_path)))
+    answers: list[str] = []
+
+    async def answer(text: str) -> None:
+        answers.append(text)
+
+    message = SimpleNamespace(answer=answer)
+    asyncio.run(usage_handler.cmd_top(message, SimpleNamespace(args="connections 5")))
+    asyncio.run(usage_handler.cmd_top(message, SimpleNamespace(args="bytes")))
+
+    assert "1. a@vpn — устройств 1, соединений 2" in answers[0]
+    assert answers[1].startswith("Использование: /top")
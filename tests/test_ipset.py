@@ -0,0 +1,112 @@
+import json
+from collections.abc import Set as AbstractSet
+
+import pytest
+
+from app.bot.services.ipset import INDEX_THRESHOLD, IpSet, IpWindow, WindowTable, pack_ip, unpack_ip
+from app.bot.services.limiter_daemon import LimiterDaemon
+
+
+def test_pack_roundtrip_and_validation() -> None:
+    for ip in ("1.2.3.4", "255.255.255.255", "2001:db8::1", "::1"):
+        packed = pack_ip(ip)
+        assert len(packed) == 16
+        assert unpack_ip(packed) == ip
+    assert pack_ip("10.0.0.1") == pack_ip("::ffff:10.0.0.1")
+    for bad in ("1.2.3", "999.1.1.1", "host", ""):
+        with pytest.raises(ValueError):
+            pack_ip(bad)
+
+
+def test_window_keeps_first_seen_order_and_expires() -> None:
+    window = IpWindow()
+    # Нули в конце "1::" и его времени вместе с первым байтом "100::" дают
+    # "::1" со смещением 5: такая позиция не должна считаться записью.
+    window.touch(pack_ip("1::"), 0)
+    window.touch(pack_ip("100::"), 10)
+    window.touch(pack_ip("::1"), 20)
+    window.touch(pack_ip("100::"), 30)
+
+    assert list(window) == ["1::", "100::", "::1"]
+    assert window.items()[1] == ("100::", 30)
+    assert len(window) == 3 and "::1" in window and "2.2.2.2" not in window
+
+    window.expire(0)
+    assert len(window) == 3
+    window.expire(25)
+    assert list(window) == ["100::"]
+    window.expire(31)
+    assert not window
+
+
+def test_ip_set_behaves_like_string_set() -> None:
+    ips = IpSet()
+    for ip in ("1.1.1.1", "2001:db8::1", "1.1.1.1"):
+        ips.add(ip)
+
+    assert len(ips) == 2
+    assert ips == {"1.1.1.1", "2001:db8::1"}
+    assert {"1.1.1.1", "2001:db8::1"} == ips
+    assert ips != {"1.1.1.1"}
+    assert "2001:db8::1" in ips and "bad" not in ips
+
+
+def test_ip_set_is_abstract_set() -> None:
+    ips = IpSet._from_iterable(["1.1.1.1", "2.2.2.2"])
+
+    assert isinstance(ips, AbstractSet)
+    assert ips <= {"1.1.1.1", "2.2.2.2", "3.3.3.3"} and ips < {"1.1.1.1", "2.2.2.2", "3.3.3.3"}
+    assert not ips >= {"3.3.3.3"}
+    assert ips & {"2.2.2.2", "3.3.3.3"} == {"2.2.2.2"}
+    assert ips | {"3.3.3.3"} == {"1.1.1.1", "2.2.2.2", "3.3.3.3"}
+    assert ips - {"1.1.1.1"} == {"2.2.2.2"}
+    assert ips.isdisjoint({"9.9.9.9"})
+
+
+def test_large_containers_use_offset_index() -> None:
+    count = INDEX_THRESHOLD * 4
+    addresses = [f"10.0.{index // 256}.{index % 256}" for index in range(count)]
+
+    ips = IpSet()
+    for ip in addresses + addresses:
+        ips.add(ip)
+    assert len(ips) == count and list(ips) == addresses
+    assert ips._offsets is not None and "10.0.0.5" in ips and "10.9.9.9" not in ips
+
+    window = IpWindow()
+    window.touch(pack_ip("1::"), 0)
+    window.touch(pack_ip("100::"), 0)
+    for index, ip in enumerate(addresses):
+        window.touch(pack_ip(ip), index)
+    # Запись внутри записей ("::1" со смещением 5) не находится и через индекс.
+    window.touch(pack_ip("::1"), count)
+    assert len(window) == count + 3 and window._offsets is not None
+
+    window.expire(count // 2)
+    assert window._offsets is None, "Индекс сбрасывается при удалении записей"
+    assert list(window) == addresses[count // 2 :] + ["::1"]
+    window.touch(pack_ip(addresses[-1]), count + 1)
+    assert len(window) == count // 2 + 1 and window.items()[-2] == (addresses[-1], count + 1)
+
+
+def test_window_table_and_legacy_state(tmp_path) -> None:
+    table = WindowTable()
+    table["a"] = [("1.1.1.1", 5.0), ("::2", 6.0)]
+    table.window(table.uuids.intern("b")).touch(pack_ip("2.2.2.2"), 7)
+    assert sorted(table) == ["a", "b"] and len(table) == 2
+    assert "missing" not in table
+
+    restored = WindowTable()
+    restored.load(json.loads(json.dumps(table.dump())))
+    assert restored["a"].items() == [("1.1.1.1", 5), ("::2", 6)]
+    del restored["a"]
+    assert list(restored) == ["b"]
+
+    # Состояние ограничителя в прежнем формате ``uuid → {ip: время}`` читается.
+    state_path = tmp_path / "state.json"
+    state_path.write_text(json.dumps({"offset": 3, "windows": {"u": {"1.1.1.1": 1.5}}, "limited": {"u": 1}}))
+    daemon = LimiterDaemon(tmp_path / "access.log", tmp_path / "config.json", state_path, limits={})
+    daemon.load_state()
+    assert daemon.windows["u"].items() == [("1.1.1.1", 1)]
+    daemon.save_state()
+    assert "packed_windows" in json.loads(state_path.read_text())
@@ -0,0 +1,191 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.bot.handlers import key_management
+from app.bot.services import journal as journal_module
+from app.bot.services import xray
+from app.bot.services.journal import MutationJournal, read_journal, recover
+from app.db import Base
+from app.models.key import Key
+
+
+def _sqlite(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def override_session():
+        session = factory()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    monkeypatch.setattr(journal_module, "get_session", override_session)
+    monkeypatch.setattr(journal_module, "reload_xray", lambda: None)
+    return engine, factory
+
+
+def _write_config(path, *uuids: str) -> None:
+    clients = [{"id": uuid, "email": f"{uuid}@vpn"} for uuid in uuids]
+    path.write_text(json.dumps({"inbounds": [{"protocol": "vless", "settings": {"clients": clients}}]}))
+
+
+def _config_ids(path) -> list[str]:
+    return [client["id"] for client in json.loads(path.read_text())["inbounds"][0]["settings"]["clients"]]
+
+
+def test_concurrent_intents_share_fsync(tmp_path, monkeypatch) -> None:
+    path = tmp_path / "journal.log"
+    journal = MutationJournal(path)
+    fsyncs: list[int] = []
+    original_append = journal._append
+    monkeypatch.setattr(journal, "_append", lambda data: (fsyncs.append(data.count(b"\n")), original_append(data)))
+
+    async def run() -> list[int]:
+        seqs = await asyncio.gather(*(journal.begin("add", f"u{i}", email=f"u{i}@vpn") for i in range(50)))
+        for seq in seqs[:40]:
+            journal.commit(seq)
+        await journal.begin("remove", "u0")
+        return seqs
+
+    seqs = asyncio.run(run())
+
+    assert sorted(seqs) == list(range(1, 51))
+    assert sum(fsyncs) == 91
+    assert len(fsyncs) < 20
+    pending, last_seq = read_journal(path)
+    assert last_seq == 51
+    assert sorted(pending) == list(range(41, 52))
+    assert pending[51] == {"seq": 51, "op": "remove", "uuid": "u0"}
+
+
+def test_recover_converges_both_stores_and_truncates(tmp_path, monkeypatch) -> None:
+    config_path = tmp_path / "config.json"
+    # u-add попал в конфиг, но не в базу; u-remove удалён из конфига, но не из базы.
+    _write_config(config_path, "u-add", "u-done")
+    journal_path = tmp_path / "journal.log"
+    records = [
+        {"seq": 1, "op": "add", "uuid": "u-done", "config_path": str(config_path)},
+        {"seq": 1, "op": "done"},
+        {"seq": 2, "op": "add", "uuid": "u-add", "config_path": str(config_path)},
+        {"seq": 3, "op": "remove", "uuid": "u-remove", "config_path": str(config_path)},
+    ]
+    journal_path.write_text("".join(json.dumps(record) + "\n" for record in records) + '{"seq": 4, "op"')
+
+    async def run() -> tuple[list[str], list[str]]:
+        engine, factory = _sqlite(monkeypatch)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as session:
+            session.add_all([Key(uuid="u-done", email="d"), Key(uuid="u-remove", email="r")])
+            await session.commit()
+
+        journal = MutationJournal(journal_path)
+        recovered = await recover(journal)
+        async with factory() as session:
+            keys = (await session.execute(select(Key.uuid))).scalars().all()
+        seq = await journal.begin("add", "u-next")
+        assert seq == 4
+        return recovered, keys
+
+    recovered, keys = asyncio.run(run())
+
+    assert recovered == ["u-add", "u-remove"]
+    assert keys == ["u-done"]
+    assert _config_ids(config_path) == ["u-done"]
+    pending, _ = read_journal(journal_path)
+    assert [record["uuid"] for record in pending.values()] == ["u-next"]
+
+
+def test_failed_creation_is_rolled_back(tmp_path, monkeypatch) -> None:
+    config_path = tmp_path / "config.json"
+    _write_config(config_path)
+    journal_path = tmp_path / "journal.log"
+    monkeypatch.setattr(
+        xray,
+        "get_settings",
+        lambda: SimpleNamespace(
+            xray_host="vpn.example.com",
+            xray_port=443,
+            xray_security="none",
+            xray_network="tcp",
+            xray_service_name="",
+            xray_flow="",
+        ),
+    )
+
+    async def failing_store(*args, **kwargs):  # noqa: ARG001
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(key_management, "_store_key", failing_store)
+    monkeypatch.setattr(journal_module, "_JOURNALS", {})
+
+    async def run() -> None:
+        engine, _ = _sqlite(monkeypatch)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        data = {"email": "e@vpn", "config_path": config_path, "journal_path": str(journal_path)}
+        with pytest.raises(RuntimeError):
+            await key_management._finalize_creation(SimpleNamespace(message=None), data)
+        await journal_module.get_journal(str(journal_path)).flush()
+
+    asyncio.run(run())
+
+    assert _config_ids(config_path) == []
+    assert read_journal(journal_path)[0] == {}
+
+
+def test_key_survives_crash_after_delivery(tmp_path, monkeypatch) -> None:
+    config_path = tmp_path / "config.json"
+    _write_config(config_path)
+    journal_path = tmp_path / "journal.log"
+    monkeypatch.setattr(
+        xray,
+        "get_settings",
+        lambda: SimpleNamespace(
+            xray_host="vpn.example.com",
+            xray_port=443,
+            xray_security="none",
+            xray_network="tcp",
+            xray_service_name="",
+            xray_flow="",
+        ),
+    )
+    monkeypatch.setattr(journal_module, "_JOURNALS", {})
+    monkeypatch.setattr(key_management, "reload_xray", lambda: None)
+    snapshots: list[bytes] = []
+
+    async def deliver(*args, **kwargs) -> None:  # noqa: ARG001
+        # Сбой сразу после выдачи ссылки: на диске остаётся то, что есть сейчас.
+        snapshots.append(journal_path.read_bytes())
+
+    async def no_qr(*args, **kwargs) -> None:  # noqa: ARG001
+        return None
+
+    monkeypatch.setattr(key_management, "send_qr", no_qr)
+
+    async def run() -> tuple[list[str], list[str]]:
+        engine, factory = _sqlite(monkeypatch)
+        monkeypatch.setattr(key_management, "get_session", journal_module.get_session)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        data = {"email": "e@vpn", "config_path": config_path, "journal_path": str(journal_path)}
+        await key_management._finalize_creation(SimpleNamespace(message=SimpleNamespace(answer=deliver)), data)
+
+        journal_path.write_bytes(snapshots[0])
+        recovered = await recover(MutationJournal(journal_path))
+        async with factory() as session:
+            keys = (await session.execute(select(Key.uuid))).scalars().all()
+        return recovered, keys
+
+    recovered, keys = asyncio.run(run())
+
+    assert recovered == [], "Выданный ключ не откатывается"
+    assert len(keys) == 1 and _config_ids(config_path) == keys
@@ -0,0 +1,132 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.bot.handlers import key_management
+from app.bot.services import key_cache
+from app.bot.services.limiter import DeviceLimitCache
+from app.db import Base
+from app.models.key import Key
+
+
+def _sqlite_factory(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def override_session():
+        session = factory()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    monkeypatch.setattr(key_cache, "get_session", override_session)
+    return engine, factory
+
+
+def test_warm_loads_records_and_limits(monkeypatch) -> None:
+    limits = DeviceLimitCache()
+    cache = key_cache.KeyCache(limits)
+
+    async def run() -> None:
+        engine, factory = _sqlite_factory(monkeypatch)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as session:
+            session.add(Key(uuid="first", email="a@vpn", device_limit=2))
+            session.add(Key(uuid="second", email="b@vpn", device_limit=None))
+            await session.commit()
+        await cache.warm()
+
+    asyncio.run(run())
+
+    assert cache.loaded and limits.loaded
+    assert [record.uuid for record in cache.all()] == ["first", "second"]
+    assert cache.get("first").device_limit == 2
+    assert dict(limits) == {"first": 2}
+
+
+def test_put_and_discard_keep_limits_in_sync() -> None:
+    limits = DeviceLimitCache()
+    cache = key_cache.KeyCache(limits)
+
+    cache.put(key_cache.KeyRecord("a", "a@vpn", None, 3))
+    cache.put(key_cache.KeyRecord("b", "b@vpn", None, None))
+    assert dict(limits) == {"a": 3}
+
+    cache.put(key_cache.KeyRecord("a", "a@vpn", None, None))
+    cache.discard("b")
+
+    assert len(cache) == 1
+    assert dict(limits) == {}
+
+
+def test_apply_notification_handles_insert_update_delete() -> None:
+    limits = DeviceLimitCache()
+    cache = key_cache.KeyCache(limits)
+
+    cache.apply_notification(
+        json.dumps(
+            {
+                "op": "INSERT",
+                "uuid": "u1",
+                "old_uuid": None,
+                "email": "u1@vpn",
+                "expires_at": "2030-01-02T03:04:05.123456+00:00",
+                "device_limit": 1,
+            }
+        )
+    )
+    record = cache.get("u1")
+    assert record.expires_at == datetime(2030, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)
+    assert dict(limits) == {"u1": 1}
+
+    cache.apply_notification(
+        json.dumps(
+            {"op": "UPDATE", "uuid": "u2", "old_uuid": "u1", "email": "u1@vpn", "expires_at": None, "device_limit": 5}
+        )
+    )
+    assert cache.get("u1") is None
+    assert cache.get("u2").device_limit == 5
+    assert dict(limits) == {"u2": 5}
+
+    cache.apply_notification(json.dumps({"op": "DELETE", "uuid": "u2"}))
+    assert len(cache) == 0
+    assert dict(limits) == {}
+
+
+def test_listen_conninfo_only_for_postgres() -> None:
+    conninfo = key_cache.listen_conninfo("postgresql+psycopg://postgres:secret@db:5432/vpn_project")
+
+    assert conninfo == "postgresql://postgres:secret@db:5432/vpn_project"
+    assert key_cache.listen_conninfo("sqlite+aiosqlite:///:memory:") is None
+
+
+def test_fetch_keys_is_served_from_cache(monkeypatch) -> None:
+    cache = key_cache.KeyCache(DeviceLimitCache())
+    monkeypatch.setattr(key_management, "KEY_CACHE", cache)
+
+    async def run() -> list:
+        engine, factory = _sqlite_factory(monkeypatch)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as session:
+            session.add(Key(uuid="stored", email="s@vpn"))
+            await session.commit()
+
+        first = await key_management._fetch_keys()
+        await engine.dispose()
+        # База недоступна — второй вызов обязан обойтись кэшем.
+        monkeypatch.setattr(key_cache, "get_session", None)
+        cache.put(key_cache.KeyRecord("local", "l@vpn", None, None))
+        second = await key_management._fetch_keys()
+        return [first, second]
+
+    first, second = asyncio.run(run())
+
+    assert [key.uuid for key in first] == ["stored"]
+    assert [key.uuid for key in second] == ["stored", "local"]
@@ -43,13 +43,22 @@ def test_create_key_flow(monkeypatch, tmp_path) -> None:
 
     store_mock = AsyncMock()
     monkeypatch.setattr(key_management, "_store_key", store_mock)
-    monkeypatch.setattr(key_management, "create_client", lambda uuid, email, path: f"vless://{uuid}")
+    monkeypatch.setattr(
+        key_management,
+        "create_client_async",
+        AsyncMock(side_effect=lambda uuid, email, path, compact=False: f"vless://{uuid}"),
+    )
     monkeypatch.setattr(key_management, "generate_qr_code", lambda link: BytesIO(b"qr"))
     monkeypatch.setattr(key_management, "reload_xray", lambda: None)
     monkeypatch.setattr(
         key_management,
         "get_settings",
-        lambda: SimpleNamespace(xray_config_path=str(tmp_path / "config.json")),
+        lambda: SimpleNamespace(
+            xray_config_path=str(tmp_path / "config.json"),
+            xray_clients_path="",
+            xray_config_compact=False,
+            journal_path="",
+        ),
     )
 
     asyncio.run(key_management.handle_create_key(callback))
@@ -73,16 +82,21 @@ def test_create_key_failure(monkeypatch, tmp_path) -> None:
     async def failing_store(*args, **kwargs):  # noqa: ARG001
         raise RuntimeError("db down")
 
-    def failing_client(*args, **kwargs):  # noqa: ARG001
+    async def failing_client(*args, **kwargs):  # noqa: ARG001
         raise RuntimeError("xray error")
 
     monkeypatch.setattr(key_management, "_store_key", failing_store)
-    monkeypatch.setattr(key_management, "create_client", failing_client)
+    monkeypatch.setattr(key_management, "create_client_async", failing_client)
     monkeypatch.setattr(key_management, "reload_xray", lambda: None)
     monkeypatch.setattr(
         key_management,
         "get_settings",
-        lambda: SimpleNamespace(xray_config_path=str(tmp_path / "config.json")),
+        lambda: SimpleNamespace(
+            xray_config_path=str(tmp_path / "config.json"),
+            xray_clients_path="",
+            xray_config_compact=False,
+            journal_path="",
+        ),
     )
 
     asyncio.run(key_management.handle_create_key(callback))
@@ -99,13 +113,18 @@ def test_handle_delete_key(monkeypatch, tmp_path) -> None:
     uuid = "11111111-2222-3333-4444-555555555555"
     callback = DummyCallback(data=f"delete_key:{uuid}")
 
-    monkeypatch.setattr(key_management, "remove_client", lambda _uuid, _path: True)
+    monkeypatch.setattr(key_management, "remove_client_async", AsyncMock(return_value=True))
     monkeypatch.setattr(key_management, "_delete_key_record", AsyncMock())
     monkeypatch.setattr(key_management, "reload_xray", lambda: None)
     monkeypatch.setattr(
         key_management,
         "get_settings",
-        lambda: SimpleNamespace(xray_config_path=str(tmp_path / "config.json")),
+        lambda: SimpleNamespace(
+            xray_config_path=str(tmp_path / "config.json"),
+            xray_clients_path="",
+            xray_config_compact=False,
+            journal_path="",
+        ),
     )
 
     asyncio.run(key_management.handle_delete_key(callback))
@@ -117,13 +136,18 @@ def test_handle_delete_key(monkeypatch, tmp_path) -> None:
 def test_handle_delete_key_not_found(monkeypatch, tmp_path) -> None:
     callback = DummyCallback(data="delete_key:missing")
 
-    monkeypatch.setattr(key_management, "remove_client", lambda _uuid, _path: False)
+    monkeypatch.setattr(key_management, "remove_client_async", AsyncMock(return_value=False))
     monkeypatch.setattr(key_management, "_delete_key_record", AsyncMock())
     monkeypatch.setattr(key_management, "reload_xray", lambda: None)
     monkeypatch.setattr(
         key_management,
         "get_settings",
-        lambda: SimpleNamespace(xray_config_path=str(tmp_path / "config.json")),
+        lambda: SimpleNamespace(
+            xray_config_path=str(tmp_path / "config.json"),
+            xray_clients_path="",
+            xray_config_compact=False,
+            journal_path="",
+        ),
     )
 
     asyncio.run(key_management.handle_delete_key(callback))
@@ -133,7 +157,11 @@ def test_handle_delete_key_not_found(monkeypatch, tmp_path) -> None:
 
 def test_handle_delete_key_without_uuid(monkeypatch) -> None:
     callback = DummyCallback(data="delete_key:")
-    monkeypatch.setattr(key_management, "get_settings", lambda: SimpleNamespace(xray_config_path="cfg"))
+    monkeypatch.setattr(
+        key_management,
+        "get_settings",
+        lambda: SimpleNamespace(xray_config_path="cfg", xray_clients_path="", xray_config_compact=False),
+    )
 
     asyncio.run(key_management.handle_delete_key(callback))
 
@@ -212,6 +240,8 @@ def test_handle_settings(monkeypatch) -> None:
             xray_service_name="",
             xray_flow="",
             xray_reload_command="service xray restart",
+            xray_clients_path="",
+            xray_config_compact=True,
         ),
     )
 
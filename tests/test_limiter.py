@@ -1,6 +1,14 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from unittest import mock
 
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
 from app.bot.services import limiter
+from app.db import Base
+from app.models.key import Key
 
 
 def _write_log(path, uuid: str, ips: list[str]) -> None:
@@ -13,19 +21,95 @@ def test_detect_overuse_returns_offenders(tmp_path) -> None:
     uuid = "123e4567-e89b-12d3-a456-426614174000"
     _write_log(log_path, uuid, ["1.1.1.1", "2.2.2.2", "3.3.3.3", "4.4.4.4"])
 
-    offenders = limiter.detect_overuse(log_path, limit=3)
+    offenders = limiter.detect_overuse(log_path, {uuid: 3})
 
     assert uuid in offenders
     assert bool(offenders)
 
 
+def test_detect_overuse_uses_per_key_limits(tmp_path) -> None:
+    log_path = tmp_path / "access.log"
+    uuid = "123e4567-e89b-12d3-a456-426614174000"
+    _write_log(log_path, uuid, ["1.1.1.1", "2.2.2.2"])
+
+    assert uuid in limiter.detect_overuse(log_path, {uuid: 1})
+    assert not limiter.detect_overuse(log_path, {uuid: 5})
+    assert not limiter.detect_overuse(log_path, {}), "Ключи без лимита пропускаются"
+
+
 def test_handle_overuse_runs_tc(tmp_path) -> None:
     log_path = tmp_path / "access.log"
     uuid = "de305d54-75b4-431b-adb2-eb6b9e546014"
     _write_log(log_path, uuid, ["1.1.1.1", "2.2.2.2", "3.3.3.3", "4.4.4.4"])
 
     with mock.patch("subprocess.run") as run_mock:
-        offenders = limiter.handle_overuse(log_path, limit=3, bandwidth="512kbit")
+        offenders = limiter.handle_overuse(log_path, {uuid: 3}, bandwidth="512kbit")
 
     run_mock.assert_called_once()
     assert offenders == [uuid]
+
+
+def test_default_limits_must_be_loaded(tmp_path, monkeypatch) -> None:
+    log_path = tmp_path / "access.log"
+    uuid = "de305d54-75b4-431b-adb2-eb6b9e546014"
+    _write_log(log_path, uuid, ["1.1.1.1", "2.2.2.2"])
+    cache = limiter.DeviceLimitCache()
+    monkeypatch.setattr(limiter, "DEVICE_LIMITS", cache)
+
+    with pytest.raises(RuntimeError):
+        limiter.detect_overuse(log_path)
+    with pytest.raises(RuntimeError), mock.patch("subprocess.run") as run_mock:
+        limiter.handle_overuse(log_path)
+    run_mock.assert_not_called()
+
+    cache.replace({uuid: 1})
+    assert uuid in limiter.detect_overuse(log_path)
+
+
+def test_device_limit_cache_loads_and_updates(monkeypatch) -> None:
+    async def run() -> limiter.DeviceLimitCache:
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        factory = async_sessionmaker(engine, expire_on_commit=False)
+
+        @asynccontextmanager
+        async def override_session():
+            session = factory()
+            try:
+                yield session
+            finally:
+                await session.close()
+
+        monkeypatch.setattr(limiter, "get_session", override_session)
+        async with factory() as session:
+            session.add(Key(uuid="limited", email="a", device_limit=2))
+            session.add(Key(uuid="unlimited", email="b", device_limit=None))
+            await session.commit()
+
+        cache = limiter.DeviceLimitCache()
+        await cache.load()
+        return cache
+
+    cache = asyncio.run(run())
+
+    assert cache.loaded
+    assert dict(cache) == {"limited": 2}
+
+    cache.set("fresh", 5)
+    cache.set("limited", None)
+    cache.discard("missing")
+
+    assert dict(cache) == {"fresh": 5}
+
+
+def test_find_offenders_pass_is_fast() -> None:
+    active = {f"uuid-{index}": {"1.1.1.1", "2.2.2.2", "3.3.3.3"} for index in range(100_000)}
+    limits = {f"uuid-{index}": 1 + index % 4 for index in range(0, 100_000, 2)}
+
+    started = time.perf_counter()
+    offenders = limiter.find_offenders(active, limits)
+    elapsed = time.perf_counter() - started
+
+    assert len(offenders) == 25_000
+    assert elapsed < 0.2, f"Проход занял {elapsed * 1000:.1f} мс"
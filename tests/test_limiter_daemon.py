@@ -0,0 +1,214 @@
+import asyncio
+import json
+import subprocess
+
+from app.bot.handlers.key_management import _key_email
+from app.bot.services.device_groups import DeviceGrouper
+from app.bot.services.file_watcher import FileWatcher
+from app.bot.services.limiter_daemon import LimiterDaemon, LogTailer
+
+UUID = "123e4567-e89b-12d3-a456-426614174000"
+
+
+def _line(ip: str, email: str = "user@vpn") -> str:
+    return f"2024/03/05 12:34:56 from {ip}:5000 accepted tcp:example.com:443 [vless-in -> direct] email: {email}\n"
+
+
+def _append(path, *ips: str) -> None:
+    with path.open("a", encoding="utf-8") as handle:
+        for ip in ips:
+            handle.write(_line(ip))
+
+
+def _daemon(tmp_path, calls: list[tuple[str, str]], **kwargs) -> LimiterDaemon:
+    config_path = tmp_path / "config.json"
+    config = {"inbounds": [{"protocol": "vless", "settings": {"clients": [{"id": UUID, "email": "user@vpn"}]}}]}
+    config_path.write_text(json.dumps(config), encoding="utf-8")
+    return LimiterDaemon(
+        tmp_path / "access.log",
+        config_path,
+        tmp_path / "state.json",
+        limits={UUID: 2},
+        window_seconds=60,
+        release_ticks=2,
+        apply_limit=lambda uuid, bandwidth: calls.append(("limit", uuid)),
+        release_limit=lambda uuid: calls.append(("release", uuid)),
+        **kwargs,
+    )
+
+
+def test_tailer_reads_appends_and_rotation(tmp_path) -> None:
+    log_path = tmp_path / "access.log"
+    log_path.write_text("first\nsecond\npartial", encoding="utf-8")
+    tailer = LogTailer(log_path)
+
+    assert tailer.read_lines() == ["first", "second"]
+    assert tailer.backlog() == len("partial")
+
+    with log_path.open("a", encoding="utf-8") as handle:
+        handle.write(" line\nthird\n")
+    assert tailer.read_lines() == ["partial line", "third"]
+
+    log_path.unlink()
+    log_path.write_text("rotated\n", encoding="utf-8")
+    assert tailer.read_lines() == ["rotated"]
+
+
+def test_limit_with_hysteresis(tmp_path) -> None:
+    calls: list[tuple[str, str]] = []
+    daemon = _daemon(tmp_path, calls)
+    log_path = tmp_path / "access.log"
+
+    _append(log_path, "1.1.1.1", "2.2.2.2", "3.3.3.3")
+    report = daemon.tick(now=1000)
+    assert report.limited == [UUID]
+    assert report.lines == 3 and report.backlog_bytes > 0
+    assert report.connections == {UUID: 3}
+
+    report = daemon.tick(now=1030)
+    assert report.limited == [] and report.released == []
+
+    report = daemon.tick(now=1070)
+    assert report.released == [], "Ограничение не снимается с первого чистого тика"
+    assert UUID not in daemon.windows
+
+    report = daemon.tick(now=1080)
+    assert report.released == [UUID]
+    assert calls == [("limit", UUID), ("release", UUID)]
+
+
+def test_state_survives_restart(tmp_path) -> None:
+    calls: list[tuple[str, str]] = []
+    log_path = tmp_path / "access.log"
+    _append(log_path, "1.1.1.1", "2.2.2.2", "3.3.3.3")
+    _daemon(tmp_path, calls).tick(now=1000)
+
+    restarted = _daemon(tmp_path, calls)
+    restarted.load_state()
+    _append(log_path, "4.4.4.4")
+    report = restarted.tick(now=1010)
+
+    assert report.lines == 1, "Журнал читается с сохранённой позиции"
+    assert len(restarted.windows[UUID]) == 4
+    assert report.limited == [], "Ключ остаётся ограниченным без повторного tc"
+    assert calls == [("limit", UUID)]
+
+
+def test_failed_tc_is_retried_and_state_saved(tmp_path) -> None:
+    calls: list[tuple[str, str]] = []
+    daemon = _daemon(tmp_path, calls)
+
+    def broken(uuid: str, bandwidth: str) -> None:
+        raise subprocess.CalledProcessError(2, ["tc"])
+
+    daemon._apply_limit = broken
+    _append(tmp_path / "access.log", "1.1.1.1", "2.2.2.2", "3.3.3.3")
+    report = daemon.tick(now=1000)
+
+    assert report.limited == [] and UUID not in daemon.limited
+    assert json.loads((tmp_path / "state.json").read_text(encoding="utf-8"))["offset"] > 0
+
+    daemon._apply_limit = lambda uuid, bandwidth: calls.append(("limit", uuid))
+    report = daemon.tick(now=1010)
+    assert report.limited == [UUID], "Ограничение повторяется на следующем тике"
+
+
+def test_unknown_emails_are_not_interned(tmp_path) -> None:
+    calls: list[tuple[str, str]] = []
+    daemon = _daemon(tmp_path, calls)
+    with (tmp_path / "access.log").open("a", encoding="utf-8") as handle:
+        for index in range(50):
+            handle.write(_line("1.1.1.1", f"stranger{index}@vpn"))
+        handle.write(_line("1.1.1.1", UUID))
+
+    report = daemon.tick(now=1000)
+
+    assert report.lines == 51
+    assert list(daemon.windows) == [UUID], "Email-UUID с лимитом учитывается, чужие email — нет"
+    assert len(daemon.windows.uuids) == 1
+
+
+def test_keys_of_one_admin_are_limited_separately(tmp_path) -> None:
+    other = "de305d54-75b4-431b-adb2-eb6b9e546014"
+    emails = {uuid: _key_email("user_42@vpn.local", uuid) for uuid in (UUID, other)}
+    clients = [{"id": uuid, "email": email} for uuid, email in emails.items()]
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"inbounds": [{"protocol": "vless", "settings": {"clients": clients}}]}))
+    calls: list[tuple[str, str]] = []
+    daemon = LimiterDaemon(
+        tmp_path / "access.log",
+        config_path,
+        tmp_path / "state.json",
+        limits={UUID: 2, other: 2},
+        apply_limit=lambda uuid, bandwidth: calls.append(("limit", uuid)),
+    )
+    with (tmp_path / "access.log").open("a", encoding="utf-8") as handle:
+        for ip in ("1.1.1.1", "2.2.2.2", "3.3.3.3"):
+            handle.write(_line(ip, emails[UUID]))
+        handle.write(_line("4.4.4.4", emails[other]))
+
+    report = daemon.tick(now=1000)
+
+    assert report.connections == {UUID: 3, other: 1}
+    assert report.limited == [UUID] and calls == [("limit", UUID)]
+
+
+def test_run_respects_stop(tmp_path) -> None:
+    calls: list[tuple[str, str]] = []
+    daemon = _daemon(tmp_path, calls)
+    _append(tmp_path / "access.log", "1.1.1.1", "2.2.2.2", "3.3.3.3")
+
+    async def run() -> None:
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(daemon.run(stop_event, tick_seconds=0.05))
+        await asyncio.sleep(0.2)
+        stop_event.set()
+        await task
+
+    asyncio.run(run())
+
+    assert calls == [("limit", UUID)]
+    assert (tmp_path / "state.json").exists()
+
+
+def test_append_wakes_watched_daemon(tmp_path) -> None:
+    calls: list[tuple[str, str]] = []
+    daemon = _daemon(tmp_path, calls)
+    log_path = tmp_path / "access.log"
+    log_path.write_text("", encoding="utf-8")
+    watcher = FileWatcher(poll_interval=0.01)
+    ticks: list[int] = []
+    original_tick = daemon.tick
+    daemon.tick = lambda: (ticks.append(1), original_tick())[1]
+
+    async def run() -> None:
+        watcher.start()
+        daemon.watch(watcher)
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(daemon.run(stop_event, tick_seconds=30, min_tick_seconds=0))
+        await asyncio.sleep(0.1)
+        _append(log_path, "1.1.1.1", "2.2.2.2", "3.3.3.3")
+        for _ in range(100):
+            if calls:
+                break
+            await asyncio.sleep(0.02)
+        stop_event.set()
+        await task
+        watcher.close()
+
+    asyncio.run(run())
+
+    assert calls == [("limit", UUID)]
+    assert len(ticks) == 2
+
+
+def test_subnet_rotation_counts_as_one_device(tmp_path) -> None:
+    calls: list[tuple[str, str]] = []
+    daemon = _daemon(tmp_path, calls, groups=DeviceGrouper(24, 64))
+    log_path = tmp_path / "access.log"
+
+    _append(log_path, "100.64.7.1", "100.64.7.2", "100.64.7.3", "[2a02:6b8:1:2::1]", "[2a02:6b8:1:2::5]")
+    assert daemon.tick(now=1000).limited == []
+
+    _append(log_path, "100.64.8.1")
+    assert daemon.tick(now=1001).limited == [UUID]
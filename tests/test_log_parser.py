@@ -0,0 +1,101 @@
+import gzip
+
+from app.bot.services import log_parser
+
+UUID_A = "123e4567-e89b-12d3-a456-426614174000"
+UUID_B = "de305d54-75b4-431b-adb2-eb6b9e546014"
+
+
+def _line(ip: str, email: str, *, accepted: bool = True) -> str:
+    status = "accepted" if accepted else "rejected"
+    return f"2024/03/05 12:34:56.123456 from {ip}:51234 {status} tcp:example.com:443 [vless-in -> direct] email: {email}"
+
+
+def test_parse_line_ipv4_ipv6_and_rejections() -> None:
+    assert log_parser.parse_line(_line("203.0.113.7", "a@vpn")) == ("a@vpn", "203.0.113.7")
+    assert log_parser.parse_line(_line("tcp:198.51.100.1", "a@vpn")) == ("a@vpn", "198.51.100.1")
+    assert log_parser.parse_line(_line("[2001:DB8::1]", "b@vpn")) == ("b@vpn", "2001:db8::1")
+    assert log_parser.parse_line(_line("203.0.113.7", "a@vpn", accepted=False)) is None
+    assert log_parser.parse_line("2024/03/05 12:34:56 [Warning] failed to handler mux client connection") is None
+    assert log_parser.parse_line(f"time uuid={UUID_A} ip=1.1.1.1") is None
+
+
+def test_parse_logs_maps_emails_to_uuids(tmp_path) -> None:
+    current = tmp_path / "access.log"
+    rotated = tmp_path / "access.log.1.gz"
+    current.write_text(
+        "\n".join([_line("1.1.1.1", "a@vpn"), _line("[2001:db8::1]", "a@vpn"), _line("3.3.3.3", "b@vpn")]),
+        encoding="utf-8",
+    )
+    with gzip.open(rotated, "wt", encoding="utf-8") as handle:
+        handle.write(_line("2.2.2.2", "a@vpn") + "\n" + _line("9.9.9.9", "unknown@vpn") + "\n")
+
+    config = {
+        "inbounds": [
+            {"protocol": "vless", "settings": {"clients": [{"id": UUID_A, "email": "a@vpn"}]}},
+            {"protocol": "trojan", "settings": {"clients": [{"password": UUID_B, "email": "b@vpn"}]}},
+        ]
+    }
+    result = log_parser.parse_logs(
+        [current, rotated, tmp_path / "missing.log"],
+        email_to_uuid=log_parser.load_email_map(config),
+        workers=1,
+    )
+
+    assert result == {
+        UUID_A: {"1.1.1.1", "2001:db8::1", "2.2.2.2"},
+        UUID_B: {"3.3.3.3"},
+        "unknown@vpn": {"9.9.9.9"},
+    }
+
+
+def test_email_map_skips_emails_shared_by_keys() -> None:
+    config = {
+        "inbounds": [
+            {
+                "tag": "vless-in",
+                "settings": {
+                    "clients": [
+                        {"id": UUID_A, "email": "a@vpn"},
+                        {"id": UUID_B, "email": "shared@vpn"},
+                        {"id": "other", "email": "shared@vpn"},
+                    ]
+                },
+            },
+            {"tag": "trojan-in", "settings": {"clients": [{"password": UUID_A, "email": "a@vpn"}]}},
+        ]
+    }
+
+    assert log_parser.load_email_map(config) == {"a@vpn": UUID_A}
+
+
+def test_byte_ranges_cover_every_line_once(tmp_path) -> None:
+    log_path = tmp_path / "access.log"
+    lines = [_line(f"10.0.{index // 250}.{index % 250}", f"user{index % 7}@vpn") for index in range(2000)]
+    log_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    expected = log_parser.parse_logs([log_path], workers=1)
+    ranges = log_parser.split_ranges(log_path, chunk_bytes=997)
+    merged: dict[str, set[str]] = {}
+    total = 0
+    for start, end in ranges:
+        part = log_parser._parse_range(str(log_path), start, end)
+        for email, ips in part.items():
+            total += len(ips)
+            merged.setdefault(email, set()).update(ips)
+
+    assert len(ranges) > 10
+    assert merged == expected
+    assert total == sum(len(ips) for ips in expected.values())
+
+
+def test_parse_logs_process_pool(tmp_path) -> None:
+    log_path = tmp_path / "access.log"
+    lines = [_line(f"10.1.{index // 250}.{index % 250}", f"user{index % 3}@vpn") for index in range(3000)]
+    log_path.write_text("\n".join(lines), encoding="utf-8")
+
+    sequential = log_parser.parse_logs([log_path], workers=1)
+    parallel = log_parser.parse_logs([log_path], workers=2, chunk_bytes=20_000)
+
+    assert parallel == sequential
+    assert sum(len(ips) for ips in parallel.values()) == 3000
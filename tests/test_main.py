@@ -1,4 +1,7 @@
 import asyncio
+import subprocess
+import sys
+from pathlib import Path
 from types import SimpleNamespace
 from unittest.mock import AsyncMock
 
@@ -10,9 +13,14 @@ class DummyDispatcher:
         self.routers: list[object] = []
         self.message_middlewares: list[object] = []
         self.callback_middlewares: list[object] = []
+        self.inner_middlewares: list[object] = []
         self.start_polling = AsyncMock()
-        self.message = SimpleNamespace(outer_middleware=self._register_message)
-        self.callback_query = SimpleNamespace(outer_middleware=self._register_callback)
+        self.message = SimpleNamespace(
+            outer_middleware=self._register_message, middleware=self.inner_middlewares.append
+        )
+        self.callback_query = SimpleNamespace(
+            outer_middleware=self._register_callback, middleware=self.inner_middlewares.append
+        )
 
     def include_router(self, router: object) -> None:
         self.routers.append(router)
@@ -43,7 +51,21 @@ def test_main_starts_polling(monkeypatch) -> None:
     monkeypatch.setattr(
         main,
         "get_settings",
-        lambda: SimpleNamespace(bot_token="token", admin_id=99),
+        lambda: SimpleNamespace(
+            bot_token="token",
+            admin_id=99,
+            metrics_port=0,
+            database_url="sqlite+aiosqlite:///:memory:",
+            key_cache_refresh_seconds=0,
+            migrate_on_startup=False,
+            settings_reload_seconds=0,
+            file_watch_poll_seconds=0,
+            journal_path="",
+            journal_checkpoint_seconds=0,
+            config_history_dir="",
+            config_history_keep=1,
+            config_history_snapshot_every=1,
+        ),
     )
 
     asyncio.run(main.main())
@@ -52,3 +74,35 @@ def test_main_starts_polling(monkeypatch) -> None:
     assert dispatcher.message_middlewares == ["mw:99"]
     assert dispatcher.callback_middlewares == ["mw:99"]
     assert len(dispatcher.routers) >= 3
+    assert len(dispatcher.inner_middlewares) == 2
+
+
+def test_build_dispatcher_accepts_custom_access_middleware(monkeypatch) -> None:
+    dispatcher = DummyDispatcher()
+    monkeypatch.setattr(main, "Dispatcher", lambda: dispatcher)
+
+    result = main.build_dispatcher(SimpleNamespace(admin_id=1), access_middleware="custom")
+
+    assert result is dispatcher
+    assert dispatcher.message_middlewares == ["custom"]
+    assert dispatcher.callback_middlewares == ["custom"]
+
+
+def test_startup_does_not_import_qr_dependencies() -> None:
+    code = (
+        "import sys\n"
+        "from app.bot.handlers import load_routers\n"
+        "import app.bot.main\n"
+        "load_routers()\n"
+        "heavy = [name for name in ('qrcode', 'PIL') if name in sys.modules]\n"
+        "print(','.join(heavy))\n"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).resolve().parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert completed.stdout.strip() == ""
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import ClientSession
+
+from app.bot.middlewares.metrics import MetricsMiddleware
+from app.bot.services import metrics
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    registry = metrics.Registry()
+    histogram = registry.register(
+        metrics.Histogram("test_seconds", "Тестовая гистограмма", ("op",), buckets=(0.1, 1.0))
+    )
+    series = histogram.labels("create")
+    for value in (0.05, 0.5, 0.5, 3.0):
+        series.observe(value)
+
+    text = registry.render()
+
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{op="create",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{op="create",le="1"} 3' in text
+    assert 'test_seconds_bucket{op="create",le="+Inf"} 4' in text
+    assert 'test_seconds_count{op="create"} 4' in text
+
+
+def test_timed_decorator_sync_and_async() -> None:
+    histogram = metrics.Histogram("timed_seconds", "Тест")
+
+    @metrics.timed(histogram)
+    def work(value: int) -> int:
+        return value * 2
+
+    @metrics.timed(histogram)
+    async def async_work(value: int) -> int:
+        return value + 1
+
+    assert work(2) == 4
+    assert asyncio.run(async_work(2)) == 3
+    assert histogram.labels().count == 2
+
+
+def test_middleware_overhead_is_small() -> None:
+    middleware = MetricsMiddleware("message")
+    handler_object = SimpleNamespace(callback=lambda: None)
+    data = {"handler": handler_object}
+
+    async def handler(event, data):  # noqa: ARG001
+        return None
+
+    iterations = 20_000
+
+    async def measure() -> tuple[float, float]:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await handler(None, data)
+        bare = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await middleware(handler, None, data)
+        wrapped = time.perf_counter() - started
+        return bare, wrapped
+
+    bare, wrapped = asyncio.run(measure())
+    overhead_us = (wrapped - bare) / iterations * 1_000_000
+
+    assert overhead_us < 10, f"Накладные расходы middleware {overhead_us:.2f} мкс"
+    assert metrics.HANDLER_SECONDS.labels("message", "<lambda>").count >= iterations
+
+
+def test_metrics_endpoint_serves_registry() -> None:
+    registry = metrics.Registry()
+    gauge = registry.register(metrics.Gauge("test_keys", "Ключи", ("state",)))
+    registry.add_collector(lambda: gauge.labels("active").set(5))
+
+    async def fetch() -> str:
+        runner = await metrics.start_metrics_server("127.0.0.1", 0, registry)
+        try:
+            port = runner.addresses[0][1]
+            async with ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    assert response.status == 200
+                    return await response.text()
+        finally:
+            await runner.cleanup()
+
+    body = asyncio.run(fetch())
+
+    assert 'test_keys{state="active"} 5' in body
+
+
+def test_db_timing_drops_start_of_failed_query() -> None:
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+
+    metrics.install_db_timing()
+    engine = create_engine("sqlite://")
+    before = metrics.DB_QUERY_SECONDS._default().count
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing"))
+        assert not conn.info.get("_query_started")
+        conn.execute(text("SELECT 1"))
+        assert not conn.info.get("_query_started")
+    assert metrics.DB_QUERY_SECONDS._default().count == before + 1
@@ -0,0 +1,174 @@
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pytest
+
+from app import migrations
+
+
+def _write(directory: Path, name: str, sql: str) -> None:
+    (directory / name).write_text(sql, encoding="utf-8")
+
+
+def test_load_migrations_orders_by_version_and_skips_bad_names(tmp_path: Path) -> None:
+    _write(tmp_path, "010_late.sql", "SELECT 10;")
+    _write(tmp_path, "002_second.sql", "SELECT 2;")
+    _write(tmp_path, "001_first.sql", "SELECT 1;")
+    _write(tmp_path, "notes.sql", "SELECT 0;")
+
+    loaded = migrations.load_migrations(tmp_path)
+
+    assert [(m.version, m.name) for m in loaded] == [("001", "first"), ("002", "second"), ("010", "late")]
+
+
+def test_load_migrations_rejects_duplicate_versions(tmp_path: Path) -> None:
+    _write(tmp_path, "001_a.sql", "SELECT 1;")
+    _write(tmp_path, "1_b.sql", "SELECT 1;")
+
+    with pytest.raises(ValueError):
+        migrations.load_migrations(tmp_path)
+
+
+def test_no_transaction_marker_and_statement_split(tmp_path: Path) -> None:
+    _write(
+        tmp_path,
+        "001_indexes.sql",
+        "-- migrate: no-transaction\n"
+        "-- индексы без блокировки записи\n"
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS a_idx ON t (a);\n"
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS b_idx\n    ON t (b);\n",
+    )
+    _write(tmp_path, "002_plain.sql", "ALTER TABLE t ADD COLUMN c INTEGER;")
+
+    indexes, plain = migrations.load_migrations(tmp_path)
+
+    assert indexes.transactional is False
+    assert plain.transactional is True
+    assert indexes.statements() == [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS a_idx ON t (a)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS b_idx\n    ON t (b)",
+    ]
+    assert migrations._CONCURRENT_INDEX.search(indexes.statements()[1]).group("name") == "b_idx"
+
+
+def test_pending_migrations_and_backend_check() -> None:
+    loaded = [
+        migrations.Migration("000", "init", "", True),
+        migrations.Migration("001", "next", "", True),
+    ]
+
+    assert [m.version for m in migrations.pending_migrations(loaded, {"000"})] == ["001"]
+    assert migrations.is_postgres("postgresql+psycopg://postgres:postgres@db:5432/vpn_project")
+    assert not migrations.is_postgres("sqlite+aiosqlite:///:memory:")
+
+
+def test_repository_migrations_are_loadable() -> None:
+    loaded = migrations.load_migrations()
+
+    assert [m.version for m in loaded][:4] == ["000", "001", "002", "003"]
+    indexes = loaded[3]
+    assert indexes.transactional is False
+    assert all("CONCURRENTLY" in statement for statement in indexes.statements())
+
+
+class _Result:
+    def __init__(self, value=None, rows=()) -> None:
+        self.value = value
+        self.rows = list(rows)
+
+    def scalar(self):
+        return self.value
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class _Server:
+    """PostgreSQL в миниатюре: одна advisory-блокировка и таблица версий."""
+
+    def __init__(self) -> None:
+        self.lock_owner: object | None = None
+        self.applied: list[str] = []
+        self.executed: list[tuple[str, str]] = []
+        self.failed_attempts = 0
+
+
+class _Connection:
+    def __init__(self, server: _Server, replica: str) -> None:
+        self.server = server
+        self.replica = replica
+
+    async def execution_options(self, **options):
+        return self
+
+    async def exec_driver_sql(self, sql: str, params=None) -> _Result:
+        await asyncio.sleep(0)
+        server = self.server
+        if "pg_advisory_lock" in sql:
+            raise AssertionError("ждущая блокировка держит снимок и мешает CONCURRENTLY")
+        if "pg_try_advisory_lock" in sql:
+            if server.lock_owner is None:
+                server.lock_owner = self
+            elif server.lock_owner is not self:
+                server.failed_attempts += 1
+                return _Result(False)
+            return _Result(True)
+        if "pg_advisory_unlock" in sql:
+            assert server.lock_owner is self
+            server.lock_owner = None
+            return _Result(True)
+        if sql.startswith("SELECT version"):
+            return _Result(rows=[(version,) for version in server.applied])
+        if sql.startswith("INSERT INTO schema_migrations"):
+            assert params["version"] not in server.applied
+            server.applied.append(params["version"])
+        elif "pg_index" in sql:
+            return _Result(None)
+        elif "CONCURRENTLY" in sql:
+            assert server.lock_owner is self
+            # Сборка индекса длится несколько шагов цикла событий.
+            for _ in range(5):
+                await asyncio.sleep(0)
+            server.executed.append((self.replica, sql))
+        elif not sql.startswith(("CREATE TABLE IF NOT EXISTS schema_migrations", "SET LOCAL")):
+            server.executed.append((self.replica, sql))
+        return _Result()
+
+
+class _Engine:
+    def __init__(self, server: _Server, replica: str) -> None:
+        self.server = server
+        self.replica = replica
+
+    @asynccontextmanager
+    async def connect(self):
+        yield _Connection(self.server, self.replica)
+
+    begin = connect
+
+
+def test_concurrent_runners_apply_each_migration_once(tmp_path: Path, monkeypatch) -> None:
+    _write(tmp_path, "001_table.sql", "CREATE TABLE items (x INT);")
+    _write(
+        tmp_path,
+        "002_index.sql",
+        "-- migrate: no-transaction\nCREATE INDEX CONCURRENTLY IF NOT EXISTS ix_items_x ON items (x);\n",
+    )
+    monkeypatch.setattr(migrations, "LOCK_POLL_INTERVAL", 0)
+    server = _Server()
+
+    async def run():
+        return await asyncio.gather(
+            migrations.run_migrations(_Engine(server, "a"), tmp_path),
+            migrations.run_migrations(_Engine(server, "b"), tmp_path),
+        )
+
+    first, second = asyncio.run(run())
+
+    assert first == ["001", "002"]
+    assert second == []
+    assert server.applied == ["001", "002"]
+    assert [replica for replica, _ in server.executed] == ["a", "a"]
+    assert server.failed_attempts > 0
+    assert server.lock_owner is None
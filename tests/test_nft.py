@@ -0,0 +1,87 @@
+import json
+import stat
+
+from app.bot.services.limiter_daemon import LimiterDaemon
+from app.bot.services.nft import NftBanSet
+
+UUID = "123e4567-e89b-12d3-a456-426614174000"
+
+
+def _fake_nft(tmp_path):
+    calls_dir = tmp_path / "nft_calls"
+    calls_dir.mkdir()
+    binary = tmp_path / "nft"
+    binary.write_text(
+        "#!/bin/sh\n"
+        f'n=$(ls "{calls_dir}" | wc -l)\n'
+        f'echo "$@" > "{calls_dir}/$n.args"\n'
+        f'cat > "{calls_dir}/$n.nft"\n',
+        encoding="utf-8",
+    )
+    binary.chmod(binary.stat().st_mode | stat.S_IEXEC)
+    return str(binary), calls_dir
+
+
+def _scripts(calls_dir) -> list[str]:
+    return [path.read_text(encoding="utf-8") for path in sorted(calls_dir.glob("*.nft"))]
+
+
+def test_setup_creates_timeout_sets(tmp_path) -> None:
+    binary, calls_dir = _fake_nft(tmp_path)
+    NftBanSet(nft_binary=binary, port=8443).setup()
+
+    (script,) = _scripts(calls_dir)
+    assert "flags timeout" in script
+    assert "type ipv6_addr" in script
+    assert "th dport 8443 ip saddr @banned_v4 reject" in script
+    assert (calls_dir / "0.args").read_text(encoding="utf-8").strip() == "-f -"
+
+
+def test_bans_are_batched_and_not_repeated(tmp_path) -> None:
+    binary, calls_dir = _fake_nft(tmp_path)
+    ban_set = NftBanSet(nft_binary=binary, timeout_seconds=60)
+
+    ips = [f"10.0.{index // 256}.{index % 256}" for index in range(2500)] + ["2001:db8::1"]
+    assert ban_set.ban(ips, now=1000) == 2501
+    assert ban_set.commit(now=1000) == 2501
+
+    assert ban_set.ban(ips[:10], now=1030) == 0, "Действующие баны не повторяются"
+    assert ban_set.commit(now=1030) == 0
+    assert ban_set.ban(ips[:10], now=1061) == 10, "После истечения IP снова банится"
+    ban_set.commit(now=1061)
+
+    first, second = _scripts(calls_dir)
+    assert first.count("add element inet vpn_limiter banned_v4") == 3
+    assert "2001:db8::1 timeout 60s" in first
+    assert second.count("timeout 60s") == 10
+
+
+def test_daemon_bans_only_excess_ips(tmp_path) -> None:
+    binary, calls_dir = _fake_nft(tmp_path)
+    config_path = tmp_path / "config.json"
+    config = {"inbounds": [{"protocol": "vless", "settings": {"clients": [{"id": UUID, "email": "u@vpn"}]}}]}
+    config_path.write_text(json.dumps(config), encoding="utf-8")
+    log_path = tmp_path / "access.log"
+    log_path.write_text(
+        "".join(
+            f"2024/03/05 12:34:56 from {ip}:5000 accepted tcp:example.com:443 [vless-in -> direct] email: u@vpn\n"
+            for ip in ("1.1.1.1", "2.2.2.2", "3.3.3.3", "4.4.4.4")
+        ),
+        encoding="utf-8",
+    )
+
+    daemon = LimiterDaemon(
+        log_path,
+        config_path,
+        tmp_path / "state.json",
+        limits={UUID: 2},
+        ban_set=NftBanSet(nft_binary=binary),
+        apply_limit=lambda uuid, bandwidth: None,
+    )
+    report = daemon.tick(now=1000)
+
+    assert report.limited == [UUID]
+    assert report.banned == 2
+    (script,) = _scripts(calls_dir)
+    assert "3.3.3.3" in script and "4.4.4.4" in script
+    assert "1.1.1.1" not in script
@@ -0,0 +1,144 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendDocument
+from aiogram.types.input_file import BufferedInputFile
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.bot.handlers import key_management
+from app.bot.services import qr_delivery
+from app.bot.services.key_cache import KeyCache, KeyRecord
+from app.bot.services.limiter import DeviceLimitCache
+from app.db import Base
+from app.models.key import Key
+
+
+class UploadingMessage:
+    """Имитирует Telegram: загруженный файл получает file_id, старые file_id можно отвергнуть."""
+
+    def __init__(self, rejected: set[str] | None = None) -> None:
+        self.sent: list[object] = []
+        self.rejected = rejected or set()
+
+    async def answer_document(self, document: object, caption: str | None = None):
+        if isinstance(document, str) and document in self.rejected:
+            raise TelegramBadRequest(SendDocument(chat_id=1, document=document), "wrong file identifier")
+        self.sent.append(document)
+        file_id = document if isinstance(document, str) else f"file-{len(self.sent)}"
+        return SimpleNamespace(document=SimpleNamespace(file_id=file_id))
+
+
+def _sqlite(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def override_session():
+        session = factory()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    monkeypatch.setattr(qr_delivery, "get_session", override_session)
+    return engine, factory
+
+
+async def _seed(engine, factory, **values) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with factory() as session:
+        session.add(Key(uuid="u1", email="u1@vpn", **values))
+        await session.commit()
+
+
+def test_first_delivery_uploads_and_second_reuses_file_id(monkeypatch) -> None:
+    message = UploadingMessage()
+    renders: list[int] = []
+
+    def render() -> bytes:
+        renders.append(1)
+        return b"png"
+
+    async def run() -> str | None:
+        engine, factory = _sqlite(monkeypatch)
+        await _seed(engine, factory)
+        await qr_delivery.send_qr(message, "u1", render)
+        await qr_delivery.send_qr(message, "u1", render)
+        return await qr_delivery.get_file_id("u1")
+
+    stored = asyncio.run(run())
+
+    assert stored == "file-1"
+    assert len(renders) == 1
+    assert isinstance(message.sent[0], BufferedInputFile)
+    assert message.sent[1] == "file-1"
+
+
+def test_rejected_file_id_is_replaced(monkeypatch) -> None:
+    message = UploadingMessage(rejected={"stale"})
+
+    async def run() -> str | None:
+        engine, factory = _sqlite(monkeypatch)
+        await _seed(engine, factory, qr_file_id="stale")
+        await qr_delivery.send_qr(message, "u1", lambda: b"png")
+        return await qr_delivery.get_file_id("u1")
+
+    assert asyncio.run(run()) == "file-1"
+    assert len(message.sent) == 1 and isinstance(message.sent[0], BufferedInputFile)
+
+
+def test_changed_link_is_uploaded_again(monkeypatch) -> None:
+    message = UploadingMessage()
+    old, new = "vless://u1@old.host:443", "vless://u1@new.host:443"
+
+    async def run() -> str | None:
+        engine, factory = _sqlite(monkeypatch)
+        await _seed(engine, factory)
+        await qr_delivery.send_qr(message, "u1", lambda: b"old", link=old)
+        await qr_delivery.send_qr(message, "u1", lambda: b"old", link=old)
+        # XRAY_HOST перечитан: ссылка другая, старый документ не годится.
+        await qr_delivery.send_qr(message, "u1", lambda: b"new", link=new)
+        return await qr_delivery.get_file_id("u1", new)
+
+    stored = asyncio.run(run())
+
+    assert message.sent[1] == "file-1"
+    assert isinstance(message.sent[2], BufferedInputFile)
+    assert stored == "file-3"
+
+
+def test_file_id_without_link_hash_is_not_reused(monkeypatch) -> None:
+    message = UploadingMessage()
+
+    async def run() -> None:
+        engine, factory = _sqlite(monkeypatch)
+        await _seed(engine, factory, qr_file_id="legacy")
+        await qr_delivery.send_qr(message, "u1", lambda: b"png", link="vless://u1@host:443")
+
+    asyncio.run(run())
+
+    assert len(message.sent) == 1 and isinstance(message.sent[0], BufferedInputFile)
+
+
+def test_show_qr_callback_uses_cached_key(monkeypatch) -> None:
+    cache = KeyCache(DeviceLimitCache())
+    cache.loaded = True
+    cache.put(KeyRecord("u1", "u1@vpn", None, None))
+    monkeypatch.setattr(key_management, "KEY_CACHE", cache)
+    send = AsyncMock()
+    monkeypatch.setattr(key_management, "send_qr", send)
+
+    found = SimpleNamespace(data="show_qr:u1", message=object(), answer=AsyncMock())
+    missing = SimpleNamespace(data="show_qr:nope", message=object(), answer=AsyncMock())
+    asyncio.run(key_management.handle_show_qr(found))
+    asyncio.run(key_management.handle_show_qr(missing))
+
+    assert send.await_args.args[:2] == (found.message, "u1")
+    assert send.await_args.kwargs["link"].startswith("vless://u1@")
+    found.answer.assert_awaited_once_with()
+    missing.answer.assert_awaited_once_with("Ключ не найден", show_alert=True)
+    assert send.await_count == 1
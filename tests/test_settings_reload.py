@@ -0,0 +1,77 @@
+import os
+
+import pytest
+from pydantic import ValidationError
+
+from app import config
+from app.bot.handlers import help as help_handler
+from app.bot.services import settings_watcher, xray
+
+
+@pytest.fixture
+def env_file(tmp_path, monkeypatch):
+    path = tmp_path / ".env"
+    path.write_text("XRAY_HOST=a.example\n", encoding="utf-8")
+    for key in ("XRAY_HOST", "XRAY_PORT"):
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setattr(config, "ENV_FILE", path)
+    monkeypatch.setattr(config, "_DOTENV_KEYS", set())
+    monkeypatch.setattr(config, "_SETTINGS", None)
+    config.reload_settings()
+    return path
+
+
+def test_reload_swaps_settings_and_bumps_version(env_file) -> None:
+    first = config.get_settings()
+    version = config.settings_version()
+    assert first.xray_host == "a.example"
+    assert help_handler.build_help_text(first) is help_handler.build_help_text(first)
+
+    env_file.write_text("XRAY_HOST=b.example\n", encoding="utf-8")
+    assert config.reload_settings() == ["xray_host"]
+
+    second = config.get_settings()
+    assert second is not first
+    assert config.settings_version() == version + 1
+    assert "b.example" in help_handler.build_help_text(second)
+    assert xray.compose_vless_link("u", "e", second) == "vless://u@b.example:443?security=none&type=tcp#e"
+
+    # Без изменений экземпляр и версия сохраняются.
+    assert config.reload_settings() == []
+    assert config.get_settings() is second and config.settings_version() == version + 1
+
+
+def test_invalid_env_keeps_current_settings(env_file) -> None:
+    current = config.get_settings()
+    env_file.write_text("XRAY_HOST=c.example\nXRAY_PORT=abc\n", encoding="utf-8")
+
+    with pytest.raises(ValidationError):
+        config.reload_settings()
+
+    assert config.get_settings() is current
+    assert os.environ["XRAY_HOST"] == "a.example"
+    assert "XRAY_PORT" not in os.environ
+
+
+def test_watcher_reloads_on_change_and_sighup(tmp_path, monkeypatch) -> None:
+    path = tmp_path / ".env"
+    path.write_text("XRAY_HOST=a\n", encoding="utf-8")
+    calls: list[int] = []
+
+    def fake_reload() -> list[str]:
+        calls.append(1)
+        if len(calls) == 2:
+            raise ValueError("broken .env")
+        return ["xray_host"]
+
+    monkeypatch.setattr(settings_watcher, "reload_settings", fake_reload)
+    watcher = settings_watcher.SettingsWatcher(path, interval=0)
+
+    assert watcher.check() == []
+    path.write_text("XRAY_HOST=bb\n", encoding="utf-8")
+    assert watcher.check() == ["xray_host"]
+    assert watcher.check() == []
+
+    watcher.trigger()
+    assert watcher.check() == []  # ошибка разбора не пробрасывается
+    assert len(calls) == 2
@@ -0,0 +1,138 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.bot.handlers import usage as usage_handler
+from app.bot.services import usage
+from app.bot.services.key_cache import KeyCache, KeyRecord
+from app.bot.services.limiter import DeviceLimitCache
+from app.db import Base
+from app.models.usage import UsageDaily, UsageHourly, UsageSample
+
+
+def _sqlite_factory(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def override_session():
+        session = factory()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    monkeypatch.setattr(usage, "get_session", override_session)
+    return engine, factory
+
+
+def test_partition_names_and_bounds() -> None:
+    month = usage.month_start(datetime(2024, 12, 31, 23, 30, tzinfo=timezone.utc))
+
+    assert month == date(2024, 12, 1)
+    assert usage.add_months(month, 1) == date(2025, 1, 1)
+    assert usage.add_months(month, -12) == date(2023, 12, 1)
+    assert usage.partition_ddl("usage_samples", month) == (
+        "CREATE TABLE IF NOT EXISTS usage_samples_2024_12 PARTITION OF usage_samples "
+        "FOR VALUES FROM ('2024-12-01T00:00:00+00:00') TO ('2025-01-01T00:00:00+00:00')"
+    )
+
+
+def test_expired_partitions_respects_cutoff() -> None:
+    names = ["usage_samples_2024_03", "usage_samples_2024_01", "usage_samples_2024_02", "usage_samples_default"]
+    cutoff = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+    assert usage.expired_partitions("usage_samples", names, cutoff) == [
+        "usage_samples_2024_01",
+        "usage_samples_2024_02",
+    ]
+    # Свёртка остановилась в середине февраля — февральскую секцию удалять рано.
+    assert usage.expired_partitions("usage_samples", names, datetime(2024, 2, 15, tzinfo=timezone.utc)) == [
+        "usage_samples_2024_01"
+    ]
+
+
+def test_recorder_aggregates_ticks_and_flushes(monkeypatch) -> None:
+    recorder = usage.UsageRecorder(interval_seconds=60)
+    recorder.add({"a": 3}, {"a": {"1.1.1.1": 0, "2.2.2.2": 0}})
+    recorder.add({"a": 2, "b": 1}, {"a": {"1.1.1.1": 0}, "b": {"3.3.3.3": 0}})
+    started = datetime(2024, 3, 5, 12, 0, tzinfo=timezone.utc)
+
+    async def run() -> list:
+        engine, factory = _sqlite_factory(monkeypatch)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        first = await recorder.maybe_flush(started)
+        second = await recorder.maybe_flush(started.replace(minute=1))
+        async with factory() as session:
+            rows = (await session.execute(select(UsageSample).order_by(UsageSample.key_uuid))).scalars().all()
+        return [first, second, rows]
+
+    first, second, rows = asyncio.run(run())
+
+    assert (first, second) == (0, 2)
+    assert [(row.key_uuid, row.connections, row.devices) for row in rows] == [("a", 5, 2), ("b", 1, 1)]
+    assert len(recorder) == 0
+
+
+def test_top_users_reads_daily_and_today_hourly(monkeypatch) -> None:
+    now = datetime(2024, 3, 5, 15, 20, tzinfo=timezone.utc)
+
+    async def run() -> list:
+        engine, factory = _sqlite_factory(monkeypatch)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as session:
+            session.add_all(
+                [
+                    UsageDaily(day=date(2024, 2, 28), key_uuid="old", connections=10_000, peak_devices=9),
+                    UsageDaily(day=date(2024, 3, 1), key_uuid="a", connections=100, peak_devices=2),
+                    UsageDaily(day=date(2024, 3, 4), key_uuid="b", connections=150, peak_devices=1),
+                    UsageHourly(
+                        hour=datetime(2024, 3, 5, 9, tzinfo=timezone.utc),
+                        key_uuid="a",
+                        connections=80,
+                        peak_devices=4,
+                        samples=60,
+                    ),
+                ]
+            )
+            await session.commit()
+        return await usage.top_users(datetime(2024, 3, 1, tzinfo=timezone.utc), limit=5, now=now)
+
+    totals = asyncio.run(run())
+
+    assert totals == [usage.UsageTotal("a", 180, 4), usage.UsageTotal("b", 150, 1)]
+
+
+def test_usage_command_formats_report(monkeypatch) -> None:
+    cache = KeyCache(DeviceLimitCache())
+    cache.loaded = True
+    cache.put(KeyRecord("a", "alice@vpn", None, 3))
+    cache.put(KeyRecord("b", "<bob>&co@vpn", None, None))
+    monkeypatch.setattr(usage_handler, "KEY_CACHE", cache)
+    requested = {}
+
+    async def fake_top(since, limit, now=None):
+        requested.update(since=since, limit=limit)
+        return [usage.UsageTotal("a", 180, 4), usage.UsageTotal("b", 7, 1), usage.UsageTotal("gone", 5, 1)]
+
+    monkeypatch.setattr(usage_handler, "top_users", fake_top)
+    answers: list[str] = []
+
+    async def answer(text: str) -> None:
+        answers.append(text)
+
+    message = SimpleNamespace(answer=answer)
+    asyncio.run(usage_handler.cmd_usage(message, SimpleNamespace(args="7")))
+    asyncio.run(usage_handler.cmd_usage(message, SimpleNamespace(args="abc")))
+
+    assert requested["limit"] == usage_handler.TOP_LIMIT
+    assert "1. alice@vpn — 180 подключений, до 4 устройств" in answers[0]
+    assert "2. &lt;bob&gt;&amp;co@vpn — 7 подключений" in answers[0], "Email экранируется для HTML"
+    assert "gone (удалён)" in answers[0]
+    assert answers[1].startswith("Использование: /usage")
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from app.bot.services import xray
+
+CLIENTS = 50_000
+MAX_LOOP_LAG = 0.1
+
+
+def _write_large_config(path) -> None:
+    clients = [
+        {"id": f"00000000-0000-4000-8000-{index:012d}", "email": f"user{index}@vpn.local"}
+        for index in range(CLIENTS)
+    ]
+    config = {"inbounds": [{"protocol": "vless", "settings": {"clients": clients}}]}
+    path.write_text(json.dumps(config, indent=2), encoding="utf-8")
+
+
+def _stub_settings(monkeypatch) -> None:
+    monkeypatch.setattr(
+        xray,
+        "get_settings",
+        lambda: SimpleNamespace(
+            xray_host="vpn.example.com",
+            xray_port=443,
+            xray_security="none",
+            xray_network="tcp",
+            xray_service_name="",
+            xray_flow="",
+        ),
+    )
+
+
+async def _max_lag_during(operation) -> tuple[float, object]:
+    lags: list[float] = []
+    done = asyncio.Event()
+
+    async def ticker() -> None:
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - started - 0.005)
+
+    probe = asyncio.create_task(ticker())
+    await asyncio.sleep(0.02)
+    try:
+        result = await operation
+    finally:
+        done.set()
+        await probe
+    return max(lags), result
+
+
+def test_async_create_keeps_event_loop_responsive(tmp_path, monkeypatch) -> None:
+    config_path = tmp_path / "config.json"
+    _write_large_config(config_path)
+    _stub_settings(monkeypatch)
+    uuid = "123e4567-e89b-12d3-a456-426614174000"
+
+    lag, link = asyncio.run(
+        _max_lag_during(xray.create_client_async(uuid, "new@vpn.local", config_path))
+    )
+
+    assert uuid in link
+    assert lag < MAX_LOOP_LAG, f"Цикл событий простаивал {lag * 1000:.1f} мс"
+
+    lag, removed = asyncio.run(_max_lag_during(xray.remove_client_async(uuid, config_path)))
+
+    assert removed is True
+    assert lag < MAX_LOOP_LAG, f"Цикл событий простаивал {lag * 1000:.1f} мс"
+    saved = json.loads(config_path.read_text(encoding="utf-8"))
+    assert len(saved["inbounds"][0]["settings"]["clients"]) == CLIENTS
+
+
+def test_concurrent_async_mutations_are_not_lost(tmp_path, monkeypatch) -> None:
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps({"inbounds": [{"protocol": "vless", "settings": {"clients": []}}]}),
+        encoding="utf-8",
+    )
+    _stub_settings(monkeypatch)
+
+    async def create_many() -> None:
+        await asyncio.gather(
+            *(xray.create_client_async(f"uuid-{index}", "u@vpn.local", config_path) for index in range(20))
+        )
+
+    asyncio.run(create_many())
+
+    saved = json.loads(config_path.read_text(encoding="utf-8"))
+    assert len(saved["inbounds"][0]["settings"]["clients"]) == 20
@@ -0,0 +1,144 @@
+import base64
+import json
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from app.bot.services import xray
+from app.bot.services.xray_model import XrayConfig, parse_tags, shadowsocks_password
+
+UUID = "123e4567-e89b-12d3-a456-426614174000"
+
+
+def _config() -> dict:
+    return {
+        "inbounds": [
+            {"tag": "api", "protocol": "dokodemo-door", "settings": {}},
+            {
+                "tag": "vless-reality",
+                "port": 443,
+                "protocol": "vless",
+                "settings": {"clients": [{"id": "old", "email": "old@vpn"}], "decryption": "none"},
+                "streamSettings": {
+                    "network": "tcp",
+                    "security": "reality",
+                    "realitySettings": {
+                        "serverNames": ["www.example.org"],
+                        "shortIds": ["ab12"],
+                        "publicKey": "PUBKEY",
+                    },
+                },
+            },
+            {
+                "tag": "vmess-ws",
+                "port": 8080,
+                "protocol": "vmess",
+                "settings": {"clients": []},
+                "streamSettings": {"network": "ws", "wsSettings": {"path": "/ws"}},
+            },
+            {
+                "tag": "trojan-grpc",
+                "port": 8443,
+                "protocol": "trojan",
+                "settings": {"clients": []},
+                "streamSettings": {
+                    "network": "grpc",
+                    "security": "tls",
+                    "tlsSettings": {"serverName": "vpn.example.com"},
+                    "grpcSettings": {"serviceName": "tr"},
+                },
+            },
+            {
+                "tag": "ss",
+                "port": 8388,
+                "protocol": "shadowsocks",
+                "settings": {"method": "2022-blake3-aes-128-gcm", "password": "SERVERKEY", "clients": []},
+            },
+        ]
+    }
+
+
+def test_index_by_tag_and_protocol() -> None:
+    model = XrayConfig(_config())
+
+    assert list(model.inbounds) == ["vless-reality", "vmess-ws", "trojan-grpc", "ss"]
+    assert model.default().tag == "vless-reality"
+    assert [inbound.tag for inbound in model.by_protocol["trojan"]] == ["trojan-grpc"]
+    assert model.get("vless-reality").has("old")
+    with pytest.raises(KeyError):
+        model.get("missing")
+    assert parse_tags(" vless-reality, ,ss ") == ["vless-reality", "ss"]
+
+
+def test_add_client_to_several_inbounds_and_remove() -> None:
+    data = _config()
+    model = XrayConfig(data)
+
+    model.add_client(UUID, "u@vpn", ["vless-reality", "trojan-grpc", "ss"], flow="xtls-rprx-vision")
+
+    vless_clients = data["inbounds"][1]["settings"]["clients"]
+    assert vless_clients[-1] == {"id": UUID, "email": "u@vpn", "flow": "xtls-rprx-vision"}
+    assert data["inbounds"][3]["settings"]["clients"] == [{"password": UUID, "email": "u@vpn"}]
+    ss_password = data["inbounds"][4]["settings"]["clients"][0]["password"]
+    assert len(base64.b64decode(ss_password)) == 16
+    assert [inbound.tag for inbound in model.find(UUID)] == ["vless-reality", "trojan-grpc", "ss"]
+
+    # Дубликат хотя бы в одном inbound-е — конфиг не меняется.
+    with pytest.raises(ValueError):
+        model.add_client(UUID, "u@vpn", ["vmess-ws", "ss"])
+    assert data["inbounds"][2]["settings"]["clients"] == []
+
+    assert model.remove_client("old") == ["vless-reality"]
+    assert model.remove_client(UUID) == ["vless-reality", "trojan-grpc", "ss"]
+    assert vless_clients == []
+    assert not model.get("vless-reality").has(UUID)
+
+
+def test_links_follow_inbound_settings() -> None:
+    model = XrayConfig(_config())
+    model.add_client(UUID, "u@vpn", ["vless-reality", "vmess-ws", "trojan-grpc", "ss"], flow="xtls-rprx-vision")
+
+    links = model.links(UUID, "u@vpn", "vpn.example.com")
+
+    vless = urlsplit(links["vless-reality"])
+    assert vless.netloc == f"{UUID}@vpn.example.com:443"
+    query = parse_qs(vless.query)
+    assert query["security"] == ["reality"]
+    assert query["pbk"] == ["PUBKEY"] and query["sid"] == ["ab12"] and query["sni"] == ["www.example.org"]
+    assert query["flow"] == ["xtls-rprx-vision"]
+
+    vmess = json.loads(base64.b64decode(links["vmess-ws"].removeprefix("vmess://")))
+    assert vmess["port"] == "8080" and vmess["net"] == "ws" and vmess["path"] == "/ws"
+
+    trojan = urlsplit(links["trojan-grpc"])
+    assert trojan.scheme == "trojan" and trojan.port == 8443
+    assert parse_qs(trojan.query)["serviceName"] == ["tr"]
+
+    ss = urlsplit(links["ss"])
+    userinfo = base64.urlsafe_b64decode(ss.username + "==").decode()
+    method, _, password = userinfo.partition(":")
+    assert method == "2022-blake3-aes-128-gcm"
+    assert password == "SERVERKEY:" + shadowsocks_password(method, UUID)
+
+
+def test_provision_client_writes_once(tmp_path: Path, monkeypatch) -> None:
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(_config()), encoding="utf-8")
+    monkeypatch.setattr(
+        xray, "get_settings", lambda: SimpleNamespace(xray_host="vpn.example.com", xray_flow="", xray_inbound_tags="")
+    )
+    writes: list[Path] = []
+    original_save = xray._save_config
+    monkeypatch.setattr(
+        xray, "_save_config", lambda config, path, **kwargs: (writes.append(path), original_save(config, path, **kwargs))
+    )
+
+    links = xray.provision_client(UUID, "u@vpn", config_path, ["vmess-ws", "trojan-grpc"])
+
+    assert list(links) == ["vmess-ws", "trojan-grpc"]
+    assert writes == [config_path]
+    assert xray.client_links(UUID, "u@vpn", config_path) == links
+    assert xray.remove_client(UUID, config_path)
+    assert xray.client_links(UUID, "u@vpn", config_path) == {}